@@ -89,6 +89,10 @@ Examples:
       --from-scratch        Ignores the current information in the personid
                             tables and disambiguates everything from scratch.
 
+      --resume              Resumes the last interrupted or partly failed
+                            disambiguation run with the same options,
+                            skipping the last names it already stored.
+
     There are no options for the merger.
 """,
         version="Invenio Bibauthorid v%s" % bconfig.VERSION,
@@ -100,7 +104,8 @@ Examples:
              "update-search-index",
              "all-records",
              "update-personid",
-             "from-scratch"
+             "from-scratch",
+             "resume"
             ]),
         task_submit_elaborate_specific_parameter_fnc=_task_submit_elaborate_specific_parameter,
         task_submit_check_options_fnc=_task_submit_check_options,
@@ -132,6 +137,8 @@ def _task_submit_elaborate_specific_parameter(key, value, opts, args):
         bibtask.task_set_option("update_search_index", True)
     elif key in ("--from-scratch",):
         bibtask.task_set_option("from_scratch", True)
+    elif key in ("--resume",):
+        bibtask.task_set_option("resume", True)
     else:
         return False
 
@@ -154,7 +161,8 @@ def _task_run_core():
 
     if bibtask.task_get_option("disambiguate"):
         bibtask.task_update_progress('Performing full disambiguation...')
-        run_tortoise(bool(bibtask.task_get_option("from_scratch")))
+        run_tortoise(bool(bibtask.task_get_option("from_scratch")),
+                     bool(bibtask.task_get_option("resume")))
         bibtask.task_update_progress('Full disambiguation finished!')
 
     if bibtask.task_get_option("merge"):
@@ -182,6 +190,7 @@ def _task_submit_check_options():
     record_ids = bibtask.task_get_option("record_ids")
     all_records = bibtask.task_get_option("all_records")
     from_scratch = bibtask.task_get_option("from_scratch")
+    resume = bibtask.task_get_option("resume")
 
     commands =( bool(update_personid) + bool(disambiguate) +
                 bool(merge) + bool(update_search_index) )
@@ -200,7 +209,7 @@ def _task_submit_check_options():
     assert commands == 1
 
     if update_personid:
-        if any((from_scratch,)):
+        if any((from_scratch, resume)):
             bibtask.write_message("ERROR: The only options which can be specified "
                                   "with --update-personid are --record-ids and "
                                   "--all-records"
@@ -223,13 +232,13 @@ def _task_submit_check_options():
 
     if disambiguate:
         if any((record_ids, all_records)):
-            bibtask.write_message("ERROR: The only option which can be specified "
-                                  "with --disambiguate is from-scratch"
+            bibtask.write_message("ERROR: The only options which can be specified "
+                                  "with --disambiguate are --from-scratch and --resume"
                                   , stream=sys.stdout, verbose=0)
             return False
 
     if merge:
-        if any((record_ids, all_records, from_scratch)):
+        if any((record_ids, all_records, from_scratch, resume)):
             bibtask.write_message("ERROR: There are no options which can be "
                                   "specified along with --merge"
                                   , stream=sys.stdout, verbose=0)
@@ -300,11 +309,11 @@ def run_rabbit(paperslist, all_records=False):
         rabbit_with_log(paperslist, True, 'bibauthorid_daemon, personid_fast_assign_papers on ' + str(paperslist), partial=True)
 
 
-def run_tortoise(from_scratch):
+def run_tortoise(from_scratch, resume=False):
     from invenio.bibauthorid_tortoise import tortoise, tortoise_from_scratch
 
     if from_scratch:
-        tortoise_from_scratch()
+        tortoise_from_scratch(resume)
     else:
         start_time = get_db_time()
         tortoise_db_name = 'tortoise'
@@ -314,7 +323,7 @@ def run_tortoise(from_scratch):
             modified = get_modified_papers_since(last_run[0][2])
         else:
             modified = []
-        tortoise(modified)
+        tortoise(modified, resume=resume)
 
     insert_user_log(tortoise_db_name, '-1', '', '', '', timestamp=start_time)
 
@@ -28,6 +28,10 @@ import gzip as filehandler
 
 import gc
 import numpy as np
+import multiprocessing as mp
+import select
+import traceback
+from hashlib import md5
 
 #This is supposed to defeat a bit of the python vm performance losses:
 import sys
@@ -45,6 +49,7 @@ override_stdout_config(fileout=True, stdout=False)
 
 from invenio.bibauthorid_cluster_set import delayed_cluster_sets_from_marktables
 from invenio.bibauthorid_cluster_set import delayed_cluster_sets_from_personid
+from invenio.bibauthorid_cluster_set import ClusterSet
 from invenio.bibauthorid_wedge import wedge
 from invenio.bibauthorid_name_utils import generate_last_name_cluster_str
 from invenio.bibauthorid_backinterface import empty_tortoise_results_table
@@ -57,6 +62,7 @@ from invenio.bibauthorid_least_squares import to_function as create_approx_func
 
 
 from invenio.bibauthorid_general_utils import schedule_workers
+from invenio.bibtask import task_update_progress
 
 #python2.4 compatibility
 from invenio.bibauthorid_general_utils import bai_all as all
@@ -76,6 +82,12 @@ from invenio.bibauthorid_general_utils import bai_all as all
         installed invenio and this is your first
         disambiguation or if personid is broken.
 
+    Both run the last name cluster sets in parallel with
+    schedule_tortoise_jobs, which checkpoints the last names
+    already stored: called again with resume=True and the same
+    arguments, an interrupted or partly failed run resumes where
+    it stopped.
+
     iii) tortoise_last_name
         Computes the clusters for only one last name
         group. Is is primary used for testing. It
@@ -88,39 +100,38 @@ from invenio.bibauthorid_general_utils import bai_all as all
 # The standard ones are not well documented
 # so we are using random numbers.
 
-def tortoise_from_scratch():
+def tortoise_from_scratch(resume=False):
     bibauthor_print("Preparing cluster sets.")
-    cluster_sets, _lnames, sizes = delayed_cluster_sets_from_marktables()
-    bibauthor_print("Building all matrices.")
-    schedule_workers(lambda x: force_create_matrix(x, force=True), cluster_sets)
+    cluster_sets, lnames, sizes = delayed_cluster_sets_from_marktables()
 
-    empty_tortoise_results_table()
+    checkpoint_path = get_tortoise_checkpoint_path('from_scratch')
+    if not resume or not load_tortoise_checkpoint(checkpoint_path):
+        empty_tortoise_results_table()
 
-    bibauthor_print("Preparing cluster sets.")
-    cluster_sets, _lnames, sizes = delayed_cluster_sets_from_marktables()
     bibauthor_print("Starting disambiguation.")
-    schedule_workers(wedge, cluster_sets)
+    schedule_tortoise_jobs(cluster_sets, lnames, sizes, checkpoint_path,
+                           create_matrices=True, force_matrix_creation=True,
+                           resume=resume)
 
 
 def tortoise(pure=False,
              force_matrix_creation=False,
              skip_matrix_creation=False,
-             last_run=None):
+             last_run=None,
+             resume=False):
     assert not force_matrix_creation or not skip_matrix_creation
     # The computation must be forced in case we want
     # to compute pure results
     force_matrix_creation = force_matrix_creation or pure
 
-    if not skip_matrix_creation:
-        bibauthor_print("Preparing cluster sets.")
-        clusters, _lnames, sizes = delayed_cluster_sets_from_personid(pure, last_run)
-        bibauthor_print("Building all matrices.")
-        schedule_workers(lambda x: force_create_matrix(x, force=force_matrix_creation), clusters)
-
     bibauthor_print("Preparing cluster sets.")
-    clusters, _lnames, sizes = delayed_cluster_sets_from_personid(pure, last_run)
+    clusters, lnames, sizes = delayed_cluster_sets_from_personid(pure, last_run)
     bibauthor_print("Starting disambiguation.")
-    schedule_workers(wedge_and_store, clusters)
+    schedule_tortoise_jobs(clusters, lnames, sizes,
+                           get_tortoise_checkpoint_path('personid', pure, last_run),
+                           create_matrices=not skip_matrix_creation,
+                           force_matrix_creation=force_matrix_creation,
+                           resume=resume)
 
 
 def tortoise_last_name(name, from_mark=True, pure=False):
@@ -387,6 +398,207 @@ def force_wedge_and_store(cluster_set):
     return wedge_and_store(cluster_set())
 
 
+def get_tortoise_checkpoint_path(run_name, *run_params):
+    '''
+    Returns the path of the checkpoint of the run run_name with the
+    parameters run_params, so that runs made with different parameters
+    never share their checkpoints.
+    '''
+    run_key = md5(repr(run_params)).hexdigest()[:16]
+    return '%stortoise_checkpoint_%s_%s' % (bconfig.TORTOISE_FILES_PATH, run_name, run_key)
+
+
+def load_tortoise_checkpoint(checkpoint_path):
+    '''
+    Returns the set of the last names whose results have already been
+    stored by the unfinished run of checkpoint_path, if any.
+    '''
+    try:
+        f = open(checkpoint_path)
+    except IOError:
+        return set()
+    try:
+        # the last line may be truncated if the writer was killed
+        return set(line[:-1] for line in f if line.endswith('\n'))
+    finally:
+        f.close()
+
+
+def _store_tortoise_results(lname, clusters):
+    '''
+    Replaces the results of last name lname by the clusters, lists
+    of signatures, computed by wedge.
+    '''
+    cluster_set = ClusterSet()
+    cluster_set.last_name = lname
+    cluster_set.clusters = [ClusterSet.Cluster(bibs) for bibs in clusters]
+    remove_clusters_by_name(lname)
+    cluster_set.store()
+
+
+def discard_tortoise_checkpoint(checkpoint_path):
+    '''
+    Removes the checkpoint of checkpoint_path, if any.
+    '''
+    try:
+        os.remove(checkpoint_path)
+    except OSError:
+        pass
+
+
+def _tortoise_worker(slot, running, cluster_sets, jobs, results,
+                     create_matrices, force_matrix_creation):
+    '''
+    Disambiguates the cluster sets whose indexes it takes from jobs,
+    until it gets None, and sends their clusters back to the writer
+    through results, its own pipe: sending is synchronous, so nothing
+    sent is lost if the worker dies afterwards. The index of the
+    current job is kept in running[slot], so that the writer knows
+    which one is lost if the worker dies.
+    '''
+    while True:
+        idx = jobs.get()
+        if idx is None:
+            break
+        running[slot] = idx
+        cluster_set = None
+        try:
+            cluster_set = cluster_sets[idx]()
+            if create_matrices:
+                create_matrix(cluster_set, force_matrix_creation)
+            bibs = cluster_set.num_all_bibs
+            bibauthor_print("Start working on %s. Total number of bibs: %d, "
+                            "maximum number of comparisons: %d"
+                            % (cluster_set.last_name, bibs, bibs * (bibs - 1) / 2))
+            wedge(cluster_set)
+            results.send(('done', idx, [list(cl.bibs) for cl in cluster_set.clusters]))
+        except Exception:
+            results.send(('error', idx, traceback.format_exc()))
+        del cluster_set
+        gc.collect()
+    results.close()
+
+
+def schedule_tortoise_jobs(cluster_sets, lnames, sizes, checkpoint_path,
+                           create_matrices=True, force_matrix_creation=False,
+                           max_processes=mp.cpu_count(), resume=False):
+    '''
+    Disambiguates the delayed cluster_sets, of last names lnames and
+    sizes bibrefs, with a pool of max_processes workers.
+
+    The last names are run by decreasing estimated cost, the square of
+    their size, and every worker takes the next one as soon as it is
+    free, so that the few huge last names start first instead of
+    holding the whole run at its end. The workers only compute; the
+    results are streamed back to this process, which alone writes
+    them to the database and appends their last name to the
+    checkpoint file. With resume, the last names found in the
+    checkpoint are skipped, so that calling again with the same
+    checkpoint_path resumes an interrupted or partly failed run;
+    otherwise any previous checkpoint is discarded. The checkpoint is
+    removed once all the last names succeeded.
+    Returns whether all the last names succeeded.
+    '''
+    if resume:
+        done = load_tortoise_checkpoint(checkpoint_path)
+        bibauthor_print("Resuming from %s: %d last names already done."
+                        % (checkpoint_path, len(done)))
+    else:
+        discard_tortoise_checkpoint(checkpoint_path)
+        done = set()
+
+    todo = [idx for idx in range(len(lnames)) if lnames[idx] not in done]
+    todo.sort(key=lambda idx: sizes[idx] ** 2, reverse=True)
+
+    total_cost = float(sum(size ** 2 for size in sizes)) or 1.
+    done_cost = sum(size ** 2 for lname, size in zip(lnames, sizes) if lname in done)
+    total_jobs = len(todo)
+    finished = 0
+    failed = []
+    # jobs whose results have been received, or given up
+    received = set()
+
+    jobs = mp.Queue()
+    for idx in todo:
+        jobs.put(idx)
+    num_workers = min(max_processes, total_jobs)
+    running = mp.Array('l', [-1] * num_workers, lock=False)
+    # file descriptor of the results pipe -> (slot, process, pipe)
+    workers = {}
+
+    def start_worker(slot):
+        reader, writer = mp.Pipe(duplex=False)
+        proc = mp.Process(target=_tortoise_worker,
+                          args=(slot, running, cluster_sets, jobs, writer,
+                                create_matrices, force_matrix_creation))
+        proc.start()
+        # so that the pipe reports the end of the worker
+        writer.close()
+        workers[reader.fileno()] = (slot, proc, reader)
+
+    for slot in range(num_workers):
+        start_worker(slot)
+    for slot in range(num_workers):
+        jobs.put(None)
+
+    checkpoint = open(checkpoint_path, 'a')
+    try:
+        while workers and finished + len(failed) < total_jobs:
+            for fd in select.select(workers.keys(), [], [])[0]:
+                slot, proc, reader = workers[fd]
+                try:
+                    message, idx, payload = reader.recv()
+                except EOFError:
+                    # the worker exited, after all that it sent has
+                    # been received: a job it did not report was lost,
+                    # e.g. to the OOM killer
+                    del workers[fd]
+                    reader.close()
+                    proc.join()
+                    idx = running[slot]
+                    if idx >= 0 and idx not in received:
+                        received.add(idx)
+                        failed.append(lnames[idx])
+                        bibauthor_print("Worker %s died on %s." % (proc.pid, lnames[idx]))
+                    if proc.exitcode and finished + len(failed) < total_jobs:
+                        # it did not take its end of jobs mark
+                        start_worker(slot)
+                    continue
+
+                received.add(idx)
+                if message == 'done':
+                    _store_tortoise_results(lnames[idx], payload)
+                    checkpoint.write(lnames[idx] + '\n')
+                    checkpoint.flush()
+                    os.fsync(checkpoint.fileno())
+                    finished += 1
+                    done_cost += sizes[idx] ** 2
+                else:
+                    failed.append(lnames[idx])
+                    bibauthor_print("Disambiguation of %s failed:\n%s" % (lnames[idx], payload))
+
+                progress = "Disambiguation: %d/%d last names done (%.1f%% of the estimated cost)" \
+                           % (finished, total_jobs, 100. * done_cost / total_cost)
+                update_status(done_cost / total_cost, progress)
+                task_update_progress(progress)
+    finally:
+        checkpoint.close()
+        for slot, proc, reader in workers.values():
+            if finished + len(failed) < total_jobs:
+                # interrupted: the checkpoint lets the next run resume
+                proc.terminate()
+            proc.join()
+            reader.close()
+
+    if finished < total_jobs:
+        bibauthor_print("Disambiguation failed for %d last names, resume the run to retry them: %s"
+                        % (total_jobs - finished, ', '.join(failed)))
+    else:
+        discard_tortoise_checkpoint(checkpoint_path)
+    update_status_final("Disambiguation done.")
+    return finished == total_jobs
+
+
 #[temporarily] deprecated
 #def schedule_create_matrix(cluster_sets, sizes, force):
 #    def create_job(cluster):
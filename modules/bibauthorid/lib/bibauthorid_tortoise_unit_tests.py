@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the tortoise scheduler."""
+
+__revision__ = \
+    "$Id$"
+
+import os
+import shutil
+import tempfile
+
+from invenio.testutils import InvenioTestCase, make_test_suite, run_test_suite, \
+     patch_attributes, restore_attributes
+from invenio import bibauthorid_tortoise as tortoise
+
+# what the fake wedge does with some last names, in the workers
+_DIE_DURING_JOB = 'die-during'
+_DIE_AFTER_RESULT = 'die-after'
+_RAISE = 'raise'
+_worker_state = {'die_after_result': False}
+
+class _FakeCluster(object):
+
+    def __init__(self, bibs):
+        self.bibs = bibs
+
+class _FakeClusterSet(object):
+
+    def __init__(self, lname):
+        self.last_name = lname
+        self.num_all_bibs = 1
+        self.clusters = [_FakeCluster([(100, 1, len(lname))])]
+
+def _fake_wedge(cluster_set):
+    if cluster_set.last_name == _DIE_DURING_JOB:
+        os._exit(1)
+    if cluster_set.last_name == _DIE_AFTER_RESULT:
+        _worker_state['die_after_result'] = True
+    if cluster_set.last_name == _RAISE:
+        raise ValueError(cluster_set.last_name)
+
+class _FakeGC(object):
+
+    def collect(self):
+        if _worker_state['die_after_result']:
+            os._exit(1)
+
+class TestTortoiseCheckpoint(InvenioTestCase):
+    """Test the checkpoints of the tortoise runs."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.checkpoint_path = os.path.join(self.path, 'checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_load_missing_checkpoint(self):
+        """tortoise - loading a missing checkpoint"""
+        self.assertEqual(tortoise.load_tortoise_checkpoint(self.checkpoint_path), set())
+
+    def test_load_truncated_checkpoint(self):
+        """tortoise - loading a checkpoint whose last line is truncated"""
+        f = open(self.checkpoint_path, 'w')
+        f.write('ellis\nsmith\njo')
+        f.close()
+        self.assertEqual(tortoise.load_tortoise_checkpoint(self.checkpoint_path),
+                         set(['ellis', 'smith']))
+
+    def test_checkpoint_path_depends_on_parameters(self):
+        """tortoise - checkpoints of runs with different parameters"""
+        self.assertEqual(tortoise.get_tortoise_checkpoint_path('personid', False, None),
+                         tortoise.get_tortoise_checkpoint_path('personid', False, None))
+        self.assertNotEqual(tortoise.get_tortoise_checkpoint_path('personid', False, None),
+                            tortoise.get_tortoise_checkpoint_path('personid', True, None))
+        self.assertNotEqual(tortoise.get_tortoise_checkpoint_path('personid', False, None),
+                            tortoise.get_tortoise_checkpoint_path('personid', False, '2014-05-01'))
+        self.assertNotEqual(tortoise.get_tortoise_checkpoint_path('personid'),
+                            tortoise.get_tortoise_checkpoint_path('from_scratch'))
+
+class TestTortoiseScheduler(InvenioTestCase):
+    """Test the scheduling of the tortoise jobs."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.checkpoint_path = os.path.join(self.path, 'checkpoint')
+        self.stored = []
+        self.saved = patch_attributes(tortoise,
+            wedge=_fake_wedge,
+            gc=_FakeGC(),
+            _store_tortoise_results=lambda lname, clusters: self.stored.append(lname),
+            bibauthor_print=lambda *args: None,
+            update_status=lambda *args: None,
+            update_status_final=lambda *args: None,
+            task_update_progress=lambda *args: None)
+
+    def tearDown(self):
+        restore_attributes(tortoise, self.saved)
+        shutil.rmtree(self.path)
+
+    def _run(self, lnames, resume=False, max_processes=2):
+        cluster_sets = [lambda lname=lname: _FakeClusterSet(lname) for lname in lnames]
+        sizes = range(1, len(lnames) + 1)
+        return tortoise.schedule_tortoise_jobs(cluster_sets, lnames, sizes,
+                                               self.checkpoint_path,
+                                               create_matrices=False,
+                                               max_processes=max_processes,
+                                               resume=resume)
+
+    def _write_checkpoint(self, lnames):
+        f = open(self.checkpoint_path, 'w')
+        f.write(''.join(lname + '\n' for lname in lnames))
+        f.close()
+
+    def test_all_jobs_done(self):
+        """tortoise - scheduling jobs which all succeed"""
+        lnames = ['ellis', 'smith', 'wang', 'li']
+        self.assertTrue(self._run(lnames))
+        self.assertEqual(sorted(self.stored), sorted(lnames))
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+    def test_previous_checkpoint_ignored_without_resume(self):
+        """tortoise - starting again discards the previous checkpoint"""
+        self._write_checkpoint(['ellis'])
+        self.assertTrue(self._run(['ellis', 'smith']))
+        self.assertEqual(sorted(self.stored), ['ellis', 'smith'])
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+    def test_resume(self):
+        """tortoise - resuming skips the last names already stored"""
+        self._write_checkpoint(['ellis'])
+        self.assertTrue(self._run(['ellis', 'smith'], resume=True))
+        self.assertEqual(self.stored, ['smith'])
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+    def test_worker_dying_during_job(self):
+        """tortoise - a worker dying during a job fails only this job"""
+        lnames = ['ellis', _DIE_DURING_JOB, 'smith', 'wang']
+        self.assertFalse(self._run(lnames))
+        self.assertEqual(sorted(self.stored), ['ellis', 'smith', 'wang'])
+        self.assertEqual(tortoise.load_tortoise_checkpoint(self.checkpoint_path),
+                         set(['ellis', 'smith', 'wang']))
+        # resuming retries only the failed job
+        self.stored[:] = []
+        self.assertFalse(self._run(lnames, resume=True))
+        self.assertEqual(self.stored, [])
+
+    def test_worker_dying_after_result(self):
+        """tortoise - a worker dying after sending its result"""
+        lnames = ['ellis', _DIE_AFTER_RESULT, 'smith', 'wang', 'li']
+        self.assertTrue(self._run(lnames))
+        self.assertEqual(sorted(self.stored), sorted(lnames))
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+    def test_job_raising(self):
+        """tortoise - a job raising an exception does not stop its worker"""
+        # a single worker runs the jobs by decreasing size, i.e. 'ellis' last
+        lnames = ['ellis', _RAISE, 'smith', 'wang']
+        self.assertFalse(self._run(lnames, max_processes=1))
+        self.assertEqual(self.stored, ['wang', 'smith', 'ellis'])
+        self.assertEqual(tortoise.load_tortoise_checkpoint(self.checkpoint_path),
+                         set(['ellis', 'smith', 'wang']))
+
+TEST_SUITE = make_test_suite(TestTortoiseCheckpoint, TestTortoiseScheduler)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE, warn_user=True)
@@ -110,6 +110,8 @@ from invenio.config import CFG_SITE_URL, \
     CFG_TMPDIR, CFG_TMPSHAREDDIR, CFG_PATH_MD5SUM, \
     CFG_WEBSUBMIT_STORAGEDIR, \
     CFG_BIBDOCFILE_USE_XSENDFILE, \
+    CFG_BIBDOCFILE_XSENDFILE_HEADER, \
+    CFG_BIBDOCFILE_XACCEL_REDIRECT_PREFIX, \
     CFG_BIBDOCFILE_MD5_CHECK_PROBABILITY, \
     CFG_SITE_RECORD, CFG_PYLIBDIR, \
     CFG_BIBUPLOAD_FFT_ALLOWED_EXTERNAL_URLS, \
@@ -835,10 +837,25 @@ class BibRecDocs(object):
             res = run_sql("""SELECT brbd.id_bibdoc, brbd.docname, brbd.type FROM bibrec_bibdoc as brbd JOIN
                          bibdoc as bd ON bd.id=brbd.id_bibdoc WHERE brbd.id_bibrec=%s AND
                          bd.status<>'DELETED' ORDER BY brbd.docname ASC""", (self.id,))
-        for row in res:
-            cur_doc = BibDoc.create_instance(docid=row[0], recid=self.id,
-                                             human_readable=self.human_readable)
-            self._bibdocs[row[1]] = (cur_doc, row[2])
+        self._set_bibdocs(res, BibDoc._retrieve_data_of_documents([row[0] for row in res]))
+
+    def _set_bibdocs(self, rows, documents_data):
+        """
+        Instantiate the documents attached to the record.
+
+        @param rows: the (docid, docname, attachment type) of the documents,
+            ordered by docname.
+        @type rows: list of tuples
+        @param documents_data: the data of the documents, as returned by
+            L{BibDoc._retrieve_data_of_documents}.
+        @type documents_data: dictionary docid -> dict
+        """
+        self._bibdocs = {}
+        for docid, docname, attachment_type in rows:
+            cur_doc = BibDoc.create_instance(docid=docid, recid=self.id,
+                                             human_readable=self.human_readable,
+                                             initial_data=documents_data.get(docid))
+            self._bibdocs[docname] = (cur_doc, attachment_type)
         self.dirty = False
 
     def list_bibdocs_by_names(self, doctype=None):
@@ -1561,6 +1578,47 @@ class BibRecDocs(object):
         return " ".join(texts)
 
 
+def get_bibrecdocs(recids, deleted_too=False, human_readable=False):
+    """
+    Return the L{BibRecDocs} of several records, e.g. of the records
+    of a page of search results, with their documents already loaded
+    by a constant number of queries instead of several per document.
+
+    When CFG_BIBDOCFILE_ENABLE_BIBDOCFSINFO_CACHE is set, the files of
+    the documents are then listed without any filesystem access.
+
+    @param recids: the record identifiers.
+    @type recids: list of integers
+    @param deleted_too: as for L{BibRecDocs}.
+    @type deleted_too: bool
+    @param human_readable: as for L{BibRecDocs}.
+    @type human_readable: bool
+    @return: the documents of every record.
+    @rtype: dictionary recid -> BibRecDocs
+    """
+    ret = {}
+    for recid in recids:
+        bibrecdocs = BibRecDocs(recid, deleted_too=deleted_too,
+                                human_readable=human_readable)
+        ret[bibrecdocs.id] = bibrecdocs
+    if not ret:
+        return ret
+    query = """SELECT brbd.id_bibrec, brbd.id_bibdoc, brbd.docname, brbd.type FROM bibrec_bibdoc as brbd JOIN
+               bibdoc as bd ON bd.id=brbd.id_bibdoc WHERE brbd.id_bibrec IN (%s)""" % \
+            ','.join(['%s'] * len(ret))
+    if not deleted_too:
+        query += " AND bd.status<>'DELETED'"
+    query += " ORDER BY brbd.docname ASC"
+    res = run_sql(query, ret.keys())
+    rows = dict([(recid, []) for recid in ret])
+    for recid, docid, docname, attachment_type in res:
+        rows[recid].append((docid, docname, attachment_type))
+    documents_data = BibDoc._retrieve_data_of_documents(set([row[1] for row in res]))
+    for recid, bibrecdocs in ret.iteritems():
+        bibrecdocs._set_bibdocs(rows[recid], documents_data)
+    return ret
+
+
 class BibDoc(object):
     """
     This class represents one document (i.e. a set of files with different
@@ -1624,15 +1682,17 @@ class BibDoc(object):
         attaching newly created document to a record
         """
         # docid is known, the document already exists
-        res2 = run_sql("SELECT id_bibrec, type, docname FROM bibrec_bibdoc WHERE id_bibdoc=%s", (docid,))
-        self.bibrec_types = [(r[0], r[1], r[2]) for r in res2 ] # just in case the result was behaving like tuples but was something else
-        if not res2:
-            # fake attachment
-            self.bibrec_types = [(0, None, "fake_name_for_unattached_document")]
-
         if initial_data is None:
             initial_data = BibDoc._retrieve_data(docid)
 
+        self.bibrec_types = initial_data.get("bibrec_types")
+        if self.bibrec_types is None:
+            res2 = run_sql("SELECT id_bibrec, type, docname FROM bibrec_bibdoc WHERE id_bibdoc=%s", (docid,))
+            self.bibrec_types = [(r[0], r[1], r[2]) for r in res2 ] # just in case the result was behaving like tuples but was something else
+        if not self.bibrec_types:
+            # fake attachment
+            self.bibrec_types = [(0, None, "fake_name_for_unattached_document")]
+
         self._docfiles = []
         self.__md5s = None
         self._related_files = {}
@@ -1647,8 +1707,9 @@ class BibDoc(object):
         self.basedir = initial_data["basedir"]
         self.doctype = initial_data["doctype"]
         self.storagename = initial_data["storagename"] # the old docname -> now used as a storage name for old records
+        self._fsinfo = initial_data.get("fsinfo") # rows of bibdocfsinfo, used by the first _build_file_list()
 
-        self.more_info = BibDocMoreInfo(self.id)
+        self.more_info = BibDocMoreInfo(self.id, database_rows=initial_data.get("more_info"))
         self.dirty = True
         self.dirty_related_files = True
         self.last_action = 'init'
@@ -1713,46 +1774,93 @@ class BibDoc(object):
         """
            Filling information about a document from the database entry
         """
-        container = {}
-        container["bibrec_links"] = []
-        container["id"] = docid
-        container["basedir"] = _make_base_dir(container["id"])
-
-        # retrieving links betwen records and documents
-
-        res = run_sql("SELECT id_bibrec, type, docname FROM bibrec_bibdoc WHERE id_bibdoc=%s", (str(docid),), 1)
-        if res:
-            for r in res:
-                container["bibrec_links"].append({"recid": r[0], "doctype": r[1], "docname": r[2]})
+        if docid is not None:
+            container = BibDoc._retrieve_data_of_documents([docid]).get(int(docid))
+            if container is not None:
+                return container
+        # this bibdoc doesn't exist
+        raise InvenioBibDocFileError, "The docid %s does not exist." % docid
 
-        # gather the other information
-        res = run_sql("SELECT status, creation_date, modification_date, text_extraction_date, doctype, docname FROM bibdoc WHERE id=%s LIMIT 1", (docid,), 1)
+    @staticmethod
+    def _retrieve_data_of_documents(docids):
+        """
+        Filling information about several documents from the database, with
+        a constant number of queries.
+
+        Besides what is needed to instantiate the documents, the links to all
+        their records, their files as listed in bibdocfsinfo (when
+        CFG_BIBDOCFILE_ENABLE_BIBDOCFSINFO_CACHE is set) and their
+        BibDocMoreInfo (descriptions, comments and flags of the files) are
+        retrieved, so that listing the files of the documents later on
+        needs neither queries nor filesystem accesses.
+
+        @param docids: the document identifiers.
+        @type docids: list of integers
+        @return: the information about the existing documents.
+        @rtype: dictionary docid -> dict
+        """
+        docids = [int(docid) for docid in docids]
+        if not docids:
+            return {}
+        in_docids = ','.join(['%s'] * len(docids))
+        containers = {}
+
+        res = run_sql("SELECT id, status, creation_date, modification_date, text_extraction_date, doctype, docname FROM bibdoc WHERE id IN (%s)" % in_docids, docids)
+        for docid, status, cd, md, td, doctype, storagename in res:
+            containers[docid] = {
+                "id": docid,
+                "basedir": _make_base_dir(docid),
+                "status": status,
+                "cd": cd,
+                "md": md,
+                "td": td,
+                "doctype": doctype,
+                "storagename": storagename,
+                "bibrec_links": [],
+                "bibrec_types": [],
+                "fsinfo": [],
+                "more_info": [],
+            }
+        if not containers:
+            return containers
 
-        if res:
-            container["status"] = res[0][0]
-            container["cd"] = res[0][1]
-            container["md"] = res[0][2]
-            container["td"] = res[0][3]
-            container["doctype"] = res[0][4]
-            container["storagename"] = res[0][5]
-        else:
-            # this bibdoc doesn't exist
-            raise InvenioBibDocFileError, "The docid %s does not exist." % docid
+        # retrieving links betwen records and documents
+        res = run_sql("SELECT id_bibdoc, id_bibrec, type, docname FROM bibrec_bibdoc WHERE id_bibdoc IN (%s)" % in_docids, docids)
+        for docid, recid, doctype, docname in res:
+            container = containers.get(docid)
+            if container is None:
+                continue
+            if not container["bibrec_links"]:
+                ## only the first link is kept here, all of them are in bibrec_types
+                container["bibrec_links"].append({"recid": recid, "doctype": doctype, "docname": docname})
+            container["bibrec_types"].append((recid, doctype, docname))
+
+        res = run_sql("SELECT id_bibdoc, namespace, data_key, data_value FROM bibdocmoreinfo WHERE id_bibdoc IN (%s) AND version IS NULL AND format IS NULL AND id_rel IS NULL" % in_docids, docids)
+        for row in res:
+            if row[0] in containers:
+                containers[row[0]]["more_info"].append(row[1:])
 
         # retreiving all available formats
-        fprefix = container["storagename"] or "content"
         if CFG_BIBDOCFILE_ENABLE_BIBDOCFSINFO_CACHE:
             ## We take all extensions from the existing formats in the DB.
-            container["extensions"] = set([ext[0] for ext in run_sql("SELECT format FROM bibdocfsinfo WHERE id_bibdoc=%s", (docid, ))])
+            res = run_sql("SELECT id_bibdoc, version, format, cd, md, checksum, filesize FROM bibdocfsinfo WHERE id_bibdoc IN (%s)" % in_docids, docids)
+            for row in res:
+                if row[0] in containers:
+                    containers[row[0]]["fsinfo"].append(row[1:])
+            for container in containers.itervalues():
+                container["extensions"] = set([fsinfo[1] for fsinfo in container["fsinfo"]])
         else:
             ## We take all the extensions by listing the directory content, stripping name
             ## and version.
-            container["extensions"] = set([fname[len(fprefix):].rsplit(";", 1)[0] for fname in filter(lambda x: x.startswith(fprefix), os.listdir(container["basedir"]))])
-        return container
+            for container in containers.itervalues():
+                fprefix = container["storagename"] or "content"
+                container["extensions"] = set([fname[len(fprefix):].rsplit(";", 1)[0] for fname in filter(lambda x: x.startswith(fprefix), os.listdir(container["basedir"]))])
+        return containers
 
     @staticmethod
     def create_instance(docid=None, recid=None, docname=None,
-                        doctype='Fulltext', a_type = 'Main', human_readable=False):
+                        doctype='Fulltext', a_type = 'Main', human_readable=False,
+                        initial_data=None):
         """
         Parameters of an attachement to the record:
         a_type, recid, docname
@@ -1761,13 +1869,19 @@ class BibDoc(object):
 
         @param doctype Type of the document itself (by default Fulltext)
         @type doctype String
+
+        @param initial_data Information about the existing document C{docid}
+                            already retrieved by L{_retrieve_data_of_documents}
+        @type initial_data dict
         """
 
         # first try to retrieve existing record based on obtained data
         data = None
         extensions = []
         if docid is not None:
-            data = BibDoc._retrieve_data(docid)
+            data = initial_data
+            if data is None:
+                data = BibDoc._retrieve_data(docid)
             doctype = data["doctype"]
             extensions = data["extensions"]
 
@@ -2694,20 +2808,24 @@ class BibDoc(object):
 
         if context != ('init', 'init_from_disk'):
             previous_file_list = list(self._docfiles)
-        res = run_sql("SELECT status, creation_date,"
-            "modification_date FROM bibdoc WHERE id=%s", (self.id,))
+        if context != 'init':
+            ## In init context these were just read by the constructor
+            res = run_sql("SELECT status, creation_date,"
+                "modification_date FROM bibdoc WHERE id=%s", (self.id,))
 
-        self.cd = res[0][1]
-        self.md = res[0][2]
-        self.status = res[0][0]
+            self.cd = res[0][1]
+            self.md = res[0][2]
+            self.status = res[0][0]
 
-        self.more_info = BibDocMoreInfo(self.id)
+            self.more_info = BibDocMoreInfo(self.id)
         self._docfiles = []
 
 
         if CFG_BIBDOCFILE_ENABLE_BIBDOCFSINFO_CACHE and context == 'init':
             ## In normal init context we read from DB
-            res = run_sql("SELECT version, format, cd, md, checksum, filesize FROM bibdocfsinfo WHERE id_bibdoc=%s", (self.id, ))
+            res = self._fsinfo
+            if res is None:
+                res = run_sql("SELECT version, format, cd, md, checksum, filesize FROM bibdocfsinfo WHERE id_bibdoc=%s", (self.id, ))
             for version, docformat, cd, md, checksum, size in res:
                 filepath = self.get_filepath(docformat, version)
                 self._docfiles.append(BibDocFile(
@@ -2731,6 +2849,7 @@ class BibDoc(object):
                         except Exception, e:
                             register_exception()
                             raise InvenioBibDocFileError, e
+        self._fsinfo = None
         if context in ('init', 'init_from_disk'):
             return
         else:
@@ -3341,8 +3460,12 @@ def stream_file(req, fullpath, fullname=None, mime=None, encoding=None, etag=Non
     g = _RE_BAD_MSIE.search(headers.get('user-agent', "MSIE 6.0"))
     bad_msie = g and float(g.group(1)) < 9.0
 
-    if CFG_BIBDOCFILE_USE_XSENDFILE:
+    multiple_ranges_p = CFG_ENABLE_HTTP_RANGE_REQUESTS and \
+        headers['range'] and len(headers['range']) > 1
+    if CFG_BIBDOCFILE_USE_XSENDFILE and not multiple_ranges_p:
         ## If XSendFile is supported by the server, let's use it.
+        ## The server takes care of plain and single range requests,
+        ## multipart responses are still built below.
         if os.path.exists(fullpath):
             if fullname is None:
                 fullname = os.path.basename(fullpath)
@@ -3354,7 +3477,10 @@ def stream_file(req, fullpath, fullname=None, mime=None, encoding=None, etag=Non
             else:
                 ## IE is confused by inline
                 req.headers_out["Content-Disposition"] = 'inline; filename="%s"' % fullname.replace('"', '\\"')
-            req.headers_out["X-Sendfile"] = fullpath
+            if CFG_BIBDOCFILE_XSENDFILE_HEADER.lower() == 'x-accel-redirect':
+                req.headers_out["X-Accel-Redirect"] = CFG_BIBDOCFILE_XACCEL_REDIRECT_PREFIX.rstrip('/') + urllib.quote(os.path.abspath(fullpath))
+            else:
+                req.headers_out["X-Sendfile"] = fullpath
             if mime is None:
                 (mime, encoding) = _mimes.guess_type(fullpath)
                 if mime is None:
@@ -3945,7 +4071,8 @@ class MoreInfo(object):
        """
 
     def __init__(self, docid = None, version = None, docformat = None,
-                 relation = None, cache_only = False, cache_reads = True, initial_data = None):
+                 relation = None, cache_only = False, cache_reads = True, initial_data = None,
+                 database_rows = None):
         """
         @param cache_only Determines if MoreInfo object should be created in
                           memory only or reflected in the database
@@ -3964,6 +4091,12 @@ class MoreInfo(object):
                              instance from serialised value
         @type initial_data string
 
+        @param database_rows The (namespace, data_key, data_value) rows of
+                             this MoreInfo, when they have already been
+                             retrieved from the database together with
+                             those of other documents
+        @type database_rows list
+
         """
         self.docid = docid
         self.version = version
@@ -3984,7 +4117,10 @@ class MoreInfo(object):
         self.cache_reads = cache_reads
 
         if not self.cache_only:
-            self.populate_from_database()
+            if database_rows is None:
+                self.populate_from_database()
+            else:
+                self._populate_from_rows(database_rows)
 
     @staticmethod
     def create_from_serialised(ser_str, docid = None, version = None, docformat = None,
@@ -4005,13 +4141,17 @@ class MoreInfo(object):
         where_str, where_args = self._generate_where_query_args()
         query_str = "SELECT namespace, data_key, data_value FROM bibdocmoreinfo WHERE %s" % (where_str, )
         res = run_sql(query_str, where_args)
-        if res:
-            for row in res:
-                namespace, data_key, data_value_ser = row
-                data_value = cPickle.loads(data_value_ser)
-                if not namespace in self.cache:
-                    self.cache[namespace] = {}
-                self.cache[namespace][data_key] = data_value
+        self._populate_from_rows(res)
+
+    def _populate_from_rows(self, rows):
+        """Places in the cache the (namespace, data_key, data_value) rows
+        read from the database"""
+        for row in rows:
+            namespace, data_key, data_value_ser = row
+            data_value = cPickle.loads(data_value_ser)
+            if not namespace in self.cache:
+                self.cache[namespace] = {}
+            self.cache[namespace][data_key] = data_value
 
     def _mark_dirty(self, namespace, data_key):
         """Marks a data key dirty - that should be saved into the database"""
@@ -4278,10 +4418,11 @@ class BibDocMoreInfo(MoreInfo):
     @note: this class will be extended in the future to hold all the new auxiliary
     information about a document.
     """
-    def __init__(self, docid, cache_only = False, initial_data = None):
+    def __init__(self, docid, cache_only = False, initial_data = None, database_rows = None):
         if not (type(docid) in (long, int) and docid > 0):
             raise ValueError("docid is not a positive integer, but %s." % docid)
-        MoreInfo.__init__(self, docid, cache_only = cache_only, initial_data = initial_data)
+        MoreInfo.__init__(self, docid, cache_only = cache_only, initial_data = initial_data,
+                          database_rows = database_rows)
 
         if 'descriptions' not in self:
             self['descriptions'] = {}
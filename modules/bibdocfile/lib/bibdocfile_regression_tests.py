@@ -27,7 +27,7 @@ from invenio.testutils import InvenioTestCase
 from invenio.testutils import make_test_suite, run_test_suite
 from invenio.bibdocfile import BibRecDocs, BibRelation, MoreInfo, \
     check_bibdoc_authorization, bibdocfile_url_p, guess_format_from_url, CFG_HAS_MAGIC, \
-    Md5Folder, calculate_md5, calculate_md5_external
+    Md5Folder, calculate_md5, calculate_md5_external, get_bibrecdocs
 from invenio.dbquery import run_sql
 
 from invenio.access_control_config import CFG_WEBACCESS_WARNING_MSGS
@@ -210,6 +210,26 @@ class BibRecDocsTest(InvenioTestCase):
         my_bibrecdoc.delete_bibdoc('file')
         my_bibrecdoc.delete_bibdoc('test')
 
+    def test_get_bibrecdocs(self):
+        """bibdocfile - batched loading of BibRecDocs"""
+        recids = [1, 2, 8, 10, 99999]
+        batch = get_bibrecdocs(recids)
+        self.assertEqual(sorted(batch.keys()), recids)
+        for recid in recids:
+            expected = BibRecDocs(recid)
+            self.assertEqual(batch[recid].get_bibdoc_names(),
+                             expected.get_bibdoc_names())
+            for docname in expected.get_bibdoc_names():
+                expected_files = [(afile.get_url(), afile.get_checksum(),
+                                   afile.get_size(), afile.hidden,
+                                   afile.get_description())
+                                  for afile in expected.get_bibdoc(docname).list_all_files()]
+                files = [(afile.get_url(), afile.get_checksum(),
+                          afile.get_size(), afile.hidden,
+                          afile.get_description())
+                         for afile in batch[recid].get_bibdoc(docname).list_all_files()]
+                self.assertEqual(sorted(files), sorted(expected_files))
+
 class BibDocsTest(InvenioTestCase):
     """regression tests about BibDocs"""
 
@@ -45,6 +45,7 @@ from invenio.config import \
      CFG_SITE_LANG, \
      CFG_SITE_URL, \
      CFG_SITE_RECORD
+from invenio.bibformat_config import CFG_BIBFORMAT_PREFETCH_CHUNK_SIZE
 import getopt
 import sys
 
@@ -52,7 +53,7 @@ import sys
 ##
 def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
                   xml_record=None, user_info=None, on_the_fly=False,
-                  save_missing=True, force_2nd_pass=False):
+                  save_missing=True, force_2nd_pass=False, batch=None):
     """
     Returns the formatted record with id 'recID' and format 'of'
 
@@ -78,6 +79,10 @@ def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
     (the normal way is to use nocache="1" in a template to have it treated
      in the 2nd pass instead)
 
+    batch is an optional BibFormatBatch, as returned by
+    prefetch_records(), holding data prefetched for a list of records
+    that includes recID.
+
     @param recID: the id of the record to fetch
     @param of: the output format code
     @return: formatted record as String, or '' if it does not exist
@@ -91,7 +96,8 @@ def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
                                         xml_record=xml_record,
                                         user_info=user_info,
                                         on_the_fly=on_the_fly,
-                                        save_missing=save_missing)
+                                        save_missing=save_missing,
+                                        batch=batch)
     if needs_2nd_pass or force_2nd_pass:
         out = bibformat_engine.format_record_2nd_pass(
                                     recID=recID,
@@ -101,10 +107,31 @@ def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
                                     verbose=verbose,
                                     search_pattern=search_pattern,
                                     xml_record=xml_record,
-                                    user_info=user_info)
+                                    user_info=user_info,
+                                    batch=batch)
 
     return out
 
+def prefetch_records(recIDs, of, ln=CFG_SITE_LANG, search_pattern=None,
+                     user_info=None, on_the_fly=False):
+    """
+    Returns a BibFormatBatch for formatting the records with ids
+    'recIDs' in format 'of' with format_record(), fetching beforehand
+    in bulk what the formatting of each record would fetch by itself
+    (preformatted outputs, record structures, values of format
+    elements providing a prefetch_values() function, etc.)
+
+    The other parameters must be the ones later given to format_record().
+
+    @param recIDs: a list of record IDs
+    @param of: the output format code
+    @return: a BibFormatBatch
+    """
+    return bibformat_engine.BibFormatBatch(recIDs, of, ln=ln,
+                                           search_pattern=search_pattern,
+                                           user_info=user_info,
+                                           on_the_fly=on_the_fly)
+
 
 def record_get_xml(recID, format='xm', decompress=zlib.decompress):
     """
@@ -165,6 +192,10 @@ def format_records(recIDs, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
     Note that you should set 'req' content-type by yourself, and send
     http header before calling this function as it will not do it.
 
+    Records given by IDs are formatted by chunks of
+    CFG_BIBFORMAT_PREFETCH_CHUNK_SIZE records, whose data are fetched
+    together beforehand (see prefetch_records()).
+
     This function takes the same parameters as 'format_record' except for:
     @param recIDs: a list of record IDs
     @type recIDs: list(int)
@@ -203,6 +234,7 @@ def format_records(recIDs, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
     formatted_records = ''
 
     #Fill one of the lists with Nones
+    batch = None
     if xml_records is not None:
         recIDs = [None for dummy in xml_records]
     else:
@@ -214,6 +246,11 @@ def format_records(recIDs, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
         if i == total_rec - 1:
             last_iteration = True
 
+        # Fetch data of the next records at once
+        if xml_records[i] is None and i % CFG_BIBFORMAT_PREFETCH_CHUNK_SIZE == 0:
+            batch = prefetch_records(recIDs[i:i + CFG_BIBFORMAT_PREFETCH_CHUNK_SIZE],
+                                     of, ln, search_pattern, user_info, on_the_fly)
+
         #Print prefix
         if record_prefix is not None:
             if isinstance(record_prefix, str):
@@ -229,7 +266,7 @@ def format_records(recIDs, of, ln=CFG_SITE_LANG, verbose=0, search_pattern=None,
         #Print formatted record
         formatted_record = format_record(recIDs[i], of, ln, verbose,
                                          search_pattern, xml_records[i],
-                                         user_info, on_the_fly)
+                                         user_info, on_the_fly, batch=batch)
         formatted_records += formatted_record
         if req is not None:
             req.write(formatted_record)
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+BibFormat output cache.
+
+Caches the output of on-the-fly formatting (i.e. of the formats that
+are not precomputed into the bibfmt table by BibReformat) for the
+output formats listed in CFG_BIBFORMAT_OUTPUT_CACHE_FORMATS.
+
+Entries are keyed by record ID, output format, language, record
+revision (bibrec.modification_date), visibility class of the user and
+search pattern, so that a modified record is never served from an old
+entry.  BibUpload furthermore drops all the entries of a record from
+the shared backends when it modifies the record.
+
+Three backends are available, chosen by CFG_BIBFORMAT_OUTPUT_CACHE_BACKEND:
+  - 'memory': per process LRU cache of CFG_BIBFORMAT_OUTPUT_CACHE_SIZE MB;
+  - 'file': files in CFG_CACHEDIR/bibformat, shared by all processes
+            of the machine;
+  - 'redis': the Redis servers of CFG_REDIS_HOSTS, shared by all
+             the machines.
+"""
+
+__revision__ = "$Id$"
+
+import marshal
+import os
+import shutil
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+from invenio.config import \
+     CFG_BIBFORMAT_OUTPUT_CACHE_BACKEND, \
+     CFG_BIBFORMAT_OUTPUT_CACHE_FORMATS, \
+     CFG_BIBFORMAT_OUTPUT_CACHE_SIZE, \
+     CFG_BIBFORMAT_OUTPUT_CACHE_TIMEOUT, \
+     CFG_CACHEDIR
+from invenio.access_control_admin import acc_get_authorization_memo, \
+     acc_get_user_roles_from_user_info
+from invenio.dbquery import run_sql
+from invenio.errorlib import register_exception
+from invenio.memoiseutils import LRUCache
+
+CFG_BIBFORMAT_OUTPUT_CACHE_DIR = os.path.join(CFG_CACHEDIR, 'bibformat')
+
+class FormattedRecordMemoryCache(object):
+    """Per process LRU cache of formatted records."""
+    def __init__(self, size=CFG_BIBFORMAT_OUTPUT_CACHE_SIZE):
+        self.entries = LRUCache(size * 1024 * 1024,
+                                weigh=lambda value: len(value[0]))
+
+    def get(self, recid, key):
+        """Return (output, needs_2nd_pass) cached for KEY, or None."""
+        return self.entries.get((recid, key))
+
+    def set(self, recid, key, revision, value):
+        """Cache VALUE, i.e. (output, needs_2nd_pass), for KEY."""
+        self.entries.set((recid, key), value)
+
+    def invalidate(self, recid):
+        """Nothing to do: other processes cannot reach this cache, and
+        new revisions of records get new keys anyway."""
+        pass
+
+class FormattedRecordFileCache(object):
+    """Cache of formatted records stored as files, one directory per
+    record, one file per key."""
+    def __init__(self, directory=CFG_BIBFORMAT_OUTPUT_CACHE_DIR):
+        self.directory = directory
+
+    def get_record_directory(self, recid):
+        """Return directory holding the entries of record RECID."""
+        return os.path.join(self.directory, str(recid / 1000), str(recid))
+
+    def get(self, recid, key):
+        """Return (output, needs_2nd_pass) cached for KEY, or None."""
+        path = os.path.join(self.get_record_directory(recid), sha1(key).hexdigest())
+        try:
+            entry_file = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                return marshal.load(entry_file)
+            except (EOFError, ValueError, TypeError):
+                return None
+        finally:
+            entry_file.close()
+
+    def set(self, recid, key, revision, value):
+        """Cache VALUE, i.e. (output, needs_2nd_pass), for KEY, and
+        remove the entries of older revisions of the record."""
+        directory = self.get_record_directory(recid)
+        revision_file = os.path.join(directory, 'revision')
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            elif open(revision_file).read() != revision:
+                self.invalidate(recid)
+                os.makedirs(directory)
+        except (IOError, OSError):
+            # e.g. concurrent creation or invalidation
+            pass
+        try:
+            if not os.path.exists(revision_file):
+                open(revision_file, 'w').write(revision)
+            path = os.path.join(directory, sha1(key).hexdigest())
+            tmp_path = '%s.%s.tmp' % (path, os.getpid())
+            entry_file = open(tmp_path, 'wb')
+            try:
+                marshal.dump(value, entry_file)
+            finally:
+                entry_file.close()
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            register_exception()
+
+    def invalidate(self, recid):
+        """Remove all the entries of record RECID."""
+        shutil.rmtree(self.get_record_directory(recid), ignore_errors=True)
+
+class FormattedRecordRedisCache(object):
+    """Cache of formatted records stored in Redis, as one hash per
+    record."""
+    def __init__(self, timeout=CFG_BIBFORMAT_OUTPUT_CACHE_TIMEOUT):
+        from invenio.redisutils import get_redis
+        self.redis = get_redis()
+        self.timeout = timeout
+
+    def get_record_key(self, recid):
+        """Return Redis key of the hash holding record RECID."""
+        return 'bibformat_output_cache:%s' % recid
+
+    def get(self, recid, key):
+        """Return (output, needs_2nd_pass) cached for KEY, or None."""
+        value = self.redis.hget(self.get_record_key(recid), key)
+        if value is None:
+            return None
+        return marshal.loads(value)
+
+    def set(self, recid, key, revision, value):
+        """Cache VALUE, i.e. (output, needs_2nd_pass), for KEY."""
+        record_key = self.get_record_key(recid)
+        self.redis.hset(record_key, key, marshal.dumps(value))
+        self.redis.expire(record_key, self.timeout)
+
+    def invalidate(self, recid):
+        """Remove all the entries of record RECID."""
+        self.redis.delete(self.get_record_key(recid))
+
+CFG_BIBFORMAT_OUTPUT_CACHE_BACKENDS = {
+    'memory': FormattedRecordMemoryCache,
+    'file': FormattedRecordFileCache,
+    'redis': FormattedRecordRedisCache,
+}
+
+_OUTPUT_CACHE = []
+
+def get_output_cache():
+    """Return the configured output cache backend, or None if the
+    output cache is disabled."""
+    if not CFG_BIBFORMAT_OUTPUT_CACHE_BACKEND:
+        return None
+    if not _OUTPUT_CACHE:
+        _OUTPUT_CACHE.append(CFG_BIBFORMAT_OUTPUT_CACHE_BACKENDS[CFG_BIBFORMAT_OUTPUT_CACHE_BACKEND]())
+    return _OUTPUT_CACHE[0]
+
+def is_format_cacheable(of):
+    """Is the output of format OF cached by the output cache?"""
+    return CFG_BIBFORMAT_OUTPUT_CACHE_BACKEND and \
+           of.lower() in CFG_BIBFORMAT_OUTPUT_CACHE_FORMATS
+
+def get_user_visibility_class(user_info):
+    """Return the visibility class of the user described by USER_INFO:
+    every authenticated user gets his own, since formats may show him
+    restricted material or personal links, while guests share the
+    class of the roles they belong to, e.g. through FireRole rules on
+    their IP address.  The class is memoised with the authorization
+    decisions of the user."""
+    if not user_info:
+        return 'guest'
+    if user_info.get('guest') != '1':
+        return 'uid%s' % user_info.get('uid')
+    memo = acc_get_authorization_memo(user_info)
+    try:
+        return memo['visibility_class']
+    except KeyError:
+        pass
+    roles = acc_get_user_roles_from_user_info(user_info)
+    if roles:
+        visibility_class = 'guest%s' % ','.join([str(id_role) for id_role in sorted(roles)])
+    else:
+        visibility_class = 'guest'
+    memo['visibility_class'] = visibility_class
+    return visibility_class
+
+def get_record_revision(recid):
+    """Return revision of record RECID, that is its modification date."""
+    res = run_sql("SELECT modification_date FROM bibrec WHERE id=%s", (recid,))
+    if res:
+        return str(res[0][0])
+    return ''
+
+def get_records_revisions(recids):
+    """Return dictionary of recid->revision for RECIDS, with one query."""
+    recids = list(recids)
+    if not recids:
+        return {}
+    res = run_sql("SELECT id, modification_date FROM bibrec WHERE id IN (%s)" % \
+                  ','.join(['%s'] * len(recids)), recids)
+    return dict([(recid, str(modification_date)) for recid, modification_date in res])
+
+def get_cache_key(of, ln, revision, user_info, search_pattern):
+    """Return key of the output of a record in the output cache."""
+    return '%s:%s:%s:%s:%s' % (of.lower(), ln, revision,
+                               get_user_visibility_class(user_info),
+                               sha1(repr(search_pattern or [])).hexdigest())
+
+def get_cached_output(recid, of, ln, user_info, search_pattern, revision=None):
+    """Return (output, needs_2nd_pass, key, revision) for record RECID
+    from the output cache.  OUTPUT is None on cache miss; KEY and
+    REVISION can then be given to set_cached_output().  REVISION can
+    be given if already known, e.g. prefetched for a page of records
+    with get_records_revisions()."""
+    output_cache = get_output_cache()
+    if revision is None:
+        revision = get_record_revision(recid)
+    key = get_cache_key(of, ln, revision, user_info, search_pattern)
+    try:
+        value = output_cache.get(recid, key)
+    except Exception:
+        # never fail formatting because of the cache
+        register_exception()
+        value = None
+    if value is None:
+        return None, False, key, revision
+    return value[0], value[1], key, revision
+
+def set_cached_output(recid, key, revision, output, needs_2nd_pass):
+    """Store OUTPUT of record RECID for KEY in the output cache."""
+    try:
+        get_output_cache().set(recid, key, revision, (output, needs_2nd_pass))
+    except Exception:
+        register_exception()
+
+def invalidate_cached_output(recid):
+    """Drop all the cached outputs of record RECID, e.g. because it
+    has been modified."""
+    output_cache = get_output_cache()
+    if output_cache is not None:
+        output_cache.invalidate(recid)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""BibFormat output cache - Unit Test Suite"""
+
+import shutil
+import tempfile
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite, \
+     patch_attributes, restore_attributes
+from invenio import bibformat_cache
+from invenio.bibformat_cache import \
+     FormattedRecordFileCache, \
+     FormattedRecordMemoryCache, \
+     get_cache_key
+
+
+class OutputCacheKeyTest(InvenioTestCase):
+    """Test keys of the output cache"""
+
+    def setUp(self):
+        """Give the role 7 to the guests coming from 137.138.*"""
+        def get_roles(user_info):
+            if user_info.get('remote_ip', '').startswith('137.138.'):
+                return [7]
+            return []
+        def get_memo(user_info):
+            return user_info.setdefault('memo', {})
+        self.saved = patch_attributes(bibformat_cache,
+            acc_get_user_roles_from_user_info=get_roles,
+            acc_get_authorization_memo=get_memo)
+
+    def tearDown(self):
+        restore_attributes(bibformat_cache, self.saved)
+
+    def test_cache_key_guest_roles(self):
+        """bibformat - output cache keys of guests with IP based roles"""
+        guest = {'guest': '1', 'uid': 11, 'remote_ip': '137.138.1.1'}
+        other_guest = {'guest': '1', 'uid': 12, 'remote_ip': '137.138.2.2'}
+        outside_guest = {'guest': '1', 'uid': 13, 'remote_ip': '10.0.0.1'}
+        key = get_cache_key('hb', 'en', '2014-01-01 10:00:00', guest, [])
+        self.assertEqual(key, get_cache_key('hb', 'en', '2014-01-01 10:00:00', other_guest, []))
+        self.assertNotEqual(key, get_cache_key('hb', 'en', '2014-01-01 10:00:00', outside_guest, []))
+
+    def test_cache_key_visibility(self):
+        """bibformat - output cache keys of guests and users"""
+        guest = {'guest': '1', 'uid': 11}
+        other_guest = {'guest': '1', 'uid': 12}
+        user = {'guest': '0', 'uid': 5}
+        key = get_cache_key('hb', 'en', '2014-01-01 10:00:00', guest, [])
+        self.assertEqual(key, get_cache_key('HB', 'en', '2014-01-01 10:00:00', other_guest, []))
+        self.assertNotEqual(key, get_cache_key('hb', 'en', '2014-01-01 10:00:00', user, []))
+
+    def test_cache_key_revision(self):
+        """bibformat - output cache keys of record revisions"""
+        self.assertNotEqual(get_cache_key('hb', 'en', '2014-01-01 10:00:00', None, []),
+                            get_cache_key('hb', 'en', '2014-01-02 10:00:00', None, []))
+        self.assertNotEqual(get_cache_key('hb', 'en', '2014-01-01 10:00:00', None, []),
+                            get_cache_key('hb', 'en', '2014-01-01 10:00:00', None, ['ellis']))
+
+
+class OutputCacheBackendTest(InvenioTestCase):
+    """Test backends of the output cache"""
+
+    def setUp(self):
+        """Store file entries into a temporary directory."""
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the temporary directory."""
+        shutil.rmtree(self.directory)
+
+    def test_memory_cache(self):
+        """bibformat - memory output cache"""
+        output_cache = FormattedRecordMemoryCache(1)
+        output_cache.set(1, 'hb:en', 'r1', ('<b>1</b>', False))
+        self.assertEqual(output_cache.get(1, 'hb:en'), ('<b>1</b>', False))
+        self.assertEqual(output_cache.get(2, 'hb:en'), None)
+
+    def test_file_cache(self):
+        """bibformat - file output cache"""
+        output_cache = FormattedRecordFileCache(self.directory)
+        output_cache.set(1, 'hb:en:r1', 'r1', ('<b>1</b>', True))
+        output_cache.set(1, 'hd:en:r1', 'r1', ('<b>one</b>', False))
+        self.assertEqual(output_cache.get(1, 'hb:en:r1'), ('<b>1</b>', True))
+        self.assertEqual(output_cache.get(1, 'hd:en:r1'), ('<b>one</b>', False))
+        # a new revision drops the entries of the previous one
+        output_cache.set(1, 'hb:en:r2', 'r2', ('<b>2</b>', False))
+        self.assertEqual(output_cache.get(1, 'hd:en:r1'), None)
+        self.assertEqual(output_cache.get(1, 'hb:en:r2'), ('<b>2</b>', False))
+        output_cache.invalidate(1)
+        self.assertEqual(output_cache.get(1, 'hb:en:r2'), None)
+
+
+TEST_SUITE = make_test_suite(OutputCacheKeyTest,
+                             OutputCacheBackendTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -450,6 +450,28 @@ def get_preformatted_record(recID, of, decompress=zlib.decompress):
     else:
         return None, None
 
+def get_preformatted_records(recIDs, of, decompress=zlib.decompress):
+    """
+    Returns the preformatted records with ids 'recIDs' in format 'of'
+    and whether they need a 2nd pass, with one query.
+
+    @param recIDs: the ids of the records to fetch
+    @param of: the output format code
+    @param decompress: the method used to decompress the preformatted records in database
+    @return: dictionary recID->(formatted record, needs 2nd pass) for
+             the records that exist in format 'of'
+    """
+    recIDs = list(recIDs)
+    if not recIDs:
+        return {}
+    run_on_slave = of not in ('xm', 'recstruct')
+    query = """SELECT id_bibrec, value, needs_2nd_pass FROM bibfmt
+               WHERE id_bibrec IN (%s) AND format = %%s""" % \
+            ','.join(['%s'] * len(recIDs))
+    res = run_sql(query, recIDs + [of], run_on_slave=run_on_slave)
+    return dict([(recID, (decompress(value), bool(needs_2nd_pass)))
+                 for recID, value, needs_2nd_pass in res])
+
 def get_preformatted_record_date(recID, of):
     """
     Returns the date of the last update of the cache for the considered
@@ -66,6 +66,10 @@ from invenio.messages import \
      wash_language, \
      gettext_set_language
 from invenio import bibformat_dblayer
+from invenio.bibformat_cache import \
+     get_cached_output, \
+     is_format_cacheable, \
+     set_cached_output
 from invenio.bibformat_config import \
      CFG_BIBFORMAT_FORMAT_TEMPLATE_EXTENSION, \
      CFG_BIBFORMAT_FORMAT_OUTPUT_EXTENSION, \
@@ -90,6 +94,7 @@ from invenio.access_control_engine import acc_authorize_action
 format_templates_cache = {}
 format_elements_cache = {}
 format_outputs_cache = {}
+format_template_plans_cache = {}
 
 html_field = '<!--HTML-->' # String indicating that field should be
                            # treated as HTML (and therefore no escaping of
@@ -197,7 +202,8 @@ pattern_format_element_seealso = re.compile(r'''@see:\s*(?P<see>.*)''',
 
 
 def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0,
-                  search_pattern=None, xml_record=None, user_info=None):
+                  search_pattern=None, xml_record=None, user_info=None,
+                  batch=None):
     """
     Formats a record given output format. Main entry function of
     bibformat engine.
@@ -224,6 +230,7 @@ def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0,
     @param search_pattern: list of strings representing the user request in web interface
     @param xml_record: an xml string representing the record to format
     @param user_info: the information of the user who will view the formatted page
+    @param batch: the L{BibFormatBatch} the record belongs to, if any
     @return: formatted record
     """
     if search_pattern is None:
@@ -240,6 +247,8 @@ def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0,
 
     #Create a BibFormat Object to pass that contain record and context
     bfo = BibFormatObject(recID, ln, search_pattern, xml_record, user_info, of)
+    if batch is not None:
+        batch.prepare_bfo(bfo)
 
     if of.lower() != 'xm' and (not bfo.get_record()
                                             or record_empty(bfo.get_record())):
@@ -290,7 +299,7 @@ def format_record(recID, of, ln=CFG_SITE_LANG, verbose=0,
 def format_record_1st_pass(recID, of, ln=CFG_SITE_LANG, verbose=0,
                            search_pattern=None, xml_record=None,
                            user_info=None, on_the_fly=False,
-                           save_missing=True):
+                           save_missing=True, batch=None):
     """
     Format a record in given output format.
 
@@ -328,10 +337,15 @@ def format_record_1st_pass(recID, of, ln=CFG_SITE_LANG, verbose=0,
     @param user_info: the information of the user who will view the formatted page (if applicable)
     @param on_the_fly: if False, try to return an already preformatted version of the record in the database
     @type on_the_fly: boolean
+    @param batch: the L{BibFormatBatch} the record belongs to, if any,
+                  holding data prefetched for all the records of the batch
+    @type batch: L{BibFormatBatch}
     @return: formatted record
     @rtype: string
     """
     from invenio.search_engine import record_exists
+    if batch is not None and recID not in batch:
+        batch = None
     if search_pattern is None:
         search_pattern = []
 
@@ -345,7 +359,8 @@ def format_record_1st_pass(recID, of, ln=CFG_SITE_LANG, verbose=0,
        (ln == CFG_SITE_LANG or
         of.lower() == 'xm' or
         (of.lower() in CFG_BIBFORMAT_DISABLE_I18N_FOR_CACHED_FORMATS)) and \
-       record_exists(recID) != -1:
+       (batch is not None and batch.existence[recID] or
+        batch is None and record_exists(recID)) != -1:
         # Try to fetch preformatted record. Only possible for records
         # formatted in CFG_SITE_LANG language (other are never
         # stored), or of='xm' which does not depend on language.
@@ -354,7 +369,10 @@ def format_record_1st_pass(recID, of, ln=CFG_SITE_LANG, verbose=0,
         # always served from the same cache for any language.  Also,
         # do not fetch from DB when record has been deleted: we want
         # to return an "empty" record in that case
-        res, needs_2nd_pass = bibformat_dblayer.get_preformatted_record(recID, of)
+        if batch is not None:
+            res, needs_2nd_pass = batch.preformatted.get(recID, (None, None))
+        else:
+            res, needs_2nd_pass = bibformat_dblayer.get_preformatted_record(recID, of)
         if res is not None:
             # record 'recID' is formatted in 'of', so return it
             if verbose == 9:
@@ -389,6 +407,20 @@ def format_record_1st_pass(recID, of, ln=CFG_SITE_LANG, verbose=0,
         Formatting record %i on-the-fly.
         </span>""" % recID
 
+    use_output_cache = recID and xml_record is None and verbose == 0 \
+                       and not on_the_fly and is_format_cacheable(of)
+    if use_output_cache and batch is not None and recID in batch.cached_outputs:
+        cached_out, needs_2nd_pass = batch.cached_outputs[recID]
+        return out + cached_out, needs_2nd_pass
+    if use_output_cache:
+        # Try the output cache, which holds live formatted records
+        # for the current revision of the record
+        cached_out, needs_2nd_pass, cache_key, revision = \
+            get_cached_output(recID, of, ln, user_info, search_pattern,
+                              batch is not None and batch.revisions.get(recID) or None)
+        if cached_out is not None:
+            return out + cached_out, needs_2nd_pass
+
     try:
         out_, needs_2nd_pass = format_record(recID=recID,
                                              of=of,
@@ -396,7 +428,8 @@ def format_record_1st_pass(recID, of, ln=CFG_SITE_LANG, verbose=0,
                                              verbose=verbose,
                                              search_pattern=search_pattern,
                                              xml_record=xml_record,
-                                             user_info=user_info)
+                                             user_info=user_info,
+                                             batch=batch)
         out += out_
 
         if of.lower() in ('xm', 'xoaimarc'):
@@ -410,6 +443,8 @@ def format_record_1st_pass(recID, of, ln=CFG_SITE_LANG, verbose=0,
                                                        of,
                                                        out,
                                                        needs_2nd_pass)
+        if use_output_cache:
+            set_cached_output(recID, cache_key, revision, out, needs_2nd_pass)
 
         return out, needs_2nd_pass
     except Exception, e:
@@ -443,9 +478,11 @@ def format_record_1st_pass(recID, of, ln=CFG_SITE_LANG, verbose=0,
 
 def format_record_2nd_pass(recID, template, ln=CFG_SITE_LANG,
                            search_pattern=None, xml_record=None,
-                           user_info=None, of=None, verbose=0):
+                           user_info=None, of=None, verbose=0, batch=None):
     # Create light bfo object
     bfo = BibFormatObject(recID, ln, search_pattern, xml_record, user_info, of)
+    if batch is not None and xml_record is None:
+        batch.prepare_bfo(bfo)
     # Translations
     template = translate_template(template, ln)
     # Format template
@@ -535,6 +572,12 @@ def format_with_format_template(format_template_filename, bfo,
                                                        9: errors and warnings, stop if error (debug mode ))
     @return: formatted text
     """
+    if format_template_code is None and format_template_filename is not None and \
+           format_template_filename.endswith("."+CFG_BIBFORMAT_FORMAT_TEMPLATE_EXTENSION):
+        # .bft, compiled once per process and language
+        plan = get_format_template_plan(format_template_filename, bfo.lang, verbose)
+        return render_format_template_plan(plan, bfo, verbose)
+
     if format_template_code is not None:
         format_content = str(format_template_code)
     else:
@@ -656,6 +699,137 @@ def eval_format_template_elements(format_template, bfo, verbose=0):
     return fmt, status['no_cache']
 
 
+def get_format_template_plan(filename, ln=CFG_SITE_LANG, verbose=0):
+    """
+    Returns the render plan of the given format template in the given
+    language (see compile_format_template()).
+
+    Plans are compiled once per process and language, and compiled
+    again when the format template file is modified.
+
+    @param filename: the filename of a .bft format template
+    @param ln: the language of the plan
+    @param verbose: the level of verbosity from 0 to 9
+    @return: a render plan
+    """
+    path = "%s%s%s" % (CFG_BIBFORMAT_TEMPLATES_PATH, os.sep, filename)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        mtime = None
+    plan = format_template_plans_cache.get((path, ln))
+    if plan is None or plan['mtime'] != mtime:
+        plan = compile_format_template(get_format_template(filename)['code'], ln, verbose)
+        plan['mtime'] = mtime
+        format_template_plans_cache[(path, ln)] = plan
+    return plan
+
+
+def compile_format_template(format_template, ln=CFG_SITE_LANG, verbose=0):
+    """
+    Compiles the code of a .bft format template into a render plan,
+    so that formatting a record does not need to parse the template
+    again.
+
+    The language tags and the translations of the template are
+    resolved at compile time, unless the template contains elements
+    with no_cache="1", whose evaluation is left to the second pass,
+    together with the translations.  The template is then split into
+    nodes, that are either literal strings, or element calls given as
+    tuples (element name, parameters dictionary, format element
+    structure as returned by get_format_element()).  For elements
+    that could not be loaded, the format element structure is None
+    and the element name is the original tag, evaluated at
+    formatting time to report the error.
+
+    @param format_template: the format template code
+    @param ln: the language of the plan
+    @param verbose: the level of verbosity from 0 to 9
+    @return: dictionary {'nodes': list of nodes, 'needs_2nd_pass': boolean}
+    """
+    def get_params(match):
+        """Returns the parameters of a matched element tag"""
+        params = {}
+        all_params = match.group('params')
+        if all_params is not None:
+            for param_match in pattern_function_params.finditer(all_params):
+                params[param_match.group('param')] = param_match.group('value')
+        return params
+
+    needs_2nd_pass = False
+    for match in pattern_tag.finditer(format_template):
+        if match.group("function_name") != 'lang' and \
+               get_params(match).get('no_cache') == '1':
+            needs_2nd_pass = True
+            break
+    if not needs_2nd_pass:
+        format_template = translate_template(format_template, ln)
+
+    nodes = []
+    position = 0
+    for match in pattern_tag.finditer(format_template):
+        nodes.append(format_template[position:match.start()])
+        position = match.end()
+        function_name = match.group("function_name")
+        if function_name == 'lang':
+            nodes.append(match.group(0))
+            continue
+        params = get_params(match)
+        if params.get('no_cache') == '1':
+            # Keep the element for the 2nd pass
+            del params['no_cache']
+            if params:
+                params_str = ' '.join('%s="%s"' % (k, v) for k, v in params.iteritems())
+                nodes.append("<bfe_%s %s />" % (function_name, params_str))
+            else:
+                nodes.append("<bfe_%s />" % function_name)
+            continue
+        try:
+            format_element = get_format_element(function_name, verbose)
+        except Exception:
+            format_element = None
+        if format_element is None:
+            nodes.append((match.group(0), None, None))
+        else:
+            nodes.append((function_name, params, format_element))
+    nodes.append(format_template[position:])
+
+    # Merge consecutive literal strings
+    plan = []
+    for node in nodes:
+        if isinstance(node, tuple):
+            plan.append(node)
+        elif node:
+            if plan and not isinstance(plan[-1], tuple):
+                plan[-1] += node
+            else:
+                plan.append(node)
+
+    return {'nodes': plan, 'needs_2nd_pass': needs_2nd_pass}
+
+
+def render_format_template_plan(plan, bfo, verbose=0):
+    """
+    Formats the record of the given L{BibFormatObject} with a render
+    plan as returned by compile_format_template().
+
+    @param plan: the render plan
+    @param bfo: the object containing parameters for the current formatting
+    @param verbose: the level of verbosity from 0 to 9
+    @return: tuple (formatted text, needs 2nd pass)
+    """
+    out = []
+    for node in plan['nodes']:
+        if not isinstance(node, tuple):
+            out.append(node)
+        elif node[2] is None:
+            # Let the usual evaluation report the error
+            out.append(eval_format_template_elements(node[0], bfo, verbose)[0])
+        else:
+            out.append(eval_format_element(node[2], bfo, node[1], verbose)[0])
+    return ''.join(out), plan['needs_2nd_pass']
+
+
 def eval_format_element(format_element, bfo, parameters=None, verbose=0):
     """
     Returns the result of the evaluation of the given format element
@@ -1073,7 +1247,8 @@ def get_format_element(element_name, verbose=0, with_built_in_params=False,
       {'attrs': {some attributes in dict. See get_format_element_attrs_from_*}
       'code': the_function_code,
       'type':"field" or "python" depending if element is defined in file or table,
-      'escape_function': the function to call to know if element output must be escaped}
+      'escape_function': the function to call to know if element output must be escaped,
+      'prefetch_function': the function to call to prefetch values for a batch of records, or None}
 
     @param element_name: the name of the format element to load
     @param verbose: the level of verbosity from 0 to 9 (O: silent,
@@ -1107,6 +1282,7 @@ def get_format_element(element_name, verbose=0, with_built_in_params=False,
                 with_built_in_params),
                               'code': None,
                               'escape_function': None,
+                              'prefetch_function': None,
                               'type': "field"}
             # Cache and returns
             format_elements_cache[name] = format_element
@@ -1169,6 +1345,12 @@ def get_format_element(element_name, verbose=0, with_built_in_params=False,
                                   None)
         format_element['escape_function'] = function_escape
 
+        # Load function 'prefetch_values()' inside element, if any
+        function_prefetch = getattr(module.__dict__[module_name],
+                                    'prefetch_values',
+                                    None)
+        format_element['prefetch_function'] = function_prefetch
+
         # Prepare, cache and return
         format_element['attrs'] = get_format_element_attrs_from_function(
                 function_format,
@@ -1786,10 +1968,12 @@ def clear_caches():
 
     @return: None
     """
-    global format_templates_cache, format_elements_cache, format_outputs_cache
+    global format_templates_cache, format_elements_cache, format_outputs_cache, \
+           format_template_plans_cache
     format_templates_cache = {}
     format_elements_cache = {}
     format_outputs_cache = {}
+    format_template_plans_cache = {}
 
 class BibFormatObject(object):
     """
@@ -1872,6 +2056,9 @@ class BibFormatObject(object):
         self.user_info = user_info
         if self.user_info is None:
             self.user_info = collect_user_info(None)
+        # values prefetched by elements for the batch of records this
+        # record is formatted with, by element name (see BibFormatBatch)
+        self.prefetched = {}
 
     def get_record(self):
         """
@@ -2084,6 +2271,132 @@ class BibFormatObject(object):
             return default
 
 
+class BibFormatBatch(object):
+    """
+    Data shared by the formatting of a list of records in the same
+    output format and language, for a same user and search pattern,
+    e.g. the records of a page of search results.
+
+    The data the formatting of each record would fetch by itself with
+    several queries are fetched for all the records at once: existence
+    of the records, preformatted outputs from the bibfmt table,
+    revisions for the output cache, record structures, as well as the
+    values of the format elements that define a 'prefetch_values()'
+    function.  Such a function is given the list of the
+    L{BibFormatObject} of the batch and returns a dictionary of
+    recID->value, that the element then finds in
+    bfo.prefetched[element_name] when formatting each record.
+
+    Give the batch to format_record_1st_pass() and
+    format_record_2nd_pass() to use these data, or more simply call
+    bibformat.format_records().
+    """
+    def __init__(self, recIDs, of, ln=CFG_SITE_LANG, search_pattern=None,
+                 user_info=None, on_the_fly=False):
+        """
+        Prefetch the data needed for formatting RECIDS.
+
+        @param recIDs: the IDs of the records to format
+        @param of: the output format code
+        @param ln: the language to use to format the records
+        @param search_pattern: list of strings representing the user request in web interface
+        @param user_info: the information of the user who will view the formatted records
+        @param on_the_fly: if True, records will be formatted on-the-fly,
+                           so do not prefetch preformatted outputs
+        """
+        from invenio.search_engine import get_records
+        from invenio.search_engine_utils import records_exist
+        from invenio.bibformat_cache import get_records_revisions
+
+        self.recIDs = [int(recID) for recID in recIDs if recID]
+        self.of = of
+        self.ln = wash_language(ln)
+        if search_pattern is None:
+            search_pattern = []
+        self.search_pattern = search_pattern
+        if user_info is None:
+            user_info = collect_user_info(None)
+        self.user_info = user_info
+
+        self.existence = records_exist(self.recIDs)
+        self.preformatted = {}
+        if not on_the_fly and \
+           (self.ln == CFG_SITE_LANG or
+            of.lower() == 'xm' or
+            (of.lower() in CFG_BIBFORMAT_DISABLE_I18N_FOR_CACHED_FORMATS)):
+            self.preformatted = bibformat_dblayer.get_preformatted_records(
+                [recID for recID in self.recIDs if self.existence[recID] == 1], of)
+
+        # records that will be formatted live:
+        to_format = [recID for recID in self.recIDs
+                     if self.existence[recID] and recID not in self.preformatted]
+        self.revisions = {}
+        self.cached_outputs = {}
+        if to_format and not on_the_fly and is_format_cacheable(of):
+            self.revisions = get_records_revisions(to_format)
+            for recID in to_format:
+                cached_out, needs_2nd_pass, dummy_key, dummy_revision = \
+                    get_cached_output(recID, of, self.ln, user_info, search_pattern,
+                                      self.revisions.get(recID))
+                if cached_out is not None:
+                    self.cached_outputs[recID] = (cached_out, needs_2nd_pass)
+            to_format = [recID for recID in to_format
+                         if recID not in self.cached_outputs]
+        self.records = {}
+        self.prefetched = {}
+        if to_format:
+            self.records = get_records(to_format)
+            self.prefetch_elements(to_format)
+
+    def __contains__(self, recID):
+        return recID in self.existence
+
+    def prefetch_elements(self, recIDs):
+        """Call the 'prefetch_values()' functions of the format
+        elements used by the format templates of RECIDS."""
+        bfos = []
+        templates = set()
+        for recID in recIDs:
+            bfo = BibFormatObject(recID, self.ln, self.search_pattern, None,
+                                  self.user_info, self.of)
+            self.prepare_bfo(bfo)
+            if not bfo.record:
+                continue
+            bfos.append(bfo)
+            templates.add(decide_format_template(bfo, self.of))
+        element_names = set()
+        for template in templates:
+            if template is None or \
+               not template.endswith("." + CFG_BIBFORMAT_FORMAT_TEMPLATE_EXTENSION):
+                continue
+            try:
+                format_content = get_format_template(template)['code']
+            except Exception:
+                # the error is reported when formatting
+                continue
+            for match in pattern_tag.finditer(format_content):
+                element_names.add(match.group('function_name').lower())
+        for element_name in element_names:
+            format_element = get_format_element(element_name, soft_fail=True)
+            if format_element is None or \
+               not format_element.get('prefetch_function'):
+                continue
+            try:
+                values = format_element['prefetch_function'](bfos)
+            except Exception:
+                register_exception()
+                continue
+            element_name = resolve_format_element_filename(element_name)[:-3].lower()
+            for recID, value in values.iteritems():
+                self.prefetched.setdefault(recID, {})[element_name] = value
+
+    def prepare_bfo(self, bfo):
+        """Give BFO the data prefetched for its record."""
+        if bfo.record is None and bfo.recID in self.records:
+            bfo.record = self.records[bfo.recID]
+        bfo.prefetched = self.prefetched.get(bfo.recID, {})
+
+
 # Utility functions
 ##
 
@@ -2234,7 +2547,61 @@ def bf_profile():
         format_record(i, "HD", ln=CFG_SITE_LANG, verbose=9, search_pattern=[])
     return
 
+def bf_benchmark(recIDs=range(1, 51), output_formats=('HB', 'HD'),
+                 ln=CFG_SITE_LANG, number=5):
+    """
+    Runs a micro-benchmark of format templates evaluation, comparing
+    the parsing of the format templates for every record with the
+    walk of their compiled render plans.
+
+    Records are loaded beforehand, so that only the evaluation of the
+    templates (and of their elements) is timed.
+
+    @param recIDs: the records to format
+    @param output_formats: the output formats whose templates are used
+    @param ln: the language to format records in
+    @param number: how many times each record is formatted
+    @return: dictionary output format -> (seconds spent parsing, seconds
+             spent walking compiled plans)
+    """
+    import time
+    from invenio.search_engine import get_record
+    results = {}
+    for of in output_formats:
+        bfos = []
+        for recID in recIDs:
+            bfo = BibFormatObject(recID, ln, output_format=of)
+            bfo.record = get_record(recID)
+            template = decide_format_template(bfo, of)
+            if bfo.record and template and \
+                   template.endswith("." + CFG_BIBFORMAT_FORMAT_TEMPLATE_EXTENSION):
+                bfos.append((bfo, template))
+        # compile plans outside of the timed loop
+        for bfo, template in bfos:
+            get_format_template_plan(template, ln)
+
+        t0 = time.time()
+        for dummy in range(number):
+            for bfo, template in bfos:
+                format_with_format_template(None, bfo,
+                    format_template_code=get_format_template(template)['code'])
+        parsing_time = time.time() - t0
+
+        t0 = time.time()
+        for dummy in range(number):
+            for bfo, template in bfos:
+                format_with_format_template(template, bfo)
+        compiled_time = time.time() - t0
+
+        results[of] = (parsing_time, compiled_time)
+    return results
+
 if __name__ == "__main__":
+    if '--benchmark' in sys.argv:
+        for of, (parsing_time, compiled_time) in bf_benchmark().items():
+            print "%s: %.3f sec parsing templates, %.3f sec with compiled templates" % \
+                  (of, parsing_time, compiled_time)
+        sys.exit(0)
     import profile
     import pstats
     #bf_profile()
@@ -820,6 +820,33 @@ class FormatTest(InvenioTestCase):
         self.assertEqual(no_cache, False)
 
 
+    def test_format_with_compiled_format_template(self):
+        """ bibformat - same formatting with compiled template"""
+        template = bibformat_engine.get_format_template("Test3.bft")
+        expected = bibformat_engine.format_with_format_template(
+                                        format_template_filename=None,
+                                        bfo=self.bfo_1,
+                                        verbose=0,
+                                        format_template_code=template['code'])
+        result = bibformat_engine.format_with_format_template("Test3.bft", self.bfo_1)
+        self.assertEqual(result, expected)
+        # compiled once per language:
+        self.assertTrue(bibformat_engine.get_format_template_plan("Test3.bft", self.bfo_1.lang) is
+                        bibformat_engine.get_format_template_plan("Test3.bft", self.bfo_1.lang))
+
+    def test_compile_format_template(self):
+        """ bibformat - compiling a format template into a render plan"""
+        code = '<lang><en>en</en><fr>fr</fr></lang>: <bfe_test_1 prefix="_(Record)_ " />!<bfe_test_6 no_cache="1" />'
+        plan = bibformat_engine.compile_format_template(code.replace('<bfe_test_6 no_cache="1" />', ''), 'en')
+        self.assertEqual(plan['needs_2nd_pass'], False)
+        self.assertEqual(plan['nodes'][0], 'en: ')
+        self.assertEqual(plan['nodes'][1][0:2], ('test_1', {'prefix': 'Record '}))
+        self.assertEqual(plan['nodes'][2], '!')
+        plan = bibformat_engine.compile_format_template(code, 'en')
+        self.assertEqual(plan['needs_2nd_pass'], True)
+        self.assertEqual(plan['nodes'][0], '<lang><en>en</en><fr>fr</fr></lang>: ')
+        self.assertEqual(plan['nodes'][2], '!<bfe_test_6 />')
+
     def test_format_2_passes_manually(self):
         result, needs_2nd_pass = bibformat_engine.format_record(
                                                 recID=None,
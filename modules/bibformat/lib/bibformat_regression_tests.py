@@ -33,8 +33,9 @@ from invenio.testutils import (make_test_suite,
                               test_web_page_content,
                               get_authenticated_mechanize_browser,
                               make_url)
-from invenio.bibformat import format_record
-from invenio.bibformat_engine import BibFormatObject
+from invenio.bibformat import format_record, format_records, prefetch_records
+from invenio.bibformat_engine import BibFormatObject, \
+     decide_format_template, format_with_format_template, get_format_template
 from invenio.bibformat_elements import bfe_authority_author
 
 
@@ -56,6 +57,32 @@ class BibFormatAPITest(InvenioTestCase):
         result = test_web_page_content(pageurl,
                                        expected_text=result)
 
+    def test_batch_formatting(self):
+        """bibformat - Checking batch formatting gives the same output as record by record formatting"""
+        recids = [1, 8, 10, 73, 107]
+        for of in ('hb', 'hd', 'xm'):
+            batch = prefetch_records(recids, of, on_the_fly=True)
+            for recid in recids:
+                self.assertEqual(format_record(recid, of, on_the_fly=True),
+                                 format_record(recid, of, on_the_fly=True, batch=batch))
+        self.assertEqual(format_records(recids, 'hb', record_separator='\n'),
+                         '\n'.join([format_record(recid, 'hb') for recid in recids]))
+
+class BibFormatCompiledTemplatesTest(InvenioTestCase):
+    """Check compiled format templates"""
+
+    def test_compiled_templates_output(self):
+        """bibformat - compiled templates give the same output as parsed templates"""
+        for of in ('hb', 'hd'):
+            for recid in range(1, 20):
+                bfo = BibFormatObject(recid, output_format=of)
+                template = decide_format_template(bfo, of)
+                if not template or not template.endswith('.bft'):
+                    continue
+                self.assertEqual(format_with_format_template(template, bfo),
+                                 format_with_format_template(None, bfo,
+                                     format_template_code=get_format_template(template)['code']))
+
 class BibFormatObjectAPITest(InvenioTestCase):
     """Check BibFormatObject (bfo) APIs"""
 
@@ -600,6 +627,7 @@ class BibFormatAuthorityRecordsBrowsingTest(InvenioTestCase):
 
 
 TEST_SUITE = make_test_suite(BibFormatBibTeXTest,
+                             BibFormatCompiledTemplatesTest,
                              BibFormatDetailedHTMLTest,
                              BibFormatBriefHTMLTest,
                              BibFormatNLMTest,
@@ -29,14 +29,15 @@ from invenio.dbquery import run_sql
 
 from invenio.intbitset import intbitset
 from invenio.search_engine import perform_request_search, search_pattern
-from invenio.bibrank_citation_searcher import get_cited_by
+from invenio.bibrank_citation_searcher import get_refersto_hitset
 from invenio.bibrank_citation_indexer import get_bibrankmethod_lastupdate
 from invenio.bibformat_dblayer import save_preformatted_record
 from invenio.shellutils import split_cli_ids_arg
 from invenio.bibtask import task_init, write_message, task_set_option, \
         task_get_option, task_update_progress, task_has_option, \
         task_sleep_now_if_required
-from invenio.bibformat_engine import format_record_1st_pass
+from invenio.bibformat_engine import format_record_1st_pass, BibFormatBatch
+from invenio.bibformat_config import CFG_BIBFORMAT_PREFETCH_CHUNK_SIZE
 
 
 def fetch_last_updated(fmt):
@@ -91,8 +92,7 @@ def bibreformat_task(fmt, recids, without_fmt, process):
                 return mod_date.strftime("%Y-%m-%d %H:%M:%S") < latest_bibrank_run
             rel_recids = intbitset([recid for recid, mod_date in run_sql(sql)
                                                     if check_date(mod_date)])
-            for r in rel_recids:
-                recids |= intbitset(get_cited_by(r))
+            recids |= get_refersto_hitset(rel_recids)
 
         # To not process recids twice
         recids -= recids_processed
@@ -212,10 +212,15 @@ def iterate_over_new(recIDs, fmt):
     tot = len(recIDs)
     for count, recID in enumerate(recIDs):
         t1 = os.times()[4]
+        if count % CFG_BIBFORMAT_PREFETCH_CHUNK_SIZE == 0:
+            # fetch data of the next records at once
+            batch = BibFormatBatch(recIDs[count:count + CFG_BIBFORMAT_PREFETCH_CHUNK_SIZE],
+                                   fmt, on_the_fly=True)
         formatted_record, needs_2nd_pass = format_record_1st_pass(recID=recID,
                                                   of=fmt,
                                                   on_the_fly=True,
-                                                  save_missing=False)
+                                                  save_missing=False,
+                                                  batch=batch)
         save_preformatted_record(recID=recID,
                                  of=fmt,
                                  res=formatted_record,
@@ -21,7 +21,7 @@
 __revision__ = "$Id$"
 
 from invenio.search_engine import get_all_collections_of_a_record, \
-    create_navtrail_links
+    get_all_collections_of_records, create_navtrail_links
 
 def format_element(bfo, separator="<br />"):
     """Prints the list of collections the record belongs to.
@@ -29,7 +29,9 @@ def format_element(bfo, separator="<br />"):
     @param separator: a separator between each collection link.
     """
 
-    coll_names = get_all_collections_of_a_record(bfo.recID)
+    coll_names = bfo.prefetched.get('bfe_appears_in_collections')
+    if coll_names is None:
+        coll_names = get_all_collections_of_a_record(bfo.recID)
     navtrails = [create_navtrail_links(coll_name, ln=bfo.lang) for coll_name in coll_names]
     navtrails = [navtrail for navtrail in navtrails if navtrail]
     navtrails.sort(lambda x, y: cmp(len(y), len(x)))
@@ -42,6 +44,13 @@ def format_element(bfo, separator="<br />"):
             final_navtrails.append(navtrail)
     return separator.join(final_navtrails)
 
+def prefetch_values(bfos):
+    """
+    Called by BibFormat when formatting a batch of records, in order
+    to look up the collections of all of them at once.
+    """
+    return get_all_collections_of_records([bfo.recID for bfo in bfos])
+
 def escape_values(bfo):
     """
     Called by BibFormat in order to check if output of this element
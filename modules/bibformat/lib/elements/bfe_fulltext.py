@@ -21,7 +21,8 @@
 __revision__ = "$Id$"
 
 import re
-from invenio.bibdocfile import BibRecDocs, file_strip_ext, normalize_format, compose_format
+from invenio.bibdocfile import BibRecDocs, file_strip_ext, normalize_format, compose_format, \
+     get_bibrecdocs
 from invenio.messages import gettext_set_language
 from invenio.config import CFG_SITE_URL, CFG_BASE_URL, CFG_CERN_SITE, CFG_SITE_RECORD, \
     CFG_BIBFORMAT_HIDDEN_FILE_FORMATS
@@ -157,6 +158,13 @@ def format_element(bfo, style, separator='; ', show_icons='no', focus_on_main_fi
 
     return out
 
+def prefetch_values(bfos):
+    """
+    Called by BibFormat when formatting a batch of records, in order
+    to load the documents of all of them at once.
+    """
+    return get_bibrecdocs([bfo.recID for bfo in bfos])
+
 def escape_values(bfo):
     """
     Called by BibFormat in order to check if output of this element
@@ -207,7 +215,10 @@ def get_files(bfo, distinguish_main_and_additional_files=True, include_subformat
         hide_doctypes = []
 
     urls = bfo.fields("8564_")
-    bibarchive = BibRecDocs(bfo.recID)
+    bibarchive = bfo.prefetched.get('bfe_fulltext',
+                                    bfo.prefetched.get('bfe_fulltext_mini'))
+    if bibarchive is None:
+        bibarchive = BibRecDocs(bfo.recID)
 
     old_versions = False # We can provide link to older files. Will be
                          # set to True if older files are found.
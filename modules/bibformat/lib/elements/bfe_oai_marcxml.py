@@ -22,14 +22,17 @@ This element return the full MARCXML representation of a record with the marc
 prefix and namespace and adding the leader.
 """
 
-from invenio.bibformat_dblayer import get_preformatted_record
+from invenio.bibformat_dblayer import get_preformatted_record, \
+     get_preformatted_records
 
 def format_element(bfo):
     """
     Return the MARCXML representation of the record with the marc prefix and
     namespace and adding the leader.
     """
-    formatted_record, dummy_needs_2nd_pass = get_preformatted_record(bfo.recID, 'xm')
+    formatted_record = bfo.prefetched.get('bfe_oai_marcxml')
+    if formatted_record is None:
+        formatted_record, dummy_needs_2nd_pass = get_preformatted_record(bfo.recID, 'xm')
     formatted_record = formatted_record.replace("<record>", "<marc:record xmlns:marc=\"http://www.loc.gov/MARC21/slim\" xmlns:xsi=\"http://www.w3.org/2001/XMLSchema-instance\" xsi:schemaLocation=\"http://www.loc.gov/MARC21/slim http://www.loc.gov/standards/marcxml/schema/MARC21slim.xsd\" type=\"Bibliographic\">\n     <marc:leader>00000coc  2200000uu 4500</marc:leader>")
     formatted_record = formatted_record.replace("<record xmlns=\"http://www.loc.gov/MARC21/slim\">", "<marc:record xmlns:marc=\"http://www.loc.gov/MARC21/slim\" xmlns:xsi=\"http://www.w3.org/2001/XMLSchema-instance\" xsi:schemaLocation=\"http://www.loc.gov/MARC21/slim http://www.loc.gov/standards/marcxml/schema/MARC21slim.xsd\" type=\"Bibliographic\">\n     <marc:leader>00000coc  2200000uu 4500</marc:leader>")
     formatted_record = formatted_record.replace("</record", "</marc:record")
@@ -41,6 +44,14 @@ def format_element(bfo):
     formatted_record = formatted_record.replace("</subfield", "</marc:subfield")
     return formatted_record
 
+def prefetch_values(bfos):
+    """
+    Called by BibFormat when formatting a batch of records, in order
+    to fetch the MARCXML of all of them at once.
+    """
+    return dict([(recID, formatted_record) for recID, (formatted_record, dummy_needs_2nd_pass) \
+                 in get_preformatted_records([bfo.recID for bfo in bfos], 'xm').iteritems()])
+
 def escape_values(bfo):
     """
     Called by BibFormat in order to check if output of this element
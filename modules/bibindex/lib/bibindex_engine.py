@@ -30,6 +30,8 @@ import sys
 import time
 import fnmatch
 import inspect
+import multiprocessing
+import signal
 from datetime import datetime
 
 from invenio.config import CFG_SOLR_URL
@@ -110,6 +112,7 @@ nb_char_in_line = 50  # for verbose pretty printing
 chunksize = 1000 # default size of chunks that the records will be treated by
 base_process_size = 4500 # process base size
 _last_word_table = None
+_worker_word_table = None # table of the worker processes, see WordTable.start_workers()
 
 
 _TOKENIZERS = load_tokenizers()
@@ -592,6 +595,20 @@ def chunk_generator(rng):
             current_low += chunksize
 
 
+def _init_worker():
+    """Initialize a process of the pool of WordTable.start_workers():
+    termination is up to the parent process, so that BibSched signal
+    handlers inherited from it are reset."""
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR1, signal.SIGUSR2,
+                   signal.SIGTSTP, signal.SIGCONT, signal.SIGQUIT, signal.SIGABRT):
+        signal.signal(signum, signal.SIG_DFL)
+
+def _add_recID_range_in_worker(recID_range):
+    """Collect the terms of RECID_RANGE in a worker process, see
+    WordTable.add_recID_range()."""
+    return _worker_word_table.get_hitlists_from_recID_range(*recID_range)
+
+
 class AbstractIndexTable(object):
     """
         This class represents an index table in database.
@@ -1242,6 +1259,10 @@ class WordTable(AbstractIndexTable):
 
         self.special_tags = self._handle_special_tags()
 
+        # pool of processes collecting terms, see start_workers()
+        self.workers = 1
+        self.workers_pool = None
+
         if self.stemming_language and self.table_name.startswith('idxWORD'):
             write_message('%s has stemming enabled, language %s' % (self.table_name, self.stemming_language))
 
@@ -1349,11 +1370,22 @@ class WordTable(AbstractIndexTable):
             write_message("The word '%s' does not exist in the word file."\
                               % word)
 
-    def add_recIDs(self, recIDs, opt_flush):
+    def add_recIDs(self, recIDs, opt_flush, workers=1):
         """Fetches records which id in the recIDs range list and adds
         them to the wordTable.  The recIDs range list is of the form:
         [[i1_low,i1_high],[i2_low,i2_high], ..., [iN_low,iN_high]].
+        If WORKERS is greater than 1, the terms of the records are
+        collected by as many worker processes.
         """
+        if workers > 1:
+            self.start_workers(workers)
+        try:
+            self._add_recIDs(recIDs, opt_flush)
+        finally:
+            self.stop_workers()
+
+    def _add_recIDs(self, recIDs, opt_flush):
+        """See add_recIDs()."""
         global chunksize, _last_word_table
         flush_count = 0
         records_done = 0
@@ -1412,10 +1444,84 @@ class WordTable(AbstractIndexTable):
             self.log_progress(time_started, records_done, records_to_go)
         self.notify_virtual_indexes(recIDs)
 
+    def start_workers(self, workers):
+        """Start a pool of WORKERS processes that will collect the terms
+        of the records added by add_recID_range().  The processes are
+        forked off the current one, so that they inherit this table."""
+        global _worker_word_table
+        _worker_word_table = self
+        self.workers = workers
+        self.workers_pool = multiprocessing.Pool(workers, initializer=_init_worker)
+        write_message("%s started %d worker processes" % (self.table_name, workers))
+
+    def stop_workers(self):
+        """Stop the pool of worker processes, if any."""
+        global _worker_word_table
+        if self.workers_pool is not None:
+            self.workers_pool.terminate()
+            self.workers_pool.join()
+            self.workers_pool = None
+        _worker_word_table = None
+
     def add_recID_range(self, recID1, recID2):
-        """Add records from RECID1 to RECID2."""
-        wlist = {}
+        """Add records from RECID1 to RECID2.  If worker processes were
+        started, the range is split between them, and the word hitlists
+        they return are merged into memory."""
         self.recIDs_in_mem.append([recID1, recID2])
+        if self.workers_pool is None:
+            wlist = self.get_words_from_recID_range(recID1, recID2)
+            if len(wlist) == 0: return 0
+            self.put_words_into_reverse_table(wlist)
+            # put words into memory word list:
+            put = self.put
+            for recID in wlist.keys():
+                for w in wlist[recID]:
+                    put(recID, w, 1)
+            return len(wlist)
+
+        shards = []
+        shard_size = (recID2 - recID1) / self.workers + 1
+        for low in xrange(recID1, recID2 + 1, shard_size):
+            shards.append((low, min(low + shard_size - 1, recID2)))
+        nb_records = 0
+        hitlists = {}
+        for shard_nb_records, shard_hitlists in self.workers_pool.map(_add_recID_range_in_worker, shards):
+            nb_records += shard_nb_records
+            for word, hitlist in shard_hitlists.iteritems():
+                if word in hitlists:
+                    hitlists[word] |= hitlist
+                else:
+                    hitlists[word] = hitlist
+        value = self.value
+        for word, hitlist in hitlists.iteritems():
+            if word in value:
+                for recID in hitlist:
+                    value[word][recID] = 1
+            else:
+                value[word] = dict.fromkeys(hitlist, 1)
+        return nb_records
+
+    def get_hitlists_from_recID_range(self, recID1, recID2):
+        """Worker side of add_recID_range(): collect the words of records
+        from RECID1 to RECID2 and store them into the reverse table.
+        Return the number of records and the dictionary word->intbitset
+        of the records containing (washed) word."""
+        self.clean()
+        wlist = self.get_words_from_recID_range(recID1, recID2)
+        if len(wlist) == 0: return 0, {}
+        self.put_words_into_reverse_table(wlist)
+        put = self.put
+        for recID in wlist.keys():
+            for w in wlist[recID]:
+                put(recID, w, 1)
+        hitlists = dict([(word, intbitset(signs.keys())) for word, signs in self.value.iteritems()])
+        self.clean()
+        return len(wlist), hitlists
+
+    def get_words_from_recID_range(self, recID1, recID2):
+        """Return dictionary recID->list of words of records from RECID1
+        to RECID2."""
+        wlist = {}
         # special case of author indexes where we also add author
         # canonical IDs:
         if self.index_name in ('author', 'firstauthor', 'exactauthor', 'exactfirstauthor'):
@@ -1446,7 +1552,7 @@ class WordTable(AbstractIndexTable):
         # lookup index-time synonyms:
         synonym_kbrs = get_all_synonym_knowledge_bases()
         if synonym_kbrs.has_key(self.index_name):
-            if len(wlist) == 0: return 0
+            if len(wlist) == 0: return wlist
             recIDs = wlist.keys()
             for recID in recIDs:
                 for word in wlist[recID]:
@@ -1466,10 +1572,12 @@ class WordTable(AbstractIndexTable):
                 wlist[recID] = []
                 write_message("... record %d was declared deleted, removing its word list" % recID, verbose=9)
             write_message("... record %d, termlist: %s" % (recID, wlist[recID]), verbose=9)
+        return wlist
 
-        if len(wlist) == 0: return 0
-        # put words into reverse index table with FUTURE status:
-        for recID in recIDs:
+    def put_words_into_reverse_table(self, wlist):
+        """Put the words of WLIST, a dictionary recID->list of words,
+        into the reverse index table with FUTURE status."""
+        for recID in wlist.keys():
             run_sql("INSERT INTO %sR (id_bibrec,termlist,type) VALUES (%%s,%%s,'FUTURE')" % wash_table_column_name(self.table_name[:-1]), (recID, serialize_via_marshal(wlist[recID]))) # kwalitee: disable=sql
             # ... and, for new records, enter the CURRENT status as empty:
             try:
@@ -1478,13 +1586,6 @@ class WordTable(AbstractIndexTable):
                 # okay, it's an already existing record, no problem
                 pass
 
-        # put words into memory word list:
-        put = self.put
-        for recID in recIDs:
-            for w in wlist[recID]:
-                put(recID, w, 1)
-        return len(recIDs)
-
     def find_nonmarc_records(self, recID1, recID2):
         """Divides recID range into two different tables,
            first one contains only recIDs of the records that
@@ -1780,6 +1881,7 @@ def main():
   -w, --windex=w1[,w2]\tword/phrase indexes to consider (all)
   -M, --maxmem=XXX\tmaximum memory usage in kB (no limit)
   -f, --flush=NNN\t\tfull consistent table flush after NNN records (10000)
+  --workers=N\t\tcollect the terms of the records with N processes (1)
   --force\t\tforce indexing of all records for provided indexes
   -Z, --remove-dependent-index=w  name of an index for removing from virtual index
   -l --all-virtual\t\t set of all virtual indexes; the same as: -w virtual_ind1, virtual_ind2, ...
@@ -1797,6 +1899,7 @@ def main():
                 "reindex",
                 "maxmem=",
                 "flush=",
+                "workers=",
                 "force",
                 "remove-dependent-index=",
                 "all-virtual"
@@ -1852,6 +1955,10 @@ def task_submit_elaborate_specific_parameter(key, value, opts, args):
                 (base_process_size + 1000))
     elif key in ("-f", "--flush"):
         task_set_option("flush", int(value))
+    elif key in ("--workers",):
+        task_set_option("workers", int(value))
+        if task_get_option("workers") < 1:
+            raise StandardError("Number of workers should be at least 1")
     elif key in ("-o", "--force"):
         task_set_option("force", True)
     elif key in ("-Z", "--remove-dependent-index",):
@@ -2197,7 +2304,8 @@ def task_run_core():
                     raise StandardError(error_message)
             elif task_get_option("cmd") == "add":
                 final_recIDs = beautify_range_list(create_range_list(recIDs_for_index[index_name]))
-                wordTable.add_recIDs(final_recIDs, task_get_option("flush"))
+                wordTable.add_recIDs(final_recIDs, task_get_option("flush"),
+                                     task_get_option("workers", 1))
                 task_sleep_now_if_required(can_stop_too=True)
             elif task_get_option("cmd") == "repair":
                 wordTable.repair(task_get_option("flush"))
@@ -2236,7 +2344,8 @@ def task_run_core():
                     raise StandardError(error_message)
             elif task_get_option("cmd") == "add":
                 final_recIDs = beautify_range_list(create_range_list(recIDs_for_index[index_name]))
-                wordTable.add_recIDs(final_recIDs, task_get_option("flush"))
+                wordTable.add_recIDs(final_recIDs, task_get_option("flush"),
+                                     task_get_option("workers", 1))
                 task_sleep_now_if_required(can_stop_too=True)
             elif task_get_option("cmd") == "repair":
                 wordTable.repair(task_get_option("flush"))
@@ -2275,7 +2384,8 @@ def task_run_core():
                     raise StandardError(error_message)
             elif task_get_option("cmd") == "add":
                 final_recIDs = beautify_range_list(create_range_list(recIDs_for_index[index_name]))
-                wordTable.add_recIDs(final_recIDs, task_get_option("flush"))
+                wordTable.add_recIDs(final_recIDs, task_get_option("flush"),
+                                     task_get_option("workers", 1))
                 if not task_get_option("id") and not task_get_option("collection"):
                     update_index_last_updated([index_name], task_get_task_param('task_starting_time'))
                 task_sleep_now_if_required(can_stop_too=True)
@@ -116,7 +116,7 @@ def prepare_for_index_update(index_id, parameters={}):
 
 
 @nottest
-def reindex_word_tables_into_testtables(index_name, recids = None, prefix = 'test_', parameters={}, turn_off_virtual_indexes=True):
+def reindex_word_tables_into_testtables(index_name, recids = None, prefix = 'test_', parameters={}, turn_off_virtual_indexes=True, workers=1):
     """Function for setting up a test enviroment. Reindexes an index with a given name to a
        new temporary table with a given prefix. During the reindexing it changes some parameters
        of chosen index. It's useful for conducting tests concerning the reindexing process.
@@ -128,6 +128,7 @@ def reindex_word_tables_into_testtables(index_name, recids = None, prefix = 'tes
        description take a look at  'prepare_for_index_update' function.
        @param turn_off_virtual_indexes: if True only specific index will be reindexed
        without connected virtual indexes
+       @param workers: number of processes collecting the terms
     """
     index_id = get_index_id_from_index_name(index_name)
     query_update = prepare_for_index_update(index_id, parameters)
@@ -166,7 +167,7 @@ def reindex_word_tables_into_testtables(index_name, recids = None, prefix = 'tes
     if turn_off_virtual_indexes:
         wordTable.turn_off_virtual_indexes()
     if recids:
-        wordTable.add_recIDs(recids, 10000)
+        wordTable.add_recIDs(recids, 10000, workers)
     else:
         recIDs_for_index = find_affected_records_for_index([index_name],
                                                  [[1, get_max_recid()]],
@@ -176,7 +177,7 @@ def reindex_word_tables_into_testtables(index_name, recids = None, prefix = 'tes
         final_recIDs = bib_recIDs | auth_recIDs
         final_recIDs = set(final_recIDs) & set(recIDs_for_index[index_name])
         final_recIDs = beautify_range_list(create_range_list(list(final_recIDs)))
-        wordTable.add_recIDs(final_recIDs, 10000)
+        wordTable.add_recIDs(final_recIDs, 10000, workers)
     return last_updated
 
 
@@ -202,6 +203,40 @@ def is_part_of(container, content):
     return cont.issubset(ctr)
 
 
+class BibIndexParallelIndexingTest(InvenioTestCase):
+    """Tests indexing with several worker processes. Reindexes 'title'
+       index into a new table with workers and compares it with the
+       original table.
+    """
+
+    def setUp(self):
+        """reindexation to new table with workers"""
+        self.last_updated = reindex_word_tables_into_testtables('title', workers=3)
+
+    def tearDown(self):
+        """cleaning up"""
+        remove_reindexed_word_testtables('title')
+        run_sql("UPDATE idxINDEX SET last_updated=%s WHERE id=%s",
+                (self.last_updated, get_index_id_from_index_name('title')))
+
+    def test_parallel_indexing_forward_table(self):
+        """bibindex - indexing with workers fills forward table as one process"""
+        index_id = get_index_id_from_index_name('title')
+        expected = dict((term, intbitset(hitlist)) for term, hitlist in
+                        run_sql("SELECT term, hitlist FROM idxWORD%02dF" % index_id))
+        result = dict((term, intbitset(hitlist)) for term, hitlist in
+                      run_sql("SELECT term, hitlist FROM test_idxWORD%02dF" % index_id))
+        self.assertEqual(expected, result)
+
+    def test_parallel_indexing_reversed_table(self):
+        """bibindex - indexing with workers fills reversed table as one process"""
+        index_id = get_index_id_from_index_name('title')
+        expected = run_sql("SELECT id_bibrec, termlist FROM idxWORD%02dR WHERE type='CURRENT' ORDER BY id_bibrec" % index_id)
+        result = run_sql("SELECT id_bibrec, termlist FROM test_idxWORD%02dR WHERE type='CURRENT' ORDER BY id_bibrec" % index_id)
+        self.assertEqual([(recid, sorted(deserialize_via_marshal(termlist))) for recid, termlist in expected],
+                         [(recid, sorted(deserialize_via_marshal(termlist))) for recid, termlist in result])
+
+
 class BibIndexRemoveStopwordsTest(InvenioTestCase):
     """Tests remove_stopwords parameter of an index. Changes it in the database
        and reindexes from scratch into a new table to see the diffrence which is brought
@@ -2008,7 +2043,8 @@ class BibIndexFilenameIndexTest(InvenioTestCase):
         self.assertTrue(len(res) == 2)
 
 
-TEST_SUITE = make_test_suite(BibIndexRemoveStopwordsTest,
+TEST_SUITE = make_test_suite(BibIndexParallelIndexingTest,
+                             BibIndexRemoveStopwordsTest,
                              BibIndexRemoveLatexTest,
                              BibIndexRemoveHtmlTest,
                              BibIndexYearIndexTest,
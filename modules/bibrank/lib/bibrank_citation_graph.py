@@ -0,0 +1,279 @@
+## -*- mode: python; coding: utf-8; -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+BibRank citation graph file.
+
+After every run, the citation indexer publishes the content of the
+rnkCITATIONDICT table as a compact file that search processes map
+read-only into memory, so that the citation graph is shared between
+all Apache processes instead of being queried or loaded into each of
+them.
+
+The graph is stored twice in compressed sparse row form: the citers
+of recid i are the cites neighbours between cites offsets i and i + 1,
+the references of recid i the refs neighbours between refs offsets i
+and i + 1.  File layout (all integers little-endian unsigned 32 bits,
+except the header ones which are 64 bits):
+
+    magic          8 bytes, 'INVCIT01'
+    size           number of recids (max recid + 1)
+    nb_edges       number of citations
+    cites offsets  SIZE + 1 integers
+    cites          NB_EDGES integers, citers sorted by citee and citer
+    refs offsets   SIZE + 1 integers
+    refs           NB_EDGES integers, citees sorted by citer and citee
+
+Files are written to a temporary name and renamed, so that readers
+always see a complete version; readers notice a new version by its
+inode and modification time, and reload in constant time.
+"""
+
+import array
+import mmap
+import os
+import struct
+import sys
+
+try:
+    ## import optional module:
+    import numpy
+    CFG_NUMPY_IMPORTABLE = True
+except ImportError:
+    CFG_NUMPY_IMPORTABLE = False
+
+from invenio.config import CFG_CACHEDIR
+from invenio.intbitset import intbitset
+
+CFG_BIBRANK_CITATION_GRAPH_PATH = os.path.join(CFG_CACHEDIR, 'bibrank', 'citation_graph.bin')
+CFG_BIBRANK_CITATION_GRAPH_MAGIC = 'INVCIT01'
+CFG_BIBRANK_CITATION_GRAPH_HEADER = '<8sQQ'
+CFG_BIBRANK_CITATION_GRAPH_HEADER_SIZE = struct.calcsize(CFG_BIBRANK_CITATION_GRAPH_HEADER)
+
+class InvenioBibRankCitationGraphError(Exception):
+    """Error raised on invalid citation graph files."""
+    pass
+
+def _to_little_endian(values):
+    """Return string of the array.array VALUES of unsigned integers,
+    in little-endian byte order."""
+    if sys.byteorder == 'big':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tostring()
+
+def _create_csr(edges, size):
+    """Return (offsets, neighbours) strings of the sparse rows of
+    EDGES, list of (row, column), for rows 0 to SIZE - 1."""
+    if CFG_NUMPY_IMPORTABLE:
+        edges = numpy.array(edges, dtype=numpy.uint32).reshape((-1, 2))
+        order = numpy.lexsort((edges[:, 1], edges[:, 0]))
+        offsets = numpy.zeros(size + 1, dtype='<u4')
+        numpy.cumsum(numpy.bincount(edges[:, 0], minlength=size), out=offsets[1:])
+        return offsets.tostring(), edges[order, 1].astype('<u4').tostring()
+    rows = {}
+    for row, column in edges:
+        rows.setdefault(row, []).append(column)
+    offsets = array.array('I', [0]) * (size + 1)
+    neighbours = array.array('I')
+    for row in xrange(size):
+        columns = rows.get(row)
+        if columns:
+            columns.sort()
+            neighbours.extend(columns)
+        offsets[row + 1] = len(neighbours)
+    return _to_little_endian(offsets), _to_little_endian(neighbours)
+
+def write_graph(citations, path=None):
+    """Publish the citation graph file holding CITATIONS, list of
+    (citer, citee) pairs."""
+    if path is None:
+        path = CFG_BIBRANK_CITATION_GRAPH_PATH
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    size = 0
+    for citer, citee in citations:
+        size = max(size, citer + 1, citee + 1)
+    tmp_path = '%s.%s.tmp' % (path, os.getpid())
+    graph_file = open(tmp_path, 'wb')
+    try:
+        graph_file.write(struct.pack(CFG_BIBRANK_CITATION_GRAPH_HEADER,
+                                     CFG_BIBRANK_CITATION_GRAPH_MAGIC,
+                                     size, len(citations)))
+        for csr in (_create_csr([(citee, citer) for citer, citee in citations], size),
+                    _create_csr(citations, size)):
+            graph_file.write(csr[0])
+            graph_file.write(csr[1])
+        graph_file.flush()
+        os.fsync(graph_file.fileno())
+    finally:
+        graph_file.close()
+    os.rename(tmp_path, path)
+
+def delete_graph(path=None):
+    """Remove the citation graph file, if any, so that search
+    processes go back to the database tables."""
+    try:
+        os.remove(path or CFG_BIBRANK_CITATION_GRAPH_PATH)
+    except OSError:
+        pass
+
+class CitationGraph(object):
+    """
+    Read-only citation graph backed by the memory mapping of the
+    citation graph file.  Use is_loaded() to know whether a graph file
+    has been published at all.
+    """
+    def __init__(self, path=None):
+        self.path = path or CFG_BIBRANK_CITATION_GRAPH_PATH
+        self.version = None
+        self.mmap = None
+        self.size = 0
+        self.sections = None
+        self.reload_if_needed()
+
+    def load(self):
+        """Map the current version of the graph file into memory."""
+        graph_file = open(self.path, 'rb')
+        try:
+            stat = os.fstat(graph_file.fileno())
+            graph_mmap = mmap.mmap(graph_file.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            graph_file.close()
+        magic, size, nb_edges = struct.unpack_from(CFG_BIBRANK_CITATION_GRAPH_HEADER, graph_mmap, 0)
+        if magic != CFG_BIBRANK_CITATION_GRAPH_MAGIC:
+            raise InvenioBibRankCitationGraphError("%s is not a citation graph file" % self.path)
+        sections = []
+        offset = CFG_BIBRANK_CITATION_GRAPH_HEADER_SIZE
+        for dummy in ('cites', 'refs'):
+            sections.append((offset, offset + 4 * (size + 1)))
+            offset += 4 * (size + 1 + nb_edges)
+        if CFG_NUMPY_IMPORTABLE:
+            sections = [(numpy.frombuffer(graph_mmap, dtype='<u4', count=size + 1, offset=offsets),
+                         numpy.frombuffer(graph_mmap, dtype='<u4', count=nb_edges, offset=neighbours))
+                        for offsets, neighbours in sections]
+        # the previous mapping is released once no request uses it
+        self.mmap = graph_mmap
+        self.size = size
+        self.sections = sections
+        self.version = (stat.st_ino, stat.st_mtime, stat.st_size)
+
+    def reload_if_needed(self):
+        """Reload the graph file if a new version was published."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self.version = None
+            self.mmap = None
+            self.size = 0
+            self.sections = None
+            return
+        if (stat.st_ino, stat.st_mtime, stat.st_size) != self.version:
+            self.load()
+
+    def is_loaded(self):
+        """Is a citation graph file mapped?"""
+        return self.sections is not None
+
+    def _get_range(self, section, recid):
+        """Return (start, end) of the neighbours of RECID in SECTION."""
+        if recid < 0 or recid >= self.size:
+            return 0, 0
+        offsets, dummy_neighbours = self.sections[section]
+        if CFG_NUMPY_IMPORTABLE:
+            return int(offsets[recid]), int(offsets[recid + 1])
+        return struct.unpack_from('<II', self.mmap, offsets + 4 * recid)
+
+    def _get_neighbours(self, section, recid):
+        """Return list of the neighbours of RECID in SECTION."""
+        start, end = self._get_range(section, recid)
+        if start == end:
+            return []
+        neighbours = self.sections[section][1]
+        if CFG_NUMPY_IMPORTABLE:
+            return neighbours[start:end].tolist()
+        return list(struct.unpack_from('<%dI' % (end - start), self.mmap, neighbours + 4 * start))
+
+    def _get_hitset_neighbours(self, section, recids):
+        """Return intbitset of the neighbours of all the RECIDS in SECTION."""
+        if not CFG_NUMPY_IMPORTABLE:
+            out = intbitset()
+            for recid in recids:
+                out.update(self._get_neighbours(section, recid))
+            return out
+        offsets, neighbours = self.sections[section]
+        slices = []
+        for recid in recids:
+            if recid < self.size:
+                start, end = offsets[recid], offsets[recid + 1]
+                if start != end:
+                    slices.append(neighbours[start:end])
+        if not slices:
+            return intbitset()
+        return intbitset(numpy.concatenate(slices).tolist())
+
+    def get_citers(self, recid):
+        """Return list of the records citing RECID."""
+        return self._get_neighbours(0, recid)
+
+    def get_references(self, recid):
+        """Return list of the records cited by RECID."""
+        return self._get_neighbours(1, recid)
+
+    def get_citation_count(self, recid):
+        """Return number of records citing RECID."""
+        start, end = self._get_range(0, recid)
+        return end - start
+
+    def get_citation_counts(self, recids):
+        """Return dictionary of recid->number of records citing it, for
+        all the RECIDS."""
+        if not CFG_NUMPY_IMPORTABLE:
+            return dict([(recid, self.get_citation_count(recid)) for recid in recids])
+        recids = numpy.array(list(recids), dtype=numpy.int64)
+        counts = numpy.zeros(len(recids), dtype=numpy.int64)
+        known = (recids >= 0) & (recids < self.size)
+        offsets = self.sections[0][0]
+        counts[known] = offsets[recids[known] + 1].astype(numpy.int64) - offsets[recids[known]]
+        return dict(zip(recids.tolist(), counts.tolist()))
+
+    def get_citers_of_hitset(self, recids):
+        """Return intbitset of the records citing some of RECIDS."""
+        return self._get_hitset_neighbours(0, recids)
+
+    def get_references_of_hitset(self, recids):
+        """Return intbitset of the records cited by some of RECIDS."""
+        return self._get_hitset_neighbours(1, recids)
+
+    def get_cited_records(self, low, high=None):
+        """Return intbitset of the records cited at least LOW times and
+        at most HIGH times, if given."""
+        if CFG_NUMPY_IMPORTABLE:
+            counts = numpy.diff(self.sections[0][0])
+            matches = counts >= low
+            if high is not None:
+                matches &= counts <= high
+            return intbitset(numpy.flatnonzero(matches).tolist())
+        out = intbitset()
+        for recid in xrange(self.size):
+            count = self.get_citation_count(recid)
+            if count >= low and (high is None or count <= high):
+                out.add(recid)
+        return out
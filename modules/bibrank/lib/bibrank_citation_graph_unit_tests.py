@@ -0,0 +1,78 @@
+## -*- mode: python; coding: utf-8; -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the citation graph file."""
+
+import os
+import shutil
+import tempfile
+
+from invenio.testutils import InvenioTestCase
+from invenio import bibrank_citation_graph
+from invenio.intbitset import intbitset
+from invenio.testutils import make_test_suite, run_test_suite
+
+
+class TestCitationGraph(InvenioTestCase):
+    """Test citation graph files."""
+
+    def setUp(self):
+        """Write graph files into a temporary directory."""
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'citation_graph.bin')
+        # (citer, citee)
+        self.citations = [(2, 1), (3, 1), (3, 2), (5, 1), (5, 3)]
+
+    def tearDown(self):
+        """Remove the temporary directory."""
+        shutil.rmtree(self.directory)
+
+    def test_write_and_read_graph(self):
+        """bibrank citation graph - writing and mapping a graph file"""
+        bibrank_citation_graph.write_graph(self.citations, self.path)
+        graph = bibrank_citation_graph.CitationGraph(self.path)
+        self.failUnless(graph.is_loaded())
+        self.assertEqual(graph.get_citers(1), [2, 3, 5])
+        self.assertEqual(graph.get_citers(4), [])
+        self.assertEqual(graph.get_citers(1000), [])
+        self.assertEqual(graph.get_references(5), [1, 3])
+        self.assertEqual(graph.get_citation_count(1), 3)
+        self.assertEqual(graph.get_citation_counts(intbitset([1, 3, 4, 1000])),
+                         {1: 3, 3: 1, 4: 0, 1000: 0})
+        self.assertEqual(graph.get_citers_of_hitset(intbitset([2, 3])), intbitset([3, 5]))
+        self.assertEqual(graph.get_references_of_hitset(intbitset([2, 3])), intbitset([1, 2]))
+        self.assertEqual(graph.get_cited_records(1), intbitset([1, 2, 3]))
+        self.assertEqual(graph.get_cited_records(2, 3), intbitset([1]))
+
+    def test_graph_reload(self):
+        """bibrank citation graph - reloading a republished graph file"""
+        bibrank_citation_graph.write_graph(self.citations, self.path)
+        graph = bibrank_citation_graph.CitationGraph(self.path)
+        bibrank_citation_graph.write_graph(self.citations + [(6, 4)], self.path)
+        graph.reload_if_needed()
+        self.assertEqual(graph.get_citers(4), [6])
+        bibrank_citation_graph.delete_graph(self.path)
+        graph.reload_if_needed()
+        self.failIf(graph.is_loaded())
+
+
+TEST_SUITE = make_test_suite(TestCitationGraph)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -44,6 +44,8 @@ from invenio.bibtask import write_message, task_get_option, \
 from invenio.bibindex_engine_utils import get_field_tags
 from invenio.docextract_record import get_record
 from invenio.dbquery import serialize_via_marshal
+from invenio.bibrank_citation_graph import write_graph, \
+                                          CFG_BIBRANK_CITATION_GRAPH_PATH
 
 re_CFG_JOURNAL_PUBINFO_STANDARD_FORM_REGEXP_CHECK \
                    = re.compile(CFG_JOURNAL_PUBINFO_STANDARD_FORM_REGEXP_CHECK)
@@ -193,6 +195,10 @@ def process_and_store(recids, config, chunk_size):
 
     store_weights_cache(weights)
 
+    # Publish the citation graph shared by the search processes
+    if modified or not os.path.exists(CFG_BIBRANK_CITATION_GRAPH_PATH):
+        store_citation_graph()
+
     return weights
 
 
@@ -202,6 +208,15 @@ def store_weights_cache(weights):
     redis.set('citations_weights', serialize_via_marshal(weights))
 
 
+def store_citation_graph():
+    """Publish the citation graph file from rnkCITATIONDICT"""
+    write_message("Publishing citation graph", verbose=2)
+    citations = run_sql("SELECT citer, citee FROM rnkCITATIONDICT")
+    write_graph(citations)
+    write_message("Citation graph of %s citations published" % len(citations),
+                  verbose=2)
+
+
 def process_chunk(recids, config):
     tags = get_tags_config(config)
 
@@ -26,6 +26,7 @@ from invenio.intbitset import intbitset
 from invenio.data_cacher import DataCacher
 from invenio.redisutils import get_redis
 from invenio.dbquery import deserialize_via_marshal
+from invenio.bibrank_citation_graph import CitationGraph
 from operator import itemgetter
 
 
@@ -110,8 +111,32 @@ def get_citation_dict(dictname):
     return CACHE_CITATION_DICTS.cache[dictname]
 
 
+CACHE_CITATION_GRAPH = None
+
+
+def get_citation_graph():
+    """
+    Returns the citation graph published by the citation indexer,
+    mapped into memory and shared by all the processes, or None if
+    there is no such graph, in which case the rnkCITATIONDICT table
+    should be queried instead.  The graph is reloaded whenever the
+    indexer publishes a new version.
+    """
+    global CACHE_CITATION_GRAPH
+    if CACHE_CITATION_GRAPH is None:
+        CACHE_CITATION_GRAPH = CitationGraph()
+    else:
+        CACHE_CITATION_GRAPH.reload_if_needed()
+    if CACHE_CITATION_GRAPH.is_loaded():
+        return CACHE_CITATION_GRAPH
+    return None
+
+
 def get_refers_to(recordid):
     """Return a list of records referenced by this record"""
+    graph = get_citation_graph()
+    if graph is not None:
+        return set(graph.get_references(recordid))
     rows = run_sql("SELECT citee FROM rnkCITATIONDICT WHERE citer = %s",
                    [recordid])
     return set(r[0] for r in rows)
@@ -119,6 +144,9 @@ def get_refers_to(recordid):
 
 def get_cited_by(recordid):
     """Return a list of records that cite recordid"""
+    graph = get_citation_graph()
+    if graph is not None:
+        return set(graph.get_citers(recordid))
     rows = run_sql("SELECT citer FROM rnkCITATIONDICT WHERE citee = %s",
                    [recordid])
     return set(r[0] for r in rows)
@@ -126,6 +154,9 @@ def get_cited_by(recordid):
 
 def get_cited_by_count(recordid):
     """Return how many records cite given RECORDID."""
+    graph = get_citation_graph()
+    if graph is not None:
+        return graph.get_citation_count(recordid)
     rows = run_sql("SELECT 1 FROM rnkCITATIONDICT WHERE citee = %s",
                    [recordid])
     return len(rows)
@@ -138,6 +169,11 @@ def get_records_with_num_cites(numstr, allrecs=intbitset([]),
        Warning: numstr is string and may not be numeric! It can
        be 10,0->100 etc
     """
+    if not exclude_selfcites:
+        graph = get_citation_graph()
+        if graph is not None:
+            return get_records_with_num_cites_from_graph(graph, numstr, allrecs)
+
     if exclude_selfcites:
         cache_cited_by_dictionary_counts = get_citation_dict("selfcites_counts")
         citations_keys = intbitset(get_citation_dict("selfcites_weights").keys())
@@ -190,6 +226,41 @@ def get_records_with_num_cites(numstr, allrecs=intbitset([]),
     return matches
 
 
+def get_records_with_num_cites_from_graph(graph, numstr, allrecs):
+    """Return an intbitset of record IDs that are cited X times,
+       X defined in numstr, from the citation graph GRAPH.
+       See get_records_with_num_cites().
+    """
+    matches = intbitset()
+    if type(numstr) != type("thisisastring"):
+        return matches
+    numstr = numstr.replace(" ", '')
+    numstr = numstr.replace('"', '')
+
+    singlenum = re.findall("^\d+$", numstr)
+    if singlenum:
+        num = int(singlenum[0])
+        if num == 0:
+            return allrecs - graph.get_cited_records(1)
+        return graph.get_cited_records(num, num)
+
+    firstsec = re.findall("(\d+)->(\d+)", numstr)
+    if firstsec:
+        first = int(firstsec[0][0])
+        sec = int(firstsec[0][1])
+        if first == 0:
+            matches = allrecs - graph.get_cited_records(1)
+        if first <= sec:
+            matches += graph.get_cited_records(max(first, 1), sec)
+        return matches
+
+    firstsec = re.findall("(\d+)\+", numstr)
+    if firstsec:
+        matches = graph.get_cited_records(int(firstsec[0]) + 1)
+
+    return matches
+
+
 def get_cited_by_list(recids):
     """Return a tuple of ([recid,list_of_citing_records],...) for all the
        records in recordlist.
@@ -197,6 +268,10 @@ def get_cited_by_list(recids):
     if not recids:
         return []
 
+    graph = get_citation_graph()
+    if graph is not None:
+        return [(recid, set(graph.get_citers(recid))) for recid in recids]
+
     in_sql = ','.join('%s' for dummy in recids)
     rows = run_sql("""SELECT citer, citee FROM rnkCITATIONDICT
                        WHERE citee IN (%s)""" % in_sql, recids)
@@ -215,6 +290,10 @@ def get_refers_to_list(recids):
     if not recids:
         return []
 
+    graph = get_citation_graph()
+    if graph is not None:
+        return [(recid, set(graph.get_references(recid))) for recid in recids]
+
     in_sql = ','.join('%s' for dummy in recids)
     rows = run_sql("""SELECT citee, citer FROM rnkCITATIONDICT
                        WHERE citer IN (%s)""" % in_sql, recids)
@@ -226,6 +305,47 @@ def get_refers_to_list(recids):
     return [(recid, refs.get(recid, set())) for recid in recids]
 
 
+def get_refers_to_map(recids):
+    """Return dictionary of recid->intbitset of the records it cites,
+       for all the records of the intbitset or list RECIDS, with at
+       most one query.
+    """
+    if not recids:
+        return {}
+
+    graph = get_citation_graph()
+    if graph is not None:
+        return dict((recid, intbitset(graph.get_references(recid))) for recid in recids)
+
+    refs = dict((recid, intbitset()) for recid in recids)
+    in_sql = ','.join('%s' for dummy in refs)
+    rows = run_sql("""SELECT citer, citee FROM rnkCITATIONDICT
+                       WHERE citer IN (%s)""" % in_sql, refs.keys())
+    for citer, citee in rows:
+        refs[citer].add(citee)
+    return refs
+
+
+def get_cited_by_counts(recids):
+    """Return dictionary of recid->number of records citing it, for
+       all the records of the intbitset or list RECIDS, with at most
+       one query.
+    """
+    if not recids:
+        return {}
+
+    graph = get_citation_graph()
+    if graph is not None:
+        return graph.get_citation_counts(recids)
+
+    counts = dict.fromkeys(recids, 0)
+    in_sql = ','.join('%s' for dummy in counts)
+    rows = run_sql("""SELECT citee, COUNT(*) FROM rnkCITATIONDICT
+                       WHERE citee IN (%s) GROUP BY citee""" % in_sql, counts.keys())
+    counts.update(rows)
+    return counts
+
+
 def get_refersto_hitset(ahitset):
     """
     Return a hitset of records that refers to (cite) some records from
@@ -240,6 +360,9 @@ def get_refersto_hitset(ahitset):
             # ignore attempt to iterate over infinite ahitset
             pass
         else:
+            graph = get_citation_graph()
+            if graph is not None:
+                return graph.get_citers_of_hitset(ahitset)
             in_sql = ','.join('%s' for dummy in ahitset)
             rows = run_sql("""SELECT citer FROM rnkCITATIONDICT
                               WHERE citee IN (%s)""" % in_sql, ahitset)
@@ -249,6 +372,10 @@ def get_refersto_hitset(ahitset):
 def get_one_cited_by_weight(recID):
     """Returns a number_of_citing_records for one record
     """
+    graph = get_citation_graph()
+    if graph is not None:
+        return graph.get_citation_count(recID)
+
     weight = get_citation_dict("citations_weights")
 
     return weight.get(recID, 0)
@@ -257,6 +384,10 @@ def get_cited_by_weight(recordlist):
     """Return a tuple of ([recid,number_of_citing_records],...) for all the
        records in recordlist.
     """
+    graph = get_citation_graph()
+    if graph is not None:
+        return [[recid, graph.get_citation_count(recid)] for recid in recordlist]
+
     weights = get_citation_dict("citations_weights")
 
     result = []
@@ -279,6 +410,9 @@ def get_citedby_hitset(ahitset):
             # ignore attempt to iterate over infinite ahitset
             pass
         else:
+            graph = get_citation_graph()
+            if graph is not None:
+                return graph.get_references_of_hitset(ahitset)
             in_sql = ','.join('%s' for dummy in ahitset)
             rows = run_sql("""SELECT citee FROM rnkCITATIONDICT
                               WHERE citer IN (%s)""" % in_sql, ahitset)
@@ -296,9 +430,8 @@ def calculate_cited_by_list(record_id, sort_order="d"):
     citation_list = get_cited_by(record_id)
 
     # Add weights i.e. records that cite each of the entries in citation_list
-    weights = get_citation_dict("citations_weights")
-    for c in citation_list:
-        result.append([c, weights.get(c, 0)])
+    result = [[recid, count] for recid, count
+              in get_cited_by_counts(citation_list).iteritems()]
 
     # sort them
     reverse = sort_order == "d"
@@ -314,8 +447,8 @@ def calculate_co_cited_with_list(record_id, sort_order="d"):
     result = []
     result_intermediate = {}
 
-    for cit_id in get_cited_by(record_id):
-        for ref_id in get_refers_to(cit_id):
+    for refs in get_refers_to_map(get_cited_by(record_id)).itervalues():
+        for ref_id in refs:
             if ref_id not in result_intermediate:
                 result_intermediate[ref_id] = 1
             else:
@@ -23,7 +23,13 @@ __revision__ = "$Id$"
 
 from invenio.testutils import InvenioTestCase
 
-from invenio.testutils import make_test_suite, run_test_suite
+from invenio.testutils import make_test_suite, run_test_suite, \
+     patch_attributes, restore_attributes
+from invenio.intbitset import intbitset
+from invenio import bibrank_citation_searcher
+
+# (citer, citee) rows of rnkCITATIONDICT
+CITATIONS = [(1, 2), (1, 3), (2, 3), (4, 3)]
 
 class TestCitationSearcher(InvenioTestCase):
 
@@ -52,7 +58,51 @@ class TestCitationSearcher(InvenioTestCase):
         """bibrank citation searcher - get co-cited-with data"""
         # FIXME: test postponed
 
-TEST_SUITE = make_test_suite(TestCitationSearcher,)
+class TestCitationDictionary(InvenioTestCase):
+    """Test citation lookups in rnkCITATIONDICT, used without citation graph."""
+
+    def setUp(self):
+        self.saved = patch_attributes(bibrank_citation_searcher,
+                                      get_citation_graph=lambda: None,
+                                      run_sql=self._run_sql)
+
+    def tearDown(self):
+        restore_attributes(bibrank_citation_searcher, self.saved)
+
+    def _run_sql(self, sql, params):
+        if 'COUNT(*)' in sql:
+            counts = {}
+            for dummy, citee in CITATIONS:
+                if citee in params:
+                    counts[citee] = counts.get(citee, 0) + 1
+            return tuple(counts.items())
+        if 'WHERE citer IN' in sql:
+            return tuple([(citer, citee) for citer, citee in CITATIONS if citer in params])
+        if 'WHERE citee = ' in sql:
+            return tuple([(citer, ) for citer, citee in CITATIONS if citee in params])
+        self.fail("unexpected query %s" % sql)
+
+    def test_refers_to_map(self):
+        """bibrank citation searcher - references of several records"""
+        self.assertEqual(bibrank_citation_searcher.get_refers_to_map(intbitset([1, 2, 5])),
+                         {1: intbitset([2, 3]), 2: intbitset([3]), 5: intbitset()})
+        self.assertEqual(bibrank_citation_searcher.get_refers_to_map([]), {})
+
+    def test_cited_by_counts(self):
+        """bibrank citation searcher - citation counts of several records"""
+        self.assertEqual(bibrank_citation_searcher.get_cited_by_counts([3, 2, 7]),
+                         {3: 3, 2: 1, 7: 0})
+        self.assertEqual(bibrank_citation_searcher.get_cited_by_counts(intbitset([1])),
+                         {1: 0})
+        self.assertEqual(bibrank_citation_searcher.get_cited_by_counts([]), {})
+
+    def test_calculate_co_cited_with_list(self):
+        """bibrank citation searcher - records co-cited with a record"""
+        self.assertEqual(bibrank_citation_searcher.calculate_co_cited_with_list(2),
+                         [[3, 1]])
+
+TEST_SUITE = make_test_suite(TestCitationSearcher,
+                             TestCitationDictionary)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
@@ -33,7 +33,9 @@ import time
 import re
 import sys
 try:
-    from numpy import array, ones, zeros, int32, float32, sqrt, dot
+    from numpy import array, ones, zeros, int32, float32, float64, sqrt, \
+         dot, asarray, fromiter, bincount, flatnonzero, concatenate, \
+         arange, count_nonzero
     import_numpy = 1
 except ImportError:
     import_numpy = 0
@@ -336,19 +338,37 @@ def get_dates_from_db(dict_of_ids, publication_year_tag, creation_date_tag):
     return dates
 
 
+def construct_citation_arrays(cit, dict_of_ids):
+    """returns the citation graph as two arrays (rows, columns) of the
+    ids of the cited and citing papers of each citation"""
+    nr_of_citations = 0
+    for item in cit:
+        nr_of_citations += len(cit[item])
+    rows = fromiter((dict_of_ids[item] for item in cit \
+                     for dummy in cit[item]), int32, nr_of_citations)
+    columns = fromiter((dict_of_ids[value] for item in cit \
+                        for value in cit[item]), int32, nr_of_citations)
+    return rows, columns
+
+
+def sparse_dot(sparse, vector, len_):
+    """returns the product of the sparse matrix SPARSE, given in
+    coordinate form (rows, columns, values), and VECTOR"""
+    rows, columns, values = sparse
+    return bincount(rows, weights=values * vector[columns],
+                    minlength=len_).astype(float32)
+
+
 def construct_sparse_matrix(cit, ref, dict_of_ids, len_, damping_factor):
     """returns several structures needed in the calculation
     of the PAGERANK method using this structures, we don't need
-    to keep the full matrix in the memory"""
-    sparse = {}
-    for item in cit:
-        for value in cit[item]:
-            sparse[(dict_of_ids[item], dict_of_ids[value])] = \
-                    damping_factor * 1.0/ref[dict_of_ids[value]]
-    semi_sparse = []
-    for j in range(len_):
-        if ref[j] == 0:
-            semi_sparse.append(j)
+    to keep the full matrix in the memory: the sparse matrix is
+    given in coordinate form, as (rows, columns, values) arrays"""
+    ref = asarray(ref, float64)
+    rows, columns = construct_citation_arrays(cit, dict_of_ids)
+    sparse = (rows, columns, damping_factor / ref[columns])
+    # papers that do not cite anybody (dangling nodes)
+    semi_sparse = flatnonzero(ref == 0)
     semi_sparse_coeficient = damping_factor/len_
     #zero_coeficient = (1-damping_factor)/len_
     write_message("Sparse information calculated", verbose=3)
@@ -360,37 +380,27 @@ def construct_sparse_matrix_ext(cit, ref, ext_links, dict_of_ids, alpha, beta):
     returns several structures needed in the calculation
     of the PAGERANK_EXT method"""
     len_ = len(dict_of_ids)
-    sparse = {}
-    semi_sparse = {}
-    sparse[0, 0] = 1.0 - alpha
+    ref = asarray(ref, float64)
+    # links from the external node (node 0) to each paper
+    ext_coef = zeros(len_, float64)
     for j in range(len_):
-        sparse[j+1, 0] = alpha/(len_)
-        if j not in ext_links:
-            sparse[0, j+1] = beta/(len_ + beta)
+        if j not in ext_links or ext_links[j] == 0:
+            ext_coef[j] = beta/(len_ + beta)
         else:
-            if ext_links[j] == 0:
-                sparse[0, j+1] = beta/(len_ + beta)
+            aux = beta * ext_links[j]
+            if ref[j] == 0:
+                ext_coef[j] = aux/(aux + len_)
             else:
-                aux = beta * ext_links[j]
-                if ref[j] == 0:
-                    sparse[0, j+1] = aux/(aux + len_)
-                else:
-                    sparse[0, j+1] = aux/(aux + ref[j])
-        if ref[j] == 0:
-            semi_sparse[j+1] = (1.0 - sparse[0, j + 1])/len_
-    for item in cit:
-        for value in cit[item]:
-            sparse[(dict_of_ids[item] + 1, dict_of_ids[value] + 1)] = \
-               (1.0 - sparse[0, dict_of_ids[value] + 1])/ref[dict_of_ids[value]]
-    #for i in range(len_ + 1):
-    #    a = ""
-    #    for j in range (len_ + 1):
-    #        if (i,j) in sparse:
-    #            a += str(sparse[(i,j)]) + "\t"
-    #        else:
-    #            a += "0\t"
-    #    print a
-    #print semi_sparse
+                ext_coef[j] = aux/(aux + ref[j])
+    # papers that do not cite anybody (dangling nodes)
+    dangling = flatnonzero(ref == 0)
+    semi_sparse = (dangling + 1, (1.0 - ext_coef[dangling])/len_)
+    rows, columns = construct_citation_arrays(cit, dict_of_ids)
+    papers = arange(1, len_ + 1, dtype=int32)
+    sparse = (concatenate(([0], papers, zeros(len_, int32), rows + 1)),
+              concatenate(([0], zeros(len_, int32), papers, columns + 1)),
+              concatenate(([1.0 - alpha], ones(len_, float64) * alpha/len_,
+                           ext_coef, (1.0 - ext_coef[columns])/ref[columns])))
     write_message("Sparse information calculated", verbose=3)
     return sparse, semi_sparse
 
@@ -401,27 +411,29 @@ def construct_sparse_matrix_time(cit, ref, dict_of_ids, \
     method using this structures,
     we don't need to keep the full matrix in the memory"""
     len_ = len(dict_of_ids)
-    sparse = {}
-    for item in cit:
-        for value in cit[item]:
-            sparse[(dict_of_ids[item], dict_of_ids[value])] = damping_factor * \
-                    date_coef[dict_of_ids[value]]/ref[dict_of_ids[value]]
-    semi_sparse = []
-    for j in range(len_):
-        if ref[j] == 0:
-            semi_sparse.append(j)
+    ref = asarray(ref, float64)
+    date_coef = date_coef_array(date_coef, len_)
+    rows, columns = construct_citation_arrays(cit, dict_of_ids)
+    sparse = (rows, columns,
+              damping_factor * date_coef[columns] / ref[columns])
+    # papers that do not cite anybody (dangling nodes)
+    semi_sparse = flatnonzero(ref == 0)
     semi_sparse_coeficient = damping_factor/len_
     #zero_coeficient = (1-damping_factor)/len_
     write_message("Sparse information calculated", verbose=3)
     return sparse, semi_sparse, semi_sparse_coeficient
 
 
+def date_coef_array(date_coef, len_):
+    """returns the time coeficients of calculate_time_weights()
+    as an array"""
+    return fromiter((date_coef[j] for j in range(len_)), float64, len_)
+
+
 def statistics_on_sparse(sparse):
     """returns the number of papers that cite themselves"""
-    count_diag = 0
-    for (i, j) in sparse.keys():
-        if i == j:
-            count_diag += 1
+    rows, columns, dummy_values = sparse
+    count_diag = count_nonzero(rows == columns)
     write_message("The number of papers that cite themselves: %s" % \
         str(count_diag), verbose=3)
     return count_diag
@@ -439,14 +451,10 @@ def pagerank(conv_threshold, check_point, len_, sparse, \
     while not converged:
         nr_of_check_points += 1
         for step in (range(check_point)):
-            weights_new = zeros((len_), float32)
-            for (i, j) in sparse.keys():
-                weights_new[i] += sparse[(i, j)]*weights_old[j]
-            semi_total = 0.0
-            for j in semi_sparse:
-                semi_total += weights_old[j]
+            weights_new = sparse_dot(sparse, weights_old, len_)
+            semi_total = weights_old[semi_sparse].sum(dtype=float64)
             weights_new = weights_new + semi_sparse_coef * semi_total + \
-                            (1.0/len_ - semi_sparse_coef) * sum(weights_old)
+                (1.0/len_ - semi_sparse_coef) * weights_old.sum(dtype=float64)
             if step == check_point - 1:
                 diff = weights_new - weights_old
                 difference = sqrt(dot(diff, diff))/len_
@@ -470,15 +478,12 @@ def pagerank_ext(conv_threshold, check_point, len_, sparse, semi_sparse):
     converged = False
     nr_of_check_points = 0
     difference = len_
+    semi_sparse_ids, semi_sparse_coefs = semi_sparse
     while not converged:
         nr_of_check_points += 1
         for step in (range(check_point)):
-            weights_new = zeros((len_), float32)
-            for (i, j) in sparse.keys():
-                weights_new[i] += sparse[(i, j)]*weights_old[j]
-            total_sum = 0.0
-            for j in semi_sparse:
-                total_sum += semi_sparse[j]*weights_old[j]
+            weights_new = sparse_dot(sparse, weights_old, len_)
+            total_sum = dot(semi_sparse_coefs, weights_old[semi_sparse_ids])
             weights_new[1:len_] = weights_new[1:len_] + total_sum
             if step == check_point - 1:
                 diff = weights_new - weights_old
@@ -499,6 +504,7 @@ def pagerank_time(conv_threshold, check_point, len_, \
         sparse, semi_sparse, semi_sparse_coeficient, date_coef):
     """the core function of the PAGERANK_TIME method: pageRank + time decay
     returns an array with the ranks coresponding to each recid"""
+    date_coef = date_coef_array(date_coef, len_)
     weights_old = array((), float32)
     weights_old = ones((len_), float32) # initial weights
     weights_new = array((), float32)
@@ -508,17 +514,9 @@ def pagerank_time(conv_threshold, check_point, len_, \
     while not converged:
         nr_of_check_points += 1
         for step in (range(check_point)):
-            weights_new = zeros((len_), float32)
-            for (i, j) in sparse.keys():
-                weights_new[i] += sparse[(i, j)]*weights_old[j]
-            semi_total = 0.0
-            for j in semi_sparse:
-                semi_total += weights_old[j]*date_coef[j]
-            zero_total = 0.0
-            for i in range(len_):
-                zero_total += weights_old[i]*date_coef[i]
-            #dates = array(date_coef.keys())
-            #zero_total = dot(weights_old, dates)
+            weights_new = sparse_dot(sparse, weights_old, len_)
+            semi_total = dot(weights_old[semi_sparse], date_coef[semi_sparse])
+            zero_total = dot(weights_old, date_coef)
             weights_new = weights_new + semi_sparse_coeficient * semi_total + \
                     (1.0/len_ - semi_sparse_coeficient) * zero_total
             if step == check_point - 1:
@@ -535,6 +533,81 @@ The threshold was %s" % (str(nr_of_check_points), \
     return weights_old
 
 
+def pagerank_reference(conv_threshold, check_point, len_, cit, ref, \
+                       dict_of_ids, damping_factor):
+    """pure Python implementation of the PAGERANK method, walking the
+    sparse matrix stored as a dictionary (i, j):value; it is much slower
+    than pagerank() and is only kept as a reference for testing and
+    benchmarking the latter"""
+    sparse = {}
+    for item in cit:
+        for value in cit[item]:
+            sparse[(dict_of_ids[item], dict_of_ids[value])] = \
+                    damping_factor * 1.0/ref[dict_of_ids[value]]
+    semi_sparse = [j for j in range(len_) if ref[j] == 0]
+    semi_sparse_coef = damping_factor/len_
+    weights_old = [1.0] * len_
+    converged = False
+    while not converged:
+        for step in range(check_point):
+            weights_new = [0.0] * len_
+            for (i, j), value in sparse.iteritems():
+                weights_new[i] += value * weights_old[j]
+            semi_total = 0.0
+            for j in semi_sparse:
+                semi_total += weights_old[j]
+            total = semi_sparse_coef * semi_total + \
+                    (1.0/len_ - semi_sparse_coef) * sum(weights_old)
+            weights_new = [weight + total for weight in weights_new]
+            if step == check_point - 1:
+                difference = sum([(new - old) * (new - old) for new, old \
+                                  in zip(weights_new, weights_old)]) ** 0.5 / len_
+                converged = (difference < conv_threshold)
+            weights_old = weights_new
+    return weights_old
+
+
+def citerank_benchmark(nr_of_papers=100000, nr_of_citations=1000000, \
+                       damping_factor=0.85, conv_threshold=0.0001, \
+                       check_point=10, seed=0):
+    """
+    Runs a benchmark of the PageRank engine on a random citation
+    graph, comparing the vectorized pagerank() with the pure Python
+    pagerank_reference().
+
+    @param nr_of_papers: the number of nodes of the random graph
+    @param nr_of_citations: the number of edges of the random graph
+    @param seed: the seed of the random graph
+    @return: (seconds spent by pagerank_reference(), seconds spent by
+             pagerank(), largest difference between their ranks)
+    """
+    import random
+    generator = random.Random(seed)
+    cit = {}
+    for dummy in xrange(nr_of_citations):
+        citee = generator.randrange(nr_of_papers)
+        citer = generator.randrange(nr_of_papers)
+        if citer != citee:
+            cit.setdefault(citee, set()).add(citer)
+    dict_of_ids = dict([(recid, recid) for recid in xrange(nr_of_papers)])
+    ref = construct_ref_array(cit, dict_of_ids, nr_of_papers)
+
+    t0 = time.time()
+    reference_weights = pagerank_reference(conv_threshold, check_point, \
+        nr_of_papers, cit, ref, dict_of_ids, damping_factor)
+    reference_time = time.time() - t0
+
+    t0 = time.time()
+    sparse, semi_sparse, semi_sparse_coeficient = construct_sparse_matrix( \
+        cit, ref, dict_of_ids, nr_of_papers, damping_factor)
+    weights = pagerank(conv_threshold, check_point, nr_of_papers, \
+        sparse, semi_sparse, semi_sparse_coeficient)
+    vectorized_time = time.time() - t0
+
+    difference = abs(weights - array(reference_weights)).max()
+    return reference_time, vectorized_time, difference
+
+
 def citation_rank_time(cit, dict_of_ids, date_coef, dates, decimals):
     """returns a dictionary recid:weight based on the total number of
     citations as function of time"""
@@ -879,3 +952,14 @@ to set output_ranks_to_filename and output_rank_limit \
 parameters in the configuration file", verbose=3)
     normalize_weights(dict_of_ranks)
     into_db(dict_of_ranks, rank_method_code)
+
+
+if __name__ == "__main__":
+    if '--benchmark' in sys.argv:
+        if not import_numpy:
+            print "The numpy package is needed by the citerank methods."
+            sys.exit(1)
+        reference_time, vectorized_time, difference = citerank_benchmark()
+        print "%.3f sec with the Python engine, %.3f sec with the vectorized \
+engine, largest difference of ranks: %g" % (reference_time, vectorized_time, \
+                                           difference)
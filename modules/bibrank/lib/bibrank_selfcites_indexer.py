@@ -41,7 +41,8 @@ from invenio.config import CFG_ETCDIR, \
                            CFG_BIBRANK_SELFCITES_PRECOMPUTE
 from invenio.dbquery import run_sql
 from invenio.bibauthorid_searchinterface import get_authors_of_claimed_paper
-from invenio.bibrank_citation_searcher import get_cited_by
+from invenio.bibrank_citation_searcher import get_cited_by, \
+     get_cited_by_counts
 
 
 def load_config_file(key):
@@ -232,10 +233,10 @@ def get_self_citations_count(recids, algorithm='simple',
         tags = get_authors_tags()
         selfcites_fun = ALL_ALGORITHMS[algorithm]
 
+        counts = get_cited_by_counts(recids)
         for recid in recids:
-            citers = get_cited_by(recid)
             self_cites = selfcites_fun(recid, tags)
-            total_cites += len(citers) - len(self_cites)
+            total_cites += counts[recid] - len(self_cites)
     else:
         results = get_precomputed_self_cites_list(recids)
 
@@ -243,10 +244,10 @@ def get_self_citations_count(recids, algorithm='simple',
         for r in results:
             results_dict[r[0]] = r[1]
 
+        counts = get_cited_by_counts(recids)
         for r in recids:
-            citers = get_cited_by(r)
             self_cites = results_dict.get(r, 0)
-            total_cites += len(citers) - self_cites
+            total_cites += counts[r] - self_cites
 
     return total_cites
 
@@ -38,6 +38,7 @@ from invenio.bibtask import write_message, task_get_option, task_update_progress
 from invenio.intbitset import intbitset
 from invenio.errorlib import register_exception
 from invenio.textutils import strip_accents
+from invenio.bibrank_word_postings import table_has_postings, serialize_postings
 
 options = {} # global variable to hold task options
 
@@ -277,8 +278,13 @@ class WordTable:
             else:
                 # yes there were some new words:
                 write_message("......... updating hitlist for ``%s''" % word, verbose=9)
-                run_sql("UPDATE %s SET hitlist=%%s WHERE term=%%s" % self.tablename,
-                        (serialize_via_marshal(set), word))
+                if table_has_postings(self.tablename):
+                    # postings are computed again at post-processing
+                    run_sql("UPDATE %s SET hitlist=%%s, postings=NULL WHERE term=%%s" % self.tablename,
+                            (serialize_via_marshal(set), word))
+                else:
+                    run_sql("UPDATE %s SET hitlist=%%s WHERE term=%%s" % self.tablename,
+                            (serialize_via_marshal(set), word))
         else: # the word is new, will create new set:
             write_message("......... inserting hitlist for ``%s''" % word, verbose=9)
             set = self.value[word]
@@ -1112,8 +1118,12 @@ def update_rnkWORD(table, terms):
                 if Git >= 0:
                     Git += 1
                 term_docs["Gi"] = (0, Git)
-                run_sql("UPDATE %s SET hitlist=%%s WHERE term=%%s" % table,
-                        (serialize_via_marshal(term_docs), t))
+                if table_has_postings(table):
+                    run_sql("UPDATE %s SET hitlist=%%s, postings=%%s WHERE term=%%s" % table,
+                            (serialize_via_marshal(term_docs), serialize_postings(term_docs), t))
+                else:
+                    run_sql("UPDATE %s SET hitlist=%%s WHERE term=%%s" % table,
+                            (serialize_via_marshal(term_docs), t))
             except (ZeroDivisionError, OverflowError), e:
                 register_exception(prefix="Error when analysing the term %s (%s): %s\n" % (t, repr(terms_docs), e), alert_admin=True)
         write_message("Phase 5: ......processed %s/%s terms" % ((i+5000>len(terms) and len(terms) or (i+5000)), len(terms)))
@@ -0,0 +1,99 @@
+## -*- mode: python; coding: utf-8; -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+BibRank word similarity posting lists.
+
+Besides its hitlist, i.e. the marshalled {recid: (tf, Nj), 'Gi': (0, Gi)}
+dictionary, the indexer stores every term of the rnkWORD forward
+tables in their postings column as parallel arrays sorted by recid,
+so that the ranking can restrict itself to the records of the hitset
+by a vectorized intersection instead of walking all the postings in
+Python.  The postings are marshalled (Gi, recids, tfs, norms), where
+RECIDS is the string of little-endian unsigned 32 bits integers and
+TFS and NORMS the strings of little-endian doubles.
+
+The postings column is NULL until the post-processing of the indexer
+computed the Gi and Nj values of the term; the searcher then uses the
+hitlist.
+"""
+
+import array
+import marshal
+import sys
+
+try:
+    ## import optional module:
+    import numpy
+    CFG_NUMPY_IMPORTABLE = True
+except ImportError:
+    CFG_NUMPY_IMPORTABLE = False
+
+from invenio.dbquery import run_sql
+
+_POSTINGS_TABLES = {}
+
+def table_has_postings(table):
+    """Does the rnkWORD forward table TABLE have a postings column?
+    Tables created before it was introduced do not."""
+    if table not in _POSTINGS_TABLES:
+        _POSTINGS_TABLES[table] = bool(run_sql("SHOW COLUMNS FROM %s LIKE 'postings'" % table))
+    return _POSTINGS_TABLES[table]
+
+def _to_little_endian(values):
+    """Return string of the array.array VALUES, in little-endian byte
+    order."""
+    if sys.byteorder == 'big':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tostring()
+
+def serialize_postings(term_docs):
+    """Return postings string of TERM_DOCS, the hitlist dictionary of
+    a term, or None if its Gi value has not been computed yet."""
+    if "Gi" not in term_docs:
+        return None
+    recids = sorted([recid for recid in term_docs if recid != "Gi"])
+    tfs = array.array('d', [term_docs[recid][0] for recid in recids])
+    norms = array.array('d', [term_docs[recid][1] for recid in recids])
+    return marshal.dumps((term_docs["Gi"][1],
+                          _to_little_endian(array.array('I', recids)),
+                          _to_little_endian(tfs),
+                          _to_little_endian(norms)))
+
+def deserialize_postings(postings):
+    """Return (Gi, recids, tfs, norms) numpy arrays of the POSTINGS
+    string."""
+    Gi, recids, tfs, norms = marshal.loads(postings)
+    return (Gi,
+            numpy.frombuffer(recids, dtype='<u4'),
+            numpy.frombuffer(tfs, dtype='<f8'),
+            numpy.frombuffer(norms, dtype='<f8'))
+
+def intersect_postings(recids, hits):
+    """Return array of the indexes of the RECIDS that belong to HITS,
+    both sorted numpy arrays of distinct recids, looking up the
+    shorter array into the longer one."""
+    if not len(recids) or not len(hits):
+        return numpy.array([], dtype=numpy.intp)
+    if len(hits) < len(recids):
+        positions = numpy.minimum(numpy.searchsorted(recids, hits), len(recids) - 1)
+        return positions[recids[positions] == hits]
+    positions = numpy.minimum(numpy.searchsorted(hits, recids), len(hits) - 1)
+    return numpy.flatnonzero(hits[positions] == recids)
@@ -0,0 +1,86 @@
+## -*- mode: python; coding: utf-8; -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the word similarity posting lists."""
+
+import random
+
+from invenio.testutils import InvenioTestCase
+from invenio.bibrank_word_postings import CFG_NUMPY_IMPORTABLE, \
+     serialize_postings, deserialize_postings
+from invenio.bibrank_word_searcher import calculate_record_relevance, \
+     sort_record_relevance
+from invenio.intbitset import intbitset
+from invenio.testutils import make_test_suite, run_test_suite
+
+if CFG_NUMPY_IMPORTABLE:
+    import numpy
+    from invenio.bibrank_word_searcher import calculate_postings_relevance, \
+         sort_record_relevance_of_postings
+
+
+class TestWordPostings(InvenioTestCase):
+    """Test ranking with posting lists."""
+
+    def setUp(self):
+        """Create the hitlists of three terms."""
+        generator = random.Random(42)
+        self.hitlists = []
+        for Gi in (87, 3, 101):
+            term_docs = {}
+            for recid in generator.sample(xrange(1, 2000), 300):
+                term_docs[recid] = (generator.randint(1, 20), generator.randint(1, 101))
+            term_docs["Gi"] = (0, Gi)
+            self.hitlists.append(term_docs)
+        self.hitset = intbitset(generator.sample(xrange(1, 2000), 500))
+
+    def test_postings_without_gi(self):
+        """bibrank - no postings for terms without Gi value"""
+        self.assertEqual(serialize_postings({1: (2, 0)}), None)
+
+    if CFG_NUMPY_IMPORTABLE:
+        def test_postings_ranking(self):
+            """bibrank - ranking with posting lists as with hitlists"""
+            (recdict, rec_termcount) = ({}, {})
+            (lrecids, lscores) = ([], [])
+            hits = numpy.array(self.hitset.tolist(), dtype=numpy.uint32)
+            for term_docs in self.hitlists:
+                postings = deserialize_postings(serialize_postings(term_docs))
+                (recids, scores) = calculate_postings_relevance(postings, hits)
+                lrecids.append(recids)
+                lscores.append(scores)
+                (recdict, rec_termcount) = calculate_record_relevance(("term", term_docs["Gi"][1]), dict(term_docs),
+                                                                      self.hitset, recdict, rec_termcount, 0)
+            self.assertEqual(sort_record_relevance_of_postings(lrecids, lscores, intbitset(self.hitset), 0, 0),
+                             sort_record_relevance(recdict, rec_termcount, intbitset(self.hitset), 0, 0))
+
+        def test_postings_of_small_hitset(self):
+            """bibrank - ranking a hitset smaller than the posting lists"""
+            term_docs = self.hitlists[0]
+            hitset = intbitset(sorted([recid for recid in term_docs if recid != "Gi"])[::50] + [5000])
+            postings = deserialize_postings(serialize_postings(term_docs))
+            (recids, scores) = calculate_postings_relevance(postings, numpy.array(hitset.tolist(), dtype=numpy.uint32))
+            (recdict, dummy) = calculate_record_relevance(("term", 87), dict(term_docs), hitset, {}, {}, 0)
+            self.assertEqual(dict(zip(recids.tolist(), scores.tolist())), recdict)
+
+
+TEST_SUITE = make_test_suite(TestWordPostings)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
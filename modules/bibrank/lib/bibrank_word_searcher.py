@@ -26,6 +26,12 @@ from operator import itemgetter
 from invenio.dbquery import run_sql, deserialize_via_marshal
 from invenio.bibindex_engine_stemmer import stem
 from invenio.bibindex_engine_stopwords import is_stopword
+from invenio.bibrank_word_postings import CFG_NUMPY_IMPORTABLE, \
+     table_has_postings, deserialize_postings, intersect_postings
+from invenio.intbitset import intbitset
+
+if CFG_NUMPY_IMPORTABLE:
+    import numpy
 
 
 def find_similar(rank_method_code, recID, hitset, rank_limit_relevance,verbose, methods):
@@ -202,20 +208,32 @@ def word_similarity(rank_method_code, lwords, hitset, rank_limit_relevance, verb
                 if lwords_old[i] != term: #add if stemmed word is different than original word
                     lwords.append((term, methods[rank_method_code]["rnkWORD_table"]))
 
-    (recdict, rec_termcount, lrecIDs_remove) = ({}, {}, {})
-    #For each term, if accepted, get a list of the records using the term
-    #calculate then relevance for each term before sorting the list of records
-    for (term, table) in lwords:
-        term_recs = run_sql("""SELECT term, hitlist FROM %s WHERE term=%%s""" % methods[rank_method_code]["rnkWORD_table"], (term,))
-        if term_recs: #if term exists in database, use for ranking
-            term_recs = deserialize_via_marshal(term_recs[0][1])
-            (recdict, rec_termcount) = calculate_record_relevance((term, int(term_recs["Gi"][1])) , term_recs, hitset, recdict, rec_termcount, verbose, quick=None)
-            del term_recs
-
-    if len(recdict) == 0 or (len(lwords) == 1 and lwords[0] == ""):
-        return (None, "Records not ranked. The query is not detailed enough, or not enough records found, for ranking to be possible.", "", voutput)
-    else: #sort if we got something to sort
-        (reclist, hitset) = sort_record_relevance(recdict, rec_termcount, hitset, rank_limit_relevance, verbose)
+    if CFG_NUMPY_IMPORTABLE:
+        #Score the records of the hitset found in the posting lists of the terms
+        (lrecIDs, lscores, hits) = ([], [], numpy.array(hitset.tolist(), dtype=numpy.uint32))
+        for (term, table) in lwords:
+            (recIDs, scores) = calculate_record_relevance_of_term(term, methods[rank_method_code]["rnkWORD_table"], hitset, hits, verbose)
+            if len(recIDs):
+                lrecIDs.append(recIDs)
+                lscores.append(scores)
+        if len(lrecIDs) == 0 or (len(lwords) == 1 and lwords[0] == ""):
+            return (None, "Records not ranked. The query is not detailed enough, or not enough records found, for ranking to be possible.", "", voutput)
+        (reclist, hitset) = sort_record_relevance_of_postings(lrecIDs, lscores, hitset, rank_limit_relevance, verbose)
+    else:
+        (recdict, rec_termcount, lrecIDs_remove) = ({}, {}, {})
+        #For each term, if accepted, get a list of the records using the term
+        #calculate then relevance for each term before sorting the list of records
+        for (term, table) in lwords:
+            term_recs = run_sql("""SELECT term, hitlist FROM %s WHERE term=%%s""" % methods[rank_method_code]["rnkWORD_table"], (term,))
+            if term_recs: #if term exists in database, use for ranking
+                term_recs = deserialize_via_marshal(term_recs[0][1])
+                (recdict, rec_termcount) = calculate_record_relevance((term, int(term_recs["Gi"][1])) , term_recs, hitset, recdict, rec_termcount, verbose, quick=None)
+                del term_recs
+
+        if len(recdict) == 0 or (len(lwords) == 1 and lwords[0] == ""):
+            return (None, "Records not ranked. The query is not detailed enough, or not enough records found, for ranking to be possible.", "", voutput)
+        else: #sort if we got something to sort
+            (reclist, hitset) = sort_record_relevance(recdict, rec_termcount, hitset, rank_limit_relevance, verbose)
 
     #Add any documents not ranked to the end of the list
     if hitset:
@@ -297,6 +315,90 @@ def sort_record_relevance(recdict, rec_termcount, hitset, rank_limit_relevance,
         voutput += "Sort time: %s<br />" % (str(time.time() - startCreate))
     return (reclist, hitset)
 
+def calculate_record_relevance_of_term(term, table, hitset, hits, verbose):
+    """Calculating the relevance of the documents of the hitset containing one word, as
+    calculate_record_relevance() does, but only looking at the postings of the records
+    of the hitset.
+    term - the term
+    table - the rnkWORD forward table
+    hitset - a hitset with records that are allowed to be ranked
+    hits - the same records, as a sorted numpy array
+    verbose - verbose value
+    output:
+    (recids, scores) - numpy arrays of the ranked records and of their rank value for the term"""
+
+    postings = None
+    if table_has_postings(table):
+        postings = run_sql("""SELECT postings FROM %s WHERE term=%%s""" % table, (term,))
+        if not postings: #term does not exist in database
+            return ([], [])
+        postings = postings[0][0]
+    if postings is None: #postings not computed yet, use the hitlist
+        term_recs = run_sql("""SELECT term, hitlist FROM %s WHERE term=%%s""" % table, (term,))
+        if not term_recs:
+            return ([], [])
+        term_recs = deserialize_via_marshal(term_recs[0][1])
+        (recdict, rec_termcount) = calculate_record_relevance((term, int(term_recs["Gi"][1])), term_recs, hitset, {}, {}, verbose, quick=None)
+        return (numpy.array(recdict.keys(), dtype=numpy.uint32),
+                numpy.array(recdict.values(), dtype=numpy.int64))
+    return calculate_postings_relevance(deserialize_postings(postings), hits)
+
+def calculate_postings_relevance(postings, hits):
+    """Calculating the relevance of the documents of the hitset containing one word
+    postings - (Gi, recids, tfs, norms) the posting lists of the word
+    hits - the records of the hitset, as a sorted numpy array
+    output:
+    (recids, scores) - numpy arrays of the ranked records and of their rank value for the term"""
+
+    (Gi, recids, tfs, norms) = postings
+    qtf = int(Gi)
+    indexes = intersect_postings(recids, hits)
+    values = tfs[indexes] * Gi * norms[indexes] * qtf
+    #records whose rank value has no logarithm are not ranked
+    indexes = indexes[values > 0]
+    values = numpy.log(values[values > 0])
+    #numpy.log may differ from math.log by one ulp, so compute again
+    #the values close to an integer to truncate them the same way
+    for i in numpy.flatnonzero(numpy.abs(values - numpy.rint(values)) < 1e-9):
+        values[i] = math.log(tfs[indexes[i]] * Gi * norms[indexes[i]] * qtf)
+    return (recids[indexes], values.astype(numpy.int64))
+
+def sort_record_relevance_of_postings(lrecids, lscores, hitset, rank_limit_relevance, verbose):
+    """Sorts the records scored by calculate_record_relevance_of_term() as
+    sort_record_relevance() does.
+    lrecids - list of numpy arrays of the ranked records of every term
+    lscores - list of numpy arrays of their rank values
+    rank_limit_relevance - a value > 0 usually
+    verbose - verbose value"""
+
+    startCreate = time.time()
+    voutput = ""
+
+    #sum the rank values of every record
+    (recids, inverse) = numpy.unique(numpy.concatenate(lrecids), return_inverse=True)
+    scores = numpy.zeros(len(recids), dtype=numpy.int64)
+    numpy.add.at(scores, inverse, numpy.concatenate(lscores))
+
+    #remove all ranked documents so that unranked can be added to the end
+    hitset -= intbitset(recids.tolist())
+
+    #gives each record a score between 0-100
+    divideby = int(scores.max())
+    if divideby == 0:
+        raise ZeroDivisionError("integer division or modulo by zero")
+    scores = scores * 100 // divideby
+    keep = scores >= rank_limit_relevance
+    (recids, scores) = (recids[keep], scores[keep])
+
+    #sort scores
+    order = numpy.lexsort((recids, scores))
+    reclist = zip(recids[order].tolist(), scores[order].tolist())
+
+    if verbose > 0:
+        voutput += "Number of records sorted: %s<br />" % len(reclist)
+        voutput += "Sort time: %s<br />" % (str(time.time() - startCreate))
+    return (reclist, hitset)
+
 def rank_method_stat(rank_method_code, reclist, lwords):
     """Shows some statistics about the searchresult.
     rank_method_code - name field from rnkMETHOD
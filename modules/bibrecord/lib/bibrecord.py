@@ -38,6 +38,7 @@ if sys.hexversion < 0x2040000:
 from invenio.bibrecord_config import CFG_MARC21_DTD, \
     CFG_BIBRECORD_WARNING_MSGS, CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL, \
     CFG_BIBRECORD_DEFAULT_CORRECT, CFG_BIBRECORD_PARSERS_AVAILABLE, \
+    CFG_BIBRECORD_STREAM_CHUNK_SIZE, \
     InvenioBibRecordParserError, InvenioBibRecordFieldError
 from invenio.config import CFG_BIBUPLOAD_EXTERNAL_OAIID_TAG
 from invenio.textutils import encode_for_xml
@@ -88,6 +89,9 @@ try:
 except ImportError:
     pass
 
+# Use the DOTALL flag to include newlines.
+_RECORD_XML_REGEX = re.compile('<record.*?>.*?</record>', re.DOTALL)
+
 ### INTERFACE / VISIBLE FUNCTIONS
 
 def create_field(subfields=None, ind1=' ', ind2=' ', controlfield_value='',
@@ -109,13 +113,63 @@ def create_records(marcxml, verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
     """Creates a list of records from the marcxml description. Returns a
     list of objects initiated by the function create_record(). Please
     see that function's docstring."""
-    # Use the DOTALL flag to include newlines.
-    regex = re.compile('<record.*?>.*?</record>', re.DOTALL)
-    record_xmls = regex.findall(marcxml)
+    record_xmls = _RECORD_XML_REGEX.findall(marcxml)
 
     return [create_record(record_xml, verbose=verbose, correct=correct,
             parser=parser, keep_singletons=keep_singletons) for record_xml in record_xmls]
 
+def iter_records(path_or_stream, verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
+    correct=CFG_BIBRECORD_DEFAULT_CORRECT, parser='',
+    keep_singletons=CFG_BIBRECORD_KEEP_SINGLETONS,
+    chunk_size=CFG_BIBRECORD_STREAM_CHUNK_SIZE):
+    """Iterates over the records of a MARCXML file, given by its path or
+    as a file-like object, yielding the same objects as
+    create_records() would return.
+
+    The file is read by chunks of CHUNK_SIZE bytes and every record is
+    parsed as soon as its closing tag has been read, so that memory
+    usage does not depend on the size of the file but only on the
+    size of the largest record."""
+    if isinstance(path_or_stream, basestring):
+        stream = open(path_or_stream, 'r')
+    else:
+        stream = path_or_stream
+    try:
+        buf = ''
+        pos = 0
+        eof = False
+        while True:
+            start = buf.find('<record', pos)
+            if start != -1:
+                match = _RECORD_XML_REGEX.match(buf, start)
+                if match is not None:
+                    yield create_record(match.group(), verbose=verbose,
+                        correct=correct, parser=parser,
+                        keep_singletons=keep_singletons)
+                    pos = match.end()
+                    continue
+                if eof:
+                    # unterminated record: look for the next one, as
+                    # create_records() would do
+                    pos = start + 1
+                    continue
+                # incomplete record: keep it and read on
+                buf = buf[start:]
+            elif eof:
+                break
+            else:
+                # keep what could be the beginning of an opening tag
+                buf = buf[max(pos, len(buf) - len('<record') + 1):]
+            pos = 0
+            chunk = stream.read(chunk_size)
+            if chunk:
+                buf += chunk
+            else:
+                eof = True
+    finally:
+        if stream is not path_or_stream:
+            stream.close()
+
 def create_record(marcxml, verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
     correct=CFG_BIBRECORD_DEFAULT_CORRECT, parser='',
     sort_fields_by_indicators=False,
@@ -21,6 +21,8 @@
 The BibRecord test suite.
 """
 
+from cStringIO import StringIO
+
 from invenio.testutils import InvenioTestCase
 
 from invenio.config import CFG_TMPDIR, \
@@ -128,6 +130,32 @@ class BibRecordSuccessTest(InvenioTestCase):
         record1 = bibrecord.create_records(xmltext)[0]
         self.assertEqual(record1, record)
 
+class BibRecordIterRecordsTest(InvenioTestCase):
+    """ bibrecord - streaming records out of MARCXML files """
+
+    def test_iter_records_demo_file(self):
+        """ bibrecord - iter_records() on demo file """
+        f = open(CFG_TMPDIR + '/demobibdata.xml', 'r')
+        xmltext = f.read()
+        f.close()
+        # small chunks so that records span several of them
+        self.assertEqual(list(bibrecord.iter_records(CFG_TMPDIR + '/demobibdata.xml',
+                                                     chunk_size=100)),
+                         bibrecord.create_records(xmltext))
+
+    def test_iter_records_stream(self):
+        """ bibrecord - iter_records() on stream with unterminated records """
+        xmltext = """<collection>
+        <record><controlfield tag="001">1</controlfield></record>
+        <record><controlfield tag="001">2</controlfield>
+        <record><controlfield tag="001">3</controlfield></record>
+        <record><controlfield tag="001">4</controlfield>
+        </collection>"""
+        for chunk_size in (1, 7, 1000):
+            self.assertEqual(list(bibrecord.iter_records(StringIO(xmltext),
+                                                         chunk_size=chunk_size)),
+                             bibrecord.create_records(xmltext))
+
 class BibRecordParsersTest(InvenioTestCase):
     """ bibrecord - testing the creation of records with different parsers"""
 
@@ -1772,6 +1800,7 @@ class BibRecordExtractIdentifiersTest(InvenioTestCase):
 
 TEST_SUITE = make_test_suite(
     BibRecordSuccessTest,
+    BibRecordIterRecordsTest,
     BibRecordParsersTest,
     BibRecordBadInputTreatmentTest,
     BibRecordGettingFieldValuesTest,
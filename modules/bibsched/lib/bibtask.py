@@ -58,7 +58,8 @@ import random
 
 from socket import gethostname
 
-from invenio.dbquery import run_sql, _db_login
+from invenio.dbquery import run_sql, _db_login, start_query_profiling, \
+    stop_query_profiling, dump_query_profile
 from invenio.access_control_engine import acc_authorize_action
 from invenio.config import CFG_PREFIX, \
                            CFG_BINDIR, \
@@ -66,7 +67,8 @@ from invenio.config import CFG_PREFIX, \
                            CFG_TMPDIR, \
                            CFG_SITE_SUPPORT_EMAIL, \
                            CFG_VERSION, \
-                           CFG_BIBSCHED_FLUSH_LOGS
+                           CFG_BIBSCHED_FLUSH_LOGS, \
+                           CFG_MISCUTIL_SQL_PROFILE
 from invenio.errorlib import register_exception
 
 from invenio.access_control_config import CFG_EXTERNAL_AUTH_USING_SSO, \
@@ -1142,6 +1144,8 @@ def _task_run(task_run_fnc):
     _TASK_PARAMS['task_starting_time'] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
 
     sleeptime = _TASK_PARAMS['sleeptime']
+    if CFG_MISCUTIL_SQL_PROFILE:
+        start_query_profiling('%s #%s' % (_TASK_PARAMS['task_name'], _TASK_PARAMS['task_id']))
     try:
         if callable(task_run_fnc) and task_run_fnc():
             task_update_status("DONE")
@@ -1150,6 +1154,8 @@ def _task_run(task_run_fnc):
         else:
             task_update_status("DONE WITH ERRORS")
     finally:
+        if CFG_MISCUTIL_SQL_PROFILE:
+            dump_query_profile(stop_query_profiling())
         task_status = task_read_status()
         if sleeptime:
             argv = task_get_options(_TASK_PARAMS['task_id'], _TASK_PARAMS['task_name'])
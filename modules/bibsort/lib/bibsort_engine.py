@@ -31,6 +31,7 @@ task_sleep_now_if_required
 from invenio.config import CFG_BIBSORT_BUCKETS, CFG_CERN_SITE
 from invenio.bibsort_washer import BibSortWasher, \
 InvenioBibSortWasherNotImplementedError
+from invenio.bibsort_store import write_store, delete_store
 
 import invenio.template
 websearch_templates = invenio.template.load('websearch')
@@ -298,13 +299,40 @@ def run_sorting_method(recids, method_name, method_id, definition, washer):
             if not executed:
                 return False
     else:
-        executed = write_to_buckets_table(method_id, 1, intbitset(sorted_data_list), \
+        bucket_dict = {1: intbitset(sorted_data_list)}
+        executed = write_to_buckets_table(method_id, 1, bucket_dict[1], \
                                           sorted_data_list[-1])
         if not executed:
             return False
+    write_to_store(method_id, sorted_data_dict, bucket_dict)
     return True
 
 
+def write_to_store(id_method, data_dict_ordered, bucket_dict=None):
+    """Publish the on-disk store read by search processes.  If
+    bucket_dict is not given, the buckets are read from the
+    bsrMETHODDATABUCKET table.  The published store is only replaced
+    once the new one has been written entirely.  Failing to write it
+    is not fatal: the outdated store is removed, and the search
+    processes then use the database tables."""
+    write_message('Writing the store file for method_id=%s' % id_method, verbose=5)
+    try:
+        if bucket_dict is None:
+            bucket_dict = {}
+            for bucket_no, bucket_data in run_sql("SELECT bucket_no, bucket_data \
+                                                  FROM bsrMETHODDATABUCKET \
+                                                  WHERE id_bsrMETHOD = %s", (id_method, )):
+                bucket_dict[bucket_no] = intbitset(bucket_data)
+        write_store(id_method, data_dict_ordered, bucket_dict)
+    except (Error, IOError, OSError, ValueError, TypeError), err:
+        write_message("The error [%s] occured when writing the store file " \
+                      "for method_id=%s" % (err, id_method), sys.stderr)
+        # make sure no outdated store is served
+        delete_store(id_method)
+        return
+    write_message('Writing the store file completed.', verbose=5)
+
+
 def write_to_methoddata_table(id_method, data_dict, data_dict_ordered, data_list_sorted, update_timestamp=True):
     """Serialize the date and write it to the bsrMETHODDATA"""
     write_message('Starting serializing the data..', verbose=5)
@@ -532,6 +560,7 @@ def delete_bibsort_data_for_method(method_id):
         run_sql("DELETE FROM bsrMETHODDATABUCKET WHERE id_bsrMETHOD = %s", (method_id, ))
     except:
         return False
+    delete_store(method_id)
     return True
 
 def delete_all_data_for_method(method_id):
@@ -539,6 +568,7 @@ def delete_all_data_for_method(method_id):
     from bibsort tables.
     Returns False in case some error occured, True otherwise"""
     method_name = 'method name'
+    delete_store(method_id)
     try:
         run_sql("DELETE FROM bsrMETHODDATA WHERE id_bsrMETHOD = %s", (method_id, ))
         run_sql("DELETE FROM bsrMETHODDATABUCKET WHERE id_bsrMETHOD = %s", (method_id, ))
@@ -655,6 +685,7 @@ def update_bibsort_tables(recids, method, update_timestamp = True):
             write_message("[%s] The bucket data for method %s has not been updated" \
                           %(method, err), sys.stderr)
             return False
+        write_to_store(method_id, data_dict_ordered)
     return True
 
 
@@ -0,0 +1,243 @@
+## -*- mode: python; coding: utf-8; -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+BibSort on-disk store.
+
+Besides the bsrMETHODDATA and bsrMETHODDATABUCKET tables, BibSort
+publishes every sorting method as a compact file that search processes
+map read-only into memory, so that the (potentially huge) recid->weight
+structure is shared between all Apache processes instead of being
+unmarshalled into each of them.
+
+File layout (all integers little-endian unsigned 64 bits):
+
+    magic       8 bytes, 'INVBSR02'
+    size        number of slots in the weight array (max recid + 1)
+    nb_records  number of records having a weight
+    nb_buckets  number of buckets
+    offset      offset of the bucket section
+    weights     SIZE doubles, weight of recid i in slot i, NaN if none
+    buckets     NB_BUCKETS times (bucket_no, length, fastdump data)
+
+Files are written to a temporary name and renamed, so that readers
+always see a complete version, and the published version is only
+replaced once the new one has been written entirely; readers notice a
+new version by its inode and modification time, and reload in
+constant time.
+"""
+
+import array
+import mmap
+import os
+import struct
+import sys
+
+try:
+    ## import optional module:
+    import numpy
+    CFG_NUMPY_IMPORTABLE = True
+except ImportError:
+    CFG_NUMPY_IMPORTABLE = False
+
+from invenio.config import CFG_CACHEDIR
+from invenio.intbitset import intbitset
+
+CFG_BIBSORT_STORE_DIR = os.path.join(CFG_CACHEDIR, 'bibsort')
+CFG_BIBSORT_STORE_MAGIC = 'INVBSR02'
+CFG_BIBSORT_STORE_HEADER = '<8sQQQQ'
+CFG_BIBSORT_STORE_HEADER_SIZE = struct.calcsize(CFG_BIBSORT_STORE_HEADER)
+
+class InvenioBibSortStoreError(Exception):
+    """Error raised on invalid BibSort store files."""
+    pass
+
+def get_store_path(method_id):
+    """Return path of the store file of the sorting method METHOD_ID."""
+    return os.path.join(CFG_BIBSORT_STORE_DIR, 'method_%s.bsr' % method_id)
+
+def write_store(method_id, data_dict_ordered, bucket_data):
+    """Publish the store file of sorting method METHOD_ID, holding the
+    recid->weight dictionary DATA_DICT_ORDERED and BUCKET_DATA, a
+    dictionary of bucket_no->intbitset."""
+    if not os.path.isdir(CFG_BIBSORT_STORE_DIR):
+        os.makedirs(CFG_BIBSORT_STORE_DIR)
+    size = data_dict_ordered and max(data_dict_ordered) + 1 or 0
+    offset = CFG_BIBSORT_STORE_HEADER_SIZE + 8 * size
+    path = get_store_path(method_id)
+    tmp_path = '%s.%s.tmp' % (path, os.getpid())
+    store_file = open(tmp_path, 'wb')
+    try:
+        try:
+            _write_store_file(store_file, data_dict_ordered, bucket_data, size, offset)
+        finally:
+            store_file.close()
+        os.rename(tmp_path, path)
+    except:
+        # the published version, if any, is left untouched
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _write_store_file(store_file, data_dict_ordered, bucket_data, size, offset):
+    """Write the store into the open file STORE_FILE."""
+    store_file.write(struct.pack(CFG_BIBSORT_STORE_HEADER, CFG_BIBSORT_STORE_MAGIC,
+                                 size, len(data_dict_ordered), len(bucket_data), offset))
+    if CFG_NUMPY_IMPORTABLE:
+        store_file.write(create_weights_array(data_dict_ordered).tostring())
+    else:
+        weights = array.array('d', [float('nan')]) * size
+        for recid, weight in data_dict_ordered.iteritems():
+            weights[recid] = weight
+        if sys.byteorder == 'big':
+            weights.byteswap()
+        store_file.write(weights.tostring())
+    for bucket_no in sorted(bucket_data):
+        dump = bucket_data[bucket_no].fastdump()
+        store_file.write(struct.pack('<QQ', bucket_no, len(dump)))
+        store_file.write(dump)
+    store_file.flush()
+    os.fsync(store_file.fileno())
+
+def create_weights_array(data_dict_ordered):
+    """Return dense numpy array of the weights of DATA_DICT_ORDERED,
+    indexed by recid, NaN standing for no weight."""
+    size = data_dict_ordered and max(data_dict_ordered) + 1 or 0
+    weights = numpy.empty(size, dtype='<f8')
+    weights.fill(numpy.nan)
+    if size:
+        weights[numpy.fromiter(data_dict_ordered.iterkeys(), dtype=numpy.int64)] = \
+            numpy.fromiter(data_dict_ordered.itervalues(), dtype=numpy.float64)
+    return weights
+
+def delete_store(method_id):
+    """Remove the store file of sorting method METHOD_ID, if any, so
+    that search processes go back to the database tables."""
+    try:
+        os.remove(get_store_path(method_id))
+    except OSError:
+        pass
+
+class BibSortWeights(object):
+    """
+    Read-only recid->weight mapping backed by the weight array of a
+    store file.  It behaves like the data_dict_ordered dictionary it
+    replaces: looking up a recid without weight raises KeyError.
+    """
+    def __init__(self, store_mmap, size, nb_records):
+        self.mmap = store_mmap
+        self.size = size
+        self.nb_records = nb_records
+        if CFG_NUMPY_IMPORTABLE:
+            self.array = numpy.frombuffer(store_mmap, dtype='<f8', count=size,
+                                          offset=CFG_BIBSORT_STORE_HEADER_SIZE)
+        else:
+            self.array = None
+
+    def __len__(self):
+        return self.nb_records
+
+    def __getitem__(self, recid):
+        if recid < 0 or recid >= self.size:
+            raise KeyError(recid)
+        if self.array is not None:
+            weight = float(self.array[recid])
+        else:
+            weight = struct.unpack_from('<d', self.mmap, CFG_BIBSORT_STORE_HEADER_SIZE + 8 * recid)[0]
+        if weight != weight:
+            # NaN, i.e. no weight
+            raise KeyError(recid)
+        if weight.is_integer():
+            return int(weight)
+        return weight
+
+    def __contains__(self, recid):
+        try:
+            self[recid]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, recid, default=None):
+        try:
+            return self[recid]
+        except KeyError:
+            return default
+
+class BibSortStore(object):
+    """
+    Store file of one sorting method, exposing the same .cache
+    structure and recreate_cache_if_needed() method as
+    BibSortDataCacher, i.e. .cache['data_dict_ordered'],
+    .cache['bucket_data'] and, if numpy is available,
+    .cache['data_array'].
+    """
+    def __init__(self, method_id):
+        self.method_id = method_id
+        self.path = get_store_path(method_id)
+        self.version = None
+        self.mmap = None
+        self.is_ok_p = True
+        self.cache = {'data_dict_ordered': {}, 'bucket_data': {}}
+        self.recreate_cache_if_needed()
+
+    def create_cache(self):
+        """Map the current version of the store file into memory."""
+        store_file = open(self.path, 'rb')
+        try:
+            stat = os.fstat(store_file.fileno())
+            store_mmap = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            store_file.close()
+        magic, size, nb_records, nb_buckets, offset = \
+            struct.unpack_from(CFG_BIBSORT_STORE_HEADER, store_mmap, 0)
+        if magic != CFG_BIBSORT_STORE_MAGIC:
+            raise InvenioBibSortStoreError("%s is not a BibSort store file" % self.path)
+        bucket_data = {}
+        for dummy in xrange(nb_buckets):
+            bucket_no, length = struct.unpack_from('<QQ', store_mmap, offset)
+            offset += 16
+            bucket_data[int(bucket_no)] = intbitset(store_mmap[offset:offset + length])
+            offset += length
+        weights = BibSortWeights(store_mmap, size, nb_records)
+        self.cache = {'data_dict_ordered': weights,
+                      'data_array': weights.array,
+                      'bucket_data': bucket_data}
+        # the previous mapping is released once no request uses it
+        self.mmap = store_mmap
+        self.version = (stat.st_ino, stat.st_mtime, stat.st_size)
+
+    def recreate_cache_if_needed(self):
+        """Reload the store file if a new version was published.  If
+        the file disappeared, serve empty data, so that clients fall
+        back to the slow sorting path."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self.version = None
+            self.cache = {'data_dict_ordered': {}, 'bucket_data': {}}
+            return
+        if (stat.st_ino, stat.st_mtime, stat.st_size) != self.version:
+            self.create_cache()
+
+def store_exists(method_id):
+    """Has a store file been published for sorting method METHOD_ID?"""
+    return os.path.exists(get_store_path(method_id))
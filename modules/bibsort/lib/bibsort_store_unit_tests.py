@@ -0,0 +1,86 @@
+## -*- mode: python; coding: utf-8; -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Testing module for the BibSort on-disk store"""
+
+import os
+import shutil
+import tempfile
+
+from invenio.testutils import InvenioTestCase
+from invenio import bibsort_store
+from invenio.intbitset import intbitset
+from invenio.testutils import make_test_suite, run_test_suite
+
+
+class TestBibSortStore(InvenioTestCase):
+    """Test BibSort store files."""
+
+    def setUp(self):
+        """Write store files into a temporary directory."""
+        self.old_store_dir = bibsort_store.CFG_BIBSORT_STORE_DIR
+        bibsort_store.CFG_BIBSORT_STORE_DIR = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the temporary directory."""
+        shutil.rmtree(bibsort_store.CFG_BIBSORT_STORE_DIR)
+        bibsort_store.CFG_BIBSORT_STORE_DIR = self.old_store_dir
+
+    def test_write_and_read_store(self):
+        """bibsort - writing and mapping a store file"""
+        data_dict_ordered = {3: 8, 7: 16, 5: 24}
+        bucket_data = {1: intbitset([3, 7]), 2: intbitset([5])}
+        bibsort_store.write_store(1, data_dict_ordered, bucket_data)
+        store = bibsort_store.BibSortStore(1)
+        weights = store.cache['data_dict_ordered']
+        self.assertEqual(weights[3], 8)
+        self.assertEqual(weights[5], 24)
+        self.assertEqual(weights.get(4), None)
+        self.assertRaises(KeyError, weights.__getitem__, 1000)
+        self.failIf(6 in weights)
+        self.assertEqual(len(weights), 3)
+        self.assertEqual(store.cache['bucket_data'], bucket_data)
+
+    def test_store_reload(self):
+        """bibsort - reloading a republished store file"""
+        bibsort_store.write_store(1, {1: 8}, {1: intbitset([1])})
+        store = bibsort_store.BibSortStore(1)
+        bibsort_store.write_store(1, {1: 8, 2: 4.5}, {1: intbitset([1, 2])})
+        store.recreate_cache_if_needed()
+        self.assertEqual(store.cache['data_dict_ordered'][2], 4.5)
+        bibsort_store.delete_store(1)
+        store.recreate_cache_if_needed()
+        self.assertEqual(store.cache['bucket_data'], {})
+
+    def test_failed_write(self):
+        """bibsort - failing to write a new version of a store file"""
+        bibsort_store.write_store(1, {1: 8}, {1: intbitset([1])})
+        store = bibsort_store.BibSortStore(1)
+        self.assertRaises(AttributeError, bibsort_store.write_store,
+                          1, {1: 8, 2: 4.5}, {1: None})
+        self.assertEqual(os.listdir(bibsort_store.CFG_BIBSORT_STORE_DIR), ['method_1.bsr'])
+        store.recreate_cache_if_needed()
+        self.assertEqual(store.cache['data_dict_ordered'].get(1), 8)
+        self.assertEqual(store.cache['data_dict_ordered'].get(2), None)
+
+
+TEST_SUITE = make_test_suite(TestBibSortStore)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -55,14 +55,17 @@ from invenio.config import CFG_OAI_ID_FIELD, \
      CFG_CERN_SITE, \
      CFG_BIBUPLOAD_MATCH_DELETED_RECORDS
 
+from invenio.bibformat_cache import invalidate_cached_output
 from invenio.jsonutils import json, CFG_JSON_AVAILABLE
 from invenio.bibupload_config import CFG_BIBUPLOAD_CONTROLFIELD_TAGS, \
     CFG_BIBUPLOAD_SPECIAL_TAGS, \
     CFG_BIBUPLOAD_DELETE_CODE, \
     CFG_BIBUPLOAD_DELETE_VALUE, \
-    CFG_BIBUPLOAD_OPT_MODES
-from invenio.dbquery import run_sql
+    CFG_BIBUPLOAD_OPT_MODES, \
+    CFG_BIBUPLOAD_BIBXXX_BATCH_SIZE
+from invenio.dbquery import run_sql, run_sql_many
 from invenio.bibrecord import create_records, \
+                              iter_records, \
                               record_add_field, \
                               record_delete_field, \
                               record_xml_output, \
@@ -630,6 +633,10 @@ def bibupload(record, opt_mode=None, opt_notimechange=0, oai_rec_id="", pretend=
         else:
             write_message("   -Stage NOT NEEDED", verbose=2)
 
+        # drop formatted versions of the record from the output cache:
+        if (updates_exist or record_had_FFT) and not pretend:
+            invalidate_cached_output(rec_id)
+
         # Increase statistics
         if insert_mode_p:
             stat['nb_records_inserted'] += 1
@@ -806,6 +813,16 @@ def print_out_bibupload_statistics():
               'nb_sec': time.time() - time.mktime(stat['exectime']) }
     write_message(out)
 
+def _marc_file_error(path, erro):
+    """Return the exception to raise when the MARCXML file PATH
+    cannot be opened or read because of IOError ERRO."""
+    write_message("ERROR: %s" % erro, verbose=1, stream=sys.stderr)
+    if erro.errno == 2:
+        # No such file or directory
+        # Not scary
+        return RecoverableError('File does not exist: %s' % path)
+    return StandardError('File not accessible: %s' % path)
+
 def open_marc_file(path):
     """Open a file and return the data"""
     try:
@@ -814,16 +831,46 @@ def open_marc_file(path):
         marc = marc_file.read()
         marc_file.close()
     except IOError, erro:
-        write_message("ERROR: %s" % erro, verbose=1, stream=sys.stderr)
-        if erro.errno == 2:
-            # No such file or directory
-            # Not scary
-            e = RecoverableError('File does not exist: %s' % path)
-        else:
-            e = StandardError('File not accessible: %s' % path)
-        raise e
+        raise _marc_file_error(path, erro)
     return marc
 
+def iter_marc_file_records(path):
+    """Iterate over the records of the MARCXML file PATH, reading and
+    parsing them one at a time, so that the file is never loaded in
+    memory as a whole.  Records are counted into
+    stat['nb_records_to_upload'] as they are read.
+
+    Raise the same errors as open_marc_file() and
+    xml_marc_to_records(); the parsing errors are raised when reaching
+    the faulty record, before it is yielded."""
+    try:
+        marc_file = open(path, 'r')
+    except IOError, erro:
+        raise _marc_file_error(path, erro)
+    return _iter_checked_records(iter_records(marc_file, 1, 1))
+
+def _iter_checked_records(recs):
+    """Yield record structures out of the (record, status, errors)
+    tuples RECS, checking them as xml_marc_to_records() does."""
+    nb_records = 0
+    try:
+        for rec in recs:
+            if nb_records == 0 and rec[0] is None:
+                msg = "ERROR: MARCXML file has wrong format: %s" % [rec]
+                write_message(msg, verbose=1, stream=sys.stderr)
+                raise RecoverableError(msg)
+            nb_records += 1
+            stat['nb_records_to_upload'] += 1
+            yield rec[0]
+    except IOError, erro:
+        msg = "ERROR: MARCXML file not readable: %s" % erro
+        write_message(msg, verbose=1, stream=sys.stderr)
+        raise StandardError(msg)
+    if nb_records == 0:
+        msg = "ERROR: Cannot parse MARCXML file."
+        write_message(msg, verbose=1, stream=sys.stderr)
+        raise StandardError(msg)
+
 def xml_marc_to_records(xml_marc):
     """create the records"""
     # Creation of the records from the xml Marc in argument
@@ -1338,6 +1385,70 @@ def insert_record_bibrec_bibxxx(table_name, id_bibxxx,
         return 1
     return res
 
+def get_bibxxx_ids(table_name, tags_values):
+    """Return dictionary (tag, value) -> id of the rows of bibxxx table
+    TABLE_NAME holding the (tag, value) pairs of TAGS_VALUES, if any,
+    using one query per CFG_BIBUPLOAD_BIBXXX_BATCH_SIZE pairs."""
+    ids = {}
+    tags_values = list(tags_values)
+    for i in xrange(0, len(tags_values), CFG_BIBUPLOAD_BIBXXX_BATCH_SIZE):
+        batch = set(tags_values[i:i + CFG_BIBUPLOAD_BIBXXX_BATCH_SIZE])
+        tags = list(set([tag for tag, dummy_value in batch]))
+        values = list(set([value for dummy_tag, value in batch]))
+        query = """SELECT id, tag, value FROM %s WHERE tag IN (%s) AND value IN (%s)""" % \
+                (table_name, ','.join(['%s'] * len(tags)), ','.join(['%s'] * len(values)))
+        # Note: as in insert_record_bibxxx(), matched values are
+        # compared in Python, in order to respect string binary
+        # equality regardless of the collation of the table.
+        for row_id, tag, value in run_sql(query, tags + values):
+            if (tag, value) in batch and (tag, value) not in ids:
+                ids[(tag, value)] = row_id
+    return ids
+
+def insert_records_bibxxx(tags_values, pretend=False):
+    """Insert the (tag, value) pairs of TAGS_VALUES into the bibxxx
+    tables, unless already there.  Existing rows are looked up with
+    one query per table, and the missing ones are inserted at once.
+
+    Return dictionary (tag, value) -> (table_name, id_bibxxx)."""
+    tables = {}
+    for tag, value in tags_values:
+        tables.setdefault('bib' + tag[0:2] + 'x', set()).add((tag, value))
+    ids = {}
+    for table_name, table_tags_values in tables.iteritems():
+        table_ids = get_bibxxx_ids(table_name, table_tags_values)
+        missing = [tag_value for tag_value in table_tags_values
+                   if tag_value not in table_ids]
+        if missing:
+            if pretend:
+                for tag_value in missing:
+                    table_ids[tag_value] = 1
+            else:
+                run_sql_many("""INSERT INTO %s (tag, value) VALUES (%%s, %%s)""" % table_name,
+                             missing)
+                table_ids.update(get_bibxxx_ids(table_name, missing))
+                for tag, value in missing:
+                    if (tag, value) not in table_ids:
+                        # the value was altered by the database
+                        # (e.g. charset), so that it cannot be matched
+                        # back: insert it again, on its own
+                        table_ids[(tag, value)] = insert_record_bibxxx(tag, value)[1]
+        for tag_value, row_id in table_ids.iteritems():
+            ids[tag_value] = (table_name, row_id)
+    return ids
+
+def insert_records_bibrec_bibxxx(rows, pretend=False):
+    """Insert the (table_name, id_bibxxx, field_number, id_bibrec) ROWS
+    into the bibrec_bibxxx tables, with one query per table."""
+    tables = {}
+    for table_name, id_bibxxx, field_number, id_bibrec in rows:
+        tables.setdefault(table_name, []).append((id_bibrec, id_bibxxx, field_number))
+    if pretend:
+        return
+    for table_name, params in tables.iteritems():
+        run_sql_many("""INSERT INTO bibrec_%s (id_bibrec, id_bibxxx, field_number)
+                        VALUES (%%s, %%s, %%s)""" % table_name, params)
+
 def synchronize_8564(rec_id, record, record_had_FFT, bibrecdocs, pretend=False):
     """
     Synchronize 8564_ tags and BibDocFile tables.
@@ -2391,6 +2502,8 @@ def update_database_with_metadata(record, rec_id, oai_rec_id="oai", affected_tag
     else:
         tmp_record = record
 
+    # (full_tag, value, field_number) of all the fields to index
+    fields = []
     for tag in tmp_record.keys():
         # check if tag is not a special one:
         if tag not in CFG_BIBUPLOAD_SPECIAL_TAGS:
@@ -2425,15 +2538,7 @@ def update_database_with_metadata(record, rec_id, oai_rec_id="oai", affected_tag
 
                     # update the tables
                     write_message("   insertion of the tag "+full_tag+" with the value "+value, verbose=9)
-                    # insert the tag and value into into bibxxx
-                    (table_name, bibxxx_row_id) = insert_record_bibxxx(full_tag, value, pretend=pretend)
-                    #print 'tname, bibrow', table_name, bibxxx_row_id;
-                    if table_name is None or bibxxx_row_id is None:
-                        write_message("   Failed: during insert_record_bibxxx", verbose=1, stream=sys.stderr)
-                    # connect bibxxx and bibrec with the table bibrec_bibxxx
-                    res = insert_record_bibrec_bibxxx(table_name, bibxxx_row_id, datafield_number, rec_id, pretend=pretend)
-                    if res is None:
-                        write_message("   Failed: during insert_record_bibrec_bibxxx", verbose=1, stream=sys.stderr)
+                    fields.append((full_tag, value, datafield_number))
                 else:
                     # get the tag and value from the content of each subfield
                     for subfield in subfield_list:
@@ -2444,19 +2549,26 @@ def update_database_with_metadata(record, rec_id, oai_rec_id="oai", affected_tag
                         full_tag = ''.join(tag_list)
                         # update the tables
                         write_message("   insertion of the tag "+full_tag+" with the value "+value, verbose=9)
-                        # insert the tag and value into into bibxxx
-                        (table_name, bibxxx_row_id) = insert_record_bibxxx(full_tag, value, pretend=pretend)
-                        if table_name is None or bibxxx_row_id is None:
-                            write_message("   Failed: during insert_record_bibxxx", verbose=1, stream=sys.stderr)
-                        # connect bibxxx and bibrec with the table bibrec_bibxxx
-                        res = insert_record_bibrec_bibxxx(table_name, bibxxx_row_id, datafield_number, rec_id, pretend=pretend)
-                        if res is None:
-                            write_message("   Failed: during insert_record_bibrec_bibxxx", verbose=1, stream=sys.stderr)
+                        fields.append((full_tag, value, datafield_number))
                         # remove the subtag from the list
                         tag_list.pop()
                 tag_list.pop()
                 tag_list.pop()
             tag_list.pop()
+
+    # insert the tags and values into bibxxx, then connect bibxxx and
+    # bibrec with the tables bibrec_bibxxx, all at once
+    bibxxx_ids = insert_records_bibxxx([(full_tag, value) for full_tag, value, dummy_field_number in fields],
+                                       pretend=pretend)
+    rows = []
+    for full_tag, value, datafield_number in fields:
+        if (full_tag, value) in bibxxx_ids:
+            table_name, bibxxx_row_id = bibxxx_ids[(full_tag, value)]
+            rows.append((table_name, bibxxx_row_id, datafield_number, rec_id))
+        else:
+            write_message("   Failed: during insert_records_bibxxx of the tag %s" % full_tag,
+                          verbose=1, stream=sys.stderr)
+    insert_records_bibrec_bibxxx(rows, pretend=pretend)
     write_message("   -Update the database with metadata: DONE", verbose=2)
 
     log_record_uploading(oai_rec_id, task_get_task_param('task_id', 0), rec_id, 'P', pretend=pretend)
@@ -2864,6 +2976,9 @@ def bibupload_records(records, opt_mode=None, opt_notimechange=0,
                       pretend=False, callback_url=None, results_for_callback=None):
     """perform the task of uploading a set of records
     returns list of (error_code, recid) tuples for separate records
+
+    RECORDS can be any iterable, e.g. the iterator returned by
+    iter_marc_file_records(): it is only traversed once.
     """
     #Dictionaries maintaining temporary identifiers
     # Structure: identifier -> number
@@ -2878,8 +2993,15 @@ def bibupload_records(records, opt_mode=None, opt_notimechange=0,
         ## NOTE: reference mode has been deprecated in favour of 'correct'
         opt_mode = 'correct'
 
+    # records to consider again in the second phase
+    post_phase_records = []
+
     record = None
     for record in records:
+        if opt_mode != "holdingpen" and record and \
+               (extract_tag_from_record(record, "BDR") is not None or \
+                extract_tag_from_record(record, "BDM") is not None):
+            post_phase_records.append(record)
         record_id = record_extract_oai_id(record)
         task_sleep_now_if_required(can_stop_too=True)
         if opt_mode == "holdingpen":
@@ -2934,7 +3056,7 @@ def bibupload_records(records, opt_mode=None, opt_notimechange=0,
     write_message("Identifiers table after processing: %s  versions: %s" % (str(tmp_ids), str(tmp_vers)), verbose=2)
     write_message("Uploading BDR and BDM fields")
     if opt_mode != "holdingpen":
-        for record in records:
+        for record in post_phase_records:
             record_id = retrieve_rec_id(record, opt_mode, pretend=pretend, post_phase = True)
             bibupload_post_phase(record,
                                  rec_id = record_id,
@@ -2955,8 +3077,8 @@ def task_run_core():
     if task_get_option('file_path') is not None:
         write_message("start preocessing", verbose=3)
         task_update_progress("Reading XML input")
-        recs = xml_marc_to_records(open_marc_file(task_get_option('file_path')))
-        stat['nb_records_to_upload'] = len(recs)
+        # records are read and parsed lazily, while being uploaded
+        recs = iter_marc_file_records(task_get_option('file_path'))
         write_message("   -Open XML marc: DONE", verbose=2)
         task_sleep_now_if_required(can_stop_too=True)
         write_message("Entering records loop", verbose=3)
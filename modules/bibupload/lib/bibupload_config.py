@@ -34,3 +34,7 @@ CFG_BIBUPLOAD_DELETE_VALUE = "__DELETE_FIELDS__"
 
 CFG_BIBUPLOAD_OPT_MODES = ['insert', 'replace', 'replace_or_insert', 'reference',
         'correct', 'append', 'holdingpen', 'delete']
+
+# maximum number of (tag, value) pairs looked up in the bibxxx tables
+# with one query:
+CFG_BIBUPLOAD_BIBXXX_BATCH_SIZE = 500
@@ -22,9 +22,15 @@ Tool for caching important infos, which are slow to rebuild, but that
 rarely change.
 """
 
-from invenio.dbquery import run_sql, get_table_update_time
+import threading
 import time
 
+from invenio.config import \
+     CFG_MISCUTIL_DATACACHER_BACKGROUND_REFRESH, \
+     CFG_MISCUTIL_DATACACHER_CHECK_INTERVAL
+from invenio.dbquery import run_sql, get_table_update_time, \
+     close_thread_connections
+
 class InvenioDataCacherError(Exception):
     """Error raised by data cacher."""
     pass
@@ -102,5 +108,135 @@ class SQLDataCacher(DataCacher):
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
+## Generations of the cached data.  Writers call
+## bump_cache_generation() after modifying the data of a generation
+## (e.g. 'collection' after WebColl updated the reclists), so that
+## every GenerationalDataCacher depending on it notices the change by
+## reading the small cacheGENERATION table, once for all the cachers
+## of the process.
+
+_CACHE_GENERATIONS = {'checked': 0, 'generations': {}}
+
+def get_cache_generations(check_interval=CFG_MISCUTIL_DATACACHER_CHECK_INTERVAL, force=False):
+    """Return dictionary of generation name->number, read from the
+    database at most once every CHECK_INTERVAL seconds per process,
+    unless FORCE is set.  Generations never bumped are missing."""
+    now = time.time()
+    if force or now - _CACHE_GENERATIONS['checked'] >= check_interval:
+        try:
+            _CACHE_GENERATIONS['generations'] = dict(run_sql("SELECT name, generation FROM cacheGENERATION"))
+        except Exception:
+            # e.g. table not created yet; keep the last known generations
+            pass
+        _CACHE_GENERATIONS['checked'] = now
+    return _CACHE_GENERATIONS['generations']
+
+def bump_cache_generation(*names):
+    """Start a new generation of the cached data of every name in
+    NAMES, invalidating the caches depending on them in all the
+    processes."""
+    for name in names:
+        run_sql("""INSERT INTO cacheGENERATION (name, generation, last_updated)
+                   VALUES (%s, 1, NOW())
+                   ON DUPLICATE KEY UPDATE generation=generation+1, last_updated=NOW()""",
+                (name,))
+    # let this process see its own bump at once
+    _CACHE_GENERATIONS['checked'] = 0
+
+class GenerationalDataCacher(DataCacher):
+    """
+    GenerationalDataCacher is a DataCacher checking whether its data
+    are stale at most once every CHECK_INTERVAL seconds, by looking at
+    the GENERATIONS it depends on and, if given, at its timestamp
+    verifier.  Stale data are rebuilt in a background thread, when
+    BACKGROUND_REFRESH is set, while clients keep on being served the
+    previous .cache until the new one is ready.
+    """
+    def __init__(self, cache_filler, timestamp_verifier=None, generations=(),
+                 check_interval=CFG_MISCUTIL_DATACACHER_CHECK_INTERVAL,
+                 background_refresh=CFG_MISCUTIL_DATACACHER_BACKGROUND_REFRESH):
+        """ @param cache_filler: a function that fills the cache dictionary.
+            @param timestamp_verifier: an optional function that returns a
+                   timestamp for checking if something has changed after
+                   cache creation.
+            @param generations: names of the generations of cached data
+                   (see bump_cache_generation()) the cache depends on.
+            @param check_interval: how often, in seconds, to check
+                   whether the cache is stale.
+            @param background_refresh: whether to rebuild stale caches
+                   in a background thread.
+        """
+        self.generations = tuple(generations)
+        self.generation_values = {}
+        self.check_interval = check_interval
+        self.background_refresh = background_refresh
+        self.last_check = time.time()
+        self.refresh_lock = threading.Lock()
+        self.refresh_thread = None
+        self.has_timestamp_verifier = timestamp_verifier is not None
+        if timestamp_verifier is None:
+            timestamp_verifier = lambda: ''
+        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+
+    def get_generation_values(self, force=False):
+        """Return current values of the generations of the cache."""
+        if not self.generations:
+            return {}
+        generations = get_cache_generations(self.check_interval, force)
+        return dict([(name, generations.get(name, 0)) for name in self.generations])
+
+    def create_cache(self):
+        """
+        Create and populate cache by calling cache filler.  The
+        timestamp and generations are read before filling, so that
+        changes made meanwhile are caught by the next check.
+        """
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        generation_values = self.get_generation_values(force=True)
+        self.cache = self.cache_filler()
+        self.timestamp = timestamp
+        self.generation_values = generation_values
+        self.last_check = time.time()
 
+    def is_stale(self):
+        """Has the cached data changed since the cache creation?"""
+        if self.generations and self.get_generation_values() != self.generation_values:
+            return True
+        # same second changes may have been missed by the filler
+        return self.has_timestamp_verifier and self.timestamp_verifier() >= self.timestamp
 
+    def recreate_cache_if_needed(self):
+        """
+        Recreate cache if needed, checking for staleness at most once
+        every CHECK_INTERVAL seconds.
+        """
+        now = time.time()
+        if now - self.last_check < self.check_interval:
+            return
+        self.last_check = now
+        if not self.is_stale():
+            return
+        if not self.background_refresh:
+            self.create_cache()
+        elif self.refresh_lock.acquire(False):
+            # otherwise a refresh is already running
+            try:
+                self.refresh_thread = threading.Thread(target=self._refresh_cache)
+                self.refresh_thread.setDaemon(True)
+                self.refresh_thread.start()
+            except Exception:
+                self.refresh_lock.release()
+                raise
+
+    def _refresh_cache(self):
+        """Rebuild the cache, in the background refresh thread."""
+        try:
+            try:
+                self.create_cache()
+            except Exception:
+                # keep on serving the previous cache; retry at next check
+                from invenio.errorlib import register_exception
+                register_exception(alert_admin=True)
+        finally:
+            self.refresh_lock.release()
+            close_thread_connections()
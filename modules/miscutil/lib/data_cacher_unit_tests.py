@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the data cacher library."""
+
+__revision__ = "$Id$"
+
+from invenio.data_cacher import GenerationalDataCacher
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+
+
+class GenerationalDataCacherTest(InvenioTestCase):
+    """Test staleness checks and refreshes of GenerationalDataCacher."""
+
+    def setUp(self):
+        """Serve a counter of fills, stale since the year 3000."""
+        self.fills = []
+        self.update_time = '3000-01-01 00:00:00'
+
+    def cache_filler(self):
+        self.fills.append(1)
+        return {'fills': len(self.fills)}
+
+    def timestamp_verifier(self):
+        return self.update_time
+
+    def test_check_interval(self):
+        """data_cacher - stale caches are checked once per interval"""
+        cacher = GenerationalDataCacher(self.cache_filler, self.timestamp_verifier,
+                                        check_interval=3600, background_refresh=False)
+        cacher.recreate_cache_if_needed()
+        self.assertEqual(cacher.cache, {'fills': 1})
+        cacher.check_interval = 0
+        cacher.recreate_cache_if_needed()
+        self.assertEqual(cacher.cache, {'fills': 2})
+        self.update_time = '2000-01-01 00:00:00'
+        cacher.recreate_cache_if_needed()
+        self.assertEqual(cacher.cache, {'fills': 2})
+
+    def test_background_refresh(self):
+        """data_cacher - stale caches are rebuilt in the background"""
+        cacher = GenerationalDataCacher(self.cache_filler, self.timestamp_verifier,
+                                        check_interval=0, background_refresh=True)
+        cacher.recreate_cache_if_needed()
+        cacher.refresh_thread.join()
+        self.assertEqual(cacher.cache, {'fills': 2})
+        self.failIf(cacher.refresh_lock.locked())
+
+    def test_failed_background_refresh(self):
+        """data_cacher - failed refreshes keep the previous cache"""
+        cacher = GenerationalDataCacher(self.cache_filler, self.timestamp_verifier,
+                                        check_interval=0, background_refresh=True)
+        cacher.cache_filler = lambda: 1 / 0
+        cacher.recreate_cache_if_needed()
+        cacher.refresh_thread.join()
+        self.assertEqual(cacher.cache, {'fills': 1})
+        self.failIf(cacher.refresh_lock.locked())
+
+
+TEST_SUITE = make_test_suite(GenerationalDataCacherTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -31,7 +31,7 @@ from invenio.dbquery import CFG_DATABASE_HOST, \
                             CFG_DATABASE_PASS, \
                             CFG_DATABASE_NAME, \
                             CFG_DATABASE_PORT, \
-                            CFG_DATABASE_SLAVE, \
+                            CFG_DATABASE_SLAVES, \
                             get_connection_for_dump_on_slave, \
                             run_sql
 from invenio.bibtask import task_init, \
@@ -236,9 +236,9 @@ def _dbdump_elaborate_submit_param(key, value, dummyopts, dummyargs):
         if value:
             task_set_option('slave', value)
         else:
-            if not CFG_DATABASE_SLAVE:
+            if not CFG_DATABASE_SLAVES:
                 raise StandardError("ERROR: No slave defined.")
-            task_set_option('slave', CFG_DATABASE_SLAVE)
+            task_set_option('slave', CFG_DATABASE_SLAVES[0])
     elif key in ('--dump-on-slave-helper', ):
         task_set_option('dump_on_slave_helper_mode', True)
     elif key in ('--ignore-tables',):
@@ -297,7 +297,7 @@ def _dbdump_run_task_core():
             connection = get_connection_for_dump_on_slave()
             write_message("... checking if slave is well down...")
             check_slave_is_down(connection)
-            host = CFG_DATABASE_SLAVE
+            host = CFG_DATABASE_SLAVES[0]
 
         task_update_progress("Reading parameters")
         write_message("Reading parameters started")
@@ -358,7 +358,7 @@ def main():
   -n, --number=NUM      Keep up to NUM previous dump files. [default=5]
   --params=PARAMS       Specify your own mysqldump parameters. Optional.
   --compress            Compress dump directly into gzip.
-  -S, --slave=HOST      Perform the dump from a slave, if no host use CFG_DATABASE_SLAVE.
+  -S, --slave=HOST      Perform the dump from a slave, if no host use the first host of CFG_DATABASE_SLAVE.
   --ignore-tables=regex Ignore tables matching the given regular expression
 
 Examples:
@@ -41,12 +41,19 @@ import marshal
 import re
 import atexit
 import os
+import random
+import traceback
 
 from zlib import compress, decompress
 from thread import get_ident
 from invenio.config import CFG_ACCESS_CONTROL_LEVEL_SITE, \
     CFG_MISCUTIL_SQL_USE_SQLALCHEMY, \
-    CFG_MISCUTIL_SQL_RUN_SQL_MANY_LIMIT
+    CFG_MISCUTIL_SQL_RUN_SQL_MANY_LIMIT, \
+    CFG_MISCUTIL_SQL_SLOW_QUERY_THRESHOLD, \
+    CFG_MISCUTIL_SQL_ROUTE_READS_TO_SLAVE, \
+    CFG_MISCUTIL_SQL_SLAVE_MAX_LAG, \
+    CFG_MISCUTIL_SQL_SLAVE_CHECK_INTERVAL, \
+    CFG_MISCUTIL_SQL_SLAVE_CONNECT_TIMEOUT
 
 if CFG_MISCUTIL_SQL_USE_SQLALCHEMY:
     try:
@@ -106,16 +113,20 @@ def _get_password_from_database_password_file(user):
 if CFG_DATABASE_SLAVE_SU_USER and not CFG_DATABASE_SLAVE_SU_PASS and CFG_DATABASE_PASSWORD_FILE:
     CFG_DATABASE_SLAVE_SU_PASS = _get_password_from_database_password_file(CFG_DATABASE_SLAVE_SU_USER)
 
+## CFG_DATABASE_SLAVE may list several replicas, separated by commas:
+CFG_DATABASE_SLAVES = [host.strip() for host in CFG_DATABASE_SLAVE.split(',') if host.strip()]
+
 _DB_CONN = {}
 _DB_CONN[CFG_DATABASE_HOST] = {}
-_DB_CONN[CFG_DATABASE_SLAVE] = {}
+for _dbhost in CFG_DATABASE_SLAVES:
+    _DB_CONN[_dbhost] = {}
 
 def get_connection_for_dump_on_slave():
     """
     Return a valid connection, suitable to perform dump operation
     on a slave node of choice.
     """
-    connection = connect(host=CFG_DATABASE_SLAVE,
+    connection = connect(host=CFG_DATABASE_SLAVES[0],
                                          port=int(CFG_DATABASE_PORT),
                                          db=CFG_DATABASE_NAME,
                                          user=CFG_DATABASE_SLAVE_SU_USER,
@@ -142,8 +153,9 @@ class InvenioDbQueryWildcardLimitError(Exception):
         """Initialization."""
         self.res = res
 
-def _db_login(dbhost=CFG_DATABASE_HOST, relogin=0):
-    """Login to the database."""
+def _db_login(dbhost=CFG_DATABASE_HOST, relogin=0, connect_timeout=None):
+    """Login to the database.  CONNECT_TIMEOUT, in seconds, only
+    applies if a new connection has to be made."""
 
     ## Note: we are using "use_unicode=False", because we want to
     ## receive strings from MySQL as Python UTF-8 binary string
@@ -156,11 +168,15 @@ def _db_login(dbhost=CFG_DATABASE_HOST, relogin=0):
     ## older MySQLdb versions here, since we are recommending to
     ## upgrade to more recent versions anyway.
 
+    connect_options = {}
+    if connect_timeout:
+        connect_options['connect_timeout'] = connect_timeout
+
     if CFG_MISCUTIL_SQL_USE_SQLALCHEMY:
         return connect(host=dbhost, port=int(CFG_DATABASE_PORT),
                        db=CFG_DATABASE_NAME, user=CFG_DATABASE_USER,
                        passwd=CFG_DATABASE_PASS,
-                       use_unicode=False, charset='utf8')
+                       use_unicode=False, charset='utf8', **connect_options)
     else:
         thread_ident = (os.getpid(), get_ident())
     if relogin:
@@ -169,7 +185,8 @@ def _db_login(dbhost=CFG_DATABASE_HOST, relogin=0):
                                          db=CFG_DATABASE_NAME,
                                          user=CFG_DATABASE_USER,
                                          passwd=CFG_DATABASE_PASS,
-                                         use_unicode=False, charset='utf8')
+                                         use_unicode=False, charset='utf8',
+                                         **connect_options)
         connection.autocommit(True)
         return connection
     else:
@@ -181,7 +198,8 @@ def _db_login(dbhost=CFG_DATABASE_HOST, relogin=0):
                                              db=CFG_DATABASE_NAME,
                                              user=CFG_DATABASE_USER,
                                              passwd=CFG_DATABASE_PASS,
-                                             use_unicode=False, charset='utf8')
+                                             use_unicode=False, charset='utf8',
+                                             **connect_options)
             connection.autocommit(True)
             return connection
 
@@ -206,6 +224,381 @@ def close_connection(dbhost=CFG_DATABASE_HOST):
     except KeyError:
         pass
 
+def close_thread_connections():
+    """
+    Close all the connections of the current thread and forget its
+    routing state, e.g. before a worker thread exits.
+    """
+    for dbhost in _DB_CONN.keys():
+        close_connection(dbhost)
+    _DB_ROUTING.pop((os.getpid(), get_ident()), None)
+
+## Routing of queries to the replicas.  Every thread sticks to one
+## healthy replica, i.e. one that answers and does not lag more than
+## CFG_MISCUTIL_SQL_SLAVE_MAX_LAG seconds behind the master, and falls
+## back to the master when there is none.  Reads are sent to it when
+## asked with run_on_slave=True or, if CFG_MISCUTIL_SQL_ROUTE_READS_TO_SLAVE
+## is set, for every SELECT and SHOW query.  They stay on the master
+## while the thread is in a transaction, holds table locks, is pinned
+## with MasterPin, or has written during the last
+## CFG_MISCUTIL_SQL_SLAVE_MAX_LAG seconds, so that it reads its own
+## writes.
+
+_DB_ROUTING = {}
+_DB_SLAVE_HEALTH = {}
+
+_SQL_READ_STATEMENTS = ("SELECT", "SHOW", "DESC", "DESCRIBE", "EXPLAIN")
+## statements that neither read nor write data:
+_SQL_NEUTRAL_STATEMENTS = ("SET", "USE", "DO")
+_SQL_TRANSACTION_START = ("BEGIN", "START")
+_SQL_TRANSACTION_END = ("COMMIT", "ROLLBACK")
+## MySQL errors telling that the server cannot be reached or the
+## connection was lost, as opposed to errors of the query itself:
+_SQL_CONNECTION_ERRORS = (1040, # too many connections
+                          1042, # cannot get host name
+                          1043, # bad handshake
+                          1045, # access denied
+                          1053, # server shutdown in progress
+                          1129, # host blocked
+                          1130, # host not allowed to connect
+                          2002, # cannot connect through socket
+                          2003, # cannot connect to server
+                          2005, # unknown server host
+                          2006, # server has gone away
+                          2013, # lost connection during query
+                          2055) # lost connection at the reading stage
+_RE_SQL_LOCKING_READ = re.compile(r"FOR\s+UPDATE|LOCK\s+IN\s+SHARE\s+MODE|GET_LOCK|RELEASE_LOCK|LAST_INSERT_ID|FOUND_ROWS", re.I)
+
+def _get_routing_state():
+    """Return the routing state of the current thread."""
+    thread_ident = (os.getpid(), get_ident())
+    try:
+        return _DB_ROUTING[thread_ident]
+    except KeyError:
+        state = _DB_ROUTING[thread_ident] = {'pins': 0,
+                                             'transaction': False,
+                                             'locks': False,
+                                             'last_write': 0,
+                                             'slave': None}
+        return state
+
+def is_connection_error(exc):
+    """Return True if the database exception EXC tells that the server
+    cannot be reached or the connection was lost, rather than that the
+    query failed."""
+    if isinstance(exc, InterfaceError):
+        return True
+    return isinstance(exc, OperationalError) and bool(exc.args) and \
+           exc.args[0] in _SQL_CONNECTION_ERRORS
+
+def check_slave_health(dbhost, force=False):
+    """Return True if the replica DBHOST is healthy, i.e. answers and
+    lags at most CFG_MISCUTIL_SQL_SLAVE_MAX_LAG seconds behind the
+    master.  The answer is cached for CFG_MISCUTIL_SQL_SLAVE_CHECK_INTERVAL
+    seconds, unless FORCE is set.  Connecting to the replica times out
+    after CFG_MISCUTIL_SQL_SLAVE_CONNECT_TIMEOUT seconds."""
+    now = time.time()
+    checked_at, healthy = _DB_SLAVE_HEALTH.get(dbhost, (0, False))
+    if not force and now - checked_at < CFG_MISCUTIL_SQL_SLAVE_CHECK_INTERVAL:
+        return healthy
+    try:
+        cur = _db_login(dbhost, connect_timeout=CFG_MISCUTIL_SQL_SLAVE_CONNECT_TIMEOUT).cursor()
+        try:
+            cur.execute("SHOW SLAVE STATUS")
+            status = cur.fetchone()
+            if status is None:
+                ## not replicating, e.g. a copy of the master
+                healthy = True
+            else:
+                columns = [column[0] for column in cur.description]
+                lag = dict(zip(columns, status)).get('Seconds_Behind_Master')
+                healthy = lag is not None and lag <= CFG_MISCUTIL_SQL_SLAVE_MAX_LAG
+        except OperationalError, exc:
+            if exc.args[0] != 1227:
+                raise
+            ## no REPLICATION CLIENT privilege: trust the replica, the
+            ## server answered after all
+            healthy = True
+    except (OperationalError, InterfaceError):
+        _db_logout(dbhost)
+        healthy = False
+    _DB_SLAVE_HEALTH[dbhost] = (now, healthy)
+    return healthy
+
+def _mark_slave_unhealthy(dbhost):
+    """Stop sending queries to the replica DBHOST until its next check."""
+    _DB_SLAVE_HEALTH[dbhost] = (time.time(), False)
+    _db_logout(dbhost)
+
+def _get_slave(state):
+    """Return the healthy replica the thread of routing STATE uses, or
+    None if no replica is healthy."""
+    if state['slave'] is not None and check_slave_health(state['slave']):
+        return state['slave']
+    slaves = [dbhost for dbhost in CFG_DATABASE_SLAVES if check_slave_health(dbhost)]
+    if not slaves:
+        state['slave'] = None
+        return None
+    state['slave'] = random.choice(slaves)
+    return state['slave']
+
+def get_dbhost(sql, run_on_slave=False):
+    """Return the database host the query SQL has to be run on, and
+    keep track of transactions, locks and writes of the current thread."""
+    if not CFG_DATABASE_SLAVES:
+        return CFG_DATABASE_HOST
+    state = _get_routing_state()
+    statement = sql.lstrip()[:20].split(None, 1)
+    statement = statement and statement[0].upper() or ''
+    if statement in _SQL_READ_STATEMENTS:
+        if (run_on_slave or CFG_MISCUTIL_SQL_ROUTE_READS_TO_SLAVE) and \
+               not state['pins'] and not state['transaction'] and not state['locks'] and \
+               time.time() - state['last_write'] > CFG_MISCUTIL_SQL_SLAVE_MAX_LAG and \
+               (statement != "SELECT" or not _RE_SQL_LOCKING_READ.search(sql)):
+            return _get_slave(state) or CFG_DATABASE_HOST
+        return CFG_DATABASE_HOST
+    if statement in _SQL_NEUTRAL_STATEMENTS:
+        pass
+    elif statement in _SQL_TRANSACTION_START:
+        state['transaction'] = True
+    elif statement in _SQL_TRANSACTION_END:
+        state['transaction'] = False
+    elif statement == "LOCK":
+        state['locks'] = True
+    elif statement == "UNLOCK":
+        state['locks'] = False
+    else:
+        state['last_write'] = time.time()
+    return CFG_DATABASE_HOST
+
+def pin_to_master():
+    """Send all the queries of the current thread to the master, until
+    unpin_from_master() is called.  Pins nest."""
+    _get_routing_state()['pins'] += 1
+
+def unpin_from_master():
+    """Release a pin taken by pin_to_master()."""
+    state = _get_routing_state()
+    state['pins'] = max(state['pins'] - 1, 0)
+
+class MasterPin(object):
+    """
+    Context manager sending all the queries of the current thread to
+    the master, e.g. for a request reading back what it has written:
+
+        with MasterPin():
+            run_sql("UPDATE ...")
+            run_sql("SELECT ...", run_on_slave=True) # runs on the master
+    """
+    def __enter__(self):
+        pin_to_master()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        unpin_from_master()
+        return False
+
+## Query profiling.  Profiles are collected per thread of a process, so
+## that every web request or bibtask gets its own, and are only looked
+## up when at least one is being collected, so that run_sql() does not
+## pay for them otherwise.
+
+_QUERY_PROFILES = {}
+
+## maximum number of distinct caller stacks kept per query fingerprint:
+CFG_MISCUTIL_SQL_PROFILE_MAX_CALLERS = 10
+
+## maximum number of slow queries kept per profile:
+CFG_MISCUTIL_SQL_PROFILE_MAX_SLOW_QUERIES = 100
+
+_RE_SQL_STRINGS = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+_RE_SQL_NUMBERS = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_RE_SQL_PLACEHOLDERS = re.compile(r"%s|%\(\w+\)s")
+_RE_SQL_VALUE_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_RE_SQL_VALUE_ROWS = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+_RE_SQL_SPACES = re.compile(r"\s+")
+
+_QUERY_FINGERPRINTS = {}
+
+def get_query_fingerprint(sql):
+    """Return the fingerprint of the query SQL, i.e. the query with its
+    literals and placeholders replaced by `?', and its lists of values
+    (e.g. of IN clauses or multi-row INSERTs) collapsed, so that all
+    the executions of a same query in a loop share one fingerprint."""
+    try:
+        return _QUERY_FINGERPRINTS[sql]
+    except KeyError:
+        pass
+    fingerprint = _RE_SQL_STRINGS.sub('?', sql)
+    fingerprint = _RE_SQL_PLACEHOLDERS.sub('?', fingerprint)
+    fingerprint = _RE_SQL_NUMBERS.sub('?', fingerprint)
+    fingerprint = _RE_SQL_VALUE_LISTS.sub('(...)', fingerprint)
+    fingerprint = _RE_SQL_VALUE_ROWS.sub('(...)', fingerprint)
+    fingerprint = _RE_SQL_SPACES.sub(' ', fingerprint).strip()
+    if len(_QUERY_FINGERPRINTS) > 10000:
+        _QUERY_FINGERPRINTS.clear()
+    _QUERY_FINGERPRINTS[sql] = fingerprint
+    return fingerprint
+
+def _get_query_caller():
+    """Return the stack of the caller of run_sql() and friends, as a
+    string of file:line:function frames, innermost last."""
+    frames = [frame for frame in traceback.extract_stack(limit=12)[:-1]
+              if not frame[0].endswith(('dbquery.py', 'dbquery.pyc'))]
+    return ' > '.join(['%s:%s:%s' % (os.path.basename(filename), lineno, function)
+                       for filename, lineno, function, dummy in frames[-5:]])
+
+class QueryProfile(object):
+    """
+    Statistics of the queries run by one web request or bibtask: for
+    every query fingerprint, the number of executions, their total and
+    maximum duration, the number of rows they returned and the stacks
+    they were called from; plus the queries slower than the slow query
+    threshold, verbatim.
+    """
+    def __init__(self, name, slow_query_threshold=CFG_MISCUTIL_SQL_SLOW_QUERY_THRESHOLD):
+        self.name = name
+        self.slow_query_threshold = slow_query_threshold
+        self.started = time.time()
+        self.stopped = None
+        self.queries = {}
+        self.slow_queries = []
+
+    def add(self, sql, param, duration, rows):
+        """Record an execution of the query SQL with PARAM, which took
+        DURATION seconds and returned ROWS rows."""
+        fingerprint = get_query_fingerprint(sql)
+        caller = _get_query_caller()
+        try:
+            stats = self.queries[fingerprint]
+        except KeyError:
+            stats = self.queries[fingerprint] = {'count': 0,
+                                                 'total_time': 0.0,
+                                                 'max_time': 0.0,
+                                                 'rows': 0,
+                                                 'callers': {}}
+        stats['count'] += 1
+        stats['total_time'] += duration
+        stats['max_time'] = max(stats['max_time'], duration)
+        stats['rows'] += rows
+        if caller in stats['callers'] or len(stats['callers']) < CFG_MISCUTIL_SQL_PROFILE_MAX_CALLERS:
+            stats['callers'][caller] = stats['callers'].get(caller, 0) + 1
+        if self.slow_query_threshold and duration >= self.slow_query_threshold and \
+               len(self.slow_queries) < CFG_MISCUTIL_SQL_PROFILE_MAX_SLOW_QUERIES:
+            self.slow_queries.append({'query': sql,
+                                      'param': repr(param)[:1000],
+                                      'time': duration,
+                                      'rows': rows,
+                                      'caller': caller})
+
+    def get_summary(self):
+        """Return the profile as a dictionary of plain types, queries
+        sorted by decreasing total time, ready to be dumped as JSON."""
+        queries = []
+        for fingerprint, stats in self.queries.iteritems():
+            callers = stats['callers'].items()
+            callers.sort(key=lambda caller: -caller[1])
+            queries.append({'fingerprint': fingerprint,
+                            'count': stats['count'],
+                            'total_time': stats['total_time'],
+                            'max_time': stats['max_time'],
+                            'rows': stats['rows'],
+                            'callers': callers})
+        queries.sort(key=lambda query: -query['total_time'])
+        return {'name': self.name,
+                'pid': os.getpid(),
+                'started': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+                'duration': (self.stopped or time.time()) - self.started,
+                'nb_queries': sum([query['count'] for query in queries]),
+                'total_time': sum([query['total_time'] for query in queries]),
+                'queries': queries,
+                'slow_queries': self.slow_queries}
+
+def start_query_profiling(name, slow_query_threshold=CFG_MISCUTIL_SQL_SLOW_QUERY_THRESHOLD):
+    """Start profiling the queries run by the current thread, e.g. for
+    the web request or bibtask called NAME.  Queries taking more than
+    SLOW_QUERY_THRESHOLD seconds are recorded verbatim.
+    @return: the new QueryProfile
+    """
+    profile = _QUERY_PROFILES[(os.getpid(), get_ident())] = QueryProfile(name, slow_query_threshold)
+    return profile
+
+def stop_query_profiling():
+    """Stop profiling the queries run by the current thread.
+    @return: the QueryProfile collected, or None if none was started
+    """
+    profile = _QUERY_PROFILES.pop((os.getpid(), get_ident()), None)
+    if profile is not None:
+        profile.stopped = time.time()
+    return profile
+
+def get_query_profile():
+    """Return the QueryProfile being collected for the current thread,
+    or None."""
+    return _QUERY_PROFILES.get((os.getpid(), get_ident()))
+
+def get_query_profile_log_path():
+    """Return path of the log file where query profiles are dumped."""
+    from invenio.config import CFG_LOGDIR
+    return os.path.join(CFG_LOGDIR, 'dbquery_profile.log')
+
+def get_slow_query_log_path():
+    """Return path of the log file where slow queries are dumped."""
+    from invenio.config import CFG_LOGDIR
+    return os.path.join(CFG_LOGDIR, 'dbquery_slow.log')
+
+def dump_query_profile(profile):
+    """Append the summary of PROFILE as one JSON line to the query
+    profile log file, and its slow queries, one JSON line each, to the
+    slow query log file, for webstat or the admin pages to render."""
+    from invenio.jsonutils import json
+    summary = profile.get_summary()
+    try:
+        log_file = open(get_query_profile_log_path(), 'a')
+        try:
+            log_file.write(json.dumps(summary) + '\n')
+        finally:
+            log_file.close()
+        if summary['slow_queries']:
+            log_file = open(get_slow_query_log_path(), 'a')
+            try:
+                for slow_query in summary['slow_queries']:
+                    slow_query = dict(slow_query, name=summary['name'], started=summary['started'])
+                    log_file.write(json.dumps(slow_query) + '\n')
+            finally:
+                log_file.close()
+    except (IOError, UnicodeDecodeError):
+        ## e.g. queries holding binary strings
+        pass
+
+def load_query_profiles(limit=100, path=None):
+    """Return the last LIMIT query profile summaries dumped into the
+    query profile log file (or PATH), most recent first."""
+    from invenio.jsonutils import json
+    try:
+        lines = open(path or get_query_profile_log_path()).readlines()
+    except IOError:
+        return []
+    profiles = []
+    for line in reversed(lines):
+        try:
+            profiles.append(json.loads(line))
+        except ValueError:
+            ## e.g. a line being written
+            continue
+        if len(profiles) >= limit:
+            break
+    return profiles
+
+def _get_nb_rows(res, with_desc=False):
+    """Return number of rows returned by a query, given the result RES
+    of run_sql()."""
+    if with_desc and type(res) is tuple and len(res) == 2:
+        res = res[0]
+    if type(res) in (tuple, list):
+        return len(res)
+    return 0
+
 def run_sql(sql, param=None, n=0, with_desc=False, with_dict=False, run_on_slave=False, connection=None):
     """Run SQL on the server with PARAM and return result.
     @param param: tuple of string params to insert in the query (see
@@ -233,8 +626,20 @@ def run_sql(sql, param=None, n=0, with_desc=False, with_dict=False, run_on_slave
     @note: In case of problems, exceptions are returned according to
     the Python DB API 2.0.  The client code can import them from
     this file and catch them.
+    @note: The query is recorded into the query profile of the current
+    thread, if any (see start_query_profiling()).
     """
-
+    if _QUERY_PROFILES:
+        profile = _QUERY_PROFILES.get((os.getpid(), get_ident()))
+        if profile is not None:
+            start = time.time()
+            res = _run_sql(sql, param, n, with_desc, with_dict, run_on_slave, connection)
+            profile.add(sql, param, time.time() - start, _get_nb_rows(res, with_desc))
+            return res
+    return _run_sql(sql, param, n, with_desc, with_dict, run_on_slave, connection)
+
+def _run_sql(sql, param=None, n=0, with_desc=False, with_dict=False, run_on_slave=False, connection=None):
+    """Run SQL on the server with PARAM and return result, see run_sql()."""
     if CFG_ACCESS_CONTROL_LEVEL_SITE == 3:
         # do not connect to the database as the site is closed for maintenance:
         return []
@@ -247,8 +652,8 @@ def run_sql(sql, param=None, n=0, with_desc=False, with_dict=False, run_on_slave
         param = tuple(param)
 
     dbhost = CFG_DATABASE_HOST
-    if run_on_slave and CFG_DATABASE_SLAVE:
-        dbhost = CFG_DATABASE_SLAVE
+    if connection is None:
+        dbhost = get_dbhost(sql, run_on_slave)
 
     ### log_sql_query(dbhost, sql, param) ### UNCOMMENT ONLY IF you REALLY want to log all queries
     try:
@@ -267,8 +672,16 @@ def run_sql(sql, param=None, n=0, with_desc=False, with_dict=False, run_on_slave
             gc.disable()
             rc = cur.execute(sql, param)
             gc.enable()
-        except (OperationalError, InterfaceError): # unexpected disconnect, bad malloc error, etc
-            raise
+        except (OperationalError, InterfaceError), exc: # unexpected disconnect, bad malloc error, etc
+            if dbhost == CFG_DATABASE_HOST or not is_connection_error(exc):
+                raise
+            ## the replica is gone: fall back to the master
+            _mark_slave_unhealthy(dbhost)
+            db = _db_login(CFG_DATABASE_HOST)
+            cur = db.cursor()
+            gc.disable()
+            rc = cur.execute(sql, param)
+            gc.enable()
 
     if string.upper(string.split(sql)[0]) in ("SELECT", "SHOW", "DESC", "DESCRIBE"):
         if n:
@@ -310,6 +723,17 @@ def run_sql_many(query, params, limit=CFG_MISCUTIL_SQL_RUN_SQL_MANY_LIMIT, run_o
 
     @return: SQL result as provided by database
     """
+    if _QUERY_PROFILES:
+        profile = _QUERY_PROFILES.get((os.getpid(), get_ident()))
+        if profile is not None:
+            start = time.time()
+            res = _run_sql_many(query, params, limit, run_on_slave)
+            profile.add(query, params[:1], time.time() - start, 0)
+            return res
+    return _run_sql_many(query, params, limit, run_on_slave)
+
+def _run_sql_many(query, params, limit=CFG_MISCUTIL_SQL_RUN_SQL_MANY_LIMIT, run_on_slave=False):
+    """Run SQL on the server with PARAMS, see run_sql_many()."""
     if CFG_ACCESS_CONTROL_LEVEL_SITE == 3:
         # do not connect to the database as the site is closed for maintenance:
         return []
@@ -318,9 +742,7 @@ def run_sql_many(query, params, limit=CFG_MISCUTIL_SQL_RUN_SQL_MANY_LIMIT, run_o
         if not query.upper().startswith("SELECT") and not query.upper().startswith("SHOW"):
             return
 
-    dbhost = CFG_DATABASE_HOST
-    if run_on_slave and CFG_DATABASE_SLAVE:
-        dbhost = CFG_DATABASE_SLAVE
+    dbhost = get_dbhost(query, run_on_slave)
     i = 0
     r = None
     while i < len(params):
@@ -500,8 +922,8 @@ def real_escape_string(unescaped_string, run_on_slave=False):
     @rtype: str
     """
     dbhost = CFG_DATABASE_HOST
-    if run_on_slave and CFG_DATABASE_SLAVE:
-        dbhost = CFG_DATABASE_SLAVE
+    if run_on_slave and CFG_DATABASE_SLAVES:
+        dbhost = _get_slave(_get_routing_state()) or CFG_DATABASE_HOST
     connection_object = _db_login(dbhost)
     escaped_string = connection_object.escape_string(unescaped_string)
     return escaped_string
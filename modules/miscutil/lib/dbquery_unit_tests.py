@@ -24,7 +24,8 @@ __revision__ = "$Id$"
 from invenio.testutils import InvenioTestCase
 
 from invenio import dbquery
-from invenio.testutils import make_test_suite, run_test_suite
+from invenio.testutils import make_test_suite, run_test_suite, \
+     patch_attributes, restore_attributes
 
 class TableUpdateTimesTest(InvenioTestCase):
     """Test functions related to the update_times of MySQL tables."""
@@ -101,8 +102,205 @@ class WashTableColumnNameTest(InvenioTestCase):
         self.assertEqual(dbquery.real_escape_string(testcase_ok), testcase_ok)
         self.assertNotEqual(dbquery.real_escape_string(testcase_injection), testcase_injection)
 
+class QueryProfilingTest(InvenioTestCase):
+    """Test the profiling of queries."""
 
-TEST_SUITE = make_test_suite(TableUpdateTimesTest, WashTableColumnNameTest)
+    def test_query_fingerprint(self):
+        """dbquery - query fingerprints"""
+        self.assertEqual(dbquery.get_query_fingerprint("SELECT id FROM bibrec WHERE id IN (%s,%s,%s)"),
+                         "SELECT id FROM bibrec WHERE id IN (...)")
+        self.assertEqual(dbquery.get_query_fingerprint("SELECT id FROM bibrec\n  WHERE id IN (%s)"),
+                         "SELECT id FROM bibrec WHERE id IN (...)")
+        self.assertEqual(dbquery.get_query_fingerprint("SELECT a FROM idxWORD01F WHERE b='it''s' LIMIT 10"),
+                         "SELECT a FROM idxWORD01F WHERE b=? LIMIT ?")
+        self.assertEqual(dbquery.get_query_fingerprint("INSERT INTO t VALUES (%s,%s), (%s,%s)"),
+                         "INSERT INTO t VALUES (...)")
+
+    def test_query_profile(self):
+        """dbquery - query profile"""
+        profile = dbquery.start_query_profiling('test', slow_query_threshold=0)
+        try:
+            for dummy in range(3):
+                dbquery.run_sql("SELECT 1")
+        finally:
+            self.assertEqual(dbquery.stop_query_profiling(), profile)
+        summary = profile.get_summary()
+        self.assertEqual(summary['nb_queries'], 3)
+        self.assertEqual(summary['queries'][0]['fingerprint'], "SELECT ?")
+        self.assertEqual(summary['queries'][0]['rows'], 3)
+        self.assertEqual(dbquery.get_query_profile(), None)
+
+class _StubCursor(object):
+    """Cursor of _StubConnection."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.rows = []
+        self.lastrowid = 0
+
+    def execute(self, sql, param=None):
+        servers = self.connection.servers
+        self.connection.queries.append(sql)
+        error = servers['errors'].get(self.connection.dbhost)
+        if error is not None:
+            raise error
+        if sql == "SHOW SLAVE STATUS":
+            self.description = (('Slave_IO_State',), ('Seconds_Behind_Master',))
+            self.rows = [('Waiting for master', servers['lag'])]
+        else:
+            self.description = (('host',),)
+            self.rows = [(self.connection.dbhost,)]
+        return len(self.rows)
+
+    def fetchone(self):
+        return self.rows and self.rows[0] or None
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchmany(self, n):
+        return self.rows[:n]
+
+class _StubConnection(object):
+    """Connection to the stubbed database server DBHOST."""
+
+    def __init__(self, dbhost, servers):
+        self.dbhost = dbhost
+        self.servers = servers
+        self.queries = servers['queries'].setdefault(dbhost, [])
+
+    def cursor(self):
+        return _StubCursor(self)
+
+class SlaveRoutingTest(InvenioTestCase):
+    """Test the routing of queries to the DB slaves."""
+
+    def setUp(self):
+        """Route all the reads to one stubbed slave."""
+        self.servers = {'lag': 0, 'errors': {}, 'queries': {}, 'logins': []}
+        def db_login(dbhost=dbquery.CFG_DATABASE_HOST, relogin=0, connect_timeout=None):
+            self.servers['logins'].append((dbhost, connect_timeout))
+            return _StubConnection(dbhost, self.servers)
+        self.saved = patch_attributes(dbquery,
+            _db_login=db_login,
+            CFG_DATABASE_SLAVES=['slave'],
+            CFG_MISCUTIL_SQL_ROUTE_READS_TO_SLAVE=1,
+            CFG_MISCUTIL_SQL_SLAVE_MAX_LAG=10,
+            CFG_MISCUTIL_SQL_SLAVE_CONNECT_TIMEOUT=2)
+        self.master = dbquery.CFG_DATABASE_HOST
+        dbquery._DB_SLAVE_HEALTH.clear()
+        dbquery._get_routing_state().update({'pins': 0,
+                                             'transaction': False,
+                                             'locks': False,
+                                             'last_write': 0,
+                                             'slave': None})
+
+    def tearDown(self):
+        """Restore the database configuration."""
+        restore_attributes(dbquery, self.saved)
+        dbquery._DB_SLAVE_HEALTH.clear()
+        dbquery._get_routing_state().update({'last_write': 0, 'slave': None})
+
+    def test_reads(self):
+        """dbquery - reads are routed to the slave"""
+        for sql in ("SELECT id FROM bibrec", "  select 1", "SHOW TABLES",
+                    "DESC bibrec", "DESCRIBE bibrec", "EXPLAIN SELECT 1"):
+            self.assertEqual(dbquery.get_dbhost(sql), 'slave', sql)
+
+    def test_locking_reads(self):
+        """dbquery - locking reads stay on the master"""
+        for sql in ("SELECT id FROM bibrec WHERE id=1 FOR UPDATE",
+                    "SELECT id FROM bibrec LOCK IN SHARE MODE",
+                    "SELECT GET_LOCK('bibsched', 5)",
+                    "SELECT LAST_INSERT_ID()"):
+            self.assertEqual(dbquery.get_dbhost(sql), self.master, sql)
+        self.assertEqual(dbquery.get_dbhost("SELECT 1"), 'slave')
+
+    def test_neutral_statements(self):
+        """dbquery - session statements are no writes"""
+        self.assertEqual(dbquery.get_dbhost("SET SESSION group_concat_max_len=100000"), self.master)
+        self.assertEqual(dbquery.get_dbhost("SELECT 1"), 'slave')
+
+    def test_last_write_window(self):
+        """dbquery - reads after a write stay on the master for a while"""
+        self.assertEqual(dbquery.get_dbhost("UPDATE bibrec SET id=1 WHERE id=1"), self.master)
+        self.assertEqual(dbquery.get_dbhost("SELECT 1"), self.master)
+        dbquery._get_routing_state()['last_write'] -= 11
+        self.assertEqual(dbquery.get_dbhost("SELECT 1"), 'slave')
+
+    def test_transactions(self):
+        """dbquery - reads in transactions stay on the master"""
+        self.assertEqual(dbquery.get_dbhost("BEGIN"), self.master)
+        self.assertEqual(dbquery.get_dbhost("SELECT 1"), self.master)
+        self.assertEqual(dbquery.get_dbhost("COMMIT"), self.master)
+        self.assertEqual(dbquery.get_dbhost("SELECT 1"), 'slave')
+        self.assertEqual(dbquery.get_dbhost("START TRANSACTION"), self.master)
+        self.assertEqual(dbquery.get_dbhost("SELECT 1"), self.master)
+        self.assertEqual(dbquery.get_dbhost("ROLLBACK"), self.master)
+        self.assertEqual(dbquery.get_dbhost("SELECT 1"), 'slave')
+
+    def test_table_locks(self):
+        """dbquery - reads under table locks stay on the master"""
+        self.assertEqual(dbquery.get_dbhost("LOCK TABLES bibrec READ"), self.master)
+        self.assertEqual(dbquery.get_dbhost("SELECT 1"), self.master)
+        self.assertEqual(dbquery.get_dbhost("UNLOCK TABLES"), self.master)
+        self.assertEqual(dbquery.get_dbhost("SELECT 1"), 'slave')
+
+    def test_pins(self):
+        """dbquery - reads of pinned threads stay on the master"""
+        pin = dbquery.MasterPin()
+        pin.__enter__()
+        try:
+            dbquery.pin_to_master()
+            dbquery.unpin_from_master()
+            self.assertEqual(dbquery.get_dbhost("SELECT 1"), self.master)
+        finally:
+            pin.__exit__(None, None, None)
+        self.assertEqual(dbquery.get_dbhost("SELECT 1"), 'slave')
+
+    def test_lagging_slave(self):
+        """dbquery - lagging slaves are not used"""
+        self.servers['lag'] = 11
+        self.assertEqual(dbquery.get_dbhost("SELECT 1"), self.master)
+        self.servers['lag'] = None
+        self.assertFalse(dbquery.check_slave_health('slave', force=True))
+        self.servers['lag'] = 10
+        self.assertTrue(dbquery.check_slave_health('slave', force=True))
+
+    def test_slave_health_check(self):
+        """dbquery - slave health checks"""
+        self.assertTrue(dbquery.check_slave_health('slave'))
+        self.assertEqual(self.servers['logins'], [('slave', 2)])
+        ## answers are cached
+        self.servers['errors']['slave'] = dbquery.OperationalError(2003, "Can't connect")
+        self.assertTrue(dbquery.check_slave_health('slave'))
+        self.assertFalse(dbquery.check_slave_health('slave', force=True))
+        ## without the REPLICATION CLIENT privilege
+        self.servers['errors']['slave'] = dbquery.OperationalError(1227, "Access denied")
+        self.assertTrue(dbquery.check_slave_health('slave', force=True))
+
+    def test_connection_errors(self):
+        """dbquery - connection errors and query errors"""
+        self.assertTrue(dbquery.is_connection_error(dbquery.OperationalError(2006, "MySQL server has gone away")))
+        self.assertTrue(dbquery.is_connection_error(dbquery.InterfaceError(0, "")))
+        self.assertFalse(dbquery.is_connection_error(dbquery.OperationalError(1054, "Unknown column")))
+        self.assertFalse(dbquery.is_connection_error(dbquery.ProgrammingError(1064, "Syntax error")))
+
+    def test_run_sql_on_slave(self):
+        """dbquery - run_sql() on the slave, falling back to the master"""
+        self.assertEqual(dbquery.run_sql("SELECT 1"), [('slave',)])
+        self.servers['errors']['slave'] = dbquery.OperationalError(1054, "Unknown column")
+        self.assertRaises(dbquery.OperationalError, dbquery.run_sql, "SELECT x")
+        self.assertTrue(dbquery.check_slave_health('slave'))
+        self.servers['errors']['slave'] = dbquery.OperationalError(2013, "Lost connection")
+        self.assertEqual(dbquery.run_sql("SELECT 1"), [(self.master,)])
+        self.assertFalse(dbquery.check_slave_health('slave'))
+        self.assertEqual(dbquery.get_dbhost("SELECT 1"), self.master)
+
+
+TEST_SUITE = make_test_suite(TableUpdateTimesTest, WashTableColumnNameTest, QueryProfilingTest,
+                             SlaveRoutingTest)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
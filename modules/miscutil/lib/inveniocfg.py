@@ -244,6 +244,7 @@ You may want to customise your invenio-local.conf configuration accordingly."""
                        'CFG_OAUTH1_PROVIDERS',
                        'CFG_OAUTH2_PROVIDERS',
                        'CFG_BIBFORMAT_CACHED_FORMATS',
+                       'CFG_BIBFORMAT_OUTPUT_CACHE_FORMATS',
                        'CFG_BIBEDIT_ADD_TICKET_RT_QUEUES',
                        'CFG_BIBAUTHORID_ENABLED_REMOTE_LOGIN_SYSTEMS',]:
         out = "["
@@ -274,7 +275,8 @@ You may want to customise your invenio-local.conf configuration accordingly."""
                        'CFG_BIBMATCH_LOCAL_SLEEPTIME',
                        'CFG_BIBMATCH_REMOTE_SLEEPTIME',
                        'CFG_PLOTEXTRACTOR_DOWNLOAD_TIMEOUT',
-                       'CFG_BIBMATCH_FUZZY_MATCH_VALIDATION_LIMIT']:
+                       'CFG_BIBMATCH_FUZZY_MATCH_VALIDATION_LIMIT',
+                       'CFG_MISCUTIL_SQL_SLOW_QUERY_THRESHOLD']:
         option_value = float(option_value[1:-1])
 
     ## 3h) special cases: bibmatch validation list
@@ -1061,7 +1063,8 @@ def cli_cmd_create_apache_conf(conf):
         # </Directory>""" % {'wsgidir': os.path.join(conf.get('Invenio', 'CFG_PREFIX'), 'var', 'www-wsgi')}
 
     ## Preparation of XSendFile directive
-    xsendfile_directive_needed = int(conf.get("Invenio", 'CFG_BIBDOCFILE_USE_XSENDFILE')) != 0
+    xsendfile_directive_needed = int(conf.get("Invenio", 'CFG_BIBDOCFILE_USE_XSENDFILE')) != 0 and \
+        conf.get("Invenio", 'CFG_BIBDOCFILE_XSENDFILE_HEADER').lower() == 'x-sendfile'
     if xsendfile_directive_needed:
         xsendfile_directive = "XSendFile On\n"
     else:
@@ -38,3 +38,76 @@ class Memoise:
         if args not in self.memo:
             self.memo[args] = self.function(*args)
         return self.memo[args]
+
+
+class LRUCache(object):
+    """
+    Least-recently-used cache bounded by the total weight of its
+    values.  By default every value weighs 1, so that MAX_WEIGHT is
+    simply the maximum number of entries; pass WEIGH to bound the
+    cache e.g. by the number of bytes its values occupy.
+
+    When the limit is exceeded, least recently used entries are
+    evicted until the cache is back to three quarters of its maximal
+    weight, so that the cost of eviction is amortised over many
+    insertions.
+    """
+
+    def __init__(self, max_weight, weigh=None):
+        """Initialise."""
+        self.max_weight = max_weight
+        self.weigh = weigh or (lambda value: 1)
+        self.weight = 0
+        self.clock = 0
+        self.entries = {} # key -> [last access tick, value, weight]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        """Return value stored for KEY, marking it as recently used."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+        self.clock += 1
+        entry[0] = self.clock
+        return entry[1]
+
+    def set(self, key, value):
+        """Store VALUE for KEY.  Values heavier than the whole cache
+        are not stored."""
+        self.pop(key)
+        weight = self.weigh(value)
+        if weight > self.max_weight:
+            return
+        self.clock += 1
+        self.entries[key] = [self.clock, value, weight]
+        self.weight += weight
+        if self.weight > self.max_weight:
+            self._evict(self.max_weight * 3 / 4)
+
+    def pop(self, key, default=None):
+        """Remove KEY from the cache and return its value."""
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return default
+        self.weight -= entry[2]
+        return entry[1]
+
+    def clear(self):
+        """Remove all entries."""
+        self.entries = {}
+        self.weight = 0
+
+    def _evict(self, target_weight):
+        """Evict least recently used entries until the cache weighs
+        no more than TARGET_WEIGHT."""
+        by_age = sorted(self.entries.iteritems(), key=lambda item: item[1][0])
+        for key, entry in by_age:
+            if self.weight <= target_weight:
+                break
+            del self.entries[key]
+            self.weight -= entry[2]
@@ -24,7 +24,7 @@ Unit tests for the memoise facility.
 from invenio.testutils import InvenioTestCase
 from invenio.testutils import make_test_suite, run_test_suite
 
-from invenio.memoiseutils import Memoise
+from invenio.memoiseutils import Memoise, LRUCache
 
 
 class MemoiseTest(InvenioTestCase):
@@ -36,7 +36,45 @@ class MemoiseTest(InvenioTestCase):
         fib_memoised = Memoise(fib)
         self.assertEqual(fib(17), fib_memoised(17))
 
-TEST_SUITE = make_test_suite(MemoiseTest, )
+
+class LRUCacheTest(InvenioTestCase):
+    """Unit test cases for LRUCache."""
+
+    def test_lru_cache_get_set(self):
+        """memoiseutils - LRU cache stores and returns values"""
+        cache = LRUCache(10)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b', 'default'), 'default')
+        self.assertTrue('a' in cache)
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_cache_evicts_least_recently_used(self):
+        """memoiseutils - LRU cache evicts least recently used entries"""
+        cache = LRUCache(4)
+        for key in 'abcd':
+            cache.set(key, key)
+        cache.get('a')
+        cache.set('e', 'e')
+        self.assertTrue('a' in cache)
+        self.assertTrue('e' in cache)
+        self.assertFalse('b' in cache)
+        self.assertTrue(cache.weight <= 4)
+
+    def test_lru_cache_weigh(self):
+        """memoiseutils - LRU cache bounded by weight of values"""
+        cache = LRUCache(10, weigh=len)
+        cache.set('small', 'x' * 4)
+        cache.set('huge', 'x' * 11)
+        self.assertFalse('huge' in cache)
+        cache.set('medium', 'x' * 6)
+        self.assertEqual(cache.weight, 10)
+        cache.set('other', 'x' * 3)
+        self.assertFalse('small' in cache)
+        self.assertTrue(cache.weight <= 10)
+
+TEST_SUITE = make_test_suite(MemoiseTest, LRUCacheTest)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
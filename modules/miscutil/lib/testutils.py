@@ -525,6 +525,32 @@ except AttributeError:
     InvenioTestCase.assertMultiLineEqual = InvenioTestCase.assertEqual
 
 
+def patch_attributes(target, **attributes):
+    """
+    Replace attributes of TARGET, typically functions or configuration
+    variables of a module that a unit test fakes, by the keyword
+    arguments ATTRIBUTES.  Return the replaced values, to be given to
+    restore_attributes() when the test is over, e.g.:
+
+        def setUp(self):
+            self.saved = patch_attributes(dbquery, run_sql=fake_run_sql)
+
+        def tearDown(self):
+            restore_attributes(dbquery, self.saved)
+    """
+    saved = {}
+    for name, value in attributes.iteritems():
+        saved[name] = getattr(target, name)
+        setattr(target, name, value)
+    return saved
+
+
+def restore_attributes(target, saved):
+    """Restore the attributes of TARGET replaced by patch_attributes()."""
+    for name, value in saved.iteritems():
+        setattr(target, name, value)
+
+
 class InvenioWebTestCase(unittest.TestCase):
     """ Helper library of useful web test functions
     for web tests creation.
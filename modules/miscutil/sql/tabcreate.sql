@@ -3218,6 +3218,7 @@ CREATE TABLE IF NOT EXISTS rnkWORD01F (
   id mediumint(9) unsigned NOT NULL auto_increment,
   term varchar(50) default NULL,
   hitlist longblob,
+  postings longblob,
   PRIMARY KEY  (id),
   UNIQUE KEY term (term)
 ) ENGINE=MyISAM;
@@ -3391,6 +3392,14 @@ CREATE TABLE IF NOT EXISTS oaiREPOSITORY (
   PRIMARY KEY (id)
 ) ENGINE=MyISAM;
 
+CREATE TABLE IF NOT EXISTS oaiREPOSITORYINDEX (
+  setSpec varchar(255) NOT NULL default '',
+  datestamp datetime NOT NULL default '0000-00-00',
+  id_bibrec mediumint(8) unsigned NOT NULL default '0',
+  PRIMARY KEY (setSpec,datestamp,id_bibrec),
+  KEY id_bibrec (id_bibrec)
+) ENGINE=MyISAM;
+
 CREATE TABLE IF NOT EXISTS oaiHARVEST (
   id mediumint(9) unsigned NOT NULL auto_increment,
   baseurl varchar(255) NOT NULL default '',
@@ -4328,6 +4337,22 @@ CREATE TABLE IF NOT EXISTS staEVENT (
   UNIQUE KEY number (number)
 ) ENGINE=MyISAM;
 
+CREATE TABLE IF NOT EXISTS staKEYEVENTROLLUP (
+  event varchar(50) NOT NULL,
+  collection varchar(255) NOT NULL default '',
+  granularity enum('hour','day','month') NOT NULL,
+  period datetime NOT NULL default '0000-00-00 00:00:00',
+  count int(15) unsigned NOT NULL default '0',
+  PRIMARY KEY (event,collection,granularity,period)
+) ENGINE=MyISAM;
+
+CREATE TABLE IF NOT EXISTS staKEYEVENTROLLUPSTATUS (
+  event varchar(50) NOT NULL,
+  collection varchar(255) NOT NULL default '',
+  rolled_up_until datetime NOT NULL default '0000-00-00 00:00:00',
+  PRIMARY KEY (event,collection)
+) ENGINE=MyISAM;
+
 -- BibClassify tables:
 
 CREATE TABLE IF NOT EXISTS clsMETHOD (
@@ -4829,6 +4854,14 @@ CREATE TABLE IF NOT EXISTS seqSTORE (
   UNIQUE KEY seq_name_value (seq_name, seq_value)
 ) ENGINE=MyISAM;
 
+-- tables for cache invalidation
+CREATE TABLE IF NOT EXISTS cacheGENERATION (
+  name varchar(100) NOT NULL,
+  generation int(15) unsigned NOT NULL default '0',
+  last_updated datetime NOT NULL default '0000-00-00',
+  PRIMARY KEY (name)
+) ENGINE=MyISAM;
+
 -- tables for linkbacks:
 
 CREATE TABLE IF NOT EXISTS lnkENTRY (
@@ -5085,4 +5118,8 @@ INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_01_22_queue_table_v
 INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2013_12_05_new_index_doi',NOW());
 INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_03_13_new_index_filename',NOW());
 INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_05_26_new_index_country',NOW());
+INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_06_02_oaiREPOSITORYINDEX',NOW());
+INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_06_16_new_cacheGENERATION_table',NOW());
+INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_06_18_rnkWORD_postings',NOW());
+INSERT INTO upgrade (upgrade, applied) VALUES ('invenio_2014_06_20_new_staKEYEVENTROLLUP_tables',NOW());
 -- end of file
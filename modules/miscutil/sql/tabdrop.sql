@@ -420,6 +420,7 @@ DROP TABLE IF EXISTS collection;
 DROP TABLE IF EXISTS collectionname;
 DROP TABLE IF EXISTS collectionboxname;
 DROP TABLE IF EXISTS oaiREPOSITORY;
+DROP TABLE IF EXISTS oaiREPOSITORYINDEX;
 DROP TABLE IF EXISTS oaiHARVEST;
 DROP TABLE IF EXISTS oaiHARVESTLOG;
 DROP TABLE IF EXISTS bibHOLDINGPEN;
@@ -508,6 +509,8 @@ DROP TABLE IF EXISTS collection_externalcollection;
 DROP TABLE IF EXISTS externalcollection;
 DROP TABLE IF EXISTS collectiondetailedrecordpagetabs;
 DROP TABLE IF EXISTS staEVENT;
+DROP TABLE IF EXISTS staKEYEVENTROLLUP;
+DROP TABLE IF EXISTS staKEYEVENTROLLUPSTATUS;
 DROP TABLE IF EXISTS clsMETHOD;
 DROP TABLE IF EXISTS collection_clsMETHOD;
 DROP TABLE IF EXISTS jrnJOURNAL;
@@ -556,6 +559,7 @@ DROP TABLE IF EXISTS lnkADMINURLLOG;
 DROP TABLE IF EXISTS webapikey;
 DROP TABLE IF EXISTS wapCACHE;
 DROP TABLE IF EXISTS seqSTORE;
+DROP TABLE IF EXISTS cacheGENERATION;
 DROP TABLE IF EXISTS upgrade;
 DROP TABLE IF EXISTS goto;
 DROP TABLE IF EXISTS rnkSELFCITEDICT;
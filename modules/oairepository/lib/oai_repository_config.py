@@ -26,3 +26,12 @@ CFG_OAI_REPOSITORY_MARCXML_SIZE = 1000
 ## Makefile.am and tabcreate.sql defaults for setSpec column in
 ## oaiREPOSITORY MySQL table.
 CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC = "GLOBAL_SET"
+
+## A magic value used to store, in the oaiREPOSITORYINDEX table, the
+## time at which the dissemination index was last rebuilt (records
+## modified since then are looked up in their metadata).
+CFG_OAI_REPOSITORY_INDEX_STAMP_SPEC = "INDEX_STAMP"
+
+## Number of records processed at once when (re)building the
+## dissemination index
+CFG_OAI_REPOSITORY_INDEX_BATCH_SIZE = 10000
@@ -36,7 +36,8 @@ from invenio.dbquery import run_sql
 from invenio.intbitset import intbitset
 from invenio import oai_repository_server, search_engine
 from invenio.testutils import make_test_suite, run_test_suite, \
-                              test_web_page_content, merge_error_messages
+                              test_web_page_content, merge_error_messages, \
+                              patch_attributes, restore_attributes
 
 class OAIRepositoryTouchSetTest(InvenioTestCase):
     """Check OAI-PMH consistency when touching a set."""
@@ -192,6 +193,55 @@ class TestSelectiveHarvesting(InvenioTestCase):
 
         self.assert_('badResumptionToken' in req.getvalue())
 
+class TestBatchFormatting(InvenioTestCase):
+    """Test formatting the records of a page together."""
+
+    def setUp(self):
+        """Export record 10 as deleted"""
+        self.deleted_recid = 10
+        record_exists = oai_repository_server.record_exists
+        records_exist = oai_repository_server.records_exist
+        def fake_record_exists(recid):
+            if recid == self.deleted_recid:
+                return -1
+            return record_exists(recid)
+        def fake_records_exist(recids):
+            existence = records_exist(recids)
+            if self.deleted_recid in existence:
+                existence[self.deleted_recid] = -1
+            return existence
+        self.saved = patch_attributes(oai_repository_server,
+                                      CFG_OAI_DELETED_POLICY='persistent',
+                                      record_exists=fake_record_exists,
+                                      records_exist=fake_records_exist)
+
+    def tearDown(self):
+        restore_attributes(oai_repository_server, self.saved)
+
+    def test_print_records(self):
+        """oairepository - records printed together as one by one"""
+        recids = [1, 8, 10, 12, 17, 73, 1000000]
+        for prefix in ('marcxml', 'oai_dc'):
+            for verb in ('ListRecords', 'ListIdentifiers'):
+                req = StringIO()
+                oai_repository_server.print_records(req, recids, prefix, verb)
+                expected = ''.join([oai_repository_server.print_record(recid, prefix, verb)
+                                    for recid in recids])
+                self.assertEqual(req.getvalue(), expected)
+                self.assertEqual(expected.count('status="deleted"'), 1)
+                self.failUnless(expected.count('<identifier>') > 1)
+
+    def test_print_records_of_set(self):
+        """oairepository - records of a set printed together as one by one"""
+        recids = [1, 8, 12, 17, 73]
+        req = StringIO()
+        oai_repository_server.print_records(req, recids, 'marcxml', 'ListRecords',
+                                            set_spec='cern:experiment')
+        self.assertEqual(req.getvalue(),
+                         ''.join([oai_repository_server.print_record(recid, 'marcxml', 'ListRecords',
+                                                                     set_spec='cern:experiment')
+                                  for recid in recids]))
+
 class TestPerformance(InvenioTestCase):
     """Test performance of the repository """
 
@@ -232,6 +282,7 @@ Limit: %s seconds""" % (t, self.number_of_records * allowed_seconds_per_record_m
 TEST_SUITE = make_test_suite(OAIRepositoryTouchSetTest,
                              OAIRepositoryWebPagesAvailabilityTest,
                              TestSelectiveHarvesting,
+                             TestBatchFormatting,
                              TestPerformance,
                              TestHiddenFields)
 
@@ -19,17 +19,18 @@
 
 __revision__ = "$Id$"
 
-import cPickle
-import os
+import base64
+import cgi
 import re
 import time
-import tempfile
 import sys
 import datetime
-if sys.hexversion < 0x2050000:
-    from glob import glob as iglob
-else:
-    from glob import iglob
+import urllib
+
+if sys.hexversion < 0x2040000:
+    # pylint: disable=W0622
+    from sets import Set as set
+    # pylint: enable=W0622
 
 from invenio.config import \
      CFG_OAI_DELETED_POLICY, \
@@ -40,7 +41,6 @@ from invenio.config import \
      CFG_OAI_SET_FIELD, \
      CFG_OAI_PREVIOUS_SET_FIELD, \
      CFG_OAI_METADATA_FORMATS, \
-     CFG_CACHEDIR, \
      CFG_SITE_NAME, \
      CFG_SITE_SUPPORT_EMAIL, \
      CFG_SITE_URL, \
@@ -61,10 +61,12 @@ from invenio.intbitset import intbitset
 from invenio.htmlutils import X, EscapedXMLString
 from invenio.dbquery import run_sql, wash_table_column_name
 from invenio.search_engine import record_exists, get_all_restricted_recids, get_all_field_values, search_unit_in_bibxxx, get_record, search_pattern
-from invenio.bibformat import format_record
+from invenio.search_engine_utils import records_exist
+from invenio.bibformat import format_record, prefetch_records
 from invenio.bibrecord import record_get_field_instances
-from invenio.errorlib import register_exception
-from invenio.oai_repository_config import CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC
+from invenio.oai_repository_config import CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC, \
+     CFG_OAI_REPOSITORY_INDEX_STAMP_SPEC, \
+     CFG_OAI_REPOSITORY_INDEX_BATCH_SIZE
 from invenio.dateutils import localtime_to_utc, utc_to_localtime
 
 CFG_VERBS = {
@@ -164,6 +166,35 @@ def get_field(recid, field):
 
     return [row[0] for row in run_sql(query, (recid, field))]
 
+def get_records_fields(recids, field):
+    """
+    Gets dictionary recid -> list of field 'field' for the records
+    'recids', with one query per CFG_OAI_REPOSITORY_INDEX_BATCH_SIZE
+    records. Records without such field are not in the dictionary.
+    """
+    digit = field[0:2]
+    bibbx = "bib%sx" % digit
+    bibx  = "bibrec_bib%sx" % digit
+    recids = list(recids)
+    out = {}
+    for i in range(0, len(recids), CFG_OAI_REPOSITORY_INDEX_BATCH_SIZE):
+        batch = recids[i:i + CFG_OAI_REPOSITORY_INDEX_BATCH_SIZE]
+        query = "SELECT bibx.id_bibrec, bx.value FROM %s AS bx, %s AS bibx WHERE bibx.id_bibrec IN (%s) AND bx.id=bibx.id_bibxxx AND bx.tag=%%s" % \
+                (wash_table_column_name(bibbx), wash_table_column_name(bibx), ','.join(['%s'] * len(batch)))
+        for recid, value in run_sql(query, batch + [field]):
+            out.setdefault(recid, []).append(value)
+    return out
+
+def get_modification_dates(recids):
+    """Returns dictionary recid -> date of last modification in UTC
+    for the records 'recids', with one query."""
+    recids = list(recids)
+    if not recids:
+        return {}
+    res = run_sql("SELECT id, DATE_FORMAT(modification_date,'%%Y-%%m-%%d %%H:%%i:%%s') FROM bibrec WHERE id IN (%s)" % \
+                  ','.join(['%s'] * len(recids)), recids)
+    return dict([(recid, localtime_to_utc(date)) for recid, date in res if date])
+
 def get_modification_date(recid):
     """Returns the date of last modification for the record 'recid'.
     Return empty string if no record or modification date in UTC.
@@ -369,6 +400,83 @@ def print_record(recid, prefix='marcxml', verb='ListRecords', set_spec=None, set
             rights = ''
         return X.record()(header, metadata, provenance, rights)
 
+def print_records(req, recids, prefix='marcxml', verb='ListRecords', set_spec=None, set_last_updated=None):
+    """Writes to 'req' the records 'recids' formatted according to
+    'prefix', like print_record() does for each of them, but fetching
+    the data of all of them at once: the OAI identifiers, sets and
+    datestamps with one query each, and the metadata through a
+    BibFormat batch (see bibformat.prefetch_records), i.e. from the
+    bibfmt table with one query when the output format is cached
+    there. The records are written one after the other as soon as
+    they are formatted.
+    """
+    recids = list(recids)
+    existence = records_exist(recids)
+    records_sets = get_records_fields(recids, CFG_OAI_SET_FIELD)
+    records_idents = get_records_fields(recids, CFG_OAI_ID_FIELD)
+    datestamps = get_modification_dates(recids)
+
+    exported_recids = []
+    for recid in recids:
+        if existence.get(recid) == 1:
+            sets = records_sets.get(recid, [])
+            if set_spec is None or set_spec in sets or [set_ for set_ in sets if set_.startswith("%s:" % set_spec)]:
+                exported_recids.append(recid)
+
+    batch = None
+    provenance_recids = {}
+    if verb != 'ListIdentifiers' and exported_recids:
+        batch = prefetch_records(exported_recids, CFG_OAI_METADATA_FORMATS[prefix][0])
+        ## only harvested records have a provenance
+        provenance_recids = get_records_fields(exported_recids,
+            CFG_BIBUPLOAD_EXTERNAL_OAIID_TAG[:5] + CFG_OAI_PROVENANCE_BASEURL_SUBFIELD)
+    exported_recids = set(exported_recids)
+
+    for recid in recids:
+        record_exists_result = recid in exported_recids
+        if not record_exists_result and CFG_OAI_DELETED_POLICY not in ('persistent', 'transient'):
+            continue
+        idents = records_idents.get(recid)
+        if not idents:
+            continue
+
+        header_body = EscapedXMLString('')
+        header_body += X.identifier()(idents[0])
+        if set_last_updated:
+            header_body += X.datestamp()(max(datestamps.get(recid, ''), set_last_updated))
+        else:
+            header_body += X.datestamp()(datestamps.get(recid, ''))
+        for a_set_spec in records_sets.get(recid, []):
+            if a_set_spec and a_set_spec != CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC:
+                # Print only if field not empty
+                header_body += X.setSpec()(a_set_spec)
+        if record_exists_result:
+            header = X.header()(header_body)
+        else:
+            header = X.header(status='deleted')(header_body)
+
+        if verb == 'ListIdentifiers':
+            req.write(header)
+            continue
+        req.write("<record>")
+        req.write(header)
+        if record_exists_result:
+            metadata_body = format_record(recid, CFG_OAI_METADATA_FORMATS[prefix][0], batch=batch)
+            if metadata_body:
+                req.write("<metadata>")
+                req.write(metadata_body)
+                req.write("</metadata>")
+            else:
+                req.write("<metadata />")
+            if recid in provenance_recids:
+                provenance_body = get_record_provenance(recid)
+                if provenance_body:
+                    req.write(X.about(body=provenance_body))
+            rights_body = get_record_rights(recid)
+            if rights_body:
+                req.write(X.about(body=rights_body))
+        req.write("</record>")
+
 def oai_list_metadata_formats(argd):
     """Generates response to oai_list_metadata_formats verb."""
 
@@ -398,53 +506,47 @@ def oai_list_records_or_identifiers(req, argd):
     if argd.get('resumptionToken'):
         resumption_token_was_specified = True
         try:
-            cache = oai_cache_load(argd['resumptionToken'])
-            last_recid = cache['last_recid']
-            argd = cache['argd']
-            complete_list = cache['complete_list']
-            complete_list = filter_out_based_on_date_range(complete_list, argd.get('from', ''), argd.get('until', ''))
-        except Exception, e:
-            # Ignore cache not found errors
-            if not isinstance(e, IOError) or e.errno != 2:
-                register_exception(alert_admin=True)
+            state = oai_parse_resumption_token(argd['resumptionToken'])
+        except ValueError:
             req.write(oai_error(argd, [("badResumptionToken", "ResumptionToken expired or invalid: %s" % argd['resumptionToken'])]))
             return
+        argd = state['argd']
+        argd['verb'] = verb
+        last_datestamp = state['datestamp']
+        last_recid = state['recid']
+        cursor = state['cursor']
+        complete_list_size = state['size']
     else:
+        last_datestamp = ''
         last_recid = 0
-        complete_list = oai_get_recid_list(argd.get('set', ""), argd.get('from', ""), argd.get('until', ""))
+        cursor = 0
+        complete_list_size = len(oai_get_recid_list(argd.get('set', ""), argd.get('from', ""), argd.get('until', "")))
 
-        if not complete_list: # noRecordsMatch error
+        if not complete_list_size: # noRecordsMatch error
             req.write(oai_error(argd, [("noRecordsMatch", "no records correspond to the request")]))
             return
 
-    cursor = 0
-    for cursor, recid in enumerate(complete_list):
-        ## Let's fast-forward the cursor to point after the last recid that was
-        ## disseminated successfully
-        if recid > last_recid:
-            break
+    ## Seek to the records following the last one that was
+    ## disseminated, fetching one more to know if the list goes on
+    records = oai_get_recid_page(argd.get('set', ""), argd.get('from', ""), argd.get('until', ""),
+                                 last_datestamp, last_recid, CFG_OAI_LOAD + 1)
 
     set_last_updated = get_set_last_update(argd.get('set', ""))
 
     req.write(oai_header(argd, verb))
-    for recid in list(complete_list)[cursor:cursor+CFG_OAI_LOAD]:
-        req.write(print_record(recid, argd['metadataPrefix'], verb=verb, set_spec=argd.get('set'), set_last_updated=set_last_updated))
-
-    if list(complete_list)[cursor+CFG_OAI_LOAD:]:
-        resumption_token = oai_generate_resumption_token(argd.get('set', ''))
-        cache = {
-            'argd': argd,
-            'last_recid': recid,
-            'complete_list': complete_list.fastdump(),
-        }
-        oai_cache_dump(resumption_token, cache)
+    print_records(req, [recid for dummy_datestamp, recid in records[:CFG_OAI_LOAD]],
+                  argd['metadataPrefix'], verb=verb, set_spec=argd.get('set'), set_last_updated=set_last_updated)
+
+    if len(records) > CFG_OAI_LOAD:
+        last_datestamp, last_recid = records[CFG_OAI_LOAD - 1]
+        resumption_token = oai_generate_resumption_token(argd, last_datestamp, last_recid,
+                                                         cursor + CFG_OAI_LOAD, complete_list_size)
         expdate = oai_get_response_date(CFG_OAI_EXPIRE)
-        req.write(X.resumptionToken(expirationDate=expdate, cursor=cursor, completeListSize=len(complete_list))(resumption_token))
+        req.write(X.resumptionToken(expirationDate=expdate, cursor=cursor, completeListSize=complete_list_size)(resumption_token))
     elif resumption_token_was_specified:
         ## Since a resumptionToken was used we shall put a last empty resumptionToken
-        req.write(X.resumptionToken(cursor=cursor, completeListSize=len(complete_list))(""))
+        req.write(X.resumptionToken(cursor=cursor, completeListSize=complete_list_size)(""))
     req.write(oai_footer(verb))
-    oai_cache_gc()
 
 def oai_list_sets(argd):
     """
@@ -620,10 +722,178 @@ def filter_out_based_on_date_range(recids, fromdate="", untildate="", set_spec=N
         recids &= intbitset(run_sql("SELECT id FROM bibrec WHERE modification_date <= %s", (untildate, )))
     return recids - get_all_restricted_recids()
 
+def get_date_range(set_spec, fromdate, untildate):
+    """
+    Returns (fromdate, untildate) in localtime, empty strings meaning
+    no bound, for the given OAI 'from' and 'until' arguments. If the
+    set was touched (see get_set_last_update) after 'fromdate', all
+    its records are disseminated again.
+    """
+    if fromdate:
+        fromdate = utc_to_localtime(normalize_date(fromdate, "T00:00:00Z"))
+        last_updated = get_set_last_update(set_spec)
+        if last_updated is not None and utc_to_localtime(last_updated) > fromdate:
+            fromdate = ""
+    if untildate:
+        untildate = utc_to_localtime(normalize_date(untildate, "T23:59:59Z"))
+    return fromdate, untildate
+
+def get_records_set_specs(recids):
+    """
+    Returns a dictionary recid -> set of the setSpecs under which the
+    records 'recids' are disseminated according to their metadata:
+    the sets of CFG_OAI_SET_FIELD (and of CFG_OAI_PREVIOUS_SET_FIELD,
+    unless deleted records are not disseminated), all their supersets,
+    and '' for the whole repository. Records that are not disseminated
+    at all are not in the dictionary.
+    """
+    fields = [CFG_OAI_SET_FIELD]
+    excluded_recids = intbitset()
+    if CFG_OAI_DELETED_POLICY != 'no':
+        fields.append(CFG_OAI_PREVIOUS_SET_FIELD)
+    else:
+        excluded_recids |= search_unit_in_bibxxx(p='DELETED', f='980__%', type='e')
+        if CFG_CERN_SITE:
+            excluded_recids |= search_unit_in_bibxxx(p='DUMMY', f='980__%', type='e')
+    set_specs = {}
+    for field in fields:
+        for recid, values in get_records_fields(recids, field).iteritems():
+            if recid in excluded_recids:
+                continue
+            specs = set_specs.setdefault(recid, set(['']))
+            for value in values:
+                ## a record of set a:b:c is also in sets a:b and a
+                while value:
+                    specs.add(value)
+                    if ':' not in value:
+                        break
+                    value = value.rsplit(':', 1)[0]
+    return set_specs
+
+def get_oai_repository_index_stamp():
+    """
+    Returns the time (in localtime) at which the oaiREPOSITORYINDEX
+    table was last rebuilt by oairepositoryupdater, or None if it has
+    never been built.
+    """
+    res = run_sql("SELECT DATE_FORMAT(datestamp,'%%Y-%%m-%%d %%H:%%i:%%s') FROM oaiREPOSITORYINDEX WHERE setSpec=%s",
+                  (CFG_OAI_REPOSITORY_INDEX_STAMP_SPEC, ), 1)
+    if res:
+        return res[0][0]
+    return None
+
+def get_fresh_records(set_spec, fromdate, untildate, index_stamp):
+    """
+    Returns (fresh_recids, fresh_records): the intbitset of the records
+    modified since the dissemination index was built, whose index
+    entries are hence outdated, and the sorted list of (datestamp,
+    recid) of those of them that belong to 'set_spec' and were
+    modified between 'fromdate' and 'untildate' (localtime, or empty
+    strings).
+    """
+    res = run_sql("SELECT id, DATE_FORMAT(modification_date,'%%Y-%%m-%%d %%H:%%i:%%s') FROM bibrec WHERE modification_date>=%s",
+                  (index_stamp, ))
+    fresh_recids = intbitset([row[0] for row in res])
+    fresh_records = []
+    if res:
+        set_specs = get_records_set_specs(fresh_recids)
+        for recid, datestamp in res:
+            if set_spec in set_specs.get(recid, ()) and \
+                   (not fromdate or datestamp >= fromdate) and \
+                   (not untildate or datestamp <= untildate):
+                fresh_records.append((datestamp, recid))
+        fresh_records.sort()
+    return fresh_recids, fresh_records
+
+def get_index_query(set_spec, fromdate, untildate, index_stamp):
+    """
+    Returns (where clause, parameters) selecting the entries of
+    'set_spec' in the dissemination index that were modified between
+    'fromdate' and 'untildate' and before 'index_stamp'.
+    """
+    where = "setSpec=%s AND datestamp<%s"
+    params = [set_spec, index_stamp]
+    if fromdate:
+        where += " AND datestamp>=%s"
+        params.append(fromdate)
+    if untildate:
+        where += " AND datestamp<=%s"
+        params.append(untildate)
+    return where, params
+
 def oai_get_recid_list(set_spec="", fromdate="", untildate=""):
     """
     Returns list of recids for the OAI set 'set', modified from 'fromdate' until 'untildate'.
     """
+    index_stamp = get_oai_repository_index_stamp()
+    if index_stamp is None:
+        return oai_get_recid_list_from_metadata(set_spec, fromdate, untildate)
+    fromdate, untildate = get_date_range(set_spec, fromdate, untildate)
+    where, params = get_index_query(set_spec, fromdate, untildate, index_stamp)
+    ret = intbitset(run_sql("SELECT id_bibrec FROM oaiREPOSITORYINDEX WHERE " + where, params))
+    fresh_recids, fresh_records = get_fresh_records(set_spec, fromdate, untildate, index_stamp)
+    ret -= fresh_recids
+    ret |= intbitset([recid for dummy, recid in fresh_records])
+    return ret - get_all_restricted_recids()
+
+def oai_get_recid_page(set_spec, fromdate, untildate, last_datestamp, last_recid, size):
+    """
+    Returns the list of (datestamp, recid) of the next 'size' records
+    of the list of records for the OAI set 'set', modified from
+    'fromdate' until 'untildate', ordered by datestamp and recid,
+    following the record 'last_recid' of datestamp 'last_datestamp'
+    (localtime), or from the start of the list if 'last_datestamp' is
+    empty.
+    """
+    index_stamp = get_oai_repository_index_stamp()
+    restricted_recids = get_all_restricted_recids()
+    if index_stamp is None:
+        ## No dissemination index yet: sort the whole list
+        recids = list(oai_get_recid_list_from_metadata(set_spec, fromdate, untildate))
+        records = []
+        for i in range(0, len(recids), CFG_OAI_REPOSITORY_INDEX_BATCH_SIZE):
+            batch = recids[i:i + CFG_OAI_REPOSITORY_INDEX_BATCH_SIZE]
+            records.extend([(datestamp, recid) for recid, datestamp in \
+                run_sql("SELECT id, DATE_FORMAT(modification_date,'%%Y-%%m-%%d %%H:%%i:%%s') FROM bibrec WHERE id IN (%s)" % \
+                        ','.join(['%s'] * len(batch)), batch)])
+        records.sort()
+        return [record for record in records if record > (last_datestamp, last_recid)][:size]
+
+    fromdate, untildate = get_date_range(set_spec, fromdate, untildate)
+    fresh_recids, fresh_records = get_fresh_records(set_spec, fromdate, untildate, index_stamp)
+    where, params = get_index_query(set_spec, fromdate, untildate, index_stamp)
+    records = []
+    while len(records) < size:
+        if last_datestamp:
+            query = "SELECT DATE_FORMAT(datestamp,'%%Y-%%m-%%d %%H:%%i:%%s'), id_bibrec FROM oaiREPOSITORYINDEX WHERE " + where + \
+                    " AND (datestamp>%s OR (datestamp=%s AND id_bibrec>%s)) ORDER BY datestamp, id_bibrec LIMIT %s"
+            res = run_sql(query, params + [last_datestamp, last_datestamp, last_recid, size])
+        else:
+            query = "SELECT DATE_FORMAT(datestamp,'%%Y-%%m-%%d %%H:%%i:%%s'), id_bibrec FROM oaiREPOSITORYINDEX WHERE " + where + \
+                    " ORDER BY datestamp, id_bibrec LIMIT %s"
+            res = run_sql(query, params + [size])
+        for datestamp, recid in res:
+            if recid not in fresh_recids and recid not in restricted_recids:
+                records.append((datestamp, recid))
+        if len(res) < size:
+            break
+        last_datestamp, last_recid = res[-1]
+    ## Records modified since the index was built come last, since
+    ## the index only holds datestamps older than index_stamp
+    for datestamp, recid in fresh_records:
+        if len(records) >= size:
+            break
+        if (datestamp, recid) > (last_datestamp, last_recid) and recid not in restricted_recids:
+            records.append((datestamp, recid))
+    return records[:size]
+
+def oai_get_recid_list_from_metadata(set_spec="", fromdate="", untildate=""):
+    """
+    Returns list of recids for the OAI set 'set', modified from
+    'fromdate' until 'untildate', searching the set fields of the
+    metadata. Used until oairepositoryupdater builds the dissemination
+    index.
+    """
     ret = intbitset()
     if not set_spec:
         ret |= search_unit_in_bibxxx(p='*', f=CFG_OAI_SET_FIELD, type='e')
@@ -641,53 +911,54 @@ def oai_get_recid_list(set_spec="", fromdate="", untildate=""):
             ret -= search_unit_in_bibxxx(p='DUMMY', f='980__%', type='e')
     return filter_out_based_on_date_range(ret, fromdate, untildate, set_spec)
 
-def oai_generate_resumption_token(set_spec):
-    """Generates unique ID for resumption token management."""
-    fd, name = tempfile.mkstemp(dir=os.path.join(CFG_CACHEDIR, 'RTdata'), prefix='%s___' % set_spec)
-    os.close(fd)
-    return os.path.basename(name)
-
-def oai_delete_resumption_tokens_for_set(set_spec):
-    """
-    In case a set is modified by the admin interface, this will delete
-    any resumption token that is now invalid.
-    """
-    aset = set_spec
-    while aset:
-        for name in iglob(os.path.join(CFG_CACHEDIR, 'RTdata', '%s___*' % set_spec)):
-            os.remove(name)
-        aset = aset.rsplit(":", 1)[0]
-    for name in iglob(os.path.join(CFG_CACHEDIR, 'RTdata', '___*')):
-        os.remove(name)
-
-def oai_cache_dump(resumption_token, cache):
-    """
-    Given a resumption_token and the cache, stores the cache.
-    """
-    cPickle.dump(cache, open(os.path.join(CFG_CACHEDIR, 'RTdata', resumption_token), 'w'), -1)
-
-def oai_cache_load(resumption_token):
+def oai_generate_resumption_token(argd, last_datestamp, last_recid, cursor, complete_list_size):
     """
-    Restores the cache from the resumption_token.
+    Generates a stateless resumption token, encoding the arguments of
+    the request together with the position (datestamp and recid of
+    the last disseminated record) in the list, so that nothing needs
+    to be stored on the server.
     """
-    fullpath = os.path.join(CFG_CACHEDIR, 'RTdata', resumption_token)
-    if os.path.dirname(os.path.abspath(fullpath)) != os.path.abspath(os.path.join(CFG_CACHEDIR, 'RTdata')):
-        raise ValueError("Invalid path")
-    return cPickle.load(open(fullpath))
-
-def oai_cache_gc():
+    state = [('expires', int(time.time() + CFG_OAI_EXPIRE)),
+             ('datestamp', last_datestamp),
+             ('recid', last_recid),
+             ('cursor', cursor),
+             ('size', complete_list_size)]
+    for param in ('metadataPrefix', 'set', 'from', 'until'):
+        if param in argd:
+            state.append((param, argd[param]))
+    return base64.urlsafe_b64encode(urllib.urlencode(state))
+
+def oai_parse_resumption_token(resumption_token):
     """
-    OAI Cache Garbage Collector.
+    Returns the state encoded by oai_generate_resumption_token(), i.e.
+    a dictionary with keys argd, datestamp, recid, cursor and size.
+    Raises ValueError if the token is invalid or expired.
     """
-    for file_ in os.listdir(os.path.join(CFG_CACHEDIR, 'RTdata')):
-        filename = os.path.join(os.path.join(CFG_CACHEDIR, 'RTdata', file_))
-        # cache entry expires when not modified during a specified period of time
-        if ((time.time() - os.path.getmtime(filename)) > CFG_OAI_EXPIRE):
-            try:
-                os.remove(filename)
-            except OSError, e:
-                # Most probably the cache was already deleted
-                pass
+    try:
+        state = cgi.parse_qs(base64.urlsafe_b64decode(resumption_token), keep_blank_values=True, strict_parsing=True)
+        for values in state.values():
+            if len(values) != 1:
+                raise ValueError("Repeated parameter")
+        if int(state['expires'][0]) < time.time():
+            raise ValueError("Expired resumption token")
+        argd = {'metadataPrefix': state['metadataPrefix'][0]}
+        for param in ('set', 'from', 'until'):
+            if param in state:
+                argd[param] = state[param][0]
+                if param != 'set' and not check_date(argd[param]):
+                    raise ValueError("Bad datestamp format")
+        if argd['metadataPrefix'] not in CFG_OAI_METADATA_FORMATS:
+            raise ValueError("Unsupported metadata format")
+        datestamp = state['datestamp'][0]
+        if datestamp:
+            time.strptime(datestamp, "%Y-%m-%d %H:%M:%S")
+        return {'argd': argd,
+                'datestamp': datestamp,
+                'recid': int(state['recid'][0]),
+                'cursor': int(state['cursor'][0]),
+                'size': int(state['size'][0])}
+    except (TypeError, KeyError):
+        raise ValueError("Invalid resumption token")
 
 def get_all_sets():
     """
@@ -828,7 +1099,46 @@ def oai_profile():
     oai_list_records_or_identifiers(StringIO(), argd={"metadataPrefix": "oai_dc", "verb": "ListIdentifiers"})
     return
 
+def oai_benchmark(sizes=(500, 1000), prefixes=('marcxml', 'oai_dc')):
+    """
+    Runs a benchmark of the formatting of ListRecords pages, comparing
+    print_record() called for every record of the page with
+    print_records() called for the whole page.
+
+    @param sizes: the numbers of records per page
+    @param prefixes: the metadata prefixes to format records in
+    @return: dictionary (prefix, size) -> (number of records, records
+             per second with print_record(), records per second with
+             print_records())
+    """
+    from cStringIO import StringIO
+    recids = list(oai_get_recid_list())
+    results = {}
+    for prefix in prefixes:
+        for size in sizes:
+            page = recids[:size]
+            if not page:
+                continue
+            t0 = time.time()
+            out = StringIO()
+            for recid in page:
+                out.write(print_record(recid, prefix, verb='ListRecords'))
+            per_record_time = time.time() - t0
+
+            t0 = time.time()
+            print_records(StringIO(), page, prefix, verb='ListRecords')
+            batched_time = time.time() - t0
+            results[(prefix, size)] = (len(page), len(page) / max(per_record_time, 1e-6),
+                                       len(page) / max(batched_time, 1e-6))
+    return results
+
 if __name__ == "__main__":
+    if '--benchmark' in sys.argv:
+        results = oai_benchmark()
+        for (prefix, size), (nb_records, per_record_rate, batched_rate) in sorted(results.items()):
+            print "%s, pages of %s (%s records): %.1f records/sec per record, %.1f records/sec batched" % \
+                  (prefix, size, nb_records, per_record_rate, batched_rate)
+        sys.exit(0)
     import profile
     import pstats
     profile.run('oai_profile()', "oai_profile")
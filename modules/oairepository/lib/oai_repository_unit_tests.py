@@ -23,6 +23,7 @@
 __revision__ = "$Id$"
 
 from invenio.testutils import InvenioTestCase
+import base64
 import re
 
 from cStringIO import StringIO
@@ -80,8 +81,34 @@ class TestErrorCodes(InvenioTestCase):
 
         self.assertNotEqual([], [code for (code, dummy_text) in oai_repository_server.check_argd({'verb': 'ListRecords', 'resumptionToken': ''}) if code == 'badResumptionToken'])
 
+class TestResumptionTokens(InvenioTestCase):
+    """Test for stateless resumption tokens."""
+
+    def test_resumption_token_roundtrip(self):
+        """oairepository - encoding and decoding resumption tokens"""
+        argd = {'verb': 'ListRecords', 'metadataPrefix': 'marcxml',
+                'set': 'cern:experiment', 'from': '2001-01-01'}
+        token = oai_repository_server.oai_generate_resumption_token(argd, '2010-02-03 10:20:30', 17, 500, 1234)
+        state = oai_repository_server.oai_parse_resumption_token(token)
+        self.assertEqual(state, {'argd': {'metadataPrefix': 'marcxml',
+                                          'set': 'cern:experiment',
+                                          'from': '2001-01-01'},
+                                 'datestamp': '2010-02-03 10:20:30',
+                                 'recid': 17,
+                                 'cursor': 500,
+                                 'size': 1234})
+
+    def test_bad_resumption_token(self):
+        """oairepository - rejecting invalid resumption tokens"""
+        self.assertRaises(ValueError, oai_repository_server.oai_parse_resumption_token, 'foobar')
+        self.assertRaises(ValueError, oai_repository_server.oai_parse_resumption_token,
+                          base64.urlsafe_b64encode('expires=9999999999&recid=1'))
+        self.assertRaises(ValueError, oai_repository_server.oai_parse_resumption_token,
+                          base64.urlsafe_b64encode('expires=0&datestamp=&recid=1&cursor=0&size=1&metadataPrefix=marcxml'))
+
 TEST_SUITE = make_test_suite(TestVerbs,
-                             TestErrorCodes)
+                             TestErrorCodes,
+                             TestResumptionTokens)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
@@ -36,6 +36,7 @@ from tempfile import mkstemp
 from pprint import pformat
 
 from invenio.config import \
+     CFG_OAI_DELETED_POLICY, \
      CFG_OAI_ID_FIELD, \
      CFG_OAI_ID_PREFIX, \
      CFG_OAI_SET_FIELD, \
@@ -43,10 +44,14 @@ from invenio.config import \
      CFG_SITE_NAME, \
      CFG_TMPSHAREDDIR
 from invenio.oai_repository_config import CFG_OAI_REPOSITORY_MARCXML_SIZE, \
-     CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC
+     CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC, \
+     CFG_OAI_REPOSITORY_INDEX_STAMP_SPEC, \
+     CFG_OAI_REPOSITORY_INDEX_BATCH_SIZE
+from invenio.oai_repository_server import get_records_set_specs, \
+     get_oai_repository_index_stamp
 from invenio.search_engine import perform_request_search, get_record, search_unit_in_bibxxx
 from invenio.intbitset import intbitset
-from invenio.dbquery import run_sql
+from invenio.dbquery import run_sql, run_sql_many
 from invenio.bibtask import \
      task_get_option, \
      task_set_option, \
@@ -283,6 +288,93 @@ def repository_size():
     """Read repository size"""
     return len(search_unit_in_bibxxx(p="*", f=CFG_OAI_SET_FIELD, type="e"))
 
+def get_oai_repository_index_entries(recids):
+    """
+    Returns the list of (setSpec, datestamp, recid) entries of the
+    dissemination index for the list of records 'recids'.
+    """
+    set_specs = get_records_set_specs(recids)
+    datestamps = dict(run_sql("SELECT id, modification_date FROM bibrec WHERE id IN (%s)" % \
+                              ','.join(['%s'] * len(recids)), recids))
+    entries = []
+    for recid, specs in set_specs.iteritems():
+        if recid in datestamps:
+            for spec in specs:
+                entries.append((spec, datestamps[recid], recid))
+    return entries
+
+def rebuild_oai_repository_index():
+    """
+    Rebuilds the oaiREPOSITORYINDEX table, holding one (setSpec,
+    datestamp, recid) entry for every set (and superset) every
+    disseminated record belongs to, plus one ('', datestamp, recid)
+    entry for the whole repository, so that OAI-PMH ListRecords and
+    ListIdentifiers requests seek into it by datestamp instead of
+    searching the metadata.
+
+    The table is filled under a temporary name and then swapped in.
+    Its CFG_OAI_REPOSITORY_INDEX_STAMP_SPEC entry stores the time the
+    rebuild started: the OAI server looks up the records modified
+    since then directly in their metadata.
+    """
+    index_stamp = run_sql("SELECT NOW()")[0][0]
+    recids = search_unit_in_bibxxx(p='*', f=CFG_OAI_SET_FIELD, type='e')
+    if CFG_OAI_DELETED_POLICY != 'no':
+        recids |= search_unit_in_bibxxx(p='*', f=CFG_OAI_PREVIOUS_SET_FIELD, type='e')
+    write_message("Indexing %s disseminated records" % len(recids), verbose=2)
+
+    run_sql("DROP TABLE IF EXISTS tmp_oaiREPOSITORYINDEX")
+    run_sql("CREATE TABLE tmp_oaiREPOSITORYINDEX LIKE oaiREPOSITORYINDEX")
+    recids = list(recids)
+    for i in range(0, len(recids), CFG_OAI_REPOSITORY_INDEX_BATCH_SIZE):
+        task_sleep_now_if_required()
+        task_update_progress("Indexing disseminated records: done %s out of %s records." % \
+                             (i, len(recids)))
+        entries = get_oai_repository_index_entries(recids[i:i + CFG_OAI_REPOSITORY_INDEX_BATCH_SIZE])
+        if entries:
+            run_sql_many("INSERT INTO tmp_oaiREPOSITORYINDEX (setSpec, datestamp, id_bibrec) VALUES (%s, %s, %s)", entries)
+    run_sql("INSERT INTO tmp_oaiREPOSITORYINDEX (setSpec, datestamp, id_bibrec) VALUES (%s, %s, 0)",
+            (CFG_OAI_REPOSITORY_INDEX_STAMP_SPEC, index_stamp))
+
+    run_sql("RENAME TABLE oaiREPOSITORYINDEX TO old_oaiREPOSITORYINDEX, "
+            "tmp_oaiREPOSITORYINDEX TO oaiREPOSITORYINDEX")
+    run_sql("DROP TABLE old_oaiREPOSITORYINDEX")
+    write_message("OAI dissemination index rebuilt")
+
+def update_oai_repository_index(rebuild=False):
+    """
+    Brings the oaiREPOSITORYINDEX table up to date by reindexing only
+    the records modified since its last update, or rebuilds it (see
+    rebuild_oai_repository_index()) if 'rebuild' is set or if it has
+    never been built.
+
+    The CFG_OAI_REPOSITORY_INDEX_STAMP_SPEC entry is moved forward
+    only once the modified records have been reindexed, so that until
+    then the OAI server keeps looking them up in their metadata.
+    """
+    last_index_stamp = get_oai_repository_index_stamp()
+    if rebuild or last_index_stamp is None:
+        rebuild_oai_repository_index()
+        return
+
+    index_stamp = run_sql("SELECT NOW()")[0][0]
+    recids = [row[0] for row in run_sql("SELECT id FROM bibrec WHERE modification_date>=%s",
+                                        (last_index_stamp, ))]
+    write_message("Reindexing %s records modified since %s" % (len(recids), last_index_stamp), verbose=2)
+    for i in range(0, len(recids), CFG_OAI_REPOSITORY_INDEX_BATCH_SIZE):
+        task_sleep_now_if_required()
+        task_update_progress("Indexing modified records: done %s out of %s records." % \
+                             (i, len(recids)))
+        batch = recids[i:i + CFG_OAI_REPOSITORY_INDEX_BATCH_SIZE]
+        run_sql("DELETE FROM oaiREPOSITORYINDEX WHERE id_bibrec IN (%s)" % \
+                ','.join(['%s'] * len(batch)), batch)
+        entries = get_oai_repository_index_entries(batch)
+        if entries:
+            run_sql_many("INSERT INTO oaiREPOSITORYINDEX (setSpec, datestamp, id_bibrec) VALUES (%s, %s, %s)", entries)
+    run_sql("UPDATE oaiREPOSITORYINDEX SET datestamp=%s WHERE setSpec=%s",
+            (index_stamp, CFG_OAI_REPOSITORY_INDEX_STAMP_SPEC))
+    write_message("OAI dissemination index updated")
+
 ### MAIN ###
 def oairepositoryupdater_task():
     """Main business logic code of oai_archive"""
@@ -335,6 +427,11 @@ def oairepositoryupdater_task():
     all_affected_recids |= missing_oaiid | no_more_exported_recids
     write_message("%s recids should updated" % (len(all_affected_recids)), verbose=2)
 
+    ## Records updated below get a new modification date, so the OAI
+    ## server will look them up in their metadata until the next run.
+    task_update_progress("Indexing disseminated records")
+    update_oai_repository_index(task_get_option("rebuild_index"))
+
     if not all_affected_recids:
         write_message("Nothing to do!")
         return True
@@ -494,12 +591,16 @@ field. Please revise your configuration for the variables
                 " -d --detailed-report\t\tOAI repository detailed status\n"
                 " -n --no-process\tDo no upload the modifications\n"
                 " --notimechange\tDo not update record modification_date\n"
-                "NOTE: --notimechange should be used with care, basically only the first time a new set is added.",
+                " --rebuild-index\tRebuild the whole dissemination index instead of\n"
+                "\t\t\treindexing only the records modified since the last run\n"
+                "NOTE: --notimechange should be used with care, basically only the first time a new set is added.\n"
+                "      Since it leaves the modified records undetectable, run with --rebuild-index afterwards.",
             specific_params=("rdn", [
                 "report",
                 "detailed-report",
                 "no-process",
-                "notimechange"]),
+                "notimechange",
+                "rebuild-index"]),
             task_submit_elaborate_specific_parameter_fnc=
                 task_submit_elaborate_specific_parameter,
             task_run_fnc=oairepositoryupdater_task)
@@ -514,6 +615,8 @@ def task_submit_elaborate_specific_parameter(key, _value, _opts, _args):
         task_set_option("no_upload", 1)
     elif key in ("--notimechange",):
         task_set_option("notimechange", 1)
+    elif key in ("--rebuild-index",):
+        task_set_option("rebuild_index", 1)
     else:
         return False
     return True
@@ -24,6 +24,7 @@ __revision__ = "$Id$"
 ## import interesting modules:
 
 import sys
+import time
 
 if sys.hexversion < 0x2040000:
     # pylint: disable=W0622
@@ -34,8 +35,10 @@ from invenio.messages import gettext_set_language
 from invenio.config import CFG_SITE_ADMIN_EMAIL, CFG_SITE_LANG
 from invenio.access_control_config import CFG_ACC_EMPTY_ROLE_DEFINITION_SER, \
     CFG_ACC_EMPTY_ROLE_DEFINITION_SRC, DELEGATEADDUSERROLE, SUPERADMINROLE, \
-    DEF_USERS, DEF_ROLES, DEF_AUTHS, DEF_ACTIONS, CFG_ACC_ACTIVITIES_URLS
-from invenio.dbquery import run_sql, ProgrammingError
+    DEF_USERS, DEF_ROLES, DEF_AUTHS, DEF_ACTIONS, CFG_ACC_ACTIVITIES_URLS, \
+    CFG_ACC_AUTHORIZATION_MEMO_KEY, CFG_ACC_AUTHORIZATION_MEMO_TIMEOUT
+from invenio.dbquery import run_sql, ProgrammingError, get_table_update_time
+from invenio.data_cacher import DataCacher
 from invenio.access_control_firerole import compile_role_definition, \
     acc_firerole_check_user, serialize, deserialize, load_role_definition
 from invenio.intbitset import intbitset
@@ -1209,15 +1212,26 @@ def acc_get_user_id(email=''):
         return 0
 
 def acc_is_user_in_role(user_info, id_role):
-    """Return True if the user belong implicitly or explicitly to the role."""
+    """Return True if the user belong implicitly or explicitly to the role.
+    The answer is memoised into USER_INFO, see acc_get_authorization_memo()."""
 
-    if run_sql("""SELECT ur.id_accROLE
-            FROM user_accROLE ur
-            WHERE ur.id_user = %s AND ur.expiration >= NOW() AND
-            ur.id_accROLE = %s LIMIT 1""", (user_info['uid'], id_role), 1, run_on_slave=True):
-        return True
-
-    return acc_firerole_check_user(user_info, load_role_definition(id_role))
+    memo = acc_get_authorization_memo(user_info)
+    try:
+        return memo['roles'][id_role]
+    except KeyError:
+        pass
+
+    if memo['explicit_roles'] is None:
+        memo['explicit_roles'] = intbitset(acc_get_user_roles(user_info['uid']))
+    if id_role in memo['explicit_roles']:
+        in_role = True
+    else:
+        firerole_def_obj = acc_authorization_cache.cache['roles'].get(id_role)
+        if firerole_def_obj is None:
+            firerole_def_obj = load_role_definition(id_role)
+        in_role = acc_firerole_check_user(user_info, firerole_def_obj)
+    memo['roles'][id_role] = in_role
+    return in_role
 
 def acc_get_user_roles_from_user_info(user_info):
     """get all roles a user is connected to."""
@@ -1363,28 +1377,141 @@ def acc_find_possible_actions_argument_listid(id_role, id_action, arglistid):
     # return this list
     return res2
 
+class AccAuthorizationDataCacher(DataCacher):
+    """
+    Compiled index of the authorizations, i.e. of the
+    accROLE_accACTION_accARGUMENT table, shared by all the requests
+    served by a process.  Its cache is a dictionary with keys:
+      - 'actions': name_action -> (id_action, roles authorized with
+        any arguments, list of (id_role, arguments) for the roles
+        authorized only with some arguments);
+      - 'roles': id_role -> deserialized FireRole definition, for the
+        roles having one;
+      - 'possible_roles': memo of acc_find_possible_roles().
+    It is rebuilt whenever one of the acc* tables has been modified.
+    """
+    def __init__(self):
+        def cache_filler():
+            actions = {}
+            for id_action, name_action in run_sql("SELECT id, name FROM accACTION", run_on_slave=True):
+                actions[name_action] = (id_action, intbitset(), [])
+            names = dict([(actions[name_action][0], name_action) for name_action in actions])
+            res = run_sql("SELECT id_accACTION, id_accROLE FROM accROLE_accACTION_accARGUMENT WHERE argumentlistid <= 0", run_on_slave=True)
+            for id_action, id_role in res:
+                if id_action in names:
+                    actions[names[id_action]][1].add(id_role)
+            restricted_roles = {}
+            res = run_sql("SELECT id_accACTION, id_accROLE, argumentlistid, keyword, value FROM accROLE_accACTION_accARGUMENT JOIN accARGUMENT ON id_accARGUMENT=id WHERE argumentlistid > 0", run_on_slave=True)
+            for id_action, id_role, argumentlistid, keyword, value in res:
+                if id_action in names:
+                    restricted_roles.setdefault((id_action, id_role, argumentlistid), {})[keyword] = value
+            for (id_action, id_role, dummy), stored_arguments in restricted_roles.iteritems():
+                actions[names[id_action]][2].append((id_role, stored_arguments))
+            roles = {}
+            res = run_sql("SELECT id, firerole_def_ser FROM accROLE WHERE firerole_def_ser IS NOT NULL", run_on_slave=True)
+            for id_role, firerole_def_ser in res:
+                try:
+                    roles[id_role] = deserialize(firerole_def_ser)
+                except Exception:
+                    ## load_role_definition() knows how to repair it
+                    roles[id_role] = load_role_definition(id_role)
+            return {'actions': actions, 'roles': roles, 'possible_roles': {}}
+
+        def timestamp_verifier():
+            return get_table_update_time('acc%')
+
+        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+
+    def create_cache(self):
+        """Build the index; if the tables do not exist yet (e.g. during
+        the installation), serve an empty index until the next check.
+        Such an index is flagged by is_ok_p being False, so that no
+        decision taken from it is memoised.  Any other database error
+        is raised, since an empty index would grant to everybody the
+        actions checked with authorized_if_no_roles."""
+        try:
+            DataCacher.create_cache(self)
+        except ProgrammingError, err:
+            if err.args and err.args[0] != 1146:
+                ## not a missing table
+                raise
+            self.cache = {'actions': {}, 'roles': {}, 'possible_roles': {}}
+            self.timestamp = ''
+            self.is_ok_p = False
+        else:
+            self.is_ok_p = True
+
+try:
+    acc_authorization_cache.is_ok_p
+except NameError:
+    acc_authorization_cache = AccAuthorizationDataCacher()
+
+def acc_get_authorization_memo(user_info):
+    """Return the memo of the role memberships and authorization
+    decisions of the user described by USER_INFO, stored into
+    USER_INFO itself, so that it lives as long as the request, or as
+    long as the dictionary for callers building their own.  A new memo
+    is started, and the authorization index refreshed if needed, when
+    the memo is older than CFG_ACC_AUTHORIZATION_MEMO_TIMEOUT seconds
+    or was made for another user or another version of the index."""
+    memo = user_info.get(CFG_ACC_AUTHORIZATION_MEMO_KEY)
+    if memo is None or memo['uid'] != user_info['uid'] or \
+           memo['time'] + CFG_ACC_AUTHORIZATION_MEMO_TIMEOUT < time.time():
+        acc_authorization_cache.recreate_cache_if_needed()
+        memo = None
+    elif memo['timestamp'] != acc_authorization_cache.timestamp:
+        memo = None
+    if memo is None:
+        memo = {'uid': user_info['uid'],
+                'time': time.time(),
+                'timestamp': acc_authorization_cache.timestamp,
+                'explicit_roles': None,
+                'roles': {},
+                'decisions': {}}
+        if acc_authorization_cache.is_ok_p:
+            ## do not keep what was memoised from a degraded index
+            user_info[CFG_ACC_AUTHORIZATION_MEMO_KEY] = memo
+    return memo
+
 def acc_find_possible_roles(name_action, always_add_superadmin=True, **arguments):
     """Find all the possible roles that are enabled to action_name with
     given arguments. roles is a list of role_id
     """
-    id_action = acc_get_action_id(name_action)
-    roles = intbitset(run_sql("SELECT id_accROLE FROM accROLE_accACTION_accARGUMENT WHERE id_accACTION=%s AND argumentlistid <= 0", (id_action, ), run_on_slave=True))
+    acc_authorization_cache.recreate_cache_if_needed()
+    return acc_find_possible_roles_in_cache(name_action, always_add_superadmin, arguments)
+
+def acc_find_possible_roles_in_cache(name_action, always_add_superadmin, arguments):
+    """Same as acc_find_possible_roles(), but without checking whether the
+    authorization index has to be refreshed first."""
+    try:
+        key = (name_action, always_add_superadmin, tuple(sorted(arguments.iteritems())))
+        return intbitset(acc_authorization_cache.cache['possible_roles'][key])
+    except TypeError:
+        ## unhashable arguments
+        key = None
+    except KeyError:
+        pass
+    try:
+        dummy, roles, other_roles_to_check = acc_authorization_cache.cache['actions'][name_action]
+    except KeyError:
+        roles, other_roles_to_check = intbitset(), []
+    roles = intbitset(roles)
     if always_add_superadmin:
         roles.add(CFG_SUPERADMINROLE_ID)
-    other_roles_to_check = run_sql("SELECT id_accROLE, keyword, value, argumentlistid FROM  accROLE_accACTION_accARGUMENT JOIN accARGUMENT ON id_accARGUMENT=id WHERE id_accACTION=%s AND argumentlistid > 0", (id_action, ), run_on_slave=True)
-    other_roles_to_check_dict = {}
-    for id_accROLE, keyword, value, argumentlistid in other_roles_to_check:
-        if id_accROLE not in roles:
-            try:
-                other_roles_to_check_dict[(id_accROLE, argumentlistid)][keyword] = value
-            except KeyError:
-                other_roles_to_check_dict[(id_accROLE, argumentlistid)] = {keyword : value}
-    for ((id_accROLE, argumentlistid), stored_arguments) in other_roles_to_check_dict.iteritems():
-        for key, value in stored_arguments.iteritems():
-            if (value != arguments.get(key, '*') != '*') and value != '*':
+    for id_accROLE, stored_arguments in other_roles_to_check:
+        if id_accROLE in roles:
+            continue
+        for key_argument, value in stored_arguments.iteritems():
+            if (value != arguments.get(key_argument, '*') != '*') and value != '*':
                 break
         else:
             roles.add(id_accROLE)
+    if key is not None and acc_authorization_cache.is_ok_p:
+        possible_roles = acc_authorization_cache.cache['possible_roles']
+        if len(possible_roles) >= 10000:
+            ## arguments like recids could make it grow forever
+            possible_roles.clear()
+        possible_roles[key] = intbitset(roles)
     return roles
 
 def acc_find_possible_actions_user_from_user_info(user_info, id_action):
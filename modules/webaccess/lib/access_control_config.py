@@ -68,6 +68,14 @@ CFG_ACC_EMPTY_ROLE_DEFINITION_OBJ = (False, ())
 # default role definition, compiled and serialized:
 CFG_ACC_EMPTY_ROLE_DEFINITION_SER = None
 
+# key of the user_info dictionary holding the memo of the role
+# memberships and authorization decisions of the user:
+CFG_ACC_AUTHORIZATION_MEMO_KEY = 'precached_acc_memo'
+
+# number of seconds during which a memo is trusted without checking
+# whether authorizations have been changed meanwhile:
+CFG_ACC_AUTHORIZATION_MEMO_TIMEOUT = 60
+
 # List of tags containing (multiple) emails of users who should authorize
 # to access the corresponding record regardless of collection restrictions.
 if CFG_CERN_SITE:
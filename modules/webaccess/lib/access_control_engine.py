@@ -30,7 +30,8 @@ if sys.hexversion < 0x2040000:
 
 from invenio.config import CFG_SITE_SECURE_URL, CFG_CERN_SITE
 from invenio.dbquery import run_sql
-from invenio.access_control_admin import acc_find_possible_roles, acc_is_user_in_role, CFG_SUPERADMINROLE_ID, acc_get_role_users
+from invenio.access_control_admin import acc_find_possible_roles, acc_is_user_in_role, CFG_SUPERADMINROLE_ID, acc_get_role_users, \
+     acc_get_authorization_memo, acc_find_possible_roles_in_cache
 from invenio.access_control_config import CFG_WEBACCESS_WARNING_MSGS, CFG_WEBACCESS_MSGS
 from invenio.webuser import collect_user_info
 from invenio.access_control_firerole import deserialize, load_role_definition, acc_firerole_extract_emails
@@ -44,9 +45,31 @@ def acc_authorize_action(req, name_action, authorized_if_no_roles=False, **argum
     than superadmin) that are authorized to execute the given action, the
     authorization will be granted.
     Returns (0, msg) when the authorization is granted, (1, msg) when it's not.
+    Decisions are memoised into the user_info dictionary, so that checking
+    the same authorization again during a request costs a lookup.
     """
+    if type(req) is dict and req.has_key('uid'):
+        ## start the memo in the dictionary of the caller, since
+        ## collect_user_info() works on a copy of it
+        acc_get_authorization_memo(req)
     user_info = collect_user_info(req)
-    roles = acc_find_possible_roles(name_action, always_add_superadmin=False, **arguments)
+    memo = acc_get_authorization_memo(user_info)
+    try:
+        key = (name_action, authorized_if_no_roles, tuple(sorted(arguments.iteritems())))
+        return memo['decisions'][key]
+    except TypeError:
+        ## unhashable arguments
+        key = None
+    except KeyError:
+        pass
+    decision = _acc_authorize_action(user_info, name_action, authorized_if_no_roles, arguments)
+    if key is not None:
+        memo['decisions'][key] = decision
+    return decision
+
+def _acc_authorize_action(user_info, name_action, authorized_if_no_roles, arguments):
+    """Take the decision of acc_authorize_action() for USER_INFO."""
+    roles = acc_find_possible_roles_in_cache(name_action, False, arguments)
     for id_role in roles:
         if acc_is_user_in_role(user_info, id_role):
             ## User belong to at least one authorized role.
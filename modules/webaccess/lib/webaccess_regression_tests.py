@@ -30,7 +30,8 @@ from urlparse import urlparse, urlunparse
 from urllib import urlopen, urlencode
 
 from invenio.access_control_admin import acc_add_role, acc_delete_role, \
-    acc_get_role_definition
+    acc_get_role_definition, acc_is_user_in_role
+from invenio.access_control_config import CFG_ACC_AUTHORIZATION_MEMO_KEY
 from invenio.access_control_firerole import compile_role_definition, \
     serialize, deserialize
 from invenio.config import CFG_SITE_URL, CFG_SITE_SECURE_URL, CFG_DEVEL_SITE
@@ -38,6 +39,7 @@ from invenio.testutils import make_test_suite, run_test_suite, \
                               test_web_page_content, merge_error_messages, \
                               get_authenticated_mechanize_browser
 from invenio.dbquery import run_sql
+from invenio.webuser import collect_user_info
 
 class WebAccessWebPagesAvailabilityTest(InvenioTestCase):
     """Check WebAccess web pages whether they are up or not."""
@@ -106,6 +108,14 @@ class WebAccessFireRoleTest(InvenioTestCase):
         tmp_def_ser = acc_get_role_definition(self.role_id)
         self.assertEqual(def_ser, deserialize(tmp_def_ser))
 
+    def test_webaccess_firerole_memo(self):
+        """webaccess - firerole role membership memoised into user_info"""
+        user_info = collect_user_info(None)
+        user_info['email'] = 'jekyll@cern.ch'
+        self.failUnless(acc_is_user_in_role(user_info, self.role_id))
+        self.assertEqual(user_info[CFG_ACC_AUTHORIZATION_MEMO_KEY]['roles'][self.role_id], True)
+        self.failUnless(acc_is_user_in_role(user_info, self.role_id))
+
 class WebAccessUseBasketsTest(InvenioTestCase):
     """
     Check WebAccess behaviour WRT enabling/disabling web modules such
@@ -29,6 +29,7 @@ __revision__ = "$Id$"
 import cgi
 import cStringIO
 import copy
+import heapq
 import os
 import re
 import time
@@ -70,6 +71,7 @@ from invenio.config import \
      CFG_BIBUPLOAD_SERIALIZE_RECORD_STRUCTURE, \
      CFG_BIBUPLOAD_EXTERNAL_SYSNO_TAG, \
      CFG_BIBRANK_SHOW_DOWNLOAD_GRAPHS, \
+     CFG_BIBRANK_SHOW_CITATION_LINKS, \
      CFG_WEBSEARCH_SYNONYM_KBRS, \
      CFG_SITE_LANG, \
      CFG_SITE_NAME, \
@@ -93,7 +95,9 @@ from invenio.search_engine_config import \
      InvenioWebSearchWildcardLimitError, \
      CFG_WEBSEARCH_IDXPAIRS_FIELDS,\
      CFG_WEBSEARCH_IDXPAIRS_EXACT_SEARCH
+from invenio.search_engine_termdict import search_term_dictionary
 from invenio.search_engine_utils import (get_fieldvalues,
+                                         get_fieldvalues_by_recid,
                                          get_fieldvalues_alephseq_like,
                                          record_exists)
 from invenio.bibrecord import create_record, record_xml_output
@@ -110,10 +114,14 @@ from invenio.bibindex_engine_utils import author_name_requires_phrase_search, \
 from invenio.bibindex_engine_washer import wash_index_term, lower_index_term, wash_author_name
 from invenio.bibindex_engine_config import CFG_BIBINDEX_SYNONYM_MATCH_TYPE
 from invenio.bibindex_engine_utils import get_idx_indexer
-from invenio.bibformat import format_record, format_records, get_output_format_content_type, create_excel
+from invenio.bibformat import format_record, format_records, get_output_format_content_type, create_excel, \
+     prefetch_records
 from invenio.bibrank_downloads_grapher import create_download_history_graph_and_box
 from invenio.bibknowledge import get_kbr_values
-from invenio.data_cacher import DataCacher
+from invenio.data_cacher import DataCacher, GenerationalDataCacher
+from invenio.bibsort_store import BibSortStore, InvenioBibSortStoreError, \
+     store_exists as bibsort_store_exists, \
+     create_weights_array as create_bibsort_weights_array
 from invenio.websearch_external_collections import print_external_results_overview, perform_external_collection_search
 from invenio.access_control_admin import acc_get_action_id
 from invenio.access_control_config import VIEWRESTRCOLL, \
@@ -136,7 +144,7 @@ webcomment_templates = invenio.template.load('webcomment')
 from invenio.bibrank_citation_searcher import calculate_cited_by_list, \
     calculate_co_cited_with_list, get_records_with_num_cites, \
     get_refersto_hitset, get_citedby_hitset, get_cited_by_list, \
-    get_refers_to_list, get_citers_log
+    get_refers_to_list, get_citers_log, get_cited_by_counts
 
 from invenio.bibrank_citation_grapher import create_citation_history_graph_and_box
 from invenio.bibrank_selfcites_searcher import get_self_cited_by_list, \
@@ -223,7 +231,7 @@ EM_REPOSITORY={"body" : "B",
                "rt_portalbox" : "Prt",
                "search_services": "SER"};
 
-class RestrictedCollectionDataCacher(DataCacher):
+class RestrictedCollectionDataCacher(GenerationalDataCacher):
     def __init__(self):
         def cache_filler():
             ret = []
@@ -237,7 +245,7 @@ class RestrictedCollectionDataCacher(DataCacher):
         def timestamp_verifier():
             return max(get_table_update_time('accROLE_accACTION_accARGUMENT'), get_table_update_time('accARGUMENT'))
 
-        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+        GenerationalDataCacher.__init__(self, cache_filler, timestamp_verifier)
 
 def collection_restricted_p(collection, recreate_cache_if_needed=True):
     if recreate_cache_if_needed:
@@ -416,7 +424,7 @@ properly access this record.""")
         ## Let's handle these situations outside of this code.
         return (0, '')
 
-class IndexStemmingDataCacher(DataCacher):
+class IndexStemmingDataCacher(GenerationalDataCacher):
     """
     Provides cache for stemming information for word/phrase indexes.
     This class is not to be used directly; use function
@@ -434,7 +442,7 @@ class IndexStemmingDataCacher(DataCacher):
         def timestamp_verifier():
             return get_table_update_time('idxINDEX')
 
-        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+        GenerationalDataCacher.__init__(self, cache_filler, timestamp_verifier)
 
 try:
     index_stemming_cache.is_ok_p
@@ -448,7 +456,7 @@ def get_index_stemming_language(index_id, recreate_cache_if_needed=True):
     return index_stemming_cache.cache[index_id]
 
 
-class FieldTokenizerDataCacher(DataCacher):
+class FieldTokenizerDataCacher(GenerationalDataCacher):
     """
     Provides cache for tokenizer information for fields corresponding to indexes.
     This class is not to be used directly; use function
@@ -466,7 +474,7 @@ class FieldTokenizerDataCacher(DataCacher):
         def timestamp_verifier():
             return get_table_update_time('idxINDEX')
 
-        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+        GenerationalDataCacher.__init__(self, cache_filler, timestamp_verifier)
 
 try:
     field_tokenizer_cache.is_ok_p
@@ -485,7 +493,7 @@ def get_field_tokenizer_type(field_name, recreate_cache_if_needed=True):
     return tokenizer
 
 
-class CollectionRecListDataCacher(DataCacher):
+class CollectionRecListDataCacher(GenerationalDataCacher):
     """
     Provides cache for collection reclist hitsets.  This class is not
     to be used directly; use function get_collection_reclist() instead.
@@ -501,7 +509,7 @@ class CollectionRecListDataCacher(DataCacher):
         def timestamp_verifier():
             return get_table_update_time('collection')
 
-        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+        GenerationalDataCacher.__init__(self, cache_filler, timestamp_verifier, generations=('collection',))
 
 try:
     if not collection_reclist_cache.is_ok_p:
@@ -575,7 +583,7 @@ try:
 except Exception:
     search_results_cache = SearchResultsCache()
 
-class CollectionI18nNameDataCacher(DataCacher):
+class CollectionI18nNameDataCacher(GenerationalDataCacher):
     """
     Provides cache for I18N collection names.  This class is not to be
     used directly; use function get_coll_i18nname() instead.
@@ -598,7 +606,7 @@ class CollectionI18nNameDataCacher(DataCacher):
         def timestamp_verifier():
             return get_table_update_time('collectionname')
 
-        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+        GenerationalDataCacher.__init__(self, cache_filler, timestamp_verifier)
 
 try:
     if not collection_i18nname_cache.is_ok_p:
@@ -632,7 +640,7 @@ def get_coll_i18nname(c, ln=CFG_SITE_LANG, verify_cache_timestamp=True):
         pass # translation in LN does not exist
     return out
 
-class FieldI18nNameDataCacher(DataCacher):
+class FieldI18nNameDataCacher(GenerationalDataCacher):
     """
     Provides cache for I18N field names.  This class is not to be used
     directly; use function get_field_i18nname() instead.
@@ -655,7 +663,7 @@ class FieldI18nNameDataCacher(DataCacher):
         def timestamp_verifier():
             return get_table_update_time('fieldname')
 
-        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+        GenerationalDataCacher.__init__(self, cache_filler, timestamp_verifier)
 
 try:
     if not field_i18nname_cache.is_ok_p:
@@ -1844,7 +1852,7 @@ def get_coll_sons(coll, coll_type='r', public_only=1):
             coll_sons.append(name[0])
     return coll_sons
 
-class CollectionAllChildrenDataCacher(DataCacher):
+class CollectionAllChildrenDataCacher(GenerationalDataCacher):
     """Cache for all children of a collection (regular & virtual, public & private)"""
     def __init__(self):
 
@@ -1882,7 +1890,7 @@ class CollectionAllChildrenDataCacher(DataCacher):
         def timestamp_verifier():
             return max(get_table_update_time('collection'), get_table_update_time('collection_collection'))
 
-        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+        GenerationalDataCacher.__init__(self, cache_filler, timestamp_verifier, generations=('collection',))
 
 try:
     if not collection_allchildren_cache.is_ok_p:
@@ -2434,6 +2442,23 @@ def get_idxpair_field_ids():
     return [index_dict[field] for field in index_dict if field in CFG_WEBSEARCH_IDXPAIRS_FIELDS]
 
 
+def run_term_query(table, query_addons, query_params, wl=0):
+    """Return list of (term, hitlist) from the forward index TABLE
+    whose terms satisfy QUERY_ADDONS (e.g. 'LIKE %s') with
+    QUERY_PARAMS, together with a flag telling whether the wildcard
+    limit WL was reached.  Hitlists are intbitsets when answered from
+    the in-process term dictionary, and serialized intbitsets when
+    answered by the database."""
+    res = search_term_dictionary(table, query_addons, query_params, wl)
+    if res is not None:
+        return res
+    try:
+        res = run_sql_with_limit("SELECT term,hitlist FROM %s WHERE term %s" % (table, query_addons),
+                                 query_params, wildcard_limit=wl) #kwalitee:disable=sql
+    except InvenioDbQueryWildcardLimitError, excp:
+        return excp.res, 1
+    return res, 0
+
 def search_unit_in_bibwords(word, f, decompress=zlib.decompress, wl=0):
     """Searches for 'word' inside bibwordsX table for field 'f' and returns hitset of recIDs."""
     hitset = intbitset() # will hold output result set
@@ -2473,12 +2498,8 @@ def search_unit_in_bibwords(word, f, decompress=zlib.decompress, wl=0):
                 word1_washed = int(word1_washed)
             except ValueError:
                 pass
-        try:
-            res = run_sql_with_limit("SELECT term,hitlist FROM %s WHERE term BETWEEN %%s AND %%s" % bibwordsX,
-                          (word0_washed, word1_washed), wildcard_limit=wl)
-        except InvenioDbQueryWildcardLimitError, excp:
-            res = excp.res
-            limit_reached = 1 # set the limit reached flag to true
+        res, limit_reached = run_term_query(bibwordsX, "BETWEEN %s AND %s",
+                                            (word0_washed, word1_washed), wl)
     else:
         if f == 'journal':
             pass # FIXME: quick hack for the journal index
@@ -2493,15 +2514,11 @@ def search_unit_in_bibwords(word, f, decompress=zlib.decompress, wl=0):
                 # FIXME: we can run a sanity check here for all indexes
                 res = ()
             else:
-                try:
-                    res = run_sql_with_limit("SELECT term,hitlist FROM %s WHERE term LIKE %%s" % bibwordsX,
-                                  (wash_index_term(word),), wildcard_limit = wl)
-                except InvenioDbQueryWildcardLimitError, excp:
-                    res = excp.res
-                    limit_reached = 1 # set the limit reached flag to true
+                res, limit_reached = run_term_query(bibwordsX, "LIKE %s",
+                                                    (wash_index_term(word),), wl)
         else:
-            res = run_sql("SELECT term,hitlist FROM %s WHERE term=%%s" % bibwordsX,
-                          (wash_index_term(word),))
+            res, limit_reached = run_term_query(bibwordsX, "= %s",
+                                                (wash_index_term(word),))
     # fill the result set:
     for word, hitlist in res:
         hitset_bibwrd = intbitset(hitlist)
@@ -2597,15 +2614,12 @@ def search_unit_in_idxpairs(p, f, search_type, wl=0):
         query_params = query_var[1]
         use_query_limit = query_var[2]
         if use_query_limit:
-            try:
-                res = run_sql_with_limit("SELECT term, hitlist FROM %s WHERE term %s"
-                                     % (idxpair_table_washed, query_addons), query_params, wildcard_limit=wl) #kwalitee:disable=sql
-            except InvenioDbQueryWildcardLimitError, excp:
-                res = excp.res
+            res, query_limit_reached = run_term_query(idxpair_table_washed, query_addons,
+                                                      query_params, wl)
+            if query_limit_reached:
                 limit_reached = 1 # set the limit reached flag to true
         else:
-            res = run_sql("SELECT term, hitlist FROM %s WHERE term %s"
-                      % (idxpair_table_washed, query_addons), query_params) #kwalitee:disable=sql
+            res, dummy = run_term_query(idxpair_table_washed, query_addons, query_params)
         if not res:
             return intbitset()
         for pair, hitlist in res:
@@ -2684,15 +2698,18 @@ def search_unit_in_idxphrases(p, f, search_type, wl=0):
             query_params_washed += (wash_author_name(query_param),)
         query_params = query_params_washed
     # perform search:
-    if use_query_limit:
+    if search_type == 'r':
+        # regular expressions are left to the database:
         try:
             res = run_sql_with_limit("SELECT term,hitlist FROM %s WHERE term %s" % (idxphraseX, query_addons),
                       query_params, wildcard_limit=wl)
         except InvenioDbQueryWildcardLimitError, excp:
             res = excp.res
             limit_reached = 1 # set the limit reached flag to true
+    elif use_query_limit:
+        res, limit_reached = run_term_query(idxphraseX, query_addons, query_params, wl)
     else:
-        res = run_sql("SELECT term,hitlist FROM %s WHERE term %s" % (idxphraseX, query_addons), query_params)
+        res, dummy = run_term_query(idxphraseX, query_addons, query_params)
     # fill the result set:
     for dummy_word, hitlist in res:
         hitset_bibphrase = intbitset(hitlist)
@@ -3638,6 +3655,20 @@ def get_all_collections_of_a_record(recID, recreate_cache_if_needed=True):
             ret.append(name)
     return ret
 
+def get_all_collections_of_records(recIDs, recreate_cache_if_needed=True):
+    """Return dictionary of recID->list of all the collection names the
+    record belongs to, for the list of record IDs RECIDS.  Like
+    get_all_collections_of_a_record(), this function is
+    O(n_collections), but for all the records at once."""
+    ret = dict([(recID, []) for recID in recIDs])
+    recIDs = intbitset(ret.keys())
+    if recreate_cache_if_needed:
+        collection_reclist_cache.recreate_cache_if_needed()
+    for name in collection_reclist_cache.cache.keys():
+        for recID in get_collection_reclist(name, recreate_cache_if_needed=False) & recIDs:
+            ret[recID].append(name)
+    return ret
+
 def get_tag_name(tag_value, prolog="", epilog=""):
     """Return tag name from the known tag value, by looking up the 'tag' table.
        Return empty string in case of failure.
@@ -4003,6 +4034,9 @@ class BibSortDataCacher(DataCacher):
             except IndexError:
                 data_dict_ordered = {}
             alldicts['data_dict_ordered'] = data_dict_ordered # recid: weight
+            if CFG_NUMPY_IMPORTABLE:
+                # dense recid->weight array, for ranking many recids at once
+                alldicts['data_array'] = create_bibsort_weights_array(data_dict_ordered)
             if not res_buckets:
                 alldicts['bucket_data'] = {}
                 return alldicts
@@ -4039,13 +4073,45 @@ def get_sorting_methods():
                      WHERE m.id = md.id_bsrMETHOD""")
     return dict(res)
 
+def get_bibsort_cacher(method_name):
+    """Return the cache of sorting method METHOD_NAME.  If BibSort has
+    published an on-disk store for the method, map it into memory,
+    so that it is shared with the other processes, otherwise load the
+    data from the database."""
+    res = run_sql("""SELECT id FROM bsrMETHOD WHERE name = %s""", (method_name,))
+    if res and bibsort_store_exists(res[0][0]):
+        try:
+            return BibSortStore(res[0][0])
+        except (IOError, ValueError, InvenioBibSortStoreError):
+            register_exception()
+    return BibSortDataCacher(method_name)
+
 SORTING_METHODS = get_sorting_methods()
 CACHE_SORTED_DATA = {}
 for sorting_method in SORTING_METHODS:
     try:
         CACHE_SORTED_DATA[sorting_method].is_ok_p
     except KeyError:
-        CACHE_SORTED_DATA[sorting_method] = BibSortDataCacher(sorting_method)
+        CACHE_SORTED_DATA[sorting_method] = get_bibsort_cacher(sorting_method)
+
+def get_bibsort_cache(method_name):
+    """Return the up-to-date cache of sorting method METHOD_NAME.  When
+    the store file of a mapped method is removed, e.g. because BibSort
+    failed to publish a new version, the data are loaded from the
+    database instead, and the store file published with the next
+    version of the data is mapped."""
+    cacher = CACHE_SORTED_DATA[method_name]
+    if isinstance(cacher, BibSortStore):
+        if not bibsort_store_exists(cacher.method_id):
+            cacher = BibSortDataCacher(method_name)
+    elif cacher.method_id and cacher.timestamp_verifier() > cacher.timestamp and \
+         bibsort_store_exists(cacher.method_id):
+        cacher = get_bibsort_cacher(method_name)
+    if cacher is not CACHE_SORTED_DATA[method_name]:
+        CACHE_SORTED_DATA[method_name] = cacher
+    else:
+        cacher.recreate_cache_if_needed()
+    return cacher.cache
 
 
 def get_tags_from_sort_fields(sort_fields):
@@ -4195,8 +4261,7 @@ def sort_records_bibsort(req, recIDs, sort_method, sort_field='', sort_order='d'
     dummy, irec_max = get_interval_for_records_to_sort(len(recIDs), jrec, rg)
     solution = intbitset()
     input_recids = intbitset(recIDs)
-    CACHE_SORTED_DATA[sort_method].recreate_cache_if_needed()
-    sort_cache = CACHE_SORTED_DATA[sort_method].cache
+    sort_cache = get_bibsort_cache(sort_method)
     bucket_numbers = sort_cache['bucket_data'].keys()
     #check if all buckets have been constructed
     if len(bucket_numbers) != CFG_BIBSORT_BUCKETS:
@@ -4219,49 +4284,114 @@ def sort_records_bibsort(req, recIDs, sort_method, sort_field='', sort_order='d'
         if len(solution) >= irec_max:
             break
 
-    dict_solution = {}
-    missing_records = intbitset()
-    for recid in solution:
-        try:
-            dict_solution[recid] = sort_cache['data_dict_ordered'][recid]
-        except KeyError:
-            #recid is in buckets, but not in the bsrMETHODDATA,
-            #maybe because the value has been deleted, but the change has not yet been propagated to the buckets
-            missing_records.add(recid)
+    reverse = sort_order == 'd'
+    # When sorting on insertion date, newest first, the records that are
+    # missing from BibSort come after the ranked ones, otherwise before:
+    missing_records_first = not (sort_method.strip().lower().startswith('latest') and reverse)
+
+    ranked_recids, ranked_weights, missing_records = \
+        get_bibsort_weights(solution, sort_cache)
     #check if there are recids that are not in any bucket -> to be added at the end/top, ordered by insertion date
     if len(solution) < irec_max:
         #some records have not been yet inserted in the bibsort structures
         #or, some records have no value for the sort_method
         missing_records += input_recids - solution
-    #the records need to be sorted in reverse order for the print record function
-    #the return statement should be equivalent with the following statements
-    #(these are clearer, but less efficient, since they revert the same list twice)
-    #sorted_solution = (missing_records + sorted(dict_solution, key=dict_solution.__getitem__, reverse=sort_order=='d'))[:irec_max]
-    #sorted_solution.reverse()
-    #return sorted_solution
-    reverse = sort_order == 'd'
-
-    if sort_method.strip().lower().startswith('latest') and reverse:
-        # If we want to sort the records on their insertion date, add the missing records at the top
-        solution = sorted(dict_solution, key=dict_solution.__getitem__, reverse=True) + sorted(missing_records, reverse=True)
-    else:
-        solution = sorted(missing_records) + sorted(dict_solution, key=dict_solution.__getitem__, reverse=reverse)
 
-    # Only keep records, we are going to display
+    # Only rank the records we are going to display
     index_min = jrec - 1
     if rg:
         index_max = index_min + rg
-        solution = solution[index_min:index_max]
     else:
-        solution = solution[index_min:]
+        index_max = None
+    nb_to_rank = index_max
+    if missing_records_first and index_max is not None:
+        nb_to_rank = max(index_max - len(missing_records), 0)
+    ranked_recids, ranked_weights = select_top_ranked_recids(ranked_recids, ranked_weights,
+                                                             nb_to_rank, reverse)
+
+    if missing_records_first:
+        solution = sorted(missing_records) + ranked_recids
+        weights = [0] * len(missing_records) + ranked_weights
+    else:
+        solution = ranked_recids + sorted(missing_records, reverse=True)
+        weights = ranked_weights + [0] * len(missing_records)
+
+    solution = solution[index_min:index_max]
 
     if sort_or_rank == 'r':
         # We need the recids, with their ranking score
-        return solution, [dict_solution.get(record, 0) for record in solution]
+        return solution, weights[index_min:index_max]
     else:
         return solution
 
 
+def get_bibsort_weights(recids, sort_cache):
+    """Look up the BibSort weights of RECIDS (an intbitset) in
+    SORT_CACHE.  Return (ranked_recids, ranked_weights,
+    missing_records): the recids having a weight, as a sequence, their
+    weights, as a sequence in the same order, and the intbitset of
+    recids without weight (e.g. because the value has been deleted,
+    but the change has not yet been propagated to the buckets).  When
+    the dense weight array is available, the sequences are numpy
+    arrays and no per-recid Python work is done."""
+    data_array = sort_cache.get('data_array')
+    if data_array is not None:
+        recids_array = numpy.array(recids.tolist(), dtype=numpy.int64)
+        weights = numpy.empty(len(recids_array), dtype=numpy.float64)
+        weights.fill(numpy.nan)
+        known = recids_array < len(data_array)
+        weights[known] = data_array[recids_array[known]]
+        has_weight = ~numpy.isnan(weights)
+        return recids_array[has_weight], weights[has_weight], \
+               intbitset(recids_array[~has_weight].tolist())
+    data_dict_ordered = sort_cache['data_dict_ordered']
+    ranked_recids = []
+    ranked_weights = []
+    missing_records = intbitset()
+    for recid in recids:
+        try:
+            ranked_weights.append(data_dict_ordered[recid])
+            ranked_recids.append(recid)
+        except KeyError:
+            missing_records.add(recid)
+    return ranked_recids, ranked_weights, missing_records
+
+
+def select_top_ranked_recids(recids, weights, k=None, reverse=False):
+    """Return the K first of RECIDS when ordered by their WEIGHTS, in
+    decreasing order if REVERSE, and by increasing recid among equal
+    weights, together with their weights.  Only the K first records are
+    ordered, using partial sorting, so that the cost depends on K
+    rather than on the total number of records.  If K is None, order
+    all of them.  RECIDS and WEIGHTS are sequences as returned by
+    get_bibsort_weights(); the output are lists."""
+    if k is None or k > len(recids):
+        k = len(recids)
+    if k == 0:
+        return [], []
+    if CFG_NUMPY_IMPORTABLE and isinstance(weights, numpy.ndarray):
+        key_recids = recids
+        if reverse:
+            key_weights = -weights
+        else:
+            key_weights = weights
+        if k < len(key_weights) and hasattr(numpy, 'partition'):
+            # keep only candidates not worse than the k-th weight:
+            threshold = numpy.partition(key_weights, k - 1)[k - 1]
+            candidates = key_weights <= threshold
+            key_weights, key_recids = key_weights[candidates], key_recids[candidates]
+            recids, weights = recids[candidates], weights[candidates]
+        order = numpy.lexsort((key_recids, key_weights))[:k]
+        return recids[order].tolist(), \
+               [int(weight) if weight.is_integer() else weight for weight in weights[order].tolist()]
+    pairs = zip(weights, recids)
+    if reverse:
+        pairs = heapq.nsmallest(k, pairs, key=lambda pair: (-pair[0], pair[1]))
+    else:
+        pairs = heapq.nsmallest(k, pairs)
+    return [recid for dummy, recid in pairs], [weight for weight, dummy in pairs]
+
+
 def slice_records(recIDs, jrec, rg):
     if not jrec:
         jrec = 1
@@ -4289,9 +4419,6 @@ def sort_records_bibxxx(req, recIDs, tags, sort_field='', sort_order='d', sort_p
             write_warning(_("Sorry, sorting is allowed on sets of up to %d records only. Using default sort order.") % CFG_WEBSEARCH_NB_RECORDS_TO_SORT, "Warning", req=req)
         return slice_records(recIDs, jrec, rg)
 
-    recIDs_dict = {}
-    recIDs_out = []
-
     if not tags:
         # tags have not been camputed yet
         sort_fields = sort_field.split(',')
@@ -4308,17 +4435,19 @@ def sort_records_bibxxx(req, recIDs, tags, sort_field='', sort_order='d', sort_p
 
     ## check if we have sorting tag defined:
     if tags:
-        # fetch the necessary field values:
-        for recID in recIDs:
-            val = "" # will hold value for recID according to which sort
-            vals = [] # will hold all values found in sorting tag for recID
-            for tag in tags:
+        # fetch the necessary field values, for all records at once:
+        recIDs_vals = {}
+        for tag in tags:
+            for recID, tag_vals in get_fieldvalues_by_recid(recIDs, tag).iteritems():
                 if CFG_CERN_SITE and tag == '773__c':
                     # CERN hack: journal sorting
                     # 773__c contains page numbers, e.g. 3-13, and we want to sort by 3, and numerically:
-                    vals.extend(["%050s" % x.split("-", 1)[0] for x in get_fieldvalues(recID, tag)])
-                else:
-                    vals.extend(get_fieldvalues(recID, tag))
+                    tag_vals = ["%050s" % x.split("-", 1)[0] for x in tag_vals]
+                recIDs_vals.setdefault(recID, []).extend(tag_vals)
+        sort_keys = []
+        for position, recID in enumerate(recIDs):
+            val = "" # will hold value for recID according to which sort
+            vals = recIDs_vals.get(recID, []) # all values found in sorting tags for recID
             if sort_pattern:
                 # try to pick that tag value that corresponds to sort pattern
                 bingo = 0
@@ -4333,20 +4462,17 @@ def sort_records_bibxxx(req, recIDs, tags, sort_field='', sort_order='d', sort_p
                 # no sort pattern defined, so join them all together
                 val = ''.join(vals)
             val = strip_accents(val.lower()) # sort values regardless of accents and case
-            if val in recIDs_dict:
-                recIDs_dict[val].append(recID)
-            else:
-                recIDs_dict[val] = [recID]
+            sort_keys.append((val, position, recID))
 
-        # create output array:
-        for k in sorted(recIDs_dict.keys()):
-            recIDs_out.extend(recIDs_dict[k])
-
-        # ascending or descending?
+        # select only the records up to the maximum that we need,
+        # in ascending or descending order:
+        dummy, irec_max = get_interval_for_records_to_sort(len(sort_keys), jrec, rg)
         if sort_order == 'd':
-            recIDs_out.reverse()
+            sort_keys = heapq.nlargest(irec_max, sort_keys)
+        else:
+            sort_keys = heapq.nsmallest(irec_max, sort_keys)
 
-        recIDs = recIDs_out
+        recIDs = [recID for dummy_val, dummy_position, recID in sort_keys]
 
     # return only up to the maximum that we need
     return slice_records(recIDs, jrec, rg)
@@ -4507,6 +4633,8 @@ def print_records(req, recIDs, jrec=1, rg=CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS, f
             # we are doing HTML output:
             if format == 'hp' or format.startswith("hb_") or format.startswith("hd_"):
                 # portfolio and on-the-fly formats:
+                batch = prefetch_print_records(recIDs, format, ot, ln, search_pattern,
+                                               user_info, verbose)
                 for recid in recIDs:
                     req.write(print_record(recid,
                                            format,
@@ -4518,7 +4646,8 @@ def print_records(req, recIDs, jrec=1, rg=CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS, f
                                            sf=sf,
                                            so=so,
                                            sp=sp,
-                                           rm=rm))
+                                           rm=rm,
+                                           batch=batch))
             elif format.startswith("hb"):
                 # HTML brief format:
                 display_add_to_basket = True
@@ -4532,6 +4661,12 @@ def print_records(req, recIDs, jrec=1, rg=CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS, f
                 if em != "" and EM_REPOSITORY["basket"] not in em:
                     display_add_to_basket = False
                 req.write(websearch_templates.tmpl_record_format_htmlbrief_header(ln=ln))
+                batch = prefetch_print_records(recIDs, format, ot, ln, search_pattern,
+                                               user_info, verbose)
+                citation_counts = {}
+                if CFG_BIBRANK_SHOW_CITATION_LINKS:
+                    # for the "Cited by" links of every record:
+                    citation_counts = get_cited_by_counts(recIDs)
                 for irec, recid in enumerate(recIDs):
                     row_number = jrec+irec
                     if relevances and relevances[irec]:
@@ -4548,7 +4683,9 @@ def print_records(req, recIDs, jrec=1, rg=CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS, f
                                           sf=sf,
                                           so=so,
                                           sp=sp,
-                                          rm=rm)
+                                          rm=rm,
+                                          batch=batch,
+                                          num_timescited=citation_counts.get(recid))
 
                     req.write(websearch_templates.tmpl_record_format_htmlbrief_body(
                         ln=ln,
@@ -4866,8 +5003,24 @@ def get_record(recid):
                 return deserialize_via_marshal(val)
     return create_record(print_record(recid, 'xm'))[0]
 
+def get_records(recids):
+    """Return dictionary of recid->record object for RECIDS, fetching
+    the serialized record structures with one query."""
+    out = {}
+    recids = list(recids)
+    if CFG_BIBUPLOAD_SERIALIZE_RECORD_STRUCTURE and recids:
+        res = run_sql("SELECT id_bibrec, value FROM bibfmt WHERE id_bibrec IN (%s) AND format='recstruct'" % \
+                      ','.join(['%s'] * len(recids)), recids)
+        for recid, value in res:
+            out[recid] = deserialize_via_marshal(value)
+    for recid in recids:
+        if recid not in out:
+            out[recid] = get_record(recid)
+    return out
+
 def print_record(recID, format='hb', ot='', ln=CFG_SITE_LANG, decompress=zlib.decompress,
-                 search_pattern=None, user_info=None, verbose=0, sf='', so='d', sp='', rm=''):
+                 search_pattern=None, user_info=None, verbose=0, sf='', so='d', sp='', rm='',
+                 batch=None, num_timescited=None):
     """
     Prints record 'recID' formatted according to 'format'.
 
@@ -4875,6 +5028,13 @@ def print_record(recID, format='hb', ot='', ln=CFG_SITE_LANG, decompress=zlib.de
     only for proper linking purposes: e.g. when a certain ranking
     method or a certain sort field was selected, keep it selected in
     any dynamic search links that may be printed.
+
+    'batch' is an optional BibFormatBatch prefetching the data of a
+    list of records including 'recID' (see prefetch_print_records()).
+
+    'num_timescited' is the number of records citing 'recID', if
+    already known, e.g. fetched with get_cited_by_counts() for a page
+    of records.
     """
     if format == 'recstruct':
         return get_record(recID)
@@ -4916,7 +5076,10 @@ def print_record(recID, format='hb', ot='', ln=CFG_SITE_LANG, decompress=zlib.de
     out = ""
 
     # sanity check:
-    record_exist_p = record_exists(recID)
+    if batch is not None and recID in batch:
+        record_exist_p = batch.existence[recID]
+    else:
+        record_exist_p = record_exists(recID)
     if record_exist_p == 0: # doesn't exist
         return out
 
@@ -4941,7 +5104,7 @@ def print_record(recID, format='hb', ot='', ln=CFG_SITE_LANG, decompress=zlib.de
                 out += ' ' + _("The record %d replaces it." % merged_recid)
         else:
             out += call_bibformat(recID, format, ln, search_pattern=search_pattern,
-                                  user_info=user_info, verbose=verbose)
+                                  user_info=user_info, verbose=verbose, batch=batch)
 
             # at the end of HTML brief mode, print the "Detailed record" functionality:
             if format.lower().startswith('hb') and \
@@ -4953,7 +5116,8 @@ def print_record(recID, format='hb', ot='', ln=CFG_SITE_LANG, decompress=zlib.de
                                                                          sp=sp,
                                                                          rm=rm,
                                                                          display_claim_link=display_claim_this_paper,
-                                                                         display_edit_link=can_edit_record)
+                                                                         display_edit_link=can_edit_record,
+                                                                         num_timescited=num_timescited)
         return out
 
     if format == "marcxml" or format == "oai_dc":
@@ -5245,7 +5409,8 @@ def print_record(recID, format='hb', ot='', ln=CFG_SITE_LANG, decompress=zlib.de
                                                                          sp=sp,
                                                                          rm=rm,
                                                                          display_claim_link=display_claim_this_paper,
-                                                                         display_edit_link=can_edit_record)
+                                                                         display_edit_link=can_edit_record,
+                                                                         num_timescited=num_timescited)
 
     # print record closing tags, if needed:
     if format == "marcxml" or format == "oai_dc":
@@ -5254,15 +5419,12 @@ def print_record(recID, format='hb', ot='', ln=CFG_SITE_LANG, decompress=zlib.de
 
     return out
 
-def call_bibformat(recID, format="HD", ln=CFG_SITE_LANG, search_pattern=None, user_info=None, verbose=0):
+def get_search_pattern_keywords(search_pattern):
     """
-    Calls BibFormat and returns formatted record.
-
-    BibFormat will decide by itself if old or new BibFormat must be used.
+    Return the list of keywords of SEARCH_PATTERN that BibFormat
+    should highlight, i.e. the positive terms searched in any field
+    or in fulltext.
     """
-
-    from invenio.bibformat_utils import get_pdf_snippets
-
     keywords = []
     if search_pattern is not None:
         for unit in create_basic_search_units(None, str(search_pattern), None):
@@ -5273,13 +5435,41 @@ def call_bibformat(recID, format="HD", ln=CFG_SITE_LANG, search_pattern=None, us
                     keywords.append(bsu_p[1:-1])
                 else:
                     keywords.append(bsu_p)
+    return keywords
+
+def prefetch_print_records(recIDs, format, ot='', ln=CFG_SITE_LANG, search_pattern=None,
+                           user_info=None, verbose=0):
+    """
+    Return BibFormatBatch fetching at once the data needed by
+    print_record() for formatting RECIDS, or None if BibFormat would
+    not format them in one batch, e.g. in debug mode or when only
+    some fields are output.
+    """
+    if verbose or ot or not recIDs:
+        return None
+    return prefetch_records(recIDs, format, ln=ln,
+                            search_pattern=get_search_pattern_keywords(search_pattern),
+                            user_info=user_info)
+
+def call_bibformat(recID, format="HD", ln=CFG_SITE_LANG, search_pattern=None, user_info=None, verbose=0,
+                   batch=None):
+    """
+    Calls BibFormat and returns formatted record.
+
+    BibFormat will decide by itself if old or new BibFormat must be used.
+    """
+
+    from invenio.bibformat_utils import get_pdf_snippets
+
+    keywords = get_search_pattern_keywords(search_pattern)
 
     out = format_record(recID,
                          of=format,
                          ln=ln,
                          search_pattern=keywords,
                          user_info=user_info,
-                         verbose=verbose)
+                         verbose=verbose,
+                         batch=batch)
 
     if CFG_WEBSEARCH_FULLTEXT_SNIPPETS and user_info and \
            'fulltext' in user_info['uri'].lower():
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+In-process term dictionaries for the idxWORD, idxPAIR and idxPHRASE
+forward index tables.
+
+Each Apache/WSGI worker keeps, per index table, the sorted list of all
+the terms of the table and a memory-bounded LRU cache of deserialized
+hitlists.  Exact, truncated (LIKE) and span (BETWEEN) term lookups are
+then answered in-process, and only the hitlists that are not cached
+yet are fetched from the database, in bulk.
+
+Term comparison follows the default MySQL collation used by Invenio
+tables, i.e. it is case and accent insensitive.
+
+The dictionaries are disabled unless CFG_WEBSEARCH_TERM_DICTIONARY_MAX_TERMS
+is set; tables holding more terms than that are always searched in SQL.
+"""
+
+__revision__ = "$Id$"
+
+import re
+import time
+from bisect import bisect_left
+
+from invenio.config import \
+     CFG_WEBSEARCH_TERM_DICTIONARY_MAX_TERMS, \
+     CFG_WEBSEARCH_TERM_DICTIONARY_HITLIST_CACHE_SIZE
+from invenio.dbquery import run_sql, get_table_update_time
+from invenio.intbitset import intbitset
+from invenio.memoiseutils import LRUCache
+from invenio.textutils import strip_accents
+
+## how many hitlists to fetch from the database in one query:
+CFG_TERM_DICTIONARY_FETCH_CHUNK_SIZE = 500
+
+def get_term_collation_key(term):
+    """Return the key under which TERM is compared and sorted,
+    emulating the case and accent insensitive MySQL collation."""
+    return strip_accents(str(term)).lower()
+
+def like_pattern_to_regexp(pattern):
+    """Translate an SQL LIKE PATTERN into a compiled regular expression
+    matching the whole term."""
+    out = []
+    escaped = False
+    for char in pattern:
+        if escaped:
+            out.append(re.escape(char))
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '%':
+            out.append('.*')
+        elif char == '_':
+            out.append('.')
+        else:
+            out.append(re.escape(char))
+    return re.compile(''.join(out) + '$', re.DOTALL)
+
+def get_like_pattern_prefix(pattern):
+    """Return the literal prefix of the SQL LIKE PATTERN, i.e. the part
+    before the first wildcard character."""
+    prefix = []
+    escaped = False
+    for char in pattern:
+        if escaped:
+            prefix.append(char)
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char in ('%', '_'):
+            break
+        else:
+            prefix.append(char)
+    return ''.join(prefix)
+
+class IndexTermDictionary(object):
+    """
+    Sorted term dictionary of one forward index table, together with
+    an LRU cache of its hitlists.  Clients should call
+    recreate_cache_if_needed() before every lookup, like they do with
+    DataCacher objects; when the table holds more than MAX_TERMS terms
+    the dictionary is not usable (see is_ok_p).
+    """
+    def __init__(self, table, max_terms=CFG_WEBSEARCH_TERM_DICTIONARY_MAX_TERMS,
+                 hitlist_cache_size=CFG_WEBSEARCH_TERM_DICTIONARY_HITLIST_CACHE_SIZE):
+        """
+        @param table: name of the forward index table, e.g. idxWORD01F
+        @param max_terms: do not load tables with more terms than this
+        @param hitlist_cache_size: maximal size of cached hitlists, in MB
+        """
+        self.table = table
+        self.max_terms = max_terms
+        self.timestamp = ''
+        self.is_ok_p = False
+        self.keys = [] # sorted collation keys
+        self.terms = [] # terms, in the same order as keys
+        self.hitsets = LRUCache(hitlist_cache_size * 1024 * 1024,
+                                weigh=lambda hitset: hitset.get_allocated() * hitset.get_wordbytsize())
+
+    def create_cache(self):
+        """Load the sorted term list of the table.  Like for DataCacher,
+        the load time is stored, to be compared with the update time of
+        the table."""
+        self.timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        self.hitsets.clear()
+        res = run_sql("SELECT term FROM %s LIMIT %%s" % self.table, (self.max_terms + 1,)) #kwalitee:disable=sql
+        if len(res) > self.max_terms:
+            self.keys, self.terms = [], []
+            self.is_ok_p = False
+            return
+        decorated = [(get_term_collation_key(row[0]), row[0]) for row in res if row[0] is not None]
+        decorated.sort()
+        self.keys = [key for key, dummy_term in decorated]
+        self.terms = [term for dummy_key, term in decorated]
+        self.is_ok_p = True
+
+    def recreate_cache_if_needed(self):
+        """Reload the dictionary if the index table has been updated
+        after the dictionary was loaded."""
+        if get_table_update_time(self.table) > self.timestamp:
+            self.create_cache()
+
+    def get_terms_equal(self, term):
+        """Return terms equal to TERM under the collation."""
+        key = get_term_collation_key(term)
+        out = []
+        idx = bisect_left(self.keys, key)
+        while idx < len(self.keys) and self.keys[idx] == key:
+            out.append(self.terms[idx])
+            idx += 1
+        return out
+
+    def get_terms_like(self, pattern):
+        """Return terms matching the SQL LIKE PATTERN."""
+        prefix = get_term_collation_key(get_like_pattern_prefix(pattern))
+        regexp = like_pattern_to_regexp(get_term_collation_key(pattern))
+        out = []
+        idx = bisect_left(self.keys, prefix)
+        while idx < len(self.keys) and self.keys[idx].startswith(prefix):
+            if regexp.match(self.keys[idx]):
+                out.append(self.terms[idx])
+            idx += 1
+        return out
+
+    def get_terms_between(self, low, high):
+        """Return terms between LOW and HIGH inclusive.  If both LOW
+        and HIGH are integers, the comparison is numerical, as for
+        the MySQL BETWEEN operator."""
+        if isinstance(low, (int, long)) and isinstance(high, (int, long)):
+            out = []
+            for term in self.terms:
+                try:
+                    if low <= int(term) <= high:
+                        out.append(term)
+                except ValueError:
+                    continue
+            return out
+        low = get_term_collation_key(low)
+        high = get_term_collation_key(high)
+        out = []
+        idx = bisect_left(self.keys, low)
+        while idx < len(self.keys) and self.keys[idx] <= high:
+            out.append(self.terms[idx])
+            idx += 1
+        return out
+
+    def get_hitsets(self, terms):
+        """Return list of (term, hitset) for TERMS, fetching hitlists
+        that are not cached yet in bulk.  The hitsets are shared with
+        the cache, so callers must copy them before updating them in
+        place."""
+        cold_terms = [term for term in terms if term not in self.hitsets]
+        for i in range(0, len(cold_terms), CFG_TERM_DICTIONARY_FETCH_CHUNK_SIZE):
+            chunk = cold_terms[i:i + CFG_TERM_DICTIONARY_FETCH_CHUNK_SIZE]
+            res = run_sql("SELECT term,hitlist FROM %s WHERE term IN (%s)" % \
+                          (self.table, ','.join(['%s'] * len(chunk))), chunk) #kwalitee:disable=sql
+            for term, hitlist in res:
+                self.hitsets.set(term, intbitset(hitlist))
+        out = []
+        for term in terms:
+            hitset = self.hitsets.get(term)
+            if hitset is None:
+                # too large to be cached (or just evicted), so fetch
+                # it directly:
+                res = run_sql("SELECT hitlist FROM %s WHERE term=%%s" % self.table, (term,)) #kwalitee:disable=sql
+                if not res:
+                    continue
+                hitset = intbitset(res[0][0])
+            out.append((term, hitset))
+        return out
+
+_TERM_DICTIONARIES = {}
+
+def get_term_dictionary(table):
+    """Return up-to-date term dictionary for index TABLE, or None if
+    term dictionaries are disabled or the table is too big."""
+    if not CFG_WEBSEARCH_TERM_DICTIONARY_MAX_TERMS:
+        return None
+    try:
+        term_dictionary = _TERM_DICTIONARIES[table]
+        term_dictionary.recreate_cache_if_needed()
+    except KeyError:
+        term_dictionary = IndexTermDictionary(table)
+        term_dictionary.create_cache()
+        _TERM_DICTIONARIES[table] = term_dictionary
+    if not term_dictionary.is_ok_p:
+        return None
+    return term_dictionary
+
+def search_term_dictionary(table, query_addons, query_params, wildcard_limit=0):
+    """
+    In-process equivalent of running:
+
+        SELECT term,hitlist FROM TABLE WHERE term QUERY_ADDONS
+
+    with QUERY_ADDONS being one of '= %s', 'LIKE %s' or
+    'BETWEEN %s AND %s'.  Return None if the query cannot be answered
+    from the term dictionary, so that the caller can fall back to SQL.
+    Otherwise return (res, limit_reached) with RES being a list of
+    (term, hitset) tuples and LIMIT_REACHED telling whether more than
+    WILDCARD_LIMIT terms matched, in which case only the first
+    WILDCARD_LIMIT are returned, as run_sql_with_limit() does.
+    """
+    term_dictionary = get_term_dictionary(table)
+    if term_dictionary is None:
+        return None
+    if query_addons == '= %s':
+        terms = term_dictionary.get_terms_equal(query_params[0])
+    elif query_addons == 'LIKE %s':
+        terms = term_dictionary.get_terms_like(query_params[0])
+    elif query_addons == 'BETWEEN %s AND %s':
+        terms = term_dictionary.get_terms_between(query_params[0], query_params[1])
+    else:
+        return None
+    limit_reached = False
+    if wildcard_limit > 0 and len(terms) >= wildcard_limit:
+        terms = terms[:wildcard_limit]
+        limit_reached = True
+    return term_dictionary.get_hitsets(terms), limit_reached
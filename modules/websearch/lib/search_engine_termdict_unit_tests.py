@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the search engine term dictionaries."""
+
+__revision__ = \
+    "$Id$"
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite
+from invenio import search_engine_termdict
+from invenio.search_engine_termdict import \
+     IndexTermDictionary, \
+     get_like_pattern_prefix, \
+     get_term_collation_key, \
+     like_pattern_to_regexp
+
+class TestLikePatterns(InvenioTestCase):
+    """Test translation of SQL LIKE patterns."""
+
+    def test_like_pattern_prefix(self):
+        """search engine termdict - LIKE pattern prefix"""
+        self.assertEqual(get_like_pattern_prefix('ell%'), 'ell')
+        self.assertEqual(get_like_pattern_prefix('e_l%'), 'e')
+        self.assertEqual(get_like_pattern_prefix('%ell'), '')
+        self.assertEqual(get_like_pattern_prefix('50\\%%'), '50%')
+
+    def test_like_pattern_regexp(self):
+        """search engine termdict - LIKE pattern regexp"""
+        self.failUnless(like_pattern_to_regexp('ell%').match('ellis'))
+        self.failUnless(like_pattern_to_regexp('e%s').match('ellis'))
+        self.failUnless(like_pattern_to_regexp('el_is').match('ellis'))
+        self.failIf(like_pattern_to_regexp('el_is').match('elliss'))
+        self.failIf(like_pattern_to_regexp('50\\%').match('500'))
+        self.failUnless(like_pattern_to_regexp('a.c').match('a.c'))
+        self.failIf(like_pattern_to_regexp('a.c').match('abc'))
+
+class TestIndexTermDictionaryLookups(InvenioTestCase):
+    """Test term lookups of the in-process term dictionary."""
+
+    def setUp(self):
+        """Build a term dictionary without touching the database."""
+        self.term_dictionary = IndexTermDictionary('idxWORD01F', 100, 1)
+        terms = ['ellis', 'Ellison', 'elephant', 'muon', 'quark', '12', '3']
+        decorated = sorted([(get_term_collation_key(term), term) for term in terms])
+        self.term_dictionary.keys = [key for key, dummy_term in decorated]
+        self.term_dictionary.terms = [term for dummy_key, term in decorated]
+
+    def test_terms_equal(self):
+        """search engine termdict - exact term lookup"""
+        self.assertEqual(self.term_dictionary.get_terms_equal('ellis'), ['ellis'])
+        self.assertEqual(self.term_dictionary.get_terms_equal('ELLISON'), ['Ellison'])
+        self.assertEqual(self.term_dictionary.get_terms_equal('ell'), [])
+
+    def test_terms_like(self):
+        """search engine termdict - truncated term lookup"""
+        self.assertEqual(self.term_dictionary.get_terms_like('ell%'), ['ellis', 'Ellison'])
+        self.assertEqual(self.term_dictionary.get_terms_like('e%n%'), ['elephant', 'Ellison'])
+        self.assertEqual(self.term_dictionary.get_terms_like('%ar%'), ['quark'])
+
+    def test_terms_between(self):
+        """search engine termdict - span term lookup"""
+        self.assertEqual(self.term_dictionary.get_terms_between('ellis', 'muon'),
+                         ['ellis', 'Ellison', 'muon'])
+        self.assertEqual(self.term_dictionary.get_terms_between(3, 20), ['12', '3'])
+
+class TestIndexTermDictionaryReload(InvenioTestCase):
+    """Test the reloading of the in-process term dictionary."""
+
+    def setUp(self):
+        """Replace the database accesses of the term dictionary."""
+        self.loads = 0
+        self.update_time = '2014-01-01 00:00:00'
+        def run_sql(dummy_query, dummy_param=None):
+            self.loads += 1
+            return (('ellis',), ('muon',))
+        self.run_sql = search_engine_termdict.run_sql
+        self.get_table_update_time = search_engine_termdict.get_table_update_time
+        search_engine_termdict.run_sql = run_sql
+        search_engine_termdict.get_table_update_time = lambda dummy_table: self.update_time
+
+    def tearDown(self):
+        search_engine_termdict.run_sql = self.run_sql
+        search_engine_termdict.get_table_update_time = self.get_table_update_time
+
+    def test_no_reload_of_unchanged_table(self):
+        """search engine termdict - no reload while the table is unchanged"""
+        term_dictionary = IndexTermDictionary('idxWORD01F', 100, 1)
+        term_dictionary.recreate_cache_if_needed()
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(term_dictionary.get_terms_equal('Ellis'), ['ellis'])
+        term_dictionary.recreate_cache_if_needed()
+        term_dictionary.recreate_cache_if_needed()
+        self.assertEqual(self.loads, 1)
+
+    def test_reload_of_updated_table(self):
+        """search engine termdict - reload after the table is updated"""
+        term_dictionary = IndexTermDictionary('idxWORD01F', 100, 1)
+        term_dictionary.recreate_cache_if_needed()
+        self.update_time = '9999-12-31 23:59:59'
+        term_dictionary.recreate_cache_if_needed()
+        self.assertEqual(self.loads, 2)
+
+TEST_SUITE = make_test_suite(TestLikePatterns,
+                             TestIndexTermDictionaryLookups,
+                             TestIndexTermDictionaryReload)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -264,9 +264,30 @@ class TestQueryParser(InvenioTestCase):
         self._check('title:"s = 630"', None, None,
                     [['+', 's = 630', 'title', 'a']])
 
+class TestSortingHelpers(InvenioTestCase):
+    """Test partial sorting of records by BibSort weights."""
+
+    def test_select_top_ranked_recids_ascending(self):
+        """search engine - top ranked records, ascending"""
+        self.assertEqual(search_engine.select_top_ranked_recids([1, 2, 3, 4], [40, 10, 30, 10], 3),
+                         ([2, 4, 3], [10, 10, 30]))
+
+    def test_select_top_ranked_recids_descending(self):
+        """search engine - top ranked records, descending"""
+        self.assertEqual(search_engine.select_top_ranked_recids([1, 2, 3, 4], [40, 10, 30, 10], 3, True),
+                         ([1, 3, 2], [40, 30, 10]))
+
+    def test_select_top_ranked_recids_all(self):
+        """search engine - ranking all records"""
+        self.assertEqual(search_engine.select_top_ranked_recids([1, 2, 3], [3, 2, 1]),
+                         ([3, 2, 1], [1, 2, 3]))
+        self.assertEqual(search_engine.select_top_ranked_recids([1, 2, 3], [3, 2, 1], 0),
+                         ([], []))
+
 TEST_SUITE = make_test_suite(TestWashQueryParameters,
                              TestQueryParser,
-                             TestMiscUtilityFunctions)
+                             TestMiscUtilityFunctions,
+                             TestSortingHelpers)
 
 
 if __name__ == "__main__":
@@ -89,6 +89,41 @@ def get_fieldvalues(recIDs, tag, repetitive_values=True, sort=True, split_by=0):
     return out
 
 
+def get_fieldvalues_by_recid(recIDs, tag):
+    """
+    Return dictionary of field values for field TAG for the given list
+    of record IDs, with one query for all of them.  Keys are record
+    IDs, values are the lists of field values of each record, in the
+    same order as get_fieldvalues() would return them.  Records
+    without value for TAG are not present in the dictionary.
+    """
+    out = {}
+    if not recIDs:
+        return out
+    if tag == "001___":
+        for recID in recIDs:
+            out[recID] = [str(recID)]
+        return out
+    digits = tag[0:2]
+    try:
+        intdigits = int(digits)
+        if intdigits < 0 or intdigits > 99:
+            raise ValueError
+    except ValueError:
+        # invalid tag value asked for
+        return out
+    bx = "bib%sx" % digits
+    bibx = "bibrec_bib%sx" % digits
+    recIDs = list(recIDs)
+    query = "SELECT bibx.id_bibrec, bx.value FROM %s AS bx, %s AS bibx " \
+            "WHERE bibx.id_bibrec IN (%s) AND bx.id=bibx.id_bibxxx AND " \
+            "bx.tag LIKE %%s ORDER BY bibx.field_number, bx.tag ASC" % \
+            (bx, bibx, ("%s,"*len(recIDs))[:-1])
+    for recID, value in run_sql(query, tuple(recIDs) + (tag,)):
+        out.setdefault(recID, []).append(value)
+    return out
+
+
 def get_fieldvalues_alephseq_like(recID, tags_in, can_see_hidden=False):
     """Return buffer of ALEPH sequential-like textual format with fields found
        in the list TAGS_IN for record RECID.
@@ -201,3 +236,23 @@ def record_exists(recID):
         else:
             out = 1 # exists fine
     return out
+
+def records_exist(recIDs):
+    """Return dictionary of recID->record_exists(recID) for the list of
+       record IDs RECIDS, with two queries for all of them."""
+    out = {}
+    for recID in recIDs:
+        out[recID] = 0
+    if not out:
+        return out
+    res = run_sql("SELECT id FROM bibrec WHERE id IN (%s)" % \
+                  ','.join(['%s'] * len(out)), out.keys())
+    existing = [row[0] for row in res]
+    dbcollids = get_fieldvalues_by_recid(existing, "980__%")
+    for recID in existing:
+        values = dbcollids.get(recID, [])
+        if ("DELETED" in values) or (CFG_CERN_SITE and "DUMMY" in values):
+            out[recID] = -1 # exists, but marked as deleted
+        else:
+            out[recID] = 1 # exists fine
+    return out
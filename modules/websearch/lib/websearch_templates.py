@@ -1642,7 +1642,7 @@ class Template:
         out += """</select>"""
         return out
 
-    def tmpl_record_links(self, recid, ln, sf='', so='d', sp='', rm=''):
+    def tmpl_record_links(self, recid, ln, sf='', so='d', sp='', rm='', num_timescited=None):
         """
           Displays the *More info* and *Find similar* links for a record
 
@@ -1651,6 +1651,9 @@ class Template:
           - 'ln' *string* - The language to display
 
           - 'recid' *string* - the id of the displayed record
+
+          - 'num_timescited' *int* - the number of records citing it,
+            if already known
         """
 
         # load the right message language
@@ -1666,7 +1669,8 @@ class Template:
                                         {'class': "moreinfo"})}
 
         if CFG_BIBRANK_SHOW_CITATION_LINKS:
-            num_timescited = get_cited_by_count(recid)
+            if num_timescited is None:
+                num_timescited = get_cited_by_count(recid)
             if num_timescited:
                 out += '''<span class="moreinfo"> - %s </span>''' % \
                        create_html_link(self.build_search_url(p='refersto:recid:%d' % recid,
@@ -3417,7 +3421,7 @@ class Template:
 
         return out
 
-    def tmpl_print_record_brief_links(self, ln, recID, sf='', so='d', sp='', rm='', display_claim_link=False, display_edit_link=False):
+    def tmpl_print_record_brief_links(self, ln, recID, sf='', so='d', sp='', rm='', display_claim_link=False, display_edit_link=False, num_timescited=None):
         """Displays links for brief record on-the-fly
 
         Parameters:
@@ -3425,6 +3429,9 @@ class Template:
           - 'ln' *string* - The language to display
 
           - 'recID' *int* - The record id
+
+          - 'num_timescited' *int* - the number of records citing it,
+            if already known
         """
         from invenio.webcommentadminlib import get_nb_reviews, get_nb_comments
 
@@ -3461,7 +3468,8 @@ class Template:
                                     {'class': "moreinfo"})
 
         if CFG_BIBRANK_SHOW_CITATION_LINKS:
-            num_timescited = get_cited_by_count(recID)
+            if num_timescited is None:
+                num_timescited = get_cited_by_count(recID)
             if num_timescited:
                 out += '<span class="moreinfo"> - %s</span>' % \
                        create_html_link(self.build_search_url(p="refersto:recid:%d" % recID,
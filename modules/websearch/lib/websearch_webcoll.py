@@ -41,11 +41,14 @@ from invenio.config import \
      CFG_WEBSEARCH_ENABLED_SEARCH_INTERFACES, \
      CFG_WEBSEARCH_DEFAULT_SEARCH_INTERFACE, \
      CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS, \
+     CFG_BIBRANK_SHOW_CITATION_LINKS, \
      CFG_SCOAP3_SITE
 from invenio.messages import gettext_set_language, language_list_long
 from invenio.search_engine import search_pattern_parenthesised, get_creation_date, get_field_i18nname, collection_restricted_p, sort_records, EM_REPOSITORY
 from invenio.dbquery import run_sql, Error, get_table_update_time
+from invenio.data_cacher import bump_cache_generation
 from invenio.bibrank_record_sorter import get_bibrank_methods
+from invenio.bibrank_citation_searcher import get_cited_by_counts
 from invenio.dateutils import convert_datestruct_to_dategui, strftime
 from invenio.bibformat import format_record
 from invenio.shellutils import mymkdir
@@ -528,6 +531,9 @@ class Collection:
 
         if latest_additions_info_p:
             passIDs = []
+            citation_counts = {}
+            if CFG_BIBRANK_SHOW_CITATION_LINKS:
+                citation_counts = get_cited_by_counts([info['id'] for info in self.latest_additions_info[:rg]])
             for idx in range(0, min(len(self.latest_additions_info), rg)):
                 # CERN hack: display the records in a grid layout, so do not show the related links
                 if CFG_CERN_SITE and self.name in ['Videos']:
@@ -539,7 +545,8 @@ class Collection:
                                     'body': self.latest_additions_info[idx]['format'] + \
                                      websearch_templates.tmpl_record_links(recid=self.latest_additions_info[idx]['id'],
                                                                               rm='citation',
-                                                                              ln=ln),
+                                                                              ln=ln,
+                                                                              num_timescited=citation_counts.get(self.latest_additions_info[idx]['id'])),
                                     'date': self.latest_additions_info[idx]['date']})
 
             if self.nbrecs > rg:
@@ -1178,6 +1185,9 @@ def task_run_core():
                 coll.update_reclist()
                 task_update_progress("Part 1/2: done %d/%d" % (i, len(colls)))
                 task_sleep_now_if_required(can_stop_too=True)
+            # let the search processes reload the updated reclists:
+            if [coll for coll in colls if coll.reclist_updated_since_start]:
+                bump_cache_generation('collection')
         # thirdly, update collection webpage cache:
         if task_get_option("part", 2) == 2:
             i = 0
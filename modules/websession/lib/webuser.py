@@ -80,7 +80,7 @@ from invenio.webgroup_dblayer import get_groups
 from invenio.external_authentication import InvenioWebAccessExternalAuthError
 from invenio.access_control_config import CFG_EXTERNAL_AUTHENTICATION, \
     CFG_WEBACCESS_MSGS, CFG_WEBACCESS_WARNING_MSGS, CFG_EXTERNAL_AUTH_DEFAULT, \
-    CFG_TEMP_EMAIL_ADDRESS
+    CFG_TEMP_EMAIL_ADDRESS, CFG_ACC_AUTHORIZATION_MEMO_KEY
 from invenio.webuser_config import CFG_WEBUSER_USER_TABLES
 import invenio.template
 tmpl = invenio.template.load('websession')
@@ -1258,6 +1258,8 @@ def collect_user_info(req, login_time=False, refresh=False):
                 user_info = req._user_info
                 if not refresh:
                     return req._user_info
+                ## authorizations might have changed since the memo was made
+                user_info.pop(CFG_ACC_AUTHORIZATION_MEMO_KEY, None)
             req._user_info = user_info
             try:
                 user_info['remote_ip'] = req.remote_ip
@@ -19,7 +19,16 @@ __revision__ = "$Id$"
 __lastupdated__ = "$Date$"
 
 import calendar, commands, datetime, time, os, cPickle, random, cgi
+from bisect import bisect_left
 from operator import itemgetter
+
+try:
+    ## import optional module:
+    import numpy
+    CFG_NUMPY_IMPORTABLE = True
+except ImportError:
+    CFG_NUMPY_IMPORTABLE = False
+
 from invenio.config import CFG_TMPDIR, \
     CFG_SITE_URL, \
     CFG_SITE_NAME, \
@@ -43,7 +52,9 @@ from invenio.search_engine import perform_request_search, \
     search_pattern
 from invenio.search_engine_utils import get_fieldvalues
 from invenio.dbquery import run_sql, \
-    wash_table_column_name
+    wash_table_column_name, \
+    get_table_update_time
+from invenio.data_cacher import DataCacher
 from invenio.websubmitadmin_dblayer import get_docid_docname_alldoctypes
 from invenio.bibcirculation_utils import book_title_from_MARC, \
     book_information_from_MARC
@@ -52,6 +63,7 @@ from invenio.bibcirculation_dblayer import get_id_bibrec, \
 from invenio.websearch_webcoll import CFG_CACHE_LAST_UPDATED_TIMESTAMP_FILE
 from invenio.dateutils import convert_datetext_to_datestruct, convert_datestruct_to_dategui
 from invenio.bibtask import get_modified_records_since
+from invenio.webstat_rollup import get_keyevent_counts, get_keyevent_total
 
 
 WEBSTAT_SESSION_LENGTH = 48 * 60 * 60 # seconds
@@ -81,6 +93,20 @@ def get_keyevent_trend_collection_population(args, return_sql=False):
     """
     # collect action dates
     lower = _to_datetime(args['t_start'], args['t_format']).isoformat()
+    if args.get('collection', 'All') != 'All' and not return_sql:
+        ids = get_collection_reclist(args['collection'])
+        if len(ids) == 0:
+            return []
+        return _get_population_trend(args, ids)
+    if not return_sql:
+        action_dates = _get_rolled_up_keyevent_trend(args, 'new_records',
+                                                     args.get('collection', 'All'),
+                                                     only_action=True)
+        if action_dates is not None:
+            initial_quantity = get_keyevent_total('new_records', args.get('collection', 'All'),
+                                                  _to_datetime(args['t_start'], args['t_format']))
+            return _get_trend_from_actions(action_dates, initial_quantity, args['t_start'],
+                          args['t_end'], args['granularity'], args['t_format'], acumulative=True)
     if args.get('collection', 'All') == 'All':
         sql_query_g = _get_sql_query("creation_date", args['granularity'],
                         "bibrec")
@@ -91,16 +117,9 @@ def get_keyevent_trend_collection_population(args, return_sql=False):
                             "Previous count: %s<br />Current count: %%s" % (sql_query_i),
                             acumulative=True)
     else:
-        ids = get_collection_reclist(args['collection'])
-        if len(ids) == 0:
-            return []
         g = get_keyevent_trend_new_records(args, return_sql, True)
         sql_query_i = "SELECT id FROM bibrec WHERE creation_date < %s"
-        if return_sql:
-            return "Previous count: %s<br />Current count: %s" % (sql_query_i % lower, g)
-        initial_quantity = len(filter(lambda x: x[0] in ids, run_sql(sql_query_i, (lower, ))))
-        return _get_trend_from_actions(g, initial_quantity, args['t_start'],
-                          args['t_end'], args['granularity'], args['t_format'], acumulative=True)
+        return "Previous count: %s<br />Current count: %s" % (sql_query_i % lower, g)
 
 
 def get_keyevent_trend_new_records(args, return_sql=False, only_action=False):
@@ -122,6 +141,11 @@ def get_keyevent_trend_new_records(args, return_sql=False, only_action=False):
     @param args['t_format']: Date and time formatting string
     @type args['t_format']: str
     """
+    if not return_sql:
+        trend = _get_rolled_up_keyevent_trend(args, 'new_records', args.get('collection', 'All'),
+                                              only_action=only_action)
+        if trend is not None:
+            return trend
 
     if args.get('collection', 'All') == 'All':
         return _get_keyevent_trend(args, _get_sql_query("creation_date", args['granularity'],
@@ -176,6 +200,10 @@ def get_keyevent_trend_search_frequency(args, return_sql=False):
     @param args['t_format']: Date and time formatting string
     @type args['t_format']: str
     """
+    if not return_sql:
+        trend = _get_rolled_up_keyevent_trend(args, 'searches')
+        if trend is not None:
+            return trend
 
     return _get_keyevent_trend(args, _get_sql_query("date", args["granularity"],
                 "query INNER JOIN user_query ON id=id_query"),
@@ -202,6 +230,11 @@ def get_keyevent_trend_comments_frequency(args, return_sql=False):
     @param args['t_format']: Date and time formatting string
     @type args['t_format']: str
     """
+    if not return_sql:
+        trend = _get_rolled_up_keyevent_trend(args, 'comments', args.get('collection', 'All'))
+        if trend is not None:
+            return trend
+
     if args.get('collection', 'All') == 'All':
         sql = _get_sql_query("date_creation", args["granularity"],
             "cmtRECORDCOMMENT")
@@ -241,10 +274,16 @@ def get_keyevent_trend_search_type_distribution(args, return_sql=False):
                     conditions="urlargs LIKE '%%as=1%%'")
 
     # Compute the trend for both types
-    s_trend = _get_keyevent_trend(args, simple,
-                        return_sql=return_sql, sql_text="Simple: %s")
-    a_trend = _get_keyevent_trend(args, advanced,
-                        return_sql=return_sql, sql_text="Advanced: %s")
+    s_trend = a_trend = None
+    if not return_sql:
+        s_trend = _get_rolled_up_keyevent_trend(args, 'simple_searches')
+        a_trend = _get_rolled_up_keyevent_trend(args, 'advanced_searches')
+    if s_trend is None:
+        s_trend = _get_keyevent_trend(args, simple,
+                            return_sql=return_sql, sql_text="Simple: %s")
+    if a_trend is None:
+        a_trend = _get_keyevent_trend(args, advanced,
+                            return_sql=return_sql, sql_text="Advanced: %s")
 
     # Assemble, according to return type
     if return_sql:
@@ -273,6 +312,11 @@ def get_keyevent_trend_download_frequency(args, return_sql=False):
     @param args['t_format']: Date and time formatting string
     @type args['t_format']: str
     """
+    if not return_sql:
+        trend = _get_rolled_up_keyevent_trend(args, 'downloads', args.get('collection', 'All'))
+        if trend is not None:
+            return trend
+
     # Collect list of timestamps of insertion in the specific collection
     if args.get('collection', 'All') == 'All':
         return _get_keyevent_trend(args, _get_sql_query("download_time",
@@ -2632,16 +2676,139 @@ def _get_trend_from_actions(action_dates, initial_value,
         vector.append((current.strftime('%Y-%m-%d %H:%M:%S'), actions_here))
 
         # Make sure to stop the iteration at the end time
-        if {"year": current.year >= stop_at.year,
+        if _is_last_period(current, stop_at, granularity):
+            break
+    # Remove the first bogus tuple, and return
+    return vector[1:]
+
+
+def _is_last_period(current, stop_at, granularity):
+    """
+    Returns whether the period of the given granularity starting at
+    current is the last one of a trend ending at stop_at.
+    """
+    return {"year": current.year >= stop_at.year,
             "month": current.month >= stop_at.month and current.year == stop_at.year,
             "day": current.day >= stop_at.day and current.month == stop_at.month,
             "hour": current.hour >= stop_at.hour and current.day == stop_at.day,
             "minute": current.minute >= stop_at.minute and current.hour == stop_at.hour,
             "second": current.second >= stop_at.second and current.minute == stop_at.minute
-            }[granularity]:
+            }[granularity]
+
+
+class RecordCreationDatesDataCacher(DataCacher):
+    """
+    Provides the creation dates of all the records, as YYYYMMDDhhmmss
+    numbers in a list (numpy array if available) indexed by recid.
+    Records keep their creation date, so only the records with a recid
+    above the known ones are loaded, unless the number of records in
+    bibrec differs from the number of known dates, e.g. because records
+    were inserted with lower recids, in which case all of them are
+    loaded again.  This class is not to be used directly; use function
+    get_record_creation_dates() instead.
+    """
+    # creation date of the recids not in bibrec, after all the others
+    missing_date = 99999999999999
+
+    def __init__(self):
+        # number of records whose creation date is known
+        self.nb_dates = 0
+
+        def cache_filler():
+            dates = self.cache
+            known = len(dates) - 1
+            sql = """SELECT id, DATE_FORMAT(creation_date, '%%Y%%m%%d%%H%%i%%s')
+                       FROM bibrec WHERE id > %s"""
+            res = run_sql(sql, (known, ))
+            if known >= 0:
+                if run_sql("SELECT COUNT(*) FROM bibrec")[0][0] != self.nb_dates + len(res):
+                    known = -1
+                    self.nb_dates = 0
+                    res = run_sql(sql, (known, ))
+                elif not res:
+                    return dates
+            self.nb_dates += len(res)
+            size = max([known] + [row[0] for row in res]) + 1
+            if CFG_NUMPY_IMPORTABLE:
+                new_dates = numpy.empty(size, dtype=numpy.int64)
+                new_dates.fill(self.missing_date)
+            else:
+                new_dates = [self.missing_date] * size
+            if known >= 0:
+                new_dates[:known + 1] = dates
+            for recid, creation_date in res:
+                new_dates[recid] = int(creation_date or 0)
+            return new_dates
+
+        def timestamp_verifier():
+            return get_table_update_time('bibrec')
+
+        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+
+_RECORD_CREATION_DATES_CACHE = []
+
+def get_record_creation_dates():
+    """
+    Returns the creation dates of all the records, indexed by recid
+    (see RecordCreationDatesDataCacher).
+    """
+    if not _RECORD_CREATION_DATES_CACHE:
+        _RECORD_CREATION_DATES_CACHE.append(RecordCreationDatesDataCacher())
+    else:
+        _RECORD_CREATION_DATES_CACHE[0].recreate_cache_if_needed()
+    return _RECORD_CREATION_DATES_CACHE[0].cache
+
+
+def _to_date_number(dttime):
+    """
+    Transforms a datetime into a YYYYMMDDhhmmss number
+    """
+    return ((((dttime.year * 100 + dttime.month) * 100 + dttime.day) * 100 +
+             dttime.hour) * 100 + dttime.minute) * 100 + dttime.second
+
+
+def _get_population_trend(args, recids):
+    """
+    Returns the number of records among recids created before the end
+    of every period of the given timestamp range, by binary search of
+    the period ends in the sorted creation dates of the records.
+
+    @param args['t_start']: Date and time of start point
+    @type args['t_start']: str
+
+    @param args['t_end']: Date and time of end point
+    @type args['t_end']: str
+
+    @param args['granularity']: Granularity of date and time
+    @type args['granularity']: str
+
+    @param args['t_format']: Date and time formatting string
+    @type args['t_format']: str
+    """
+    dates = get_record_creation_dates()
+    if CFG_NUMPY_IMPORTABLE:
+        recids = numpy.array(recids.tolist(), dtype=numpy.int64)
+        recids_dates = numpy.sort(dates[recids[recids < len(dates)]])
+    else:
+        recids_dates = [dates[recid] for recid in recids if recid < len(dates)]
+        recids_dates.sort()
+
+    t_end = _to_datetime(args['t_end'], args['t_format'])
+    stop_at = t_end - datetime.timedelta(seconds=1)
+    periods = []
+    for current in _get_datetime_iter(args['t_start'], args['granularity'], args['t_format']):
+        periods.append(current)
+        if _is_last_period(current, stop_at, args['granularity']):
             break
-    # Remove the first bogus tuple, and return
-    return vector[1:]
+
+    # every period ends where the next one starts, the last one at t_end
+    ends = [_to_date_number(period) for period in periods[1:]] + [_to_date_number(t_end)]
+    if CFG_NUMPY_IMPORTABLE:
+        counts = numpy.searchsorted(recids_dates, ends).tolist()
+    else:
+        counts = [bisect_left(recids_dates, end) for end in ends]
+    return [(period.strftime('%Y-%m-%d %H:%M:%S'), count)
+            for period, count in zip(periods, counts)]
 
 
 def _get_keyevent_trend(args, sql, initial_quantity=0, extra_param=[],
@@ -2673,6 +2840,40 @@ def _get_keyevent_trend(args, sql, initial_quantity=0, extra_param=[],
                           args['t_end'], args['granularity'], args['t_format'], acumulative)
 
 
+def _get_rolled_up_keyevent_trend(args, event, collection='All', initial_quantity=0,
+                                  acumulative=False, only_action=False):
+    """
+    Returns the trend of the rolled up key event EVENT of COLLECTION in
+    the given timestamp range, or None if the rollups cannot answer
+    (see webstat_rollup.get_keyevent_counts).
+
+    @param args['t_start']: Date and time of start point
+    @type args['t_start']: str
+
+    @param args['t_end']: Date and time of end point
+    @type args['t_end']: str
+
+    @param args['granularity']: Granularity of date and time
+    @type args['granularity']: str
+
+    @param args['t_format']: Date and time formatting string
+    @type args['t_format']: str
+    """
+    counts = get_keyevent_counts(event, collection,
+                                 _to_datetime(args['t_start'], args['t_format']),
+                                 _to_datetime(args['t_end'], args['t_format']),
+                                 args['granularity'])
+    if counts is None:
+        return None
+    # same (period, count) rows, in decreasing order, as the SQL queries
+    action_dates = [(getattr(period, args['granularity']), counts[period])
+                    for period in sorted(counts.keys(), reverse=True)]
+    if only_action:
+        return action_dates
+    return _get_trend_from_actions(action_dates, initial_quantity, args['t_start'],
+                          args['t_end'], args['granularity'], args['t_format'], acumulative)
+
+
 def _get_datetime_iter(t_start, granularity='day',
                        dt_format='%Y-%m-%d %H:%M:%S'):
     """
@@ -2696,26 +2897,25 @@ def _get_datetime_iter(t_start, granularity='day',
 
     # Make a time increment depending on the granularity and the current time
     # (the length of years and months vary over time)
-    span = ""
     while True:
         yield tim
 
         if granularity == "year":
-            span = (calendar.isleap(tim.year) and ["days=366"] or ["days=365"])[0]
+            span = datetime.timedelta(days=calendar.isleap(tim.year) and 366 or 365)
         elif granularity == "month":
-            span = "days=" + str(calendar.monthrange(tim.year, tim.month)[1])
+            span = datetime.timedelta(days=calendar.monthrange(tim.year, tim.month)[1])
         elif granularity == "day":
-            span = "days=1"
+            span = datetime.timedelta(days=1)
         elif granularity == "hour":
-            span = "hours=1"
+            span = datetime.timedelta(hours=1)
         elif granularity == "minute":
-            span = "minutes=1"
+            span = datetime.timedelta(minutes=1)
         elif granularity == "second":
-            span = "seconds=1"
+            span = datetime.timedelta(seconds=1)
         else:
             # Default just in case
-            span = "days=1"
-        tim += eval("datetime.timedelta(" + span + ")")
+            span = datetime.timedelta(days=1)
+        tim += span
 
 def _to_datetime(dttime, dt_format='%Y-%m-%d %H:%M:%S'):
     """
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""WebStat engine - Unit Test Suite"""
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite, \
+     patch_attributes, restore_attributes
+from invenio.intbitset import intbitset
+from invenio import webstat_engine
+
+# recid: creation date, recid 0 not being a record
+CREATION_DATES = [webstat_engine.RecordCreationDatesDataCacher.missing_date,
+                  20131215000000,
+                  20140110100000,
+                  20140201000000,
+                  20140331230000,
+                  20140501000000,
+                  20140120000000]
+
+
+class PopulationTrendTest(InvenioTestCase):
+    """Test the population trends of the collections"""
+
+    args = {'t_start': '2014-01-01 00:00:00', 't_end': '2014-04-01 00:00:00',
+            'granularity': 'month', 't_format': '%Y-%m-%d %H:%M:%S'}
+
+    def setUp(self):
+        self.saved = patch_attributes(webstat_engine,
+            CFG_NUMPY_IMPORTABLE=webstat_engine.CFG_NUMPY_IMPORTABLE,
+            get_record_creation_dates=lambda: list(CREATION_DATES))
+
+    def tearDown(self):
+        restore_attributes(webstat_engine, self.saved)
+
+    def _get_filtered_population_trend(self, recids):
+        """Return the population trend of RECIDS counted as before the
+        cache of the creation dates, by filtering the records created
+        before and during the interval."""
+        lower, upper = 20140101000000, 20140401000000
+        initial_quantity = len(filter(lambda x: x[0] in recids,
+                                      [(recid, ) for recid, date in enumerate(CREATION_DATES)
+                                       if date < lower]))
+        recs = sorted([(date, recid) for recid, date in enumerate(CREATION_DATES)
+                       if lower < date < upper], reverse=True)
+        action_dates = []
+        for date, recid in filter(lambda x: x[1] in recids, recs):
+            month = date / 100000000 % 100
+            if action_dates and action_dates[-1][0] == month:
+                action_dates[-1][1] += 1
+            else:
+                action_dates.append([month, 1])
+        return webstat_engine._get_trend_from_actions(action_dates, initial_quantity,
+                                                      self.args['t_start'], self.args['t_end'],
+                                                      self.args['granularity'],
+                                                      self.args['t_format'], acumulative=True)
+
+    def test_population_trend_without_numpy(self):
+        """webstat - population trend from the list of creation dates"""
+        webstat_engine.CFG_NUMPY_IMPORTABLE = False
+        recids = intbitset([1, 2, 3, 4, 5, 7])
+        trend = webstat_engine._get_population_trend(self.args, recids)
+        self.assertEqual([count for dummy, count in trend], [2, 3, 4])
+        self.assertEqual(trend, self._get_filtered_population_trend(recids))
+
+    def test_population_trend_with_numpy(self):
+        """webstat - population trend from the array of creation dates"""
+        if not webstat_engine.CFG_NUMPY_IMPORTABLE:
+            return
+        webstat_engine.get_record_creation_dates = \
+            lambda: webstat_engine.numpy.array(CREATION_DATES, dtype=webstat_engine.numpy.int64)
+        recids = intbitset([1, 2, 3, 4, 5, 7])
+        self.assertEqual(webstat_engine._get_population_trend(self.args, recids),
+                         self._get_filtered_population_trend(recids))
+
+
+class RecordCreationDatesDataCacherTest(InvenioTestCase):
+    """Test the cache of the creation dates of the records"""
+
+    def setUp(self):
+        self.bibrec = {1: CREATION_DATES[1], 3: CREATION_DATES[3]}
+        self.update_time = '2014-01-01 00:00:00'
+        self.saved = patch_attributes(webstat_engine,
+            run_sql=self._run_sql,
+            get_table_update_time=lambda table: self.update_time)
+
+    def tearDown(self):
+        restore_attributes(webstat_engine, self.saved)
+
+    def _run_sql(self, sql, params=None):
+        if 'COUNT(*)' in sql:
+            return ((len(self.bibrec), ), )
+        return tuple([(recid, str(date)) for recid, date in self.bibrec.iteritems()
+                      if recid > params[0]])
+
+    def _update_bibrec(self, recid):
+        self.bibrec[recid] = CREATION_DATES[recid]
+        self.update_time = '9999-12-31 00:00:00'
+
+    def test_new_records(self):
+        """webstat - creation dates of the records inserted since the last fill"""
+        cacher = webstat_engine.RecordCreationDatesDataCacher()
+        self._update_bibrec(5)
+        cacher.recreate_cache_if_needed()
+        self.assertEqual(list(cacher.cache), [CREATION_DATES[0], CREATION_DATES[1],
+                                              CREATION_DATES[0], CREATION_DATES[3],
+                                              CREATION_DATES[0], CREATION_DATES[5]])
+
+    def test_records_inserted_with_lower_recids(self):
+        """webstat - creation dates of the records inserted below the known ones"""
+        cacher = webstat_engine.RecordCreationDatesDataCacher()
+        self._update_bibrec(2)
+        cacher.recreate_cache_if_needed()
+        self.assertEqual(list(cacher.cache), CREATION_DATES[:4])
+
+
+TEST_SUITE = make_test_suite(PopulationTrendTest,
+                             RecordCreationDatesDataCacherTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
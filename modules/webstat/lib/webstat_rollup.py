@@ -0,0 +1,361 @@
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+WebStat key event rollups.
+
+Rather than grouping the raw log tables (query, rnkDOWNLOADS, bibrec,
+...) over the whole interval of every key event graph, the trends are
+read from the staKEYEVENTROLLUP table, which holds the number of
+events per hour, day and month, for all the records and for every
+collection.  The table is maintained incrementally by
+`webstatadmin --rollup-events`: every run rolls up the complete hours
+elapsed since the previous one.  staKEYEVENTROLLUPSTATUS records, for
+every event and collection, until when it has been rolled up; a
+collection rolled up for the first time, e.g. a new one, is rolled up
+from the first event on.  Readers of a collection that has not been
+rolled up fall back to the raw tables.
+
+Readers cover the requested interval with the coarsest rolled up
+periods that fit in it, and only query the raw tables for the
+beginning of an interval not aligned on an hour and for the tail that
+has not been rolled up yet.
+
+The events of a collection are counted according to its content at
+rollup time, so rollups do not go beyond the last run of webcoll.
+"""
+
+__revision__ = "$Id$"
+
+import datetime
+import time
+
+from invenio.dbquery import run_sql
+from invenio.intbitset import intbitset
+from invenio.search_engine import get_collection_reclist
+from invenio.websearch_webcoll import CFG_CACHE_LAST_UPDATED_TIMESTAMP_FILE
+
+# event: (timestamp column, tables, conditions, record column), where
+# the record column is None for the events not related to records,
+# which are only rolled up for all the records
+CFG_WEBSTAT_ROLLUP_EVENTS = {
+    'new_records': ("creation_date", "bibrec", "", "id"),
+    'searches': ("date", "query INNER JOIN user_query ON id=id_query", "", None),
+    'simple_searches': ("date", "query INNER JOIN user_query ON id=id_query",
+                        "urlargs LIKE '%%p=%%'", None),
+    'advanced_searches': ("date", "query INNER JOIN user_query ON id=id_query",
+                          "urlargs LIKE '%%as=1%%'", None),
+    'downloads': ("download_time", "rnkDOWNLOADS", "", "id_bibrec"),
+    'comments': ("date_creation", "cmtRECORDCOMMENT", "", "id_bibrec"),
+}
+
+# granularity of a trend: rolled up granularities that can be summed
+# into its periods, coarsest first
+CFG_WEBSTAT_ROLLUP_LEVELS = {
+    'year': ('month', 'day', 'hour'),
+    'month': ('month', 'day', 'hour'),
+    'day': ('day', 'hour'),
+    'hour': ('hour',),
+}
+
+# all the records are rolled up as collection ''
+CFG_WEBSTAT_ROLLUP_ALL = ''
+
+# start of the rolled up history
+CFG_WEBSTAT_ROLLUP_EPOCH = datetime.datetime(1900, 1, 1)
+
+
+def _floor_period(dttime, granularity):
+    """Return start of the GRANULARITY period of datetime DTTIME."""
+    dttime = dttime.replace(minute=0, second=0, microsecond=0)
+    if granularity in ('day', 'month', 'year'):
+        dttime = dttime.replace(hour=0)
+    if granularity in ('month', 'year'):
+        dttime = dttime.replace(day=1)
+    if granularity == 'year':
+        dttime = dttime.replace(month=1)
+    return dttime
+
+
+def _next_period(dttime, granularity):
+    """Return start of the GRANULARITY period following the one
+    starting at DTTIME."""
+    if granularity == 'hour':
+        return dttime + datetime.timedelta(hours=1)
+    if granularity == 'day':
+        return dttime + datetime.timedelta(days=1)
+    if dttime.month == 12:
+        return dttime.replace(year=dttime.year + 1, month=1)
+    return dttime.replace(month=dttime.month + 1)
+
+
+def _ceil_period(dttime, granularity):
+    """Return start of the first GRANULARITY period starting at or
+    after DTTIME."""
+    start = _floor_period(dttime, granularity)
+    if start == dttime:
+        return start
+    return _next_period(start, granularity)
+
+
+def _cover_interval(start, end, levels):
+    """
+    Return list of (granularity, start, end) covering the interval
+    [START, END), aligned on the finest of LEVELS, with the coarsest
+    periods of LEVELS.
+    """
+    if start >= end:
+        return []
+    level = levels[0]
+    if len(levels) == 1:
+        return [(level, start, end)]
+    inner_start = _ceil_period(start, level)
+    inner_end = _floor_period(end, level)
+    if inner_start >= inner_end:
+        return _cover_interval(start, end, levels[1:])
+    return _cover_interval(start, inner_start, levels[1:]) + \
+           [(level, inner_start, inner_end)] + \
+           _cover_interval(inner_end, end, levels[1:])
+
+
+def _to_datetime(value):
+    """Return datetime of the VALUE returned by the database."""
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime(*time.strptime(str(value), '%Y-%m-%d %H:%M:%S')[:6])
+
+
+def get_raw_counts(event, lower, upper, collections):
+    """
+    Return dictionary of (collection, hour)->number of EVENT events
+    that happened in the interval [LOWER, UPPER), according to the
+    raw tables, for every collection of COLLECTIONS.
+    """
+    column, tables, conditions, recid_column = CFG_WEBSTAT_ROLLUP_EVENTS[event]
+    if conditions:
+        conditions = "AND %s" % conditions
+    if recid_column is None or collections == [CFG_WEBSTAT_ROLLUP_ALL]:
+        recid_column = "NULL"
+    res = run_sql("""SELECT DATE_FORMAT(%s, %%s), %s, COUNT(*)
+                       FROM %s WHERE %s >= %%s AND %s < %%s %s
+                      GROUP BY 1, 2""" % (column, recid_column, tables,
+                                           column, column, conditions),
+                  ('%Y-%m-%d %H:00:00', lower, upper))
+    counts = {}
+    recids = intbitset([recid for dummy, recid, dummy in res if recid])
+    for collection in collections:
+        if collection == CFG_WEBSTAT_ROLLUP_ALL:
+            members = None
+        else:
+            members = recids & get_collection_reclist(collection)
+            if not members:
+                continue
+        for hour, recid, count in res:
+            if members is None or recid in members:
+                key = (collection, _to_datetime(hour))
+                counts[key] = counts.get(key, 0) + count
+    return counts
+
+
+def get_rolled_up_until(event, collection=CFG_WEBSTAT_ROLLUP_ALL):
+    """Return datetime until which EVENT has been rolled up for
+    COLLECTION, or None if it has never been."""
+    res = run_sql("""SELECT rolled_up_until FROM staKEYEVENTROLLUPSTATUS
+                      WHERE event=%s AND collection=%s""", (event, collection))
+    if res:
+        return _to_datetime(res[0][0])
+    return None
+
+
+def _set_rolled_up_until(event, collections, until):
+    """Record that EVENT has been rolled up until UNTIL for every
+    collection of COLLECTIONS."""
+    params = []
+    for collection in collections:
+        params.extend((event, collection, until))
+    run_sql("""REPLACE INTO staKEYEVENTROLLUPSTATUS (event, collection, rolled_up_until)
+               VALUES %s""" % ', '.join(["(%s, %s, %s)"] * len(collections)), params)
+
+
+def get_keyevent_counts(event, collection, lower, upper, granularity):
+    """
+    Return dictionary of period->number of EVENT events of COLLECTION
+    (None or 'All' for all the records) in the interval [LOWER, UPPER),
+    where the periods are the starts of the GRANULARITY periods.
+
+    Return None if the rollups cannot answer, i.e. if EVENT has never
+    been rolled up for COLLECTION, is not rolled up per collection, or
+    if GRANULARITY is finer than an hour.
+    """
+    if collection in (None, 'All'):
+        collection = CFG_WEBSTAT_ROLLUP_ALL
+    if granularity not in CFG_WEBSTAT_ROLLUP_LEVELS or \
+       (collection and CFG_WEBSTAT_ROLLUP_EVENTS[event][3] is None):
+        return None
+    rolled_up_until = get_rolled_up_until(event, collection)
+    if rolled_up_until is None:
+        return None
+
+    # [LOWER, start) and [end, UPPER) come from the raw tables
+    start = min(_ceil_period(lower, 'hour'), upper)
+    end = max(start, min(_floor_period(upper, 'hour'), rolled_up_until))
+
+    counts = {}
+    for level, level_start, level_end in _cover_interval(start, end,
+                                                         CFG_WEBSTAT_ROLLUP_LEVELS[granularity]):
+        for period, count in run_sql("""SELECT period, count FROM staKEYEVENTROLLUP
+                                         WHERE event=%s AND collection=%s AND granularity=%s
+                                           AND period >= %s AND period < %s""",
+                                     (event, collection, level, level_start, level_end)):
+            period = _floor_period(_to_datetime(period), granularity)
+            counts[period] = counts.get(period, 0) + count
+    for raw_lower, raw_upper in ((lower, start), (end, upper)):
+        if raw_lower < raw_upper:
+            for (dummy, hour), count in get_raw_counts(event, raw_lower, raw_upper,
+                                                       [collection]).iteritems():
+                period = _floor_period(hour, granularity)
+                counts[period] = counts.get(period, 0) + count
+    return counts
+
+
+def get_keyevent_total(event, collection, upper):
+    """
+    Return number of EVENT events of COLLECTION that happened before
+    UPPER, or None if the rollups cannot answer.
+    """
+    counts = get_keyevent_counts(event, collection, CFG_WEBSTAT_ROLLUP_EPOCH,
+                                 upper, 'year')
+    if counts is None:
+        return None
+    return sum(counts.values())
+
+
+def get_rollup_limit():
+    """
+    Return datetime until which the events can be rolled up: the
+    start of the current hour, or of the hour of the last webcoll run
+    if earlier, since newer records may not be in their collections
+    yet.
+    """
+    limit = _floor_period(datetime.datetime.now(), 'hour')
+    try:
+        timestamp_file = open(CFG_CACHE_LAST_UPDATED_TIMESTAMP_FILE)
+        try:
+            webcoll_time = _to_datetime(timestamp_file.read().strip())
+        finally:
+            timestamp_file.close()
+    except (IOError, ValueError):
+        return limit
+    return min(limit, _floor_period(webcoll_time, 'hour'))
+
+
+def get_rollup_collections():
+    """Return names of the collections rolled up separately."""
+    return [row[0] for row in run_sql("""SELECT name FROM collection
+        WHERE dbquery IS NULL OR dbquery NOT LIKE 'hostedcollection:%'""")]
+
+
+def _get_first_event_hour(event):
+    """Return start of the hour of the first EVENT event, or None if
+    there is none."""
+    column, tables, conditions = CFG_WEBSTAT_ROLLUP_EVENTS[event][:3]
+    if conditions:
+        conditions = "AND %s" % conditions
+    first = run_sql("SELECT MIN(%s) FROM %s WHERE %s >= %%s %s" % \
+                    (column, tables, column, conditions),
+                    (CFG_WEBSTAT_ROLLUP_EPOCH, ))[0][0]
+    if first is None:
+        return None
+    return _floor_period(_to_datetime(first), 'hour')
+
+
+def _rollup_collections(event, since, until, collections):
+    """
+    Roll up the events EVENT that happened in [SINCE, UNTIL) for every
+    collection of COLLECTIONS, month by month.
+    """
+    collections_in = ', '.join(['%s'] * len(collections))
+    while since < until:
+        chunk_end = min(until, _next_period(_floor_period(since, 'month'), 'month'))
+        counts = get_raw_counts(event, since, chunk_end, collections)
+        run_sql("""DELETE FROM staKEYEVENTROLLUP WHERE event=%%s AND collection IN (%s)
+                    AND granularity='hour' AND period >= %%s AND period < %%s""" % collections_in,
+                [event] + collections + [since, chunk_end])
+        rows = [(event, collection, hour, count)
+                for (collection, hour), count in counts.iteritems()]
+        for i in range(0, len(rows), 1000):
+            chunk = rows[i:i + 1000]
+            run_sql("""INSERT INTO staKEYEVENTROLLUP (event, collection, granularity, period, count)
+                       VALUES %s""" % ', '.join(["(%s, %s, 'hour', %s, %s)"] * len(chunk)),
+                    sum(chunk, ()))
+        # days and months are summed from the periods they contain
+        for level, finer_level in (('day', 'hour'), ('month', 'day')):
+            level_start = _floor_period(since, level)
+            level_end = _ceil_period(chunk_end, level)
+            run_sql("""DELETE FROM staKEYEVENTROLLUP WHERE event=%%s AND collection IN (%s)
+                        AND granularity=%%s AND period >= %%s AND period < %%s""" % collections_in,
+                    [event] + collections + [level, level_start, level_end])
+            run_sql("""INSERT INTO staKEYEVENTROLLUP (event, collection, granularity, period, count)
+                       SELECT event, collection, %%s, DATE_FORMAT(period, %%s), SUM(count)
+                         FROM staKEYEVENTROLLUP
+                        WHERE event=%%s AND collection IN (%s) AND granularity=%%s
+                          AND period >= %%s AND period < %%s
+                        GROUP BY collection, 4""" % collections_in,
+                    [level, {'day': '%Y-%m-%d 00:00:00', 'month': '%Y-%m-01 00:00:00'}[level],
+                     event] + collections + [finer_level, level_start, level_end])
+        _set_rolled_up_until(event, collections, chunk_end)
+        since = chunk_end
+
+
+def rollup_keyevent(event, until, collections=None):
+    """
+    Roll up the events EVENT that happened since the previous rollup
+    and before UNTIL, an hour start, for all the records and, if EVENT
+    is related to records, for every collection of COLLECTIONS.  The
+    collections never rolled up before are rolled up from the first
+    event on.
+
+    Every month is stored independently and the stored counts are
+    replaced, not incremented, so that an interrupted rollup is simply
+    done again.
+    """
+    rollup_collections = [CFG_WEBSTAT_ROLLUP_ALL]
+    if CFG_WEBSTAT_ROLLUP_EVENTS[event][3] is not None:
+        if collections is None:
+            collections = get_rollup_collections()
+        rollup_collections.extend(collections)
+
+    rolled_up_until = dict([(collection, _to_datetime(rolled_up))
+                            for collection, rolled_up in run_sql("""SELECT collection, rolled_up_until
+                                FROM staKEYEVENTROLLUPSTATUS WHERE event=%s""", (event, ))])
+    # collections rolled up until the same time are rolled up together
+    groups = {}
+    first = None
+    for collection in rollup_collections:
+        since = rolled_up_until.get(collection)
+        if since is None:
+            if first is None:
+                first = _get_first_event_hour(event) or until
+            since = first
+        groups.setdefault(since, []).append(collection)
+    for since in sorted(groups.keys()):
+        _rollup_collections(event, since, until, groups[since])
+        new_collections = [collection for collection in groups[since]
+                           if collection not in rolled_up_until]
+        if since >= until and new_collections:
+            # nothing to roll up yet, but the collections are covered
+            _set_rolled_up_until(event, new_collections, since)
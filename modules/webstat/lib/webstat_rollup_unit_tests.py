@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""WebStat key event rollups - Unit Test Suite"""
+
+from datetime import datetime
+
+from invenio.testutils import InvenioTestCase
+from invenio.testutils import make_test_suite, run_test_suite, \
+     patch_attributes, restore_attributes
+from invenio.intbitset import intbitset
+from invenio import webstat_engine
+from invenio import webstat_rollup
+from invenio.webstat_rollup import \
+     _ceil_period, \
+     _cover_interval, \
+     _floor_period
+
+
+class RollupPeriodTest(InvenioTestCase):
+    """Test periods of the rollups"""
+
+    def test_floor_period(self):
+        """webstat - start of rollup periods"""
+        dttime = datetime(2014, 3, 15, 10, 30, 12)
+        self.assertEqual(_floor_period(dttime, 'hour'), datetime(2014, 3, 15, 10))
+        self.assertEqual(_floor_period(dttime, 'day'), datetime(2014, 3, 15))
+        self.assertEqual(_floor_period(dttime, 'month'), datetime(2014, 3, 1))
+        self.assertEqual(_floor_period(dttime, 'year'), datetime(2014, 1, 1))
+
+    def test_ceil_period(self):
+        """webstat - start of the next rollup periods"""
+        self.assertEqual(_ceil_period(datetime(2014, 12, 15), 'month'), datetime(2015, 1, 1))
+        self.assertEqual(_ceil_period(datetime(2014, 12, 1), 'month'), datetime(2014, 12, 1))
+        self.assertEqual(_ceil_period(datetime(2014, 2, 28, 1), 'day'), datetime(2014, 3, 1))
+
+
+class RollupCoverTest(InvenioTestCase):
+    """Test covering of intervals with rollup periods"""
+
+    def test_cover_aligned_interval(self):
+        """webstat - cover of an interval aligned on months"""
+        self.assertEqual(_cover_interval(datetime(2013, 1, 1), datetime(2014, 1, 1),
+                                         ('month', 'day', 'hour')),
+                         [('month', datetime(2013, 1, 1), datetime(2014, 1, 1))])
+
+    def test_cover_unaligned_interval(self):
+        """webstat - cover of an interval aligned on hours"""
+        self.assertEqual(_cover_interval(datetime(2013, 1, 30, 22), datetime(2013, 3, 2, 5),
+                                         ('month', 'day', 'hour')),
+                         [('hour', datetime(2013, 1, 30, 22), datetime(2013, 1, 31)),
+                          ('day', datetime(2013, 1, 31), datetime(2013, 2, 1)),
+                          ('month', datetime(2013, 2, 1), datetime(2013, 3, 1)),
+                          ('day', datetime(2013, 3, 1), datetime(2013, 3, 2)),
+                          ('hour', datetime(2013, 3, 2), datetime(2013, 3, 2, 5))])
+
+    def test_cover_finest_levels(self):
+        """webstat - cover of an interval without months"""
+        self.assertEqual(_cover_interval(datetime(2013, 1, 30, 22), datetime(2013, 1, 31, 2),
+                                         ('day', 'hour')),
+                         [('hour', datetime(2013, 1, 30, 22), datetime(2013, 1, 31, 2))])
+
+
+class RollupStatusTest(InvenioTestCase):
+    """Test rollups of the collections according to their status"""
+
+    def setUp(self):
+        self.status = {}
+        self.rollups = []
+        self.saved = patch_attributes(webstat_rollup,
+            run_sql=self._run_sql,
+            get_rolled_up_until=lambda event, collection='': self.status.get(collection),
+            _get_first_event_hour=lambda event: datetime(2010, 5, 3, 10),
+            _rollup_collections=lambda event, since, until, collections: \
+                self.rollups.append((since, until, collections)),
+            _set_rolled_up_until=self._set_rolled_up_until)
+
+    def tearDown(self):
+        restore_attributes(webstat_rollup, self.saved)
+
+    def _run_sql(self, sql, params=None):
+        if 'staKEYEVENTROLLUPSTATUS' in sql:
+            return tuple(self.status.items())
+        return ()
+
+    def _set_rolled_up_until(self, event, collections, until):
+        for collection in collections:
+            self.status[collection] = until
+
+    def test_counts_of_collection_not_rolled_up(self):
+        """webstat - no rolled up counts of a collection never rolled up"""
+        self.status = {'': datetime(2014, 3, 1), 'Articles': datetime(2014, 3, 1)}
+        self.assertEqual(webstat_rollup.get_keyevent_counts('new_records', 'Books',
+                                                            datetime(2014, 1, 1),
+                                                            datetime(2014, 3, 1), 'month'),
+                         None)
+        self.assertEqual(webstat_rollup.get_keyevent_counts('new_records', 'Articles',
+                                                            datetime(2014, 1, 1),
+                                                            datetime(2014, 3, 1), 'month'),
+                         {})
+
+    def test_rollup_new_collection(self):
+        """webstat - rollup of a new collection from the first event"""
+        self.status = {'': datetime(2014, 3, 1), 'Articles': datetime(2014, 3, 1)}
+        webstat_rollup.rollup_keyevent('new_records', datetime(2014, 3, 2),
+                                       ['Articles', 'Books'])
+        self.assertEqual(self.rollups,
+                         [(datetime(2010, 5, 3, 10), datetime(2014, 3, 2), ['Books']),
+                          (datetime(2014, 3, 1), datetime(2014, 3, 2), ['', 'Articles'])])
+
+    def test_rollup_without_events(self):
+        """webstat - rollup of collections before the first event"""
+        webstat_rollup._get_first_event_hour = lambda event: None
+        webstat_rollup.rollup_keyevent('new_records', datetime(2014, 3, 2), ['Books'])
+        self.assertEqual(self.status, {'': datetime(2014, 3, 2),
+                                       'Books': datetime(2014, 3, 2)})
+
+    def test_rollup_event_without_records(self):
+        """webstat - rollup of an event not related to records"""
+        webstat_rollup.rollup_keyevent('searches', datetime(2014, 3, 2), ['Books'])
+        self.assertEqual([collections for dummy, dummy, collections in self.rollups],
+                         [['']])
+
+
+class RollupEngineTest(InvenioTestCase):
+    """Test the key event trends of the engine with and without rollups"""
+
+    args = {'t_start': '2014-01-01 00:00:00', 't_end': '2014-04-01 00:00:00',
+            'granularity': 'month', 't_format': '%Y-%m-%d %H:%M:%S',
+            'collection': 'Books'}
+
+    def setUp(self):
+        self.saved_rollup = patch_attributes(webstat_rollup,
+            run_sql=self._rollup_run_sql,
+            get_rolled_up_until=lambda event, collection='': None)
+        self.saved_engine = patch_attributes(webstat_engine,
+            run_sql=lambda sql, params=None: ((3, 5), (2, 7), (2, 6), (1, 9)),
+            get_collection_reclist=lambda collection: intbitset([5, 6, 9]))
+
+    def tearDown(self):
+        restore_attributes(webstat_rollup, self.saved_rollup)
+        restore_attributes(webstat_engine, self.saved_engine)
+
+    def _rollup_run_sql(self, sql, params=None):
+        self.assertEqual(params[1:3], ('Books', 'month'))
+        return ((datetime(2014, 1, 1), 4), (datetime(2014, 3, 1), 2))
+
+    def test_trend_of_collection_not_rolled_up(self):
+        """webstat - trend of a collection never rolled up from the raw tables"""
+        trend = webstat_engine.get_keyevent_trend_new_records(self.args)
+        self.assertEqual([count for dummy, count in trend], [1, 1, 1])
+
+    def test_trend_of_rolled_up_collection(self):
+        """webstat - trend of a rolled up collection from the rollups"""
+        def engine_run_sql(sql, params=None):
+            self.fail("raw tables queried")
+        webstat_rollup.get_rolled_up_until = lambda event, collection='': datetime(2014, 4, 1)
+        webstat_engine.run_sql = engine_run_sql
+        trend = webstat_engine.get_keyevent_trend_new_records(self.args)
+        self.assertEqual([count for dummy, count in trend], [4, 0, 2])
+
+
+TEST_SUITE = make_test_suite(RollupPeriodTest,
+                             RollupCoverTest,
+                             RollupStatusTest,
+                             RollupEngineTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -27,6 +27,9 @@ from invenio.dbquery import run_sql
 from invenio.bibtask import task_init, task_get_option, task_set_option, \
                             task_has_option, task_update_progress, write_message
 from invenio.webstat_config import CFG_WEBSTAT_CONFIG_PATH
+from invenio.webstat_rollup import CFG_WEBSTAT_ROLLUP_EVENTS, \
+                                   get_rollup_collections, get_rollup_limit, \
+                                   rollup_keyevent
 from invenio.config import CFG_SITE_RECORD
 
 
@@ -35,7 +38,8 @@ def main():
     task_init(authorization_action="runwebstatadmin",
               authorization_msg="Webstat Administrator",
               description="Description: %s Creates/deletes custom events. Can be set\n"
-                          "             to cache key events and previously defined custom events.\n" % sys.argv[0],
+                          "             to cache key events and previously defined custom events,\n"
+                          "             or to roll up the key event counters.\n" % sys.argv[0],
               help_specific_usage="  -n, --new-event=ID            create a new custom event with the human-readable ID\n"
                                   "  -r, --remove-event=ID         remote the custom event with id ID and all its data\n"
                                   "  -S, --show-events             show all currently available custom events\n"
@@ -44,6 +48,9 @@ def main():
                                   "                                  -c KEYEVENTS\n"
                                   "                                  -c CUSTOMEVENTS\n"
                                   "                                  -c 'event id1',id2,'testevent'\n"
+                                  "  -R, --rollup-events=ALL|[EVENT] rolls up the counters of all or some key events, e.g.:\n"
+                                  "                                  -R ALL\n"
+                                  "                                  -R downloads,searches\n"
                                   "  -d,--dump-config              dump default config file\n"
                                   "  -e,--load-config              create the custom events described in config_file\n"
                                   "\nWhen creating events (-n) the following parameters are also applicable:\n"
@@ -51,9 +58,9 @@ def main():
                                   "  -a, --args=[NAME]       set column headers for additional custom event arguments\n"
                                   "                          (e.g. -a country,person,car)\n",
               version=__revision__,
-              specific_params=("n:r:Sl:a:c:de", ["new-event=", "remove-event=", "show-events",
+              specific_params=("n:r:Sl:a:c:deR:", ["new-event=", "remove-event=", "show-events",
                                                   "event-label=", "args=", "cache-events=", "dump-config",
-                                                  "load-config"]),
+                                                  "load-config", "rollup-events="]),
               task_submit_elaborate_specific_parameter_fnc=task_submit_elaborate_specific_parameter,
               task_submit_check_options_fnc=task_submit_check_options,
               task_run_fnc=task_run_core)
@@ -89,6 +96,9 @@ def task_submit_elaborate_specific_parameter(key, value, opts, args):
     elif key in ("-e", "--load-config"):
         task_set_option("load_config", True)
 
+    elif key in ("-R", "--rollup-events"):
+        task_set_option("rollup_events", value.split(','))
+
     else:
         return False
 
@@ -150,6 +160,16 @@ def task_submit_check_options():
 
         return True
 
+    elif task_has_option("rollup_events"):
+        events = task_get_option("rollup_events")
+        if events[0] == 'ALL':
+            events = sorted(CFG_WEBSTAT_ROLLUP_EVENTS.keys())
+        if [event for event in events if event not in CFG_WEBSTAT_ROLLUP_EVENTS]:
+            # Unknown events. Abort and display help.
+            return False
+        task_set_option("rollup_events", events)
+        return True
+
     elif task_has_option("dump_config"):
         print """\
 [general]
@@ -224,6 +244,9 @@ def task_run_core():
     When this function is called, the tool has entered BibSched mode, which means
     that we're going to cache events according to the parameters.
     """
+    if task_has_option("rollup_events"):
+        return task_run_rollup()
+
     write_message("Initiating rawdata caching")
     task_update_progress("Initating rawdata caching")
 
@@ -247,3 +270,22 @@ def task_run_core():
     task_update_progress("Finished rawdata caching succesfully")
 
     return True
+
+
+def task_run_rollup():
+    """
+    Rolls up the counters of the key events since the previous rollup.
+    """
+    events = task_get_option("rollup_events")
+    until = get_rollup_limit()
+    collections = get_rollup_collections()
+    write_message("Rolling up key events until %s" % until)
+    for i in range(len(events)):
+        write_message("Rolling up key event: %s" % events[i])
+        rollup_keyevent(events[i], until, collections)
+        task_update_progress("Rollup: done %d/%d" % (i + 1, len(events)))
+
+    write_message("Finished rollup succesfully")
+    task_update_progress("Finished rollup succesfully")
+
+    return True
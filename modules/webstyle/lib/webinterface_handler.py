@@ -42,7 +42,9 @@ import gc
 
 from invenio import webinterface_handler_config as apache
 from invenio.config import CFG_SITE_URL, CFG_SITE_SECURE_URL, CFG_TMPDIR, \
-    CFG_SITE_RECORD, CFG_ACCESS_CONTROL_LEVEL_SITE
+    CFG_SITE_RECORD, CFG_ACCESS_CONTROL_LEVEL_SITE, CFG_MISCUTIL_SQL_PROFILE
+from invenio.dbquery import start_query_profiling, stop_query_profiling, \
+    get_query_profile, dump_query_profile
 from invenio.messages import wash_language
 from invenio.urlutils import redirect_to_url
 from invenio.errorlib import register_exception
@@ -275,6 +277,19 @@ def create_handler(root):
     """ Return a handler function that will dispatch apache requests
     through the URL layout passed in parameter."""
 
+    def _sql_profiler(req):
+        """ This handler wraps the profiler handler, recording the SQL
+        queries of every request into CFG_LOGDIR/dbquery_profile.log when
+        CFG_MISCUTIL_SQL_PROFILE is set.
+        """
+        if not CFG_MISCUTIL_SQL_PROFILE:
+            return _profiler(req)
+        start_query_profiling('%s %s' % (req.method, req.unparsed_uri))
+        try:
+            return _profiler(req)
+        finally:
+            dump_query_profile(stop_query_profiling())
+
     def _profiler(req):
         """ This handler wrap the default handler with a profiler.
         Profiling data is written into
@@ -284,6 +299,7 @@ def create_handler(root):
         can provide profile=algorithm_name. You can add more than one
         profile requirement like ?profile=time&profile=cumulative.
         The list of available algorithm is displayed at the end of the profile.
+        Use profile=sql to display the statistics of the SQL queries instead.
         """
         args = {}
         if req.args:
@@ -301,6 +317,20 @@ def create_handler(root):
         # Profiler enabled?
         if 'profile' in args:
 
+            if 'sql' in args.get('profile', []):
+                from invenio.jsonutils import json
+                start_query_profiling('%s %s' % (req.method, req.unparsed_uri))
+                try:
+                    ret = _handler(req)
+                finally:
+                    if CFG_MISCUTIL_SQL_PROFILE:
+                        ## _sql_profiler() will dump it
+                        profile = get_query_profile()
+                    else:
+                        profile = stop_query_profiling()
+                req.write("\n<pre>%s</pre>" % cgi.escape(json.dumps(profile.get_summary(), indent=2)))
+                return ret
+
             if 'memory' in args.get('profile', []):
                 gc.set_debug(gc.DEBUG_LEAK)
                 ret = _handler(req)
@@ -456,7 +486,7 @@ def create_handler(root):
 
         # Serve an error by default.
         raise apache.SERVER_RETURN, apache.HTTP_NOT_FOUND
-    return _profiler
+    return _sql_profiler
 
 
 def wash_urlargd(form, content):
@@ -56,6 +56,16 @@ from invenio.errorlib import register_exception, get_pretty_traceback
 ## turned on (it is done automatically by wsgi_handler_test).
 CFG_WSGI_SERVE_STATIC_FILES = False
 
+## The response body is kept in memory as a list of chunks, which is
+## passed to the WSGI server upon req.flush().  Content written with
+## flush=0 is nevertheless sent as soon as this many bytes are pending,
+## so that big responses (e.g. of=xm exports) use bounded memory.
+CFG_WSGI_RESPONSE_BUFFER_SIZE = 256 * 1024
+
+## Block size suggested to wsgi.file_wrapper, for the servers that read
+## the file in Python rather than using the sendfile system call.
+CFG_WSGI_FILE_WRAPPER_BLOCK_SIZE = 64 * 1024
+
 
 ## Magic regexp to search for usage of CFG_SITE_URL within src/href or
 ## any src usage of an external website
@@ -100,7 +110,8 @@ class SimulatedModPythonRequest(object):
         self.__environ = environ
         self.__start_response = start_response
         self.__response_sent_p = False
-        self.__buffer = ''
+        self.__buffer = []
+        self.__buffer_size = 0
         self.__low_level_headers = []
         self.__headers = table(self.__low_level_headers)
         self.__headers.add = self.__headers.add_header
@@ -114,13 +125,14 @@ class SimulatedModPythonRequest(object):
         ## See: <http://www.python.org/dev/peps/pep-0333/#the-write-callable>
         self.__write = None
         self.__write_error = False
+        self.__file_wrapper = None
         self.__errors = environ['wsgi.errors']
         self.__headers_in = table([])
         self.__tainted = False
         self.__is_https = self.__environ.get('wsgi.url_scheme') == 'https'
         self.__replace_https = False
         self.track_writings = False
-        self.__what_was_written = ""
+        self.__what_was_written = []
         self.__cookies_out = {}
         self.g = {} ## global dictionary in case it's needed
         for key, value in environ.iteritems():
@@ -184,31 +196,55 @@ class SimulatedModPythonRequest(object):
         return self.__low_level_headers
 
     def get_buffer(self):
-        return self.__buffer
+        return ''.join(self.__buffer)
 
     def write(self, string, flush=1):
         if isinstance(string, unicode):
-            self.__buffer += string.encode('utf8')
-        else:
-            self.__buffer += string
+            string = string.encode('utf8')
+        if string:
+            self.__buffer.append(string)
+            self.__buffer_size += len(string)
         if flush:
             self.flush()
+        elif self.__buffer_size >= CFG_WSGI_RESPONSE_BUFFER_SIZE:
+            self._flush_buffer(partial=True)
 
     def flush(self):
+        self._flush_buffer()
+
+    def _flush_buffer(self, partial=False):
+        """
+        Send the buffered chunks to the WSGI server.
+
+        @param partial: whether this is a flush triggered by the size of
+            the buffer rather than by the caller.  In this case, when the
+            HTTPS rewriting is active, whatever follows the last closing
+            angle bracket is kept in the buffer, so that a URL split
+            between two writes is still rewritten.
+        """
         self.send_http_header()
         if self.__buffer:
-            self.__bytes_sent += len(self.__buffer)
+            self._send_file_wrapper()
+            if len(self.__buffer) == 1:
+                data = self.__buffer[0]
+            else:
+                data = ''.join(self.__buffer)
+            self.__buffer = []
+            self.__buffer_size = 0
+            if self.__replace_https and partial:
+                cut = data.rfind('>') + 1
+                if 0 < cut < len(data):
+                    self.__buffer.append(data[cut:])
+                    self.__buffer_size = len(data) - cut
+                    data = data[:cut]
+            self.__bytes_sent += len(data)
+            if self.__replace_https:
+                data = https_replace(data)
             try:
                 if not self.__write_error:
-                    if self.__replace_https:
-                        self.__write(https_replace(self.__buffer))
-                    else:
-                        self.__write(self.__buffer)
+                    self.__write(data)
                     if self.track_writings:
-                        if self.__replace_https:
-                            self.__what_was_written += https_replace(self.__buffer)
-                        else:
-                            self.__what_was_written += self.__buffer
+                        self.__what_was_written.append(data)
             except IOError, err:
                 if "failed to write data" in str(err) or "client connection closed" in str(err):
                     ## Let's just log this exception without alerting the admin:
@@ -217,7 +253,32 @@ class SimulatedModPythonRequest(object):
                         ## to not report later other errors to the admin.
                 else:
                     raise
-            self.__buffer = ''
+
+    def _send_file_wrapper(self):
+        """
+        Send through the write callable the file that was handed to
+        wsgi.file_wrapper by L{sendfile}, because more content is
+        following it.
+        """
+        if self.__file_wrapper is not None:
+            file_wrapper = self.__file_wrapper
+            self.__file_wrapper = None
+            try:
+                for chunk in file_wrapper:
+                    if not self.__write_error:
+                        self.__write(chunk)
+            finally:
+                if hasattr(file_wrapper, 'close'):
+                    file_wrapper.close()
+
+    def get_file_wrapper(self):
+        """
+        Return the wsgi.file_wrapper that ends the response, if any, in
+        order for it to be returned to the WSGI server.
+        """
+        file_wrapper = self.__file_wrapper
+        self.__file_wrapper = None
+        return file_wrapper
 
     def set_content_type(self, content_type):
         self.__headers['content-type'] = content_type
@@ -300,9 +361,20 @@ class SimulatedModPythonRequest(object):
 
     def sendfile(self, path, offset=0, the_len=-1):
         try:
-            self.send_http_header()
+            self.flush()
+            self._send_file_wrapper()
             file_to_send = open(path)
             file_to_send.seek(offset)
+            if 'wsgi.file_wrapper' in self.__environ and not self.__write_error:
+                size = os.fstat(file_to_send.fileno()).st_size
+                if the_len < 0 or offset + the_len >= size:
+                    ## The file is sent up to its end: unless something
+                    ## is written after it, it is returned to the WSGI
+                    ## server, which can copy it with the sendfile
+                    ## system call instead of reading it in Python.
+                    self.__file_wrapper = self.__environ['wsgi.file_wrapper'](file_to_send, CFG_WSGI_FILE_WRAPPER_BLOCK_SIZE)
+                    self.__bytes_sent += max(size - offset, 0)
+                    return self.__bytes_sent
             file_wrapper = FileWrapper(file_to_send)
             count = 0
             if the_len < 0:
@@ -406,7 +478,7 @@ class SimulatedModPythonRequest(object):
         return self.headers_in.get('referer')
 
     def get_what_was_written(self):
-        return self.__what_was_written
+        return ''.join(self.__what_was_written)
 
     def __str__(self):
         from pprint import pformat
@@ -578,6 +650,9 @@ def application(environ, start_response):
         gc.enable()
         gc.collect()
         del gc.garbage[:]
+    file_wrapper = req.get_file_wrapper()
+    if file_wrapper is not None:
+        return file_wrapper
     return []
 
 def generate_error_page(req, admin_was_alerted=True, page_already_started=False):
@@ -736,6 +811,58 @@ def wsgi_handler_test(port=80):
     print "Serving on port %s..." % port
     httpd.serve_forever()
 
+def benchmark_response_buffering(size=100, of='xm', https=False):
+    """
+    Write a response of about C{size} MB through
+    search_engine.print_records() into a SimulatedModPythonRequest whose
+    WSGI server just discards the data, and report the time spent and
+    the peak memory of the process.
+
+    @param size: the size of the response, in MB
+    @param of: the output format used to print the records
+    @param https: whether to simulate an HTTPS request, so that the
+        HTTPS rewriting is exercised with HTML output formats
+    @return: (number of bytes written, number of chunks received by the
+        WSGI server, seconds spent, peak RSS of the process in KB)
+    """
+    import time
+    import resource
+    from wsgiref.util import setup_testing_defaults
+    from invenio.dbquery import run_sql
+    from invenio.search_engine import print_records, print_records_epilogue
+
+    recids = [row[0] for row in run_sql("SELECT id FROM bibrec ORDER BY id DESC")]
+    if not recids:
+        return 0, 0, 0.0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    chunks = [0]
+    def start_response(dummy_status, dummy_headers, dummy_exc_info=None):
+        def write(dummy_data):
+            chunks[0] += 1
+        return write
+
+    environ = {'PATH_INFO': '/search', 'QUERY_STRING': 'of=%s' % of}
+    if https:
+        environ['wsgi.url_scheme'] = 'https'
+    setup_testing_defaults(environ)
+    req = SimulatedModPythonRequest(environ, start_response)
+    if of.startswith('x'):
+        req.content_type = 'text/xml'
+    else:
+        req.content_type = 'text/html'
+
+    t0 = time.time()
+    first = True
+    while req.bytes_sent < size * 1024 * 1024:
+        print_records(req, recids, rg=-9999, format=of,
+                      print_records_prologue_p=first,
+                      print_records_epilogue_p=False)
+        first = False
+    print_records_epilogue(req, of)
+    req.flush()
+    return (req.bytes_sent, chunks[0], time.time() - t0,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
 def main():
     from optparse import OptionParser
     parser = OptionParser()
@@ -744,9 +871,25 @@ def main():
                       help="Run a WSGI test server via wsgiref (not using Apache).")
     parser.add_option('-p', '--port', type='int', dest='port', default='80',
                       help="The port where the WSGI test server will listen. [80]")
+    parser.add_option('-b', '--benchmark', action='store_true',
+                      dest='benchmark', default=False,
+                      help="Benchmark the writing of a big response through print_records().")
+    parser.add_option('-s', '--size', type='int', dest='size', default=100,
+                      help="The size in MB of the benchmark response. [100]")
+    parser.add_option('-f', '--format', dest='format', default='xm',
+                      help="The output format of the benchmark response. [xm]")
+    parser.add_option('--https', action='store_true', dest='https', default=False,
+                      help="Simulate an HTTPS request in the benchmark.")
     (options, args) = parser.parse_args()
     if options.test:
         wsgi_handler_test(options.port)
+    elif options.benchmark:
+        bytes_sent, chunks, elapsed, maxrss = benchmark_response_buffering(
+            options.size, options.format, options.https)
+        print "%.1f MB of %s in %.2f sec (%.1f MB/s), %s chunks, peak RSS %.1f MB" % \
+              (bytes_sent / 1048576.0, options.format, elapsed,
+               bytes_sent / 1048576.0 / max(elapsed, 1e-6), chunks,
+               maxrss / 1024.0)
     else:
         parser.print_help()
 
@@ -21,6 +21,7 @@ __revision__ = "$Id$"
 
 from invenio.testutils import InvenioTestCase
 import cgi
+import os
 
 from invenio.testutils import make_test_suite, run_test_suite
 
@@ -75,7 +76,9 @@ from invenio.webinterface_handler_wsgi_utils import FieldStorage
 # --------------------------------------------------
 
 from invenio import webinterface_handler
-from invenio.config import CFG_SITE_LANG
+from invenio import webinterface_handler_wsgi
+from invenio.webinterface_handler_wsgi import SimulatedModPythonRequest
+from invenio.config import CFG_SITE_LANG, CFG_SITE_URL, CFG_SITE_SECURE_URL
 
 
 class TestWashArgs(InvenioTestCase):
@@ -121,7 +124,126 @@ class TestWashArgs(InvenioTestCase):
         self._check('jrec=12&jrec=foo', default, {'jrec': 12})
 
 
-TEST_SUITE = make_test_suite(TestWashArgs,)
+class TestSimulatedModPythonRequestBuffering(InvenioTestCase):
+    """webinterface - Test for the buffering of the WSGI responses"""
+
+    def setUp(self):
+        self.written = []
+        self.buffer_size = webinterface_handler_wsgi.CFG_WSGI_RESPONSE_BUFFER_SIZE
+        webinterface_handler_wsgi.CFG_WSGI_RESPONSE_BUFFER_SIZE = 10
+
+    def tearDown(self):
+        webinterface_handler_wsgi.CFG_WSGI_RESPONSE_BUFFER_SIZE = self.buffer_size
+
+    def _start_response(self, dummy_status, dummy_headers, dummy_exc_info=None):
+        return self.written.append
+
+    def _get_req(self, url_scheme='http'):
+        import sys
+        environ = {'wsgi.errors': sys.stderr, 'wsgi.url_scheme': url_scheme}
+        return SimulatedModPythonRequest(environ, self._start_response)
+
+    def test_write_and_flush(self):
+        """ webinterface - every flushed write reaches the server """
+        req = self._get_req()
+        req.write('abc')
+        req.write(u'd\xe9f')
+        self.assertEqual(self.written, ['abc', 'd\xc3\xa9f'])
+        self.assertEqual(req.bytes_sent, 7)
+
+    def test_write_without_flush(self):
+        """ webinterface - unflushed writes are sent in one chunk """
+        req = self._get_req()
+        req.write('abc', flush=0)
+        req.write('def', flush=0)
+        self.assertEqual(self.written, [])
+        self.assertEqual(req.get_buffer(), 'abcdef')
+        req.flush()
+        self.assertEqual(self.written, ['abcdef'])
+
+    def test_write_without_flush_bounded(self):
+        """ webinterface - unflushed writes are sent past the buffer size """
+        req = self._get_req()
+        for dummy in range(4):
+            req.write('abcd', flush=0)
+        self.assertEqual(self.written, ['abcdabcdabcd'])
+        req.flush()
+        self.assertEqual(''.join(self.written), 'abcd' * 4)
+
+    def test_https_replace_across_chunks(self):
+        """ webinterface - HTTPS rewriting of a URL split between writes """
+        req = self._get_req('https')
+        req.content_type = 'text/html'
+        req.track_writings = True
+        req.write('<p>a</p><img src="', flush=0)
+        req.write('http://example.org/a.png" />', flush=0)
+        req.write('<a href="%s/">' % CFG_SITE_URL, flush=0)
+        req.flush()
+        expected = '<p>a</p><img src="%s/sslredirect/example.org/a.png" />' \
+                   '<a href="%s/">' % (CFG_SITE_SECURE_URL, CFG_SITE_SECURE_URL)
+        self.assertEqual(''.join(self.written), expected)
+        self.assertEqual(req.what_was_written, expected)
+
+
+class TestSimulatedModPythonRequestSendfile(InvenioTestCase):
+    """webinterface - Test for sending files through wsgi.file_wrapper"""
+
+    def setUp(self):
+        import tempfile
+        self.written = []
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, 'abcdefghij')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def _start_response(self, dummy_status, dummy_headers, dummy_exc_info=None):
+        return self.written.append
+
+    def _get_req(self, file_wrapper=True):
+        import sys
+        from wsgiref.util import FileWrapper
+        environ = {'wsgi.errors': sys.stderr}
+        if file_wrapper:
+            environ['wsgi.file_wrapper'] = FileWrapper
+        return SimulatedModPythonRequest(environ, self._start_response)
+
+    def test_sendfile_file_wrapper(self):
+        """ webinterface - a file ending the response goes to wsgi.file_wrapper """
+        req = self._get_req()
+        req.sendfile(self.path, 3)
+        self.assertEqual(self.written, [])
+        self.assertEqual(''.join(req.get_file_wrapper()), 'defghij')
+        self.assertEqual(req.bytes_sent, 7)
+
+    def test_sendfile_followed_by_content(self):
+        """ webinterface - a file followed by content is written in order """
+        req = self._get_req()
+        req.write('<')
+        req.sendfile(self.path)
+        req.write('>')
+        self.assertEqual(''.join(self.written), '<abcdefghij>')
+        self.assertEqual(req.get_file_wrapper(), None)
+
+    def test_sendfile_range(self):
+        """ webinterface - a range not reaching the end of file is written """
+        req = self._get_req()
+        req.sendfile(self.path, 2, 3)
+        self.assertEqual(''.join(self.written), 'cde')
+        self.assertEqual(req.get_file_wrapper(), None)
+
+    def test_sendfile_without_file_wrapper(self):
+        """ webinterface - files are written without wsgi.file_wrapper """
+        req = self._get_req(file_wrapper=False)
+        req.sendfile(self.path)
+        self.assertEqual(''.join(self.written), 'abcdefghij')
+        self.assertEqual(req.get_file_wrapper(), None)
+
+
+TEST_SUITE = make_test_suite(TestWashArgs,
+                             TestSimulatedModPythonRequestBuffering,
+                             TestSimulatedModPythonRequestSendfile)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)